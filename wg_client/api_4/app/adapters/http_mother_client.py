@@ -1,10 +1,26 @@
+import os
+
 import httpx
 from typing import Dict, Any, Optional
 
+API_MOTHER_URL = os.getenv("API_MOTHER_URL", "http://api_mother:8083")
+# Пул соединений с api_mother: один клиент на приложение (container.build_app), keep-alive между запросами
+MOTHER_MAX_CONNECTIONS = int(os.getenv("MOTHER_MAX_CONNECTIONS", "20"))
+MOTHER_MAX_KEEPALIVE = int(os.getenv("MOTHER_MAX_KEEPALIVE", "10"))
+MOTHER_KEEPALIVE_EXPIRY = float(os.getenv("MOTHER_KEEPALIVE_EXPIRY", "30"))
+
+
 class HttpMotherClient:
-    def __init__(self, base_url: str = "http://api_mother:8083"):
+    def __init__(self, base_url: str = API_MOTHER_URL, client: Optional[httpx.AsyncClient] = None):
         self.base_url = base_url
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.client = client or httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=MOTHER_MAX_CONNECTIONS,
+                max_keepalive_connections=MOTHER_MAX_KEEPALIVE,
+                keepalive_expiry=MOTHER_KEEPALIVE_EXPIRY,
+            ),
+        )
     
     async def sync_logs(self) -> Dict[str, Any]:
         """Запускает синхронизацию логов через api_mother"""
@@ -18,6 +34,22 @@ class HttpMotherClient:
         response.raise_for_status()
         return response.content
     
+    async def open_gz(self, path: str) -> httpx.Response:
+        """
+        Открывает .gz файл через api_mother потоком, не читая тело
+
+        Тело читается через response.aiter_raw() (байты как пришли, без распаковки);
+        вызывающий обязан закрыть ответ (await response.aclose()).
+        """
+        request = self.client.build_request("GET", f"{self.base_url}/gz/{path}")
+        response = await self.client.send(request, stream=True)
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError:
+            await response.aclose()
+            raise
+        return response
+
     async def health_check(self) -> bool:
         """Проверяет доступность api_mother"""
         try:
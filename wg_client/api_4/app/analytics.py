@@ -85,26 +85,25 @@ class BattleAnalytics:
             if not player_id:
                 return None
         
+        # Суточная витрина mart_player_daily (V7) вместо агрегации по battle_participants
         query = """
             SELECT 
-                p.id as player_id,
-                p.login,
-                COUNT(bp.battle_id) as battles_count,
-                SUM(CASE WHEN bp.survived = true THEN 1 ELSE 0 END) as wins,
-                SUM(CASE WHEN bp.survived = false THEN 1 ELSE 0 END) as losses,
-                SUM(bp.kills_monsters) as kills_monsters,
-                SUM(bp.kills_players) as kills_players,
-                AVG(bp.rank_points) as rank_points_avg,
-                AVG(bp.pve_points) as pve_points_avg
-            FROM players p
-            JOIN battle_participants bp ON p.id = bp.player_id
-            JOIN battles b ON bp.battle_id = b.id
-            WHERE p.id = $1
-            AND b.ts >= $2
-            GROUP BY p.id, p.login
+                m.player_id,
+                (ARRAY_AGG(m.login ORDER BY m.day DESC))[1] as login,
+                SUM(m.battles) as battles_count,
+                SUM(m.wins) as wins,
+                SUM(m.losses) as losses,
+                SUM(m.kills_monsters) as kills_monsters,
+                SUM(m.kills_players) as kills_players,
+                SUM(m.rank_points_sum)::numeric / NULLIF(SUM(m.battles), 0) as rank_points_avg,
+                SUM(m.pve_points_sum)::numeric / NULLIF(SUM(m.battles), 0) as pve_points_avg
+            FROM mart_player_daily m
+            WHERE m.player_id = $1
+            AND m.day >= $2
+            GROUP BY m.player_id
         """
         
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         result = await self.db._execute_one(query, player_id, cutoff_date)
         
         if not result:
@@ -139,26 +138,24 @@ class BattleAnalytics:
         
         query = f"""
             SELECT 
-                p.id as player_id,
-                p.login,
-                COUNT(bp.battle_id) as battles_count,
-                SUM(CASE WHEN bp.survived = true THEN 1 ELSE 0 END) as wins,
-                SUM(CASE WHEN bp.survived = false THEN 1 ELSE 0 END) as losses,
-                SUM(bp.kills_monsters) as kills_monsters,
-                SUM(bp.kills_players) as kills_players,
-                AVG(bp.rank_points) as rank_points_avg,
-                AVG(bp.pve_points) as pve_points_avg
-            FROM players p
-            JOIN battle_participants bp ON p.id = bp.player_id
-            JOIN battles b ON bp.battle_id = b.id
-            WHERE b.ts >= $1
-            GROUP BY p.id, p.login
-            HAVING COUNT(bp.battle_id) >= $2
+                m.player_id,
+                (ARRAY_AGG(m.login ORDER BY m.day DESC))[1] as login,
+                SUM(m.battles) as battles_count,
+                SUM(m.wins) as wins,
+                SUM(m.losses) as losses,
+                SUM(m.kills_monsters) as kills_monsters,
+                SUM(m.kills_players) as kills_players,
+                SUM(m.rank_points_sum)::numeric / NULLIF(SUM(m.battles), 0) as rank_points_avg,
+                SUM(m.pve_points_sum)::numeric / NULLIF(SUM(m.battles), 0) as pve_points_avg
+            FROM mart_player_daily m
+            WHERE m.day >= $1
+            GROUP BY m.player_id
+            HAVING SUM(m.battles) >= $2
             ORDER BY {metric} DESC
             LIMIT $3
         """
         
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         results = await self.db._execute_query(
             query, cutoff_date, self.config.min_battles_for_analysis, limit
         )
@@ -199,30 +196,27 @@ class BattleAnalytics:
         
         query = """
             SELECT 
-                c.clan_id as clan_id,
-                c.name,
-                COUNT(DISTINCT bp.player_id) as members_count,
-                COUNT(bp.battle_id) as battles_count,
-                SUM(CASE WHEN bp.survived = true THEN 1 ELSE 0 END) as wins,
-                SUM(CASE WHEN bp.survived = false THEN 1 ELSE 0 END) as losses,
-                SUM(bp.rank_points) as total_rank_points,
-                SUM(bp.pve_points) as total_pve_points
-            FROM clans c
-            JOIN battle_participants bp ON c.name = bp.clan
-            JOIN battles b ON bp.battle_id = b.id
-            WHERE c.name = $1
-            AND b.ts >= $2
-            GROUP BY c.clan_id, c.name
+                m.clan as name,
+                COUNT(DISTINCT m.player_id) as members_count,
+                SUM(m.battles) as battles_count,
+                SUM(m.wins) as wins,
+                SUM(m.losses) as losses,
+                SUM(m.rank_points_sum) as total_rank_points,
+                SUM(m.pve_points_sum) as total_pve_points
+            FROM mart_clan_player_daily m
+            WHERE m.clan = $1
+            AND m.day >= $2
+            GROUP BY m.clan
         """
         
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         result = await self.db._execute_one(query, clan_name, cutoff_date)
         
         if not result:
             return None
         
         return ClanStats(
-            clan_id=result["clan_id"],
+            clan_id=clan_id or await self._get_clan_id_by_name(clan_name),
             name=result["name"],
             members_count=result["members_count"],
             battles_count=result["battles_count"],
@@ -254,19 +248,17 @@ class BattleAnalytics:
             SELECT 
                 r.id as resource_id,
                 r.name,
-                SUM(bl.qty) as total_quantity,
-                COUNT(DISTINCT bl.battle_id) as battles_count,
-                AVG(bl.qty) as avg_per_battle
+                SUM(m.qty) as total_quantity,
+                SUM(m.battles) as battles_count,
+                SUM(m.qty)::numeric / NULLIF(SUM(m.battles), 0) as avg_per_battle
             FROM resource_names r
-            JOIN battle_loot bl ON r.id = bl.resource_id
-            JOIN battles b ON bl.battle_id = b.id
+            JOIN mart_resource_daily m ON r.id = m.resource_id
             WHERE r.id = $1
-            AND bl.kind = 'resource'
-            AND b.ts >= $2
+            AND m.day >= $2
             GROUP BY r.id, r.name
         """
         
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         result = await self.db._execute_one(query, resource_id, cutoff_date)
         
         if not result:
@@ -287,14 +279,11 @@ class BattleAnalytics:
                 SELECT 
                     r.id as resource_id,
                     r.name,
-                    DATE(b.ts) as battle_date,
-                    SUM(bl.qty) as daily_quantity
+                    m.day as battle_date,
+                    m.qty as daily_quantity
                 FROM resource_names r
-                JOIN battle_loot bl ON r.id = bl.resource_id
-                JOIN battles b ON b.id = bl.battle_id
-                WHERE bl.kind = 'resource'
-                AND b.ts >= $1
-                GROUP BY r.id, r.name, DATE(b.ts)
+                JOIN mart_resource_daily m ON r.id = m.resource_id
+                WHERE m.day >= $1
             ),
             resource_means AS (
                 SELECT 
@@ -456,22 +445,17 @@ class BattleAnalytics:
 
     async def get_player_efficiency(self, login: str, days: int = 30, w_p: float = 1.0) -> Dict[str, Any]:
         """KPM, KPT, Weighted Kills (упрощённо: вес PvP = w_p)."""
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         # Пер-матч метрики на основе записей участника в каждом бою
+        # Средние восстанавливаются из сумм витрины: KPM = Σkills / бои, KPT = Σ(kills/turns) / бои с turns > 0
         query = """
             SELECT
-                COUNT(*)::int AS battles,
-                AVG((bp.kills_monsters + $3 * bp.kills_players)::numeric) AS kpm_avg,
-                AVG(
-                    CASE WHEN NULLIF(b.turns, 0) IS NULL THEN NULL
-                         ELSE (bp.kills_monsters + $3 * bp.kills_players)::numeric / NULLIF(b.turns, 0)
-                    END
-                ) AS kpt_avg,
-                SUM((bp.kills_monsters + $3 * bp.kills_players))::numeric AS weighted_kills_sum
-            FROM battle_participants bp
-            JOIN players p ON p.id = bp.player_id
-            JOIN battles b ON b.id = bp.battle_id
-            WHERE p.login = $1 AND b.ts >= $2
+                COALESCE(SUM(m.battles), 0)::int AS battles,
+                SUM(m.kills_monsters + $3 * m.kills_players)::numeric / NULLIF(SUM(m.battles), 0) AS kpm_avg,
+                SUM(m.kpt_monsters_sum + $3 * m.kpt_players_sum) / NULLIF(SUM(m.kpt_battles), 0) AS kpt_avg,
+                SUM(m.kills_monsters + $3 * m.kills_players)::numeric AS weighted_kills_sum
+            FROM mart_player_daily m
+            WHERE m.login = $1 AND m.day >= $2
         """
         row = await self.db._execute_one(query, login, cutoff_date, w_p)
         battles = int((row or {}).get("battles", 0) or 0)
@@ -487,23 +471,17 @@ class BattleAnalytics:
 
     async def get_efficiency_top(self, limit: int = 10, days: int = 30, w_p: float = 1.0) -> List[Dict[str, Any]]:
         """Топ игроков по KPM/KPT (с фильтром минимум боёв)."""
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         query = """
             SELECT
-                p.login,
-                COUNT(*)::int AS battles,
-                AVG((bp.kills_monsters + $2 * bp.kills_players)::numeric) AS kpm_avg,
-                AVG(
-                    CASE WHEN NULLIF(b.turns, 0) IS NULL THEN NULL
-                         ELSE (bp.kills_monsters + $2 * bp.kills_players)::numeric / NULLIF(b.turns, 0)
-                    END
-                ) AS kpt_avg
-            FROM battle_participants bp
-            JOIN players p ON p.id = bp.player_id
-            JOIN battles b ON b.id = bp.battle_id
-            WHERE b.ts >= $1
-            GROUP BY p.login
-            HAVING COUNT(*) >= $3
+                m.login,
+                SUM(m.battles)::int AS battles,
+                SUM(m.kills_monsters + $2 * m.kills_players)::numeric / NULLIF(SUM(m.battles), 0) AS kpm_avg,
+                SUM(m.kpt_monsters_sum + $2 * m.kpt_players_sum) / NULLIF(SUM(m.kpt_battles), 0) AS kpt_avg
+            FROM mart_player_daily m
+            WHERE m.day >= $1
+            GROUP BY m.login
+            HAVING SUM(m.battles) >= $3
             ORDER BY kpm_avg DESC NULLS LAST
             LIMIT $4
         """
@@ -609,7 +587,7 @@ class BattleAnalytics:
             else:
                 reg_score = max(0.0, min(1.0, (cfg.intervals_std_ratio_thresh / ratio)))
             if reg_score > 0.7:
-            reasons.append("Слишком регулярные интервалы между боями")
+                reasons.append("Слишком регулярные интервалы между боями")
         else:
             reg_score = 0.0
 
@@ -1380,9 +1358,7 @@ class BattleAnalytics:
     
     async def _get_player_id_by_login(self, login: str) -> Optional[int]:
         """Получение ID игрока по логину"""
-        query = "SELECT id FROM players WHERE login = $1"
-        result = await self.db._execute_one(query, login)
-        return result["id"] if result else None
+        return await self.db.get_player_id(login)
     
     async def _get_playstyle(self, player_id: int, days: int = 90) -> Optional[Dict[str, Any]]:
         """Получает стиль игры из K-means (если модель обучена)"""
@@ -1402,9 +1378,7 @@ class BattleAnalytics:
     
     async def _get_clan_id_by_name(self, name: str) -> Optional[int]:
         """Получение ID клана по названию"""
-        query = "SELECT id FROM clans WHERE name = $1"
-        result = await self.db._execute_one(query, name)
-        return result["id"] if result else None
+        return await self.db.get_clan_id(name)
     
     async def _get_clan_name_by_id(self, clan_id: int) -> Optional[str]:
         """Получение имени клана по ID"""
@@ -1428,40 +1402,35 @@ class BattleAnalytics:
     
     async def get_general_stats(self, days: int = 30) -> Dict[str, Any]:
         """Общая статистика системы"""
-        cutoff_date = datetime.now() - timedelta(days=days)
+        cutoff_date = (datetime.now() - timedelta(days=days)).date()
         
-        # Статистика боёв
+        # Статистика боёв (суточные витрины V7)
         battles_query = """
             SELECT 
-                COUNT(*) as total_battles,
-                COUNT(DISTINCT DATE(ts)) as active_days,
-                AVG(players_cnt) as avg_players_per_battle,
-                AVG(monsters_cnt) as avg_monsters_per_battle
-            FROM battles
-            WHERE ts >= $1
+                SUM(battles) as total_battles,
+                COUNT(*) as active_days,
+                SUM(players_cnt_sum)::numeric / NULLIF(SUM(battles), 0) as avg_players_per_battle,
+                SUM(monsters_cnt_sum)::numeric / NULLIF(SUM(battles), 0) as avg_monsters_per_battle
+            FROM mart_battles_daily
+            WHERE day >= $1
         """
         battles_stats = await self.db._execute_one(battles_query, cutoff_date)
         
         # Статистика игроков
         players_query = """
             SELECT 
-                COUNT(DISTINCT bp.player_id) as unique_players,
-                COUNT(DISTINCT bp.clan) as unique_clans
-            FROM battle_participants bp
-            JOIN battles b ON bp.battle_id = b.id
-            WHERE b.ts >= $1
+                (SELECT COUNT(DISTINCT player_id) FROM mart_player_daily WHERE day >= $1) as unique_players,
+                (SELECT COUNT(DISTINCT clan) FROM mart_clan_player_daily WHERE day >= $1) as unique_clans
         """
         players_stats = await self.db._execute_one(players_query, cutoff_date)
         
         # Статистика ресурсов
         resources_query = """
             SELECT 
-                COUNT(DISTINCT bl.resource_id) as unique_resources,
-                SUM(bl.qty) as total_resources
-            FROM battle_loot bl
-            JOIN battles b ON bl.battle_id = b.id
-            WHERE bl.kind = 'resource'
-            AND b.ts >= $1
+                COUNT(DISTINCT resource_id) as unique_resources,
+                SUM(qty) as total_resources
+            FROM mart_resource_daily
+            WHERE day >= $1
         """
         resources_stats = await self.db._execute_one(resources_query, cutoff_date)
         
@@ -1488,13 +1457,12 @@ class BattleAnalytics:
         cutoff = date.today() - timedelta(days=days)
         # Сутки x ресурс
         per_day_query = """
-            SELECT DATE(b.ts) AS day, r.name AS resource, SUM(bl.qty) AS qty
-            FROM battle_loot bl
-            JOIN battles b ON b.id = bl.battle_id
-            JOIN resource_names r ON r.id = bl.resource_id
-            WHERE bl.kind = 'resource' AND b.ts >= $1
-            GROUP BY DATE(b.ts), r.name
-            ORDER BY DATE(b.ts) ASC, r.name ASC
+            SELECT m.day AS day, r.name AS resource, SUM(m.qty) AS qty
+            FROM mart_resource_daily m
+            JOIN resource_names r ON r.id = m.resource_id
+            WHERE m.day >= $1
+            GROUP BY m.day, r.name
+            ORDER BY m.day ASC, r.name ASC
         """
         rows = await self.db._execute_query(per_day_query, cutoff)
         # Сумма по дню
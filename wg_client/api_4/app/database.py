@@ -4,19 +4,77 @@
 """
 
 import asyncio
-import uuid
 import asyncpg
 import os
 import json
 import hashlib
-from typing import List, Optional, Dict, Any, Tuple
-from datetime import datetime, date
+import time
+from typing import List, Optional, Dict, Any, Sequence, Tuple
+from datetime import datetime, date, timezone
 from pathlib import Path
 
 from app.models import (
     BattleResponse, BattleListItem, BattleSearchResponse,
     BattleMeta, Participant, Monster, Loot, BattleInfo
 )
+from app.dimension_cache import DimensionCache
+from app.id_ranges import IdRangeSet, islands_sql
+from app.name_search import match_sql, match_value, order_sql
+
+
+# Справочник -> SQL-функция get_or_create_*
+_DIMENSION_FUNCTIONS = {
+    "players": "get_or_create_player",
+    "clans": "get_or_create_clan",
+    "monsters": "get_or_create_monster",
+    "resources": "get_or_create_resource",
+    "monster_parts": "get_or_create_monster_part",
+}
+
+# Кэши справочников общие для всех экземпляров BattleDatabase одной БД
+# (экземпляры создаются и на запрос — кэш не должен пропадать вместе с ними)
+_DIMENSION_CACHES: Dict[Tuple[Any, ...], Dict[str, DimensionCache]] = {}
+
+
+# Месяцы, для которых секции battles/battle_participants/battle_loot (V8) уже созданы.
+# Секцию может отсоединить другой процесс — тогда вставка падает с «no partition of
+# relation», месяц забывается и создаётся заново (см. save_battle)
+_ENSURED_PARTITION_MONTHS: set = set()
+
+
+# Кэш общего количества боёв для списков/поиска: ключ фильтров -> (истекает, total)
+_BATTLES_TOTALS: Dict[Tuple[Any, ...], Tuple[float, int]] = {}
+
+
+# xml_sync_log: колонки записей upsert_sync_log и слияние по battle_id
+_SYNC_LOG_COLUMNS = "battle_id, requested_at, status, error_message, file_path, size_bytes"
+_SYNC_LOG_ON_CONFLICT = """
+    ON CONFLICT (battle_id) DO UPDATE SET
+        requested_at = EXCLUDED.requested_at,
+        status = EXCLUDED.status,
+        error_message = EXCLUDED.error_message,
+        file_path = EXCLUDED.file_path,
+        size_bytes = EXCLUDED.size_bytes
+"""
+
+
+def _battle_day(ts: Optional[datetime]) -> date:
+    """Дата боя в UTC — ключ месячных секций участников и лута"""
+    if ts is None:
+        return datetime.now(timezone.utc).date()
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return ts.date()
+
+
+def _dimension_caches_for(connection_params: Dict[str, Any]) -> Dict[str, DimensionCache]:
+    key = (connection_params["host"], connection_params["port"], connection_params["database"])
+    caches = _DIMENSION_CACHES.get(key)
+    if caches is None:
+        max_size = int(os.getenv("DIMENSION_CACHE_SIZE", "50000"))
+        caches = {name: DimensionCache(name, max_size) for name in _DIMENSION_FUNCTIONS}
+        _DIMENSION_CACHES[key] = caches
+    return caches
 
 
 class BattleDatabase:
@@ -24,7 +82,9 @@ class BattleDatabase:
     
     def __init__(self):
         self.pool: Optional[asyncpg.Pool] = None
+        self._connect_lock = asyncio.Lock()
         self._connection_params = self._get_connection_params()
+        self.dimension_caches = _dimension_caches_for(self._connection_params)
     
     def _get_connection_params(self) -> Dict[str, Any]:
         """Получение параметров подключения к БД"""
@@ -47,18 +107,28 @@ class BattleDatabase:
                 "password": os.getenv("DB_API4_PROD_PASSWORD", "api4_pass")
             }
     
+    def _get_pool_params(self) -> Dict[str, Any]:
+        """Параметры пула: один пул на приложение (container.build_app), размеры из окружения"""
+        return {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            "command_timeout": float(os.getenv("DB_COMMAND_TIMEOUT", "60")),
+            # Кэш подготовленных выражений: повторяющиеся запросы не парсятся заново
+            # (0 — выключить, если между API и БД стоит pgbouncer в режиме transaction)
+            "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256")),
+            "max_inactive_connection_lifetime": float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300")),
+            "max_queries": int(os.getenv("DB_POOL_MAX_QUERIES", "50000")),
+        }
+    
     async def connect(self):
         """Подключение к базе данных"""
         if self.pool is None:
-            self.pool = await asyncpg.create_pool(
-                **self._connection_params,
-                min_size=1,
-                max_size=2,  # МИНИМУМ: api_mother создаёт МНОГО экземпляров BattleDatabase
-                command_timeout=60,
-                statement_cache_size=0,
-                max_inactive_connection_lifetime=20,  # Быстро закрывать
-                max_queries=1000  # Ограничение запросов на соединение
-            )
+            async with self._connect_lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(
+                        **self._connection_params,
+                        **self._get_pool_params()
+                    )
     
     async def disconnect(self):
         """Отключение от базы данных"""
@@ -93,39 +163,136 @@ class BattleDatabase:
             result = await conn.execute(query, *args)
             return result
     
+    async def executemany(self, query: str, args: Sequence[Sequence[Any]]) -> None:
+        """Один оператор на много наборов параметров — пакетом, без round-trip на строку"""
+        if not args:
+            return
+        if not self.pool:
+            await self.connect()
+        
+        async with self.pool.acquire() as conn:
+            await conn.executemany(query, args)
+    
+    async def copy_merge(
+        self,
+        table: str,
+        columns: Sequence[str],
+        records: Sequence[Sequence[Any]],
+        merge_sql: str
+    ) -> str:
+        """
+        COPY записей во временную таблицу и слияние одним оператором
+        
+        Временная таблица создаётся по образцу table (LIKE) и удаляется в конце транзакции.
+        
+        Args:
+            table: Целевая таблица
+            columns: Колонки записей
+            records: Строки для загрузки
+            merge_sql: INSERT ... SELECT ... FROM {staging} ... — {staging} заменяется именем временной таблицы
+        
+        Returns:
+            Статус слияния (например, "INSERT 0 10000")
+        """
+        if not records:
+            return "INSERT 0 0"
+        if not self.pool:
+            await self.connect()
+        
+        staging = f"_{table}_staging"
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(f"CREATE TEMP TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+                await conn.copy_records_to_table(staging, records=records, columns=list(columns))
+                return await conn.execute(merge_sql.format(staging=staging))
+    
+    async def upsert_sync_log(self, records: Sequence[Tuple[int, datetime, str, Optional[str], Optional[str], Optional[int]]]) -> None:
+        """
+        Запись результатов XML sync в xml_sync_log
+        
+        Записи: (battle_id, requested_at, status, error_message, file_path, size_bytes).
+        Небольшие пачки — executemany, от XML_SYNC_LOG_COPY_MIN_ROWS строк — COPY и одно слияние.
+        """
+        if len(records) < int(os.getenv("XML_SYNC_LOG_COPY_MIN_ROWS", "500")):
+            await self.executemany(
+                f"INSERT INTO xml_sync_log ({_SYNC_LOG_COLUMNS}) VALUES ($1, $2, $3, $4, $5, $6) {_SYNC_LOG_ON_CONFLICT}",
+                records
+            )
+            return
+        await self.copy_merge(
+            "xml_sync_log",
+            _SYNC_LOG_COLUMNS.split(", "),
+            records,
+            # DISTINCT ON: повтор ID в пачке не должен ронять ON CONFLICT — побеждает последняя запись
+            f"""
+            INSERT INTO xml_sync_log ({_SYNC_LOG_COLUMNS})
+            SELECT DISTINCT ON (battle_id) {_SYNC_LOG_COLUMNS}
+            FROM {{staging}}
+            ORDER BY battle_id, requested_at DESC
+            {_SYNC_LOG_ON_CONFLICT}
+            """
+        )
+    
     # ===== МЕТОДЫ ДЛЯ РАБОТЫ СО СПРАВОЧНИКАМИ =====
     
+    async def _cached_get_or_create(self, dimension: str, query: str, key, *args) -> int:
+        """get_or_create_* через кэш справочника: в БД только при промахе"""
+        cache = self.dimension_caches[dimension]
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        result = await self._execute_one(query, *args)
+        cache.put(key, result["id"])
+        return result["id"]
+    
     async def get_or_create_player(self, login: str) -> int:
         """Получить или создать игрока"""
         query = "SELECT get_or_create_player(CAST($1 AS TEXT)) as id"
-        result = await self._execute_one(query, login)
-        return result["id"]
+        return await self._cached_get_or_create("players", query, login, login)
     
     async def get_or_create_clan(self, name: str) -> Optional[int]:
         """Получить или создать клан"""
         if not name:
             return None
         query = "SELECT get_or_create_clan($1) as id"
-        result = await self._execute_one(query, name)
-        return result["id"]
+        return await self._cached_get_or_create("clans", query, name, name)
     
     async def get_or_create_monster(self, kind: str, spec: str = None) -> int:
         """Получить или создать монстра"""
         query = "SELECT get_or_create_monster($1, $2) as id"
-        result = await self._execute_one(query, kind, spec)
-        return result["id"]
+        return await self._cached_get_or_create("monsters", query, (kind, spec), kind, spec)
     
     async def get_or_create_resource(self, name: str) -> int:
         """Получить или создать ресурс"""
         query = "SELECT get_or_create_resource($1) as id"
-        result = await self._execute_one(query, name)
-        return result["id"]
+        return await self._cached_get_or_create("resources", query, name, name)
     
     async def get_or_create_monster_part(self, name: str) -> int:
         """Получить или создать часть монстра"""
         query = "SELECT get_or_create_monster_part($1) as id"
-        result = await self._execute_one(query, name)
-        return result["id"]
+        return await self._cached_get_or_create("monster_parts", query, name, name)
+    
+    async def get_player_id(self, login: str) -> Optional[int]:
+        """ID существующего игрока по логину (без создания)"""
+        return await self._cached_lookup("players", "SELECT id FROM players WHERE login = $1", login)
+    
+    async def get_clan_id(self, name: str) -> Optional[int]:
+        """ID существующего клана по названию (без создания)"""
+        return await self._cached_lookup("clans", "SELECT id FROM clans WHERE name = $1", name)
+    
+    async def _cached_lookup(self, dimension: str, query: str, key: str) -> Optional[int]:
+        cache = self.dimension_caches[dimension]
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        result = await self._execute_one(query, key)
+        value = result["id"] if result else None
+        cache.put(key, value)
+        return value
+    
+    def dimension_cache_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Счётчики кэшей справочников (размер, попадания, промахи, вытеснения)"""
+        return {name: cache.stats() for name, cache in self.dimension_caches.items()}
     
     # ===== МЕТОДЫ ДЛЯ РАБОТЫ С БОЯМИ =====
     
@@ -146,8 +313,7 @@ class BattleDatabase:
                 $11, $12, $13, $14, $15,
                 $16
             )
-            ON CONFLICT (source_id) DO UPDATE SET
-                ts = EXCLUDED.ts,
+            ON CONFLICT (source_id, ts) DO UPDATE SET
                 size_bytes = EXCLUDED.size_bytes,
                 sha256 = EXCLUDED.sha256,
                 storage_key = EXCLUDED.storage_key,
@@ -170,7 +336,9 @@ class BattleDatabase:
         storage_key_value = str(battle_data.get("storage_key") or "")
 
         # Подготавливаем все значения строго по типам столбцов
-        ts_value = battle_data["ts"]
+        # ts — ключ секции (V8) и не может быть NULL
+        ts_value = battle_data["ts"] or battle_data.get("start_ts") or datetime.now(timezone.utc)
+        battle_day = _battle_day(ts_value)
         size_bytes_value = int(battle_data.get("size_bytes") or 0)
         battle_type_value = str(battle_data.get("battle_type") or "")
         loc_x_value = int(battle_data.get("loc_x") or 0) if battle_data.get("loc_x") is not None else None
@@ -200,8 +368,7 @@ class BattleDatabase:
             except Exception:
                 source_id_value = None
 
-        inserted = await self._execute_one(
-            battle_query,
+        battle_args = (
             ts_value,
             size_bytes_value,
             sha256_value,
@@ -219,30 +386,221 @@ class BattleDatabase:
             data_value,
             source_id_value
         )
-        battle_id = inserted["id"] if inserted and "id" in inserted else battle_declared_id or 0
+        meta = battle_data.get("meta", {})
         
-        # Сохраняем участников
-        await self._save_battle_participants(battle_id, battle_data.get("meta", {}).get("participants", []))
+        if not self.pool:
+            await self.connect()
+        await self._ensure_partitions(battle_day)
         
-        # Сохраняем монстров
-        await self._save_battle_monsters(battle_id, battle_data.get("meta", {}).get("monsters", {}))
+        # Один бой — одна транзакция на одном соединении: бой, справочники
+        # и дочерние строки уходят пачками, а не запросом на каждую строку
+        for attempt in range(2):
+            # ID, полученные в транзакции, попадают в кэш только после COMMIT
+            learned: Dict[str, Dict[Any, int]] = {}
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        # Перезапись боя: сначала вычитаем его прежний вклад из витрин аналитики
+                        if source_id_value is not None:
+                            await self._retract_previous_battle(conn, source_id_value, ts_value)
+                        inserted = await conn.fetchrow(battle_query, *battle_args)
+                        battle_id = inserted["id"] if inserted and "id" in inserted else battle_declared_id or 0
+                        
+                        # Сохраняем участников
+                        await self._save_battle_participants(conn, battle_id, battle_day, meta.get("participants", []), learned)
+                        
+                        # Сохраняем монстров
+                        await self._save_battle_monsters(conn, battle_id, meta.get("monsters", {}), learned)
+                        
+                        # Сохраняем лут
+                        await self._save_battle_loot(conn, battle_id, battle_day, meta.get("loot", {}), learned)
+                        
+                        # Витрины аналитики (V7) обновляются в той же транзакции
+                        await conn.execute("SELECT mart_apply_battle($1, 1)", battle_id)
+            except asyncpg.CheckViolationError as e:
+                # Секцию месяца отсоединили после того, как мы её запомнили, — создаём заново
+                if attempt or "no partition" not in str(e):
+                    raise
+                _ENSURED_PARTITION_MONTHS.discard((battle_day.year, battle_day.month))
+                await self._ensure_partitions(battle_day)
+                continue
+            except asyncpg.ForeignKeyViolationError:
+                # Закэшированный ID указывает на удалённую строку справочника —
+                # сбрасываем кэши справочников и повторяем бой один раз
+                if attempt:
+                    raise
+                for cache in self.dimension_caches.values():
+                    cache.invalidate()
+                continue
+            
+            for dimension, values in learned.items():
+                self.dimension_caches[dimension].put_many(values)
+            return battle_id
+    
+    async def _ensure_partitions(self, battle_day: date) -> None:
+        """Создать месячные секции для даты боя (один запрос на месяц на процесс)"""
+        month = (battle_day.year, battle_day.month)
+        if month in _ENSURED_PARTITION_MONTHS:
+            return
+        async with self.pool.acquire() as conn:
+            await conn.execute("SELECT ensure_battle_partitions($1)", battle_day)
+        _ENSURED_PARTITION_MONTHS.add(month)
+    
+    async def _retract_previous_battle(
+        self,
+        conn: asyncpg.Connection,
+        source_id: int,
+        ts: datetime
+    ) -> None:
+        """
+        Вычесть прежнюю версию боя из витрин; если у неё другое время (другая секция),
+        удалить её целиком — иначе ON CONFLICT (source_id, ts) создаст дубль
+        """
+        rows = await conn.fetch("SELECT id, ts FROM battles WHERE source_id = $1", source_id)
+        for row in rows:
+            await conn.execute("SELECT mart_apply_battle($1, -1)", row["id"])
+            if row["ts"] == ts:
+                continue
+            old_day = _battle_day(row["ts"])
+            await conn.execute(
+                "DELETE FROM battle_participants WHERE battle_id = $1 AND battle_ts = $2",
+                row["id"], old_day
+            )
+            await conn.execute(
+                "DELETE FROM battle_loot WHERE battle_id = $1 AND battle_ts = $2",
+                row["id"], old_day
+            )
+            await conn.execute("DELETE FROM battle_monsters WHERE battle_id = $1", row["id"])
+            await conn.execute("DELETE FROM battles WHERE id = $1 AND ts = $2", row["id"], row["ts"])
+    
+    async def detach_partitions_before(self, cutoff: date) -> int:
+        """
+        Отсоединить месячные секции боёв, целиком лежащие раньше cutoff
         
-        # Сохраняем лут
-        await self._save_battle_loot(battle_id, battle_data.get("meta", {}).get("loot", {}))
+        Секции не удаляются — переименовываются в battles_yYYYYmMM_detached_{время} и т.п.;
+        имя месяца освобождается, и save_battle создаст для него новую пустую секцию.
         
-        return battle_id
+        Returns:
+            Количество отсоединённых месяцев
+        """
+        if not self.pool:
+            await self.connect()
+        async with self.pool.acquire() as conn:
+            detached = await conn.fetchval("SELECT detach_battle_partitions($1)", cutoff)
+        _ENSURED_PARTITION_MONTHS.clear()
+        return int(detached or 0)
     
-    async def _save_battle_participants(self, battle_id: int, participants: List[Dict]):
+    async def sync_log_ranges(
+        self,
+        start_id: Optional[int] = None,
+        end_id: Optional[int] = None,
+        statuses: Tuple[str, ...] = ("success",)
+    ) -> IdRangeSet:
+        """
+        ID из xml_sync_log с указанными статусами — диапазонами
+        
+        БД возвращает по строке на непрерывный участок (gaps and islands), а не на каждый бой.
+        """
+        where = "status = ANY($1::text[])"
+        args: List[Any] = [list(statuses)]
+        if start_id is not None and end_id is not None:
+            where += " AND battle_id BETWEEN $2 AND $3"
+            args += [start_id, end_id]
+        rows = await self._execute_query(islands_sql("battle_id", "xml_sync_log", where), *args)
+        return IdRangeSet.from_rows(rows)
+    
+    async def battle_source_ranges(self) -> IdRangeSet:
+        """Игровые ID загруженных боёв (battles.source_id) — диапазонами"""
+        rows = await self._execute_query(islands_sql("source_id", "battles"))
+        return IdRangeSet.from_rows(rows)
+    
+    async def _bulk_get_or_create(
+        self,
+        conn: asyncpg.Connection,
+        dimension: str,
+        names: List[str],
+        learned: Dict[str, Dict[Any, int]]
+    ) -> Dict[str, int]:
+        """
+        Массовый get_or_create_* по справочнику: попадания из кэша, промахи — одним запросом
+        
+        Args:
+            conn: Соединение текущей транзакции
+            dimension: Справочник (players, resources, monster_parts, ...)
+            names: Имена (повторы допустимы)
+            learned: Сюда складываются ID из БД — в кэш они попадут после COMMIT
+            
+        Returns:
+            Словарь имя -> id
+        """
+        ids, missing = self.dimension_caches[dimension].get_many(names)
+        if not missing:
+            return ids
+        # Сортировка задаёт одинаковый порядок вставок во всех транзакциях — без взаимоблокировок
+        rows = await conn.fetch(
+            f"SELECT n.name, {_DIMENSION_FUNCTIONS[dimension]}(n.name) AS id "
+            "FROM unnest($1::text[]) WITH ORDINALITY AS n(name, ord) ORDER BY n.ord",
+            sorted(missing)
+        )
+        fetched = {row["name"]: row["id"] for row in rows}
+        learned.setdefault(dimension, {}).update(fetched)
+        ids.update(fetched)
+        return ids
+    
+    async def _bulk_get_or_create_monsters(
+        self,
+        conn: asyncpg.Connection,
+        keys: List[Tuple[str, Optional[str]]],
+        learned: Dict[str, Dict[Any, int]]
+    ) -> Dict[Tuple[str, Optional[str]], int]:
+        """Массовый get_or_create_monster по парам (kind, spec): промахи кэша — одним запросом"""
+        ids, missing = self.dimension_caches["monsters"].get_many(keys)
+        if not missing:
+            return ids
+        missing = sorted(missing, key=lambda k: (k[0], k[1] or ""))
+        rows = await conn.fetch(
+            """
+            SELECT m.kind, m.spec, get_or_create_monster(m.kind, m.spec) AS id
+            FROM unnest($1::text[], $2::text[]) WITH ORDINALITY AS m(kind, spec, ord)
+            ORDER BY m.ord
+            """,
+            [kind for kind, _ in missing],
+            [spec for _, spec in missing]
+        )
+        fetched = {(row["kind"], row["spec"]): row["id"] for row in rows}
+        learned.setdefault("monsters", {}).update(fetched)
+        ids.update(fetched)
+        return ids
+    
+    async def _save_battle_participants(
+        self,
+        conn: asyncpg.Connection,
+        battle_id: int,
+        battle_day: date,
+        participants: List[Dict],
+        learned: Dict[str, Dict[Any, int]]
+    ):
         """Сохранение участников боя"""
         if not participants:
             return
         
         # Удаляем старых участников
-        await self._execute_command(
-            "DELETE FROM battle_participants WHERE battle_id = $1",
-            battle_id
+        await conn.execute(
+            "DELETE FROM battle_participants WHERE battle_id = $1 AND battle_ts = $2",
+            battle_id, battle_day
+        )
+        
+        player_ids = await self._bulk_get_or_create(
+            conn, "players",
+            [str(participant.get("login", "")) for participant in participants],
+            learned
         )
+        # Справочник кланов нужен поиску по клану (V9) — ID в участниках не хранится
+        clan_names = [str(p["clan"]) for p in participants if p.get("clan")]
+        if clan_names:
+            await self._bulk_get_or_create(conn, "clans", clan_names, learned)
         
+        records = []
         for participant in participants:
             # Нормализуем типы под схему БД
             login_value = str(participant.get("login", ""))
@@ -261,9 +619,7 @@ class BattleDatabase:
             if isinstance(survived_value, int):
                 survived_value = bool(survived_value)
 
-            player_id = await self.get_or_create_player(login_value)
-
-            # удалён временный диагностический вывод типов и значений параметров
+            player_id = player_ids[login_value]
 
             # Жестко приводим числовые поля к int
             rank_points_value = int(participant.get("rank_points", 0)) if participant.get("rank_points") is not None else 0
@@ -282,46 +638,60 @@ class BattleDatabase:
             kills_monsters_value = int(kills_monsters_cnt) if kills_monsters_cnt is not None else 0
             kills_players_value = int(kills_players_cnt) if kills_players_cnt is not None else 0
 
-            # Полный INSERT согласно схеме таблицы
-            insert_sql = f"""
-                INSERT INTO battle_participants (
-                    battle_id, player_id, login, clan, side,
-                    survived, rank_points, pve_points,
-                    intervened, kills, damage_total, loot,
-                    profession, gender, level, kills_monsters, kills_players
-                ) VALUES (
-                    $1::bigint, $2::int, $3::text, $4::text, $5::text,
-                    $6::boolean, $7::int, $8::int,
-                    $9::jsonb, $10::jsonb, $11::jsonb, $12::jsonb,
-                    $13::text, $14::text, $15::int, $16::int, $17::int
-                ) -- full_insert_bp_v2 {uuid.uuid4()}
-            """
-            await self._execute_command(
-                insert_sql,
+            records.append((
                 battle_id, player_id, login_value, clan_value, side_value,
                 survived_value, rank_points_value, pve_points_value,
                 intervened_value, kills_value, damage_total_value, loot_value,
-                profession_value, gender_value, level_value, kills_monsters_value, kills_players_value
+                profession_value, gender_value, level_value, kills_monsters_value, kills_players_value,
+                battle_day
+            ))
+        
+        # Полный INSERT согласно схеме таблицы — один подготовленный запрос на все строки
+        await conn.executemany("""
+            INSERT INTO battle_participants (
+                battle_id, player_id, login, clan, side,
+                survived, rank_points, pve_points,
+                intervened, kills, damage_total, loot,
+                profession, gender, level, kills_monsters, kills_players,
+                battle_ts
+            ) VALUES (
+                $1::bigint, $2::int, $3::text, $4::text, $5::text,
+                $6::boolean, $7::int, $8::int,
+                $9::jsonb, $10::jsonb, $11::jsonb, $12::jsonb,
+                $13::text, $14::text, $15::int, $16::int, $17::int,
+                $18::date
             )
+        """, records)
     
-    async def _save_battle_monsters(self, battle_id: int, monsters: Dict[str, Dict]):
+    async def _save_battle_monsters(
+        self,
+        conn: asyncpg.Connection,
+        battle_id: int,
+        monsters: Dict[str, Dict],
+        learned: Dict[str, Dict[Any, int]]
+    ):
         """Сохранение монстров боя"""
         if not monsters:
             return
         
         # Удаляем старых монстров
-        await self._execute_command(
+        await conn.execute(
             "DELETE FROM battle_monsters WHERE battle_id = $1",
             battle_id
         )
         
+        # Парсим имена монстров (kind|spec)
+        keyed = []
         for monster_name, monster_data in monsters.items():
-            # Парсим имя монстра (kind|spec)
             parts = monster_name.split("|", 1)
             kind = parts[0]
             spec = parts[1] if len(parts) > 1 else None
-            
-            monster_id = await self.get_or_create_monster(kind, spec)
+            keyed.append(((kind, spec), monster_data))
+        
+        monster_ids = await self._bulk_get_or_create_monsters(conn, [key for key, _ in keyed], learned)
+        
+        records = []
+        for key, monster_data in keyed:
             # Нормализуем типы
             side_value = monster_data.get("side")
             if isinstance(side_value, int):
@@ -329,52 +699,73 @@ class BattleDatabase:
             count_value = int(monster_data.get("count", 0)) if monster_data.get("count") is not None else 0
             min_level_value = int(monster_data.get("min_level", 0)) if monster_data.get("min_level") is not None else 0
             max_level_value = int(monster_data.get("max_level", 0)) if monster_data.get("max_level") is not None else 0
-            
-            await self._execute_command("""
-                INSERT INTO battle_monsters (
-                    battle_id, monster_id, side, count, min_level, max_level
-                ) VALUES ($1::bigint, $2::int, $3::text, $4::int, $5::int, $6::int)
-            """,
-                battle_id, monster_id, side_value,
+            records.append((
+                battle_id, monster_ids[key], side_value,
                 count_value, min_level_value,
                 max_level_value
-            )
+            ))
+        
+        await conn.executemany("""
+            INSERT INTO battle_monsters (
+                battle_id, monster_id, side, count, min_level, max_level
+            ) VALUES ($1::bigint, $2::int, $3::text, $4::int, $5::int, $6::int)
+        """, records)
     
-    async def _save_battle_loot(self, battle_id: int, loot: Dict):
+    async def _save_battle_loot(
+        self,
+        conn: asyncpg.Connection,
+        battle_id: int,
+        battle_day: date,
+        loot: Dict,
+        learned: Dict[str, Dict[Any, int]]
+    ):
         """Сохранение лута боя"""
         if not loot:
             return
         
         # Удаляем старый лут
-        await self._execute_command(
-            "DELETE FROM battle_loot WHERE battle_id = $1",
-            battle_id
+        await conn.execute(
+            "DELETE FROM battle_loot WHERE battle_id = $1 AND battle_ts = $2",
+            battle_id, battle_day
         )
         
-        battle_ts = date.today()
+        # battle_ts — дата боя, а не загрузки: по ней лут лежит в секции своего месяца
+        battle_ts = battle_day
+        resources = loot.get("resources_total", {})
+        parts = loot.get("monster_parts_total", {})
+        other_items = loot.get("other_items", {})
         
         # Сохраняем ресурсы
-        for resource_name, quantity in loot.get("resources_total", {}).items():
-            resource_id = await self.get_or_create_resource(resource_name)
-            await self._execute_command("""
+        if resources:
+            resource_ids = await self._bulk_get_or_create(conn, "resources", list(resources), learned)
+            await conn.executemany("""
                 INSERT INTO battle_loot (battle_id, battle_ts, kind, resource_id, qty)
                 VALUES ($1, $2, 'resource', $3, $4)
-            """, battle_id, battle_ts, resource_id, quantity)
+            """, [
+                (battle_id, battle_ts, resource_ids[resource_name], quantity)
+                for resource_name, quantity in resources.items()
+            ])
         
         # Сохраняем части монстров
-        for part_name, quantity in loot.get("monster_parts_total", {}).items():
-            part_id = await self.get_or_create_monster_part(part_name)
-            await self._execute_command("""
+        if parts:
+            part_ids = await self._bulk_get_or_create(conn, "monster_parts", list(parts), learned)
+            await conn.executemany("""
                 INSERT INTO battle_loot (battle_id, battle_ts, kind, part_id, qty)
                 VALUES ($1, $2, 'monster_part', $3, $4)
-            """, battle_id, battle_ts, part_id, quantity)
+            """, [
+                (battle_id, battle_ts, part_ids[part_name], quantity)
+                for part_name, quantity in parts.items()
+            ])
         
         # Сохраняем другие предметы
-        for item_name, quantity in loot.get("other_items", {}).items():
-            await self._execute_command("""
+        if other_items:
+            await conn.executemany("""
                 INSERT INTO battle_loot (battle_id, battle_ts, kind, item_id, item_name, qty)
                 VALUES ($1, $2, 'other', $3, $4, $5)
-            """, battle_id, battle_ts, hash(item_name) % 2147483647, item_name, quantity)
+            """, [
+                (battle_id, battle_ts, hash(item_name) % 2147483647, item_name, quantity)
+                for item_name, quantity in other_items.items()
+            ])
     
     async def get_battle(self, battle_id: int) -> Optional[Dict[str, Any]]:
         """Получение информации о бое по настоящему battle_id (source_id)"""
@@ -401,39 +792,24 @@ class BattleDatabase:
         
         return battle
     
-    async def list_battles(self, page: int = 1, limit: int = 10) -> Tuple[List[Dict], int]:
-        """Список боёв с пагинацией"""
-        offset = (page - 1) * limit
-        
-        # Получаем общее количество
-        count_query = "SELECT COUNT(*) as total FROM battles"
-        total_result = await self._execute_one(count_query)
-        total = total_result["total"]
-        
-        # Получаем список боёв
-        battles_query = """
-            SELECT b.id, b.ts, b.battle_type, b.turns, b.loc_x, b.loc_y,
-                   b.source_id,
-                   array_agg(DISTINCT p.login) as players,
-                   COALESCE(SUM(bm.count), 0) as monsters_count
-            FROM battles b
-            LEFT JOIN battle_participants bp ON b.id = bp.battle_id
-            LEFT JOIN players p ON bp.player_id = p.id
-            LEFT JOIN battle_monsters bm ON b.id = bm.battle_id
-            GROUP BY b.id, b.ts, b.battle_type, b.turns, b.loc_x, b.loc_y, b.source_id
-            ORDER BY b.id DESC
-            LIMIT $1 OFFSET $2
+    async def list_battles(
+        self,
+        page: int = 1,
+        limit: int = 10,
+        after_id: Optional[int] = None
+    ) -> Tuple[List[Dict], int]:
         """
+        Список боёв с пагинацией
         
-        battles = await self._execute_query(battles_query, limit, offset)
-        
-        # Преобразуем в нужный формат
-        for battle in battles:
-            battle["players"] = list(set(battle["players"])) if battle["players"] else []
-            battle["location"] = [battle["loc_x"], battle["loc_y"]] if battle["loc_x"] is not None else None
-            battle["duration"] = battle.get("turns", 0)  # ✅ Количество ходов
-        
-        return battles, total
+        Args:
+            page: Номер страницы (режим совместимости, OFFSET)
+            limit: Боёв на странице
+            after_id: Keyset-режим — бои с id меньше after_id (page игнорируется)
+            
+        Returns:
+            (бои страницы, оценка общего количества)
+        """
+        return await self._battles_page("1=1", [], page, limit, after_id, ("list",))
     
     async def search_battles(
         self,
@@ -444,11 +820,18 @@ class BattleDatabase:
         to_date: Optional[datetime] = None,
         monsters: Optional[str] = None,
         page: int = 1,
-        limit: int = 10
+        limit: int = 10,
+        after_id: Optional[int] = None,
+        match: str = "substring"
     ) -> Tuple[List[Dict], int]:
-        """Поиск боёв по критериям"""
-        offset = (page - 1) * limit
+        """
+        Поиск боёв по критериям (after_id — keyset-режим, как в list_battles)
         
+        player/clan/monsters сначала разрешаются в ID (имена кланов) по триграммным
+        индексам справочников (match: substring | prefix | fuzzy, см. app.name_search),
+        затем бои ищутся по индексам (player_id, battle_id) / (clan, battle_id) /
+        (monster_id, battle_id). Нет совпадений в справочнике — нет и боёв, запрос к боям не нужен.
+        """
         # Строим условия поиска
         conditions = []
         params = []
@@ -456,14 +839,28 @@ class BattleDatabase:
         
         if player:
             param_count += 1
-            conditions.append(f"EXISTS (SELECT 1 FROM battle_participants bp JOIN players p ON bp.player_id = p.id WHERE bp.battle_id = b.id AND p.login ILIKE ${param_count})")
-            params.append(f"%{player}%")
+            player_ids = await self.resolve_player_ids(player, match)
+            if player_ids == []:
+                return [], 0
+            if player_ids is None:
+                # Совпадений слишком много для списка — разрешаем в подзапросе
+                conditions.append(f"EXISTS (SELECT 1 FROM battle_participants bp JOIN players p ON bp.player_id = p.id WHERE bp.battle_id = b.id AND {match_sql('p.login', f'${param_count}', match)})")
+                params.append(match_value(player, match))
+            else:
+                conditions.append(f"EXISTS (SELECT 1 FROM battle_participants bp WHERE bp.player_id = ANY(${param_count}::int[]) AND bp.battle_id = b.id)")
+                params.append(player_ids)
         
         if clan:
             param_count += 1
-            # ✅ Упрощенный поиск по клану без JOIN с таблицей clans
-            conditions.append(f"EXISTS (SELECT 1 FROM battle_participants bp WHERE bp.battle_id = b.id AND bp.clan ILIKE ${param_count})")
-            params.append(f"%{clan}%")
+            clan_names = await self.resolve_clan_names(clan, match)
+            if clan_names == []:
+                return [], 0
+            if clan_names is None:
+                conditions.append(f"EXISTS (SELECT 1 FROM battle_participants bp WHERE bp.battle_id = b.id AND {match_sql('bp.clan', f'${param_count}', match)})")
+                params.append(match_value(clan, match))
+            else:
+                conditions.append(f"EXISTS (SELECT 1 FROM battle_participants bp WHERE bp.clan = ANY(${param_count}::text[]) AND bp.battle_id = b.id)")
+                params.append(clan_names)
         
         if battle_type:
             param_count += 1
@@ -483,47 +880,160 @@ class BattleDatabase:
         if monsters:
             param_count += 1
             # ✅ Поиск по монстрам через monster_catalog (kind и spec)
-            conditions.append(f"""EXISTS (
-                SELECT 1 FROM battle_monsters bm 
-                JOIN monster_catalog mc ON bm.monster_id = mc.id 
-                WHERE bm.battle_id = b.id 
-                AND (mc.kind ILIKE ${param_count} OR mc.spec ILIKE ${param_count})
-            )""")
-            params.append(f"%{monsters}%")
+            monster_ids = await self.resolve_monster_ids(monsters, match)
+            if monster_ids == []:
+                return [], 0
+            if monster_ids is None:
+                conditions.append(f"""EXISTS (
+                    SELECT 1 FROM battle_monsters bm 
+                    JOIN monster_catalog mc ON bm.monster_id = mc.id 
+                    WHERE bm.battle_id = b.id 
+                    AND ({match_sql('mc.kind', f'${param_count}', match)} OR {match_sql('mc.spec', f'${param_count}', match)})
+                )""")
+                params.append(match_value(monsters, match))
+            else:
+                conditions.append(f"EXISTS (SELECT 1 FROM battle_monsters bm WHERE bm.monster_id = ANY(${param_count}::int[]) AND bm.battle_id = b.id)")
+                params.append(monster_ids)
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
+        total_key = ("search", player, clan, battle_type, from_date, to_date, monsters, match)
+        return await self._battles_page(where_clause, params, page, limit, after_id, total_key)
+    
+    async def resolve_player_ids(self, term: str, match: str = "substring") -> Optional[List[int]]:
+        """ID игроков, чей логин совпадает с term (None — совпадений больше NAME_SEARCH_MAX_IDS)"""
+        return await self._resolve_names("players", "id", ["login"], term, match)
+    
+    async def resolve_clan_names(self, term: str, match: str = "substring") -> Optional[List[str]]:
+        """Имена кланов, совпадающие с term (battle_participants хранит имя клана, а не ID)"""
+        return await self._resolve_names("clans", "name", ["name"], term, match)
+    
+    async def resolve_monster_ids(self, term: str, match: str = "substring") -> Optional[List[int]]:
+        """ID монстров каталога, у которых kind или spec совпадает с term"""
+        return await self._resolve_names("monster_catalog", "id", ["kind", "spec"], term, match)
+    
+    async def _resolve_names(
+        self,
+        table: str,
+        value_column: str,
+        match_columns: List[str],
+        term: str,
+        match: str
+    ) -> Optional[List[Any]]:
+        """
+        Предварительный поиск по справочнику (триграммные GIN-индексы V9)
         
-        # Получаем общее количество
-        count_query = f"SELECT COUNT(*) as total FROM battles b WHERE {where_clause}"
-        total_result = await self._execute_one(count_query, *params)
-        total = total_result["total"]
+        Returns:
+            Список значений value_column; None, если совпадений больше NAME_SEARCH_MAX_IDS —
+            тогда вызывающий код сравнивает имена в подзапросе, а не по списку
+        """
+        max_ids = int(os.getenv("NAME_SEARCH_MAX_IDS", "5000"))
+        condition = " OR ".join(match_sql(column, "$1", match) for column in match_columns)
+        rows = await self._execute_query(f"""
+            SELECT {value_column} AS value
+            FROM {table}
+            WHERE {condition}
+            ORDER BY {order_sql(match_columns[0], "$1", match)}
+            LIMIT $2
+        """, match_value(term, match), max_ids + 1)
+        if len(rows) > max_ids:
+            return None
+        return [row["value"] for row in rows]
+    
+    async def _battles_page(
+        self,
+        where_clause: str,
+        params: List[Any],
+        page: int,
+        limit: int,
+        after_id: Optional[int],
+        total_key: Tuple[Any, ...]
+    ) -> Tuple[List[Dict], int]:
+        """
+        Страница боёв: сначала только id-шники страницы из battles (по индексу id),
+        затем игроки и монстры — лишь для этих боёв, а не для всего набора
+        """
+        page_params = list(params)
+        conditions = [where_clause]
+        if after_id is not None:
+            page_params.append(after_id)
+            conditions.append(f"b.id < ${len(page_params)}")
+        page_params.append(limit)
+        tail = f"LIMIT ${len(page_params)}"
+        if after_id is None and page > 1:
+            page_params.append((page - 1) * limit)
+            tail += f" OFFSET ${len(page_params)}"
         
-        # Получаем результаты поиска
-        search_query = f"""
-            SELECT b.id, b.ts, b.battle_type, b.turns, b.loc_x, b.loc_y,
-                   b.source_id,
-                   array_agg(DISTINCT p.login) as players,
-                   COALESCE(SUM(bm.count), 0) as monsters_count
+        battles = await self._execute_query(f"""
+            SELECT b.id, b.ts, b.battle_type, b.turns, b.loc_x, b.loc_y, b.source_id
             FROM battles b
-            LEFT JOIN battle_participants bp ON b.id = bp.battle_id
-            LEFT JOIN players p ON bp.player_id = p.id
-            LEFT JOIN battle_monsters bm ON b.id = bm.battle_id
-            WHERE {where_clause}
-            GROUP BY b.id, b.ts, b.battle_type, b.turns, b.loc_x, b.loc_y, b.source_id
+            WHERE {" AND ".join(conditions)}
             ORDER BY b.id DESC
-            LIMIT ${param_count + 1} OFFSET ${param_count + 2}
-        """
+            {tail}
+        """, *page_params)
+        await self._attach_page_details(battles)
         
-        params.extend([limit, offset])
-        battles = await self._execute_query(search_query, *params)
+        total = await self._battles_total(where_clause, params, total_key)
+        return battles, total
+    
+    async def _attach_page_details(self, battles: List[Dict]) -> None:
+        """Игроки и число монстров для боёв страницы — двумя запросами по списку id"""
+        if not battles:
+            return
+        battle_ids = [battle["id"] for battle in battles]
+        # Даты боёв отсекают лишние месячные секции battle_participants (V8)
+        battle_days = sorted({_battle_day(battle["ts"]) for battle in battles})
+        players_rows = await self._execute_query("""
+            SELECT bp.battle_id, array_agg(DISTINCT p.login) AS players
+            FROM battle_participants bp
+            JOIN players p ON bp.player_id = p.id
+            WHERE bp.battle_id = ANY($1::bigint[]) AND bp.battle_ts = ANY($2::date[])
+            GROUP BY bp.battle_id
+        """, battle_ids, battle_days)
+        monsters_rows = await self._execute_query("""
+            SELECT battle_id, COALESCE(SUM(count), 0) AS monsters_count
+            FROM battle_monsters
+            WHERE battle_id = ANY($1::bigint[])
+            GROUP BY battle_id
+        """, battle_ids)
+        players = {row["battle_id"]: row["players"] for row in players_rows}
+        monsters_count = {row["battle_id"]: row["monsters_count"] for row in monsters_rows}
         
         # Преобразуем в нужный формат
         for battle in battles:
-            battle["players"] = list(set(battle["players"])) if battle["players"] else []
+            battle["players"] = list(players.get(battle["id"]) or [])
+            battle["monsters_count"] = int(monsters_count.get(battle["id"], 0))
             battle["location"] = [battle["loc_x"], battle["loc_y"]] if battle["loc_x"] is not None else None
             battle["duration"] = battle.get("turns", 0)  # ✅ Количество ходов
+    
+    async def _battles_total(self, where_clause: str, params: List[Any], total_key: Tuple[Any, ...]) -> int:
+        """
+        Общее количество боёв для страницы: кэшируется на BATTLES_TOTAL_CACHE_TTL секунд;
+        без фильтров большие таблицы не считаются — берётся оценка планировщика (reltuples)
+        """
+        now = time.monotonic()
+        cached = _BATTLES_TOTALS.get(total_key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
         
-        return battles, total
+        total = None
+        if where_clause == "1=1":
+            estimate = await self._execute_one("""
+                SELECT COALESCE(SUM(GREATEST(c.reltuples, 0)), 0)::bigint AS estimate
+                FROM pg_class c
+                WHERE c.oid = 'battles'::regclass
+                   OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = 'battles'::regclass)
+            """)
+            # Маленькие или ещё не проанализированные таблицы дёшево посчитать точно
+            if estimate and estimate["estimate"] >= int(os.getenv("BATTLES_EXACT_COUNT_BELOW", "100000")):
+                total = int(estimate["estimate"])
+        if total is None:
+            result = await self._execute_one(f"SELECT COUNT(*) AS total FROM battles b WHERE {where_clause}", *params)
+            total = int(result["total"])
+        
+        if len(_BATTLES_TOTALS) >= 1024:
+            _BATTLES_TOTALS.clear()
+        _BATTLES_TOTALS[total_key] = (now + float(os.getenv("BATTLES_TOTAL_CACHE_TTL", "30")), total)
+        return total
     
     async def find_new_files(self, logs_base: str) -> List[str]:
         """Поиск новых файлов логов"""
@@ -564,3 +1074,20 @@ class BattleDatabase:
             return True
         except Exception:
             return False
+    
+    async def pool_stats(self) -> Dict[str, Any]:
+        """Состояние пула соединений и время пробного запроса"""
+        if not self.pool:
+            return {"connected": False}
+        started = time.perf_counter()
+        healthy = await self.health_check()
+        return {
+            "connected": True,
+            "healthy": healthy,
+            "ping_ms": round((time.perf_counter() - started) * 1000, 2),
+            "size": self.pool.get_size(),
+            "idle": self.pool.get_idle_size(),
+            "min_size": self.pool.get_min_size(),
+            "max_size": self.pool.get_max_size(),
+            "statement_cache_size": self._get_pool_params()["statement_cache_size"],
+        }
@@ -0,0 +1,85 @@
+"""
+Кэш ID справочников (игроки, кланы, монстры, ресурсы, части монстров) для API_4
+
+Справочники маленькие и почти не меняются, поэтому натуральный ключ -> id
+держим в памяти процесса и ходим в БД только за промахами — одним запросом на пачку.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+
+class DimensionCache:
+    """Ограниченный LRU-кэш натуральный ключ -> id со счётчиками попаданий/промахов"""
+
+    def __init__(self, name: str, max_size: int = 50000):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self._items: "OrderedDict[Hashable, int]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[int]:
+        """ID по ключу или None (промах)"""
+        value = self._items.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get_many(self, keys: Iterable[Hashable]) -> Tuple[Dict[Hashable, int], List[Hashable]]:
+        """
+        Поиск пачки ключей
+
+        Returns:
+            (найденные ключ -> id, уникальные промахи в порядке первого появления) —
+            промахи разрешаются одним запросом к БД
+        """
+        found: Dict[Hashable, int] = {}
+        missing: List[Hashable] = []
+        for key in dict.fromkeys(keys):
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        return found, missing
+
+    def put(self, key: Hashable, value: Optional[int]) -> None:
+        """Запомнить ID (None не кэшируется — отсутствие в справочнике может измениться)"""
+        if value is None:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def put_many(self, values: Dict[Hashable, int]) -> None:
+        for key, value in values.items():
+            self.put(key, value)
+
+    def invalidate(self, keys: Optional[Iterable[Hashable]] = None) -> None:
+        """Сбросить ключи (или весь кэш, если keys не задан)"""
+        if keys is None:
+            self._items.clear()
+        else:
+            for key in keys:
+                self._items.pop(key, None)
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
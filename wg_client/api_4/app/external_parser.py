@@ -41,7 +41,7 @@ def _import_from_example() -> tuple:
 
 def run_new_parser(file_path: str) -> Dict[str, Any]:
     """Выполняет новый парсер из example/parser в том же процессе и возвращает JSON."""
-    example_parser_battle, example_parser_dedupe = _import_from_example()
+    example_parser_battle, _ = _import_from_example()
 
     p = Path(file_path)
     
@@ -50,18 +50,7 @@ def run_new_parser(file_path: str) -> Dict[str, Any]:
         magic = f.read(2)
         is_gzipped = (magic == b'\x1f\x8b')
     
-    # Безопасное чтение файла
-    try:
-        with p.open('r', encoding='utf-8', errors='replace') as f:
-            content = f.read()
-    except UnicodeDecodeError:
-        # Fallback на cp1251
-        with p.open('r', encoding='cp1251', errors='replace') as f:
-            content = f.read()
-    
-    # Дедупликация в памяти (не перезаписываем файл)
-    deduped = example_parser_dedupe.dedupe_tzb_content(content)  # type: ignore[attr-defined]
-
+    # Дубль <BATTLE> отрезает сам parse_file (для очищенных на входе логов — по маркеру, без сканирования)
     parser = example_parser_battle.BattleParser()  # type: ignore[attr-defined]
     result = parser.parse_file(str(p))  # type: ignore[call-arg]
     if not isinstance(result, dict):
@@ -74,6 +63,26 @@ def run_new_parser(file_path: str) -> Dict[str, Any]:
     return result
 
 
+def warm_up_parser() -> None:
+    """Инициализатор процесса пула парсинга: парсер импортируется один раз на процесс."""
+    try:
+        _import_from_example()
+    except FileNotFoundError:
+        # Ошибку увидит вызывающий при первом parse_for_db, а не как BrokenProcessPool
+        pass
+
+
+def parse_for_db(file_path: str) -> Dict[str, Any]:
+    """Парсинг файла и нормализация под схему БД — вся CPU-часть загрузки одного боя.
+
+    Выполняется в процессе пула BattleLoader, поэтому возвращает только picklable данные.
+    """
+    battle_data = normalize_for_db(run_new_parser(file_path))
+    # storage_key — путь, по которому файл нашёл загрузчик (а не то, что записал парсер)
+    battle_data["storage_key"] = str(file_path)
+    return battle_data
+
+
 def normalize_for_db(parser_json: Dict[str, Any]) -> Dict[str, Any]:
     """Преобразует JSON нового парсера к схеме, ожидаемой слоем БД API4."""
     battle = parser_json.get("battle", {})
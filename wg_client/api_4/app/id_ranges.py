@@ -0,0 +1,179 @@
+"""
+Компактное множество ID боёв в виде отсортированных непересекающихся диапазонов
+
+Подряд идущие ID (а синхронизированные бои почти всегда идут подряд) хранятся
+как один диапазон [lo, hi]: миллион боёв без пропусков — одна пара чисел,
+а не миллион объектов int в set. Операции над множествами работают
+слиянием списков диапазонов — за O(число диапазонов), без развёртки в ID.
+
+Диапазоны из БД получаются запросом «gaps and islands» (см. ISLANDS_SQL):
+PostgreSQL возвращает по строке на непрерывный участок, а не на каждый ID.
+"""
+
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+Range = Tuple[int, int]
+
+# Острова подряд идущих значений: у соседних ID разность с DENSE_RANK постоянна.
+# {column} — целочисленная колонка, {source} — таблица или подзапрос с условиями.
+ISLANDS_SQL = """
+    SELECT MIN(v) AS lo, MAX(v) AS hi
+    FROM (
+        SELECT {column} AS v, {column} - DENSE_RANK() OVER (ORDER BY {column}) AS grp
+        FROM {source}
+        WHERE {column} IS NOT NULL{where}
+    ) s
+    GROUP BY grp
+    ORDER BY lo
+"""
+
+
+def islands_sql(column: str, source: str, where: str = "") -> str:
+    """SQL, возвращающий строки (lo, hi) непрерывных участков значений column"""
+    return ISLANDS_SQL.format(column=column, source=source, where=f" AND ({where})" if where else "")
+
+
+class IdRangeSet:
+    """Неизменяемое множество целых чисел, хранимое диапазонами [lo, hi] включительно"""
+
+    __slots__ = ("_ranges", "_count")
+
+    def __init__(self, ranges: Iterable[Range] = ()):
+        self._ranges: List[Range] = self._normalize(ranges)
+        self._count = sum(hi - lo + 1 for lo, hi in self._ranges)
+
+    @staticmethod
+    def _normalize(ranges: Iterable[Range]) -> List[Range]:
+        merged: List[Range] = []
+        for lo, hi in sorted((int(lo), int(hi)) for lo, hi in ranges):
+            if lo > hi:
+                continue
+            if merged and lo <= merged[-1][1] + 1:
+                if hi > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], hi)
+            else:
+                merged.append((lo, hi))
+        return merged
+
+    @classmethod
+    def _from_normalized(cls, ranges: List[Range]) -> "IdRangeSet":
+        result = cls.__new__(cls)
+        result._ranges = ranges
+        result._count = sum(hi - lo + 1 for lo, hi in ranges)
+        return result
+
+    @classmethod
+    def span(cls, lo: int, hi: int) -> "IdRangeSet":
+        """Все ID от lo до hi включительно"""
+        return cls([(lo, hi)])
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> "IdRangeSet":
+        """Из отдельных ID (сворачиваются в диапазоны)"""
+        ranges: List[Range] = []
+        for value in sorted(set(ids)):
+            if ranges and value == ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], value)
+            else:
+                ranges.append((value, value))
+        return cls._from_normalized(ranges)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Any], lo_key: str = "lo", hi_key: str = "hi") -> "IdRangeSet":
+        """Из строк запроса islands_sql"""
+        return cls((row[lo_key], row[hi_key]) for row in rows)
+
+    @property
+    def ranges(self) -> Sequence[Range]:
+        return tuple(self._ranges)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __bool__(self) -> bool:
+        return bool(self._ranges)
+
+    def __iter__(self) -> Iterator[int]:
+        for lo, hi in self._ranges:
+            yield from range(lo, hi + 1)
+
+    def __reversed__(self) -> Iterator[int]:
+        for lo, hi in reversed(self._ranges):
+            yield from range(hi, lo - 1, -1)
+
+    def __contains__(self, value: int) -> bool:
+        idx = bisect_right(self._ranges, (value, float("inf"))) - 1
+        return idx >= 0 and self._ranges[idx][0] <= value <= self._ranges[idx][1]
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, IdRangeSet) and self._ranges == other._ranges
+
+    def __repr__(self) -> str:
+        return f"IdRangeSet({self._ranges!r})"
+
+    @property
+    def min(self) -> Optional[int]:
+        return self._ranges[0][0] if self._ranges else None
+
+    @property
+    def max(self) -> Optional[int]:
+        return self._ranges[-1][1] if self._ranges else None
+
+    def __or__(self, other: "IdRangeSet") -> "IdRangeSet":
+        return IdRangeSet(self._ranges + other._ranges)
+
+    def __sub__(self, other: "IdRangeSet") -> "IdRangeSet":
+        result: List[Range] = []
+        j = 0
+        theirs = other._ranges
+        for lo, hi in self._ranges:
+            # Пропускаем вычитаемые диапазоны, целиком лежащие левее
+            while j < len(theirs) and theirs[j][1] < lo:
+                j += 1
+            k = j
+            while k < len(theirs) and theirs[k][0] <= hi:
+                if theirs[k][0] > lo:
+                    result.append((lo, theirs[k][0] - 1))
+                lo = max(lo, theirs[k][1] + 1)
+                if lo > hi:
+                    break
+                k += 1
+            if lo <= hi:
+                result.append((lo, hi))
+        return IdRangeSet._from_normalized(result)
+
+    def __and__(self, other: "IdRangeSet") -> "IdRangeSet":
+        result: List[Range] = []
+        i = j = 0
+        ours, theirs = self._ranges, other._ranges
+        while i < len(ours) and j < len(theirs):
+            lo = max(ours[i][0], theirs[j][0])
+            hi = min(ours[i][1], theirs[j][1])
+            if lo <= hi:
+                result.append((lo, hi))
+            if ours[i][1] < theirs[j][1]:
+                i += 1
+            else:
+                j += 1
+        return IdRangeSet._from_normalized(result)
+
+    def last(self, n: int) -> "IdRangeSet":
+        """n наибольших ID"""
+        result: List[Range] = []
+        for lo, hi in reversed(self._ranges):
+            if n <= 0:
+                break
+            take_lo = max(lo, hi - n + 1)
+            result.append((take_lo, hi))
+            n -= hi - take_lo + 1
+        result.reverse()
+        return IdRangeSet._from_normalized(result)
+
+    def describe(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Диапазоны для JSON-ответов: {"single": id} или {"range": [lo, hi], "count": n}"""
+        ranges = self._ranges if limit is None else self._ranges[:limit]
+        return [
+            {"single": lo} if lo == hi else {"range": [lo, hi], "count": hi - lo + 1}
+            for lo, hi in ranges
+        ]
@@ -6,8 +6,10 @@ import os
 
 from app.database import BattleDatabase
 from app.parser import BattleParser
-from app.loader import BattleLoader
+from app.loader import BattleLoader, shutdown_parse_executor
 from app.analytics import BattleAnalytics
+from app.adapters.http_mother_client import HttpMotherClient
+from app.raw_cache import raw_cache_from_env
 from app.infrastructure.repositories.pg_battle_repository import PgBattleRepository
 from app.usecases.get_battle import GetBattleUseCase
 from app.usecases.list_battles import ListBattlesUseCase
@@ -31,12 +33,16 @@ def require_admin_token_factory(env_getter):
 @asynccontextmanager
 async def build_app(app: FastAPI) -> AsyncIterator[FastAPI]:
 
-    # core infrastructure
+    # core infrastructure: один пул соединений на приложение, роутеры получают его отсюда
     db = BattleDatabase()
     await db.connect()
     parser = BattleParser()
     loader = BattleLoader(db)
     analytics = BattleAnalytics(db)
+    # один пул HTTP-соединений с api_mother на приложение
+    mother_client = HttpMotherClient()
+    # горячий кэш /battle/{id}/raw: свой на процесс, каталог сброса удаляется при остановке
+    raw_cache = raw_cache_from_env()
 
     # ports/adapters and use cases
     repo = PgBattleRepository(db)
@@ -66,12 +72,29 @@ async def build_app(app: FastAPI) -> AsyncIterator[FastAPI]:
         monster_analytics_uc=monster_analytics_uc,
         general_stats_uc=general_stats_uc,
         admin_logs_uc=admin_logs_uc,
+        db=db,
         require_admin_token=require_admin_token,
+        mother_client=mother_client,
+        raw_cache=raw_cache,
     ))
 
+    # Раннер долговечных заданий XML sync (xml_sync_jobs): куски забираются в аренду,
+    # поэтому его можно включать на нескольких репликах сразу
+    job_runner = None
+    if os.getenv("XML_SYNC_JOBS_ENABLED", "0") == "1":
+        from app.xml_sync_jobs import XmlSyncJobs, XmlSyncJobRunner
+        from app.xml_sync_worker import XmlSyncWorker
+        job_runner = XmlSyncJobRunner(XmlSyncJobs(db), XmlSyncWorker(db))
+        job_runner.start()
+
     try:
         yield app
     finally:
+        if job_runner:
+            await job_runner.stop()
+        await mother_client.close()
+        raw_cache.close()
         await db.disconnect()
+        shutdown_parse_executor()
 
 
@@ -16,6 +16,9 @@ class PgBattleRepository(BattleRepository):
     async def list_battles(self, page: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
         return await self._db.list_battles(page, limit)
 
+    async def list_battles_after(self, after_id: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        return await self._db.list_battles(limit=limit, after_id=after_id)
+
     async def search_battles(self, **filters) -> Tuple[List[Dict[str, Any]], int]:
         return await self._db.search_battles(
             player=filters.get("player"),
@@ -26,6 +29,8 @@ class PgBattleRepository(BattleRepository):
             monsters=filters.get("monsters"),
             page=filters.get("page", 1),
             limit=filters.get("limit", 10),
+            after_id=filters.get("after_id"),
+            match=filters.get("match", "substring"),
         )
 
     async def save_battle(self, battle_data: Dict[str, Any]) -> int:
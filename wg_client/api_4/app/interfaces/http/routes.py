@@ -1,9 +1,10 @@
 from typing import Optional, Any, Dict, List
+import asyncio
 import os
 import logging
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException, Path, Query, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Path, Query, Depends, UploadFile, File, Request
 
 logger = logging.getLogger(__name__)
 
@@ -16,9 +17,48 @@ from app.usecases.analytics import (
 )
 from app.usecases.admin_logs import AdminLogsUseCase
 from app.domain.mappers import map_domain_battles_to_summary
-from fastapi.responses import Response
+from app.pagination import decode_cursor, next_cursor_for
+from app.name_search import MATCH_MODE_PATTERN
 from app.adapters.http_mother_client import HttpMotherClient
 from app.database import BattleDatabase
+from app.raw_cache import RawLogCache, raw_cache_from_env
+from app.raw_stream import RawSource, etag_for, file_chunks, memory_chunks, not_modified, raw_log_response
+from shared.utils.btl_codec import CHUNK, decoded_length
+from shared.utils.btl_pack import PackError, PackStore
+
+
+def _parse_cursor(cursor: Optional[str]) -> Optional[int]:
+    """id из курсора пагинации (None — первая страница / режим page)"""
+    if not cursor:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _response_chunks(response):
+    """Тело ответа api_mother как пришло (сжатое), кусками; соединение возвращается в пул"""
+    try:
+        async for chunk in response.aiter_raw(CHUNK):
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+def _open_log(path: str):
+    """Открытый файл лога, его размер и длина распакованного лога (если известна)"""
+    f = open(path, 'rb')
+    try:
+        size = os.fstat(f.fileno()).st_size
+        head = f.read(18)
+        f.seek(max(size - 4, 0))
+        tail = f.read(4)
+        f.seek(0)
+    except BaseException:
+        f.close()
+        raise
+    return f, size, decoded_length(head, tail, size)
 
 
 def build_router(
@@ -33,9 +73,18 @@ def build_router(
     monster_analytics_uc: MonsterAnalyticsUseCase,
     general_stats_uc: GeneralStatsUseCase,
     admin_logs_uc: AdminLogsUseCase,
+    db: BattleDatabase,
     require_admin_token,
+    mother_client: Optional[HttpMotherClient] = None,
+    raw_cache: Optional[RawLogCache] = None,
 ) -> APIRouter:
     router = APIRouter()
+    # Паки шардов ({shard}.pack + {shard}.idx) в локальном хранилище — только чтение
+    pack_store = PackStore(os.getenv('LOGS_STORE', '/srv/btl/gz'))
+    # Один клиент api_mother (пул keep-alive соединений) на приложение — см. container.build_app
+    mother_client = mother_client or HttpMotherClient()
+    # Горячий кэш сырых логов (память + диск) — см. app.raw_cache
+    raw_cache = raw_cache or raw_cache_from_env()
 
     @router.get("/healthz")
     async def healthz():
@@ -45,21 +94,47 @@ def build_router(
     async def battle_healthz():
         return {"status": "ok"}
 
+    @router.get("/healthz/db")
+    async def db_healthz():
+        """Состояние общего пула соединений с БД (размер, простаивающие, ping)"""
+        stats = await db.pool_stats()
+        if not stats.get("healthy"):
+            raise HTTPException(status_code=503, detail=stats)
+        return stats
+
     @router.get(
         "/battles/list",
         summary="Список боёв",
-        description="Получить список всех боёв с пагинацией. Возвращает реальные battle_id из игры (source_id).",
+        description="""
+Получить список всех боёв с пагинацией. Возвращает реальные battle_id из игры (source_id).
+
+Для глубокого листания передавайте `cursor` из `next_cursor` предыдущего ответа —
+страница читается по индексу без OFFSET (`page` при этом игнорируется).
+`total` — оценка: для больших таблиц по статистике планировщика, кэшируется на несколько секунд.
+        """,
         tags=["Battles"]
     )
-    async def list_battles(page: int = Query(1, ge=1), limit: int = Query(10, ge=1, le=100)):
-        battles, total = await list_battles_uc.execute(page=page, limit=limit)
+    async def list_battles(
+        page: int = Query(1, ge=1),
+        limit: int = Query(10, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+    ):
+        after_id = _parse_cursor(cursor)
+        battles, total = await list_battles_uc.execute(page=page, limit=limit, after_id=after_id)
         items = map_domain_battles_to_summary(battles)
-        return {"battles": items, "total": total, "page": page, "limit": limit}
+        return {
+            "battles": items, "total": total, "page": page, "limit": limit,
+            "next_cursor": next_cursor_for(battles, limit),
+        }
 
     # Алиас для совместимости с клиентами, ожидающими /battle/list
     @router.get("/battle/list")
-    async def list_battles_alias(page: int = Query(1, ge=1), limit: int = Query(10, ge=1, le=100)):
-        return await list_battles(page=page, limit=limit)
+    async def list_battles_alias(
+        page: int = Query(1, ge=1),
+        limit: int = Query(10, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+    ):
+        return await list_battles(page=page, limit=limit, cursor=cursor)
 
     @router.get(
         "/battles/search",
@@ -72,6 +147,10 @@ def build_router(
 - `clan=WG` - все бои клана
 - `from_date=2025-10-01&to_date=2025-10-08` - бои за период
 - `monsters=rat` - бои с крысами
+- `player=Терм&match=prefix` - логины, начинающиеся с «Терм»
+- `player=Термид&match=fuzzy` - нечёткий поиск (опечатки)
+
+Для глубокого листания передавайте `cursor` из `next_cursor` предыдущего ответа.
         """,
         tags=["Battles"]
     )
@@ -84,14 +163,20 @@ def build_router(
         monsters: Optional[str] = Query(None, description="Тип монстра"),
         page: int = Query(1, ge=1),
         limit: int = Query(10, ge=1, le=100),
+        cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+        match: str = Query("substring", pattern=MATCH_MODE_PATTERN, description="Сравнение имён: substring | prefix | fuzzy"),
     ):
+        after_id = _parse_cursor(cursor)
         battles, total = await search_battles_uc.execute(
             player=player, clan=clan, battle_type=battle_type,
             from_date=from_date, to_date=to_date, monsters=monsters,
-            page=page, limit=limit,
+            page=page, limit=limit, after_id=after_id, match=match,
         )
         items = map_domain_battles_to_summary(battles)
-        return {"battles": items, "total": total, "page": page, "limit": limit}
+        return {
+            "battles": items, "total": total, "page": page, "limit": limit,
+            "next_cursor": next_cursor_for(battles, limit),
+        }
 
     # Алиас для совместимости: /battle/search
     @router.get(
@@ -106,15 +191,18 @@ def build_router(
         - `battle_type` - тип боя (pve/pvp/boss)
         - `from_date`, `to_date` - диапазон дат (ISO 8601)
         - `monsters` - логин монстра (например: "$Кровопийца")
+        - `match` - сравнение имён: substring (по умолчанию) | prefix | fuzzy
         
         **Пагинация:**
         - `page` - номер страницы (начиная с 1)
         - `limit` - боёв на странице (1-100)
+        - `cursor` - `next_cursor` предыдущего ответа (keyset, без OFFSET)
         
         **Возвращает:**
         - `battles` - массив боёв
         - `total` - всего найдено
         - `page`, `limit` - текущая страница
+        - `next_cursor` - курсор следующей страницы (null на последней)
         - `has_more` - есть ли еще результаты
         
         **Примеры:**
@@ -135,11 +223,13 @@ def build_router(
         monsters: Optional[str] = Query(None, description="Логин монстра (с $)"),
         page: int = Query(1, ge=1, description="Номер страницы"),
         limit: int = Query(10, ge=1, le=100, description="Боёв на странице"),
+        cursor: Optional[str] = Query(None, description="next_cursor предыдущей страницы"),
+        match: str = Query("substring", pattern=MATCH_MODE_PATTERN, description="Сравнение имён: substring | prefix | fuzzy"),
     ):
         return await search_battles(
             player=player, clan=clan, battle_type=battle_type,
             from_date=from_date, to_date=to_date, monsters=monsters,
-            page=page, limit=limit,
+            page=page, limit=limit, cursor=cursor, match=match,
         )
 
     @router.get(
@@ -163,9 +253,7 @@ def build_router(
     async def get_battle_by_source(source_id: int = Path(..., description="source_id (ID из БД)")):
         # source_id в URL - это на самом деле service_id (внутренний id из БД)
         # get_battle ищет по source_id, поэтому делаем прямой запрос по id
-        db = BattleDatabase()
         row = await db._execute_one("SELECT source_id FROM battles WHERE id = $1", source_id)
-        await db.disconnect()
         if not row:
             raise HTTPException(status_code=404, detail="Бой с таким source_id не найден")
         # Теперь ищем по реальному battle_id (source_id из БД)
@@ -174,52 +262,45 @@ def build_router(
             raise HTTPException(status_code=404, detail="Бой не найден")
         return battle
 
-    @router.get(
-        "/battle/{battle_id:int}/raw",
-        summary="Получить сырой XML лог боя",
-        description="Возвращает оригинальный XML файл боя (.tzb) для скачивания или анализа.",
-        tags=["Battles"]
-    )
-    async def get_battle_raw(battle_id: int = Path(..., description="Service ID боя")):
-        # 1) Получаем storage_key из БД (ищем по source_id, т.к. battle_id = source_id)
-        db = BattleDatabase()
-        # Сначала находим service_id по source_id
-        row = await db._execute_one("SELECT id, storage_key FROM battles WHERE source_id = $1", battle_id)
-        await db.disconnect()
-        if not row or not row.get("storage_key"):
-            raise HTTPException(status_code=404, detail="Исходный файл не найден")
-        storage_key = row["storage_key"]
-
-        # 2) Пытаемся получить файл через api_mother (предпочтительно)
-        mother = HttpMotherClient()
+    async def open_raw_source(battle_id: int, storage_key: str) -> RawSource:
+        """Открыть сжатый лог боя: api_mother, затем пак шарда и файлы хранилища"""
+        # 1) Пытаемся получить файл через api_mother (предпочтительно) — потоком, без чтения в память
         try:
-            if await mother.health_check():
-                # Передаём battle_id.tzb для правильного определения шарда в api_mother
-                import os
-                content = await mother.get_gz_file(f"{battle_id}.tzb")
-                try:
-                    import gzip
-                    xml = gzip.decompress(content)
-                except Exception:
-                    xml = content
-                return Response(content=xml, media_type="application/xml")
+            # Передаём battle_id.tzb для правильного определения шарда в api_mother
+            response = await mother_client.open_gz(f"{battle_id}.tzb")
         except Exception as e:
             # Если api_mother не смог найти файл, переходим к локальному поиску
-            import logging
-            logging.getLogger(__name__).debug(f"api_mother failed for battle {battle_id}: {e}")
-        finally:
-            await mother.close()
+            logger.debug(f"api_mother failed for battle {battle_id}: {e}")
+        else:
+            size = response.headers.get("content-length")
+            length = response.headers.get("x-decoded-length")
+            return RawSource(
+                _response_chunks(response),
+                size=int(size) if size else None,
+                decoded_length=int(length) if length else None,
+            )
 
-        # 3) Фолбэк: читаем файл с локального пути
-            import gzip, os
+        # 2) Фолбэк: пак шарда, затем файл с локального пути
+        try:
+            member = await asyncio.to_thread(pack_store.get, battle_id)
+        except (PackError, OSError) as e:
+            logger.warning(f"pack read failed for battle {battle_id}: {e}")
+            member = None
+        if member is not None:
+            return RawSource(
+                memory_chunks(member),
+                size=len(member),
+                decoded_length=decoded_length(member[:18], member[-4:], len(member)),
+            )
         candidates = []
         
         shard = battle_id // 50000
         gz_base = os.getenv('LOGS_STORE', '/srv/btl/gz')
         raw_base = os.getenv('LOGS_RAW', '/srv/btl/raw')
         
-        # ПРИОРИТЕТ 1: /srv/btl/gz/{shard}/{battle_id}.tzb.gz (ОСНОВНОЕ ХРАНИЛИЩЕ!)
+        # ПРИОРИТЕТ 1: /srv/btl/gz/{shard}/{battle_id}.tzb.gz (ОСНОВНОЕ ХРАНИЛИЩЕ!) или .tzb.zst
         candidates.append(os.path.join(gz_base, str(shard), f"{battle_id}.tzb.gz"))
+        candidates.append(os.path.join(gz_base, str(shard), f"{battle_id}.tzb.zst"))
         
         # ПРИОРИТЕТ 2: /srv/btl/raw/{shard}/{battle_id}.tzb (ВРЕМЕННОЕ, если ещё не сжато)
         candidates.append(os.path.join(raw_base, str(shard), f"{battle_id}.tzb"))
@@ -241,18 +322,56 @@ def build_router(
 
         for cand in candidates:
             try:
-                if cand.endswith('.gz'):
-                    with gzip.open(cand, 'rb') as f:
-                    data = f.read()
-            else:
-                    with open(cand, 'rb') as f:
-                    data = f.read()
-            return Response(content=data, media_type="application/xml")
-            except Exception as e:  # пробуем следующий кандидат
+                # Формат — по магии: gzip, zstd со словарём хранилища или несжатый
+                f, size, length = await asyncio.to_thread(_open_log, cand)
+            except OSError as e:  # пробуем следующий кандидат
                 last_err = e
                 continue
+            return RawSource(file_chunks(f), size=size, decoded_length=length)
         raise HTTPException(status_code=500, detail=f"Не удалось прочитать файл: {last_err}")
 
+    @router.get(
+        "/battle/{battle_id:int}/raw",
+        summary="Получить сырой XML лог боя",
+        description="Возвращает оригинальный XML файл боя (.tzb) для скачивания или анализа. Отдаётся потоком; с Accept-Encoding: gzip — сжатым, поддерживает Range по распакованному логу и If-None-Match (ETag — sha256 лога). Свежие бои отдаются из кэша.",
+        tags=["Battles"]
+    )
+    async def get_battle_raw(request: Request, battle_id: int = Path(..., description="Service ID боя")):
+        # 1) storage_key и sha256 из БД (ищем по source_id, т.к. battle_id = source_id).
+        # Один индексный запрос и на попадании в кэш: бой могут перезалить (/upload,
+        # /sync), и запись кэша с другим sha256 устарела
+        row = await db._execute_one("SELECT id, storage_key, sha256 FROM battles WHERE source_id = $1", battle_id)
+        if not row or not row.get("storage_key"):
+            raise HTTPException(status_code=404, detail="Исходный файл не найден")
+        sha256 = row.get("sha256") or ""
+        etag = etag_for(sha256)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+
+        # 2) Горячий кэш: на попадании хранилище не читается
+        entry = await raw_cache.lookup(battle_id, sha256)
+        if entry is not None:
+            chunks = await raw_cache.open(entry)
+            if chunks is not None:
+                return await raw_log_response(
+                    request, chunks, size=entry.size, decoded_length=entry.decoded_length,
+                    dicts=pack_store.dicts, etag=etag,
+                )
+
+        # 3) Загрузка в кэш: одновременные промахи по одному бою — одна загрузка
+        entry, source = await raw_cache.load(battle_id, sha256, lambda: open_raw_source(battle_id, row["storage_key"]))
+        if source is not None:
+            # Лог больше RAW_CACHE_MAX_ENTRY_MB — потоком мимо кэша
+            return await raw_log_response(
+                request, source.chunks, size=source.size, decoded_length=source.decoded_length,
+                dicts=pack_store.dicts, etag=etag,
+            )
+        return await raw_log_response(
+            request, memory_chunks(entry.data), size=entry.size, decoded_length=entry.decoded_length,
+            dicts=pack_store.dicts, etag=etag,
+        )
+
     @router.post(
         "/sync",
         summary="Синхронизация логов",
@@ -692,7 +811,6 @@ def build_router(
         limit: int = Query(1000, ge=1, le=100000, description="Максимум боёв"),
     ):
         """Вернёт список боёв игрока за период: id и ts."""
-        db = BattleDatabase()
         where = ["p.login = $1"]
         params: List[Any] = [login]
         arg_idx = 2
@@ -716,7 +834,6 @@ def build_router(
         """
         params.append(limit)
         rows = await db._execute_query(query, *params)
-        await db.disconnect()
         return [{"battle_id": r["battle_id"], "service_id": r.get("service_id"), "ts": r["ts"]} for r in rows]
 
     @router.get(
@@ -758,10 +875,22 @@ def build_router(
     async def loading_stats(_: str = Depends(require_admin_token)):
         return await admin_logs_uc.loading_stats()
 
+    @router.get("/admin/dimension-cache")
+    async def dimension_cache_stats(_: str = Depends(require_admin_token)):
+        return {"caches": admin_logs_uc.dimension_cache_stats()}
+
+    @router.get("/admin/raw-cache")
+    async def raw_cache_stats(_: str = Depends(require_admin_token)):
+        return raw_cache.stats()
+
     @router.post("/admin/cleanup")
     async def cleanup(days_old: int = Query(30, ge=1, le=365), _: str = Depends(require_admin_token)):
-        deleted = await admin_logs_uc.cleanup(days_old=days_old)
-        return {"message": f"Удалено {deleted} старых записей логов", "deleted_count": deleted}
+        detached = await admin_logs_uc.cleanup(days_old=days_old)
+        return {
+            "message": f"Отсоединено {detached} месячных секций боёв старше {days_old} дней",
+            "deleted_count": detached,
+            "detached_partitions": detached,
+        }
     
     @router.get(
         "/admin/battles-inventory",
@@ -771,51 +900,13 @@ def build_router(
     )
     async def battles_inventory(_: str = Depends(require_admin_token)):
         """Сравнивает файлы с БД и показывает диапазоны"""
-        from pathlib import Path
-        
-        # Собираем battle_id из файлов
-        files_battles = set()
-        # DEPRECATED: старое зеркало больше не используется
-        mirror_path = None
-        if False:  # mirror_path and mirror_path.exists():
-            for file in []:  # mirror_path.rglob("*.tzb"):
-                try:
-                    battle_id = int(file.stem)
-                    files_battles.add(battle_id)
-                except ValueError:
-                    continue
-        
-        # Собираем battle_id из БД
-        db = BattleDatabase()
-        db_battles_rows = await db._execute_query("SELECT DISTINCT source_id as battle_id FROM battles ORDER BY source_id")
-        await db.disconnect()
-        db_battles = set(row["battle_id"] for row in db_battles_rows if row.get("battle_id"))
-        
-        # Анализируем диапазоны
-        def find_ranges(ids):
-            if not ids:
-                return []
-            sorted_ids = sorted(ids)
-            ranges = []
-            start = sorted_ids[0]
-            prev = sorted_ids[0]
-            
-            for current in sorted_ids[1:]:
-                if current != prev + 1:
-                    if start == prev:
-                        ranges.append({"single": start})
-                    else:
-                        ranges.append({"range": [start, prev], "count": prev - start + 1})
-                    start = current
-                prev = current
-            
-            # Последний диапазон
-            if start == prev:
-                ranges.append({"single": start})
-            else:
-                ranges.append({"range": [start, prev], "count": prev - start + 1})
-            
-            return ranges
+        from app.id_ranges import IdRangeSet
+        
+        # battle_id из файлов (DEPRECATED: старое зеркало больше не используется)
+        files_battles = IdRangeSet()
+        
+        # battle_id из БД — диапазонами (gaps and islands), а не строкой на бой
+        db_battles = await db.battle_source_ranges()
         
         # Находим разницу
         only_files = files_battles - db_battles
@@ -825,23 +916,23 @@ def build_router(
         return {
             "files": {
                 "total": len(files_battles),
-                "ranges": find_ranges(files_battles)[:50] if len(files_battles) <= 10000 else None,
-                "min": min(files_battles) if files_battles else None,
-                "max": max(files_battles) if files_battles else None,
+                "ranges": files_battles.describe(50) if len(files_battles) <= 10000 else None,
+                "min": files_battles.min,
+                "max": files_battles.max,
             },
             "database": {
                 "total": len(db_battles),
-                "ranges": find_ranges(db_battles)[:50] if len(db_battles) <= 10000 else None,
-                "min": min(db_battles) if db_battles else None,
-                "max": max(db_battles) if db_battles else None,
+                "ranges": db_battles.describe(50) if len(db_battles) <= 10000 else None,
+                "min": db_battles.min,
+                "max": db_battles.max,
             },
             "comparison": {
                 "in_both": len(both),
                 "only_in_files": len(only_files),
                 "only_in_db": len(only_db),
             },
-            "missing_in_db": find_ranges(only_files)[:30] if len(only_files) <= 1000 else {"count": len(only_files), "note": "Слишком много для отображения"},
-            "missing_in_files": find_ranges(only_db)[:30] if len(only_db) <= 1000 else {"count": len(only_db), "note": "Слишком много для отображения"},
+            "missing_in_db": only_files.describe(30) if len(only_files) <= 1000 else {"count": len(only_files), "note": "Слишком много для отображения"},
+            "missing_in_files": only_db.describe(30) if len(only_db) <= 1000 else {"count": len(only_db), "note": "Слишком много для отображения"},
         }
 
     @router.post("/battles/upload")
@@ -886,9 +977,7 @@ def build_router(
             
             # Обрабатываем файл через loader
             from app.loader import BattleLoader
-            from app.database import BattleDatabase
             
-            db = BattleDatabase()
             loader = BattleLoader(db)
             
             # Передаём ПРАВИЛЬНЫЙ путь парсеру
@@ -1395,9 +1484,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
             )
         
         # Классифицируем игрока
-        db = BattleDatabase()
         result = await classifier.classify_player(player_id, db, days=days)
-        await db.disconnect()
         
         if not result:
             raise HTTPException(status_code=404, detail=f"Недостаточно данных для классификации (минимум 5 боёв)")
@@ -1431,7 +1518,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
     async def xml_sync_workers_health(_token = Depends(require_admin_token)):
         """Проверить здоровье всех XML воркеров"""
         from app.xml_sync_worker import XmlSyncWorker
-        worker = XmlSyncWorker()
+        worker = XmlSyncWorker(db)
         return await worker.check_workers_health()
     
     @router.post("/admin/xml-sync/battle/{battle_id}")
@@ -1441,10 +1528,8 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
     ):
         """Запросить один лог боя через XML протокол"""
         from app.xml_sync_client import XmlSyncClient
-        from app.database import BattleDatabase
         
         client = XmlSyncClient()
-        db = BattleDatabase()
         
         # Проверяем не запрашивали ли уже
         existing = await db._execute_one(
@@ -1453,7 +1538,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         )
         
         if existing and existing['status'] == 'success':
-            await db.disconnect()
             return {
                 "message": f"Бой {battle_id} уже был успешно запрошен ранее",
                 "battle_id": battle_id,
@@ -1465,26 +1549,15 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         
         # Сохраняем в лог
         if result:
-            await db._execute_command(
-                """
-                INSERT INTO xml_sync_log (battle_id, requested_at, status, error_message, file_path, size_bytes)
-                VALUES ($1, $2, $3, $4, $5, $6)
-                ON CONFLICT (battle_id) DO UPDATE SET
-                    requested_at = EXCLUDED.requested_at,
-                    status = EXCLUDED.status,
-                    error_message = EXCLUDED.error_message,
-                    file_path = EXCLUDED.file_path,
-                    size_bytes = EXCLUDED.size_bytes
-                """,
+            await db.upsert_sync_log([(
                 battle_id,
                 datetime.now(),
                 result['status'],
                 result.get('error'),
                 result.get('file_path'),
                 result.get('size_bytes')
-            )
+            )])
         
-        await db.disconnect()
         return result
     
     @router.post("/admin/xml-sync/range")
@@ -1503,7 +1576,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         if end_id - start_id > 1000:
             raise HTTPException(status_code=400, detail="Максимальный диапазон: 1000 боев за раз")
         
-        worker = XmlSyncWorker()
+        worker = XmlSyncWorker(db)
         result = await worker.sync_range(start_id, end_id, skip_existing)
         
         return result
@@ -1511,9 +1584,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
     @router.get("/admin/xml-sync/status")
     async def xml_sync_status(_token = Depends(require_admin_token)):
         """Получить статистику XML синхронизации"""
-        from app.database import BattleDatabase
-        
-        db = BattleDatabase()
         
         stats = await db._execute_one("""
             SELECT 
@@ -1526,8 +1596,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
             FROM xml_sync_log
         """)
         
-        await db.disconnect()
-        
         return {
             "total_requests": stats['total_requests'] or 0,
             "success_count": stats['success_count'] or 0,
@@ -1544,9 +1612,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         _token = Depends(require_admin_token)
     ):
         """Получить список запрошенных боев"""
-        from app.database import BattleDatabase
-        
-        db = BattleDatabase()
         
         if status:
             query = """
@@ -1566,8 +1631,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
             """
             rows = await db._execute_query(query, limit)
         
-        await db.disconnect()
-        
         return {
             "count": len(rows),
             "limit": limit,
@@ -1612,9 +1675,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         _token = Depends(require_admin_token)
     ):
         """Получить список боев с ошибками"""
-        from app.database import BattleDatabase
-        
-        db = BattleDatabase()
         
         if error_type == "all":
             query = """
@@ -1635,8 +1695,6 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
             """
             rows = await db._execute_query(query, error_type, limit)
         
-        await db.disconnect()
-        
         return {
             "count": len(rows),
             "error_type": error_type,
@@ -1660,7 +1718,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         """Докачать бои с ошибками (failed, response_timeout)"""
         from app.xml_sync_worker import XmlSyncWorker
         
-        worker = XmlSyncWorker()
+        worker = XmlSyncWorker(db)
         result = await worker.sync_missing(limit=limit)
         
         return result
@@ -1674,7 +1732,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         """Автоматическая синхронизация: продолжить с последнего успешного боя"""
         from app.xml_sync_worker import XmlSyncWorker
         
-        worker = XmlSyncWorker()
+        worker = XmlSyncWorker(db)
         result = await worker.sync_auto_continue(batch_size=batch_size)
         
         return result
@@ -1724,7 +1782,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         import httpx
         from app.xml_sync_worker import XmlSyncWorker
         
-        worker = XmlSyncWorker()
+        worker = XmlSyncWorker(db)
         await worker._init_db()  # Инициализируем БД
         
         # Определяем стартовый ID
@@ -1845,7 +1903,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
                 detail=f"Операция уже выполняется: {status['current_operation']}. Используйте /admin/xml-sync/abort для прерывания."
             )
         
-        worker = XmlSyncWorker()
+        worker = XmlSyncWorker(db)
         await worker._init_db()  # Инициализируем БД
         
         # Определяем конечный ID
@@ -1980,6 +2038,78 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         
         return status
 
+    @router.post(
+        "/admin/xml-sync/jobs",
+        summary="Создать долговечное задание XML Sync",
+        description="""
+        Диапазон делится на куски по chunk_size боёв и сохраняется в БД (xml_sync_jobs).
+        Куски разбирают раннеры всех реплик api_4 с XML_SYNC_JOBS_ENABLED=1; прогресс
+        переживает перезапуск, готовые куски повторно не запрашиваются.
+        """,
+        tags=["Admin - XML Sync"]
+    )
+    async def xml_sync_create_job(
+        start_id: int = Query(..., ge=1, description="Начальный ID боя"),
+        end_id: int = Query(..., ge=1, description="Конечный ID боя"),
+        chunk_size: Optional[int] = Query(None, ge=10, le=100000, description="Размер куска (по умолчанию XML_SYNC_JOB_CHUNK_SIZE)"),
+        skip_existing: bool = Query(True, description="Пропускать уже загруженные бои"),
+        _token = Depends(require_admin_token)
+    ):
+        """Создать задание синхронизации диапазона"""
+        from app.xml_sync_jobs import XmlSyncJobs, XML_SYNC_JOB_CHUNK_SIZE
+
+        if end_id < start_id:
+            raise HTTPException(status_code=400, detail="end_id должен быть >= start_id")
+
+        return await XmlSyncJobs(db).create_job(start_id, end_id, chunk_size or XML_SYNC_JOB_CHUNK_SIZE, skip_existing)
+
+    @router.get("/admin/xml-sync/jobs", tags=["Admin - XML Sync"])
+    async def xml_sync_list_jobs(
+        limit: int = Query(20, ge=1, le=200),
+        _token = Depends(require_admin_token)
+    ):
+        """Последние задания с прогрессом и скоростью"""
+        from app.xml_sync_jobs import XmlSyncJobs
+
+        return {"jobs": await XmlSyncJobs(db).list_jobs(limit)}
+
+    @router.get("/admin/xml-sync/jobs/{job_id}", tags=["Admin - XML Sync"])
+    async def xml_sync_get_job(
+        job_id: int = Path(..., ge=1),
+        _token = Depends(require_admin_token)
+    ):
+        """Прогресс задания, скорость (бои/с, байты/с) в целом и по аккаунтам воркеров"""
+        from app.xml_sync_jobs import XmlSyncJobs
+
+        job = await XmlSyncJobs(db).get_job(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Задание не найдено")
+        return job
+
+    @router.post("/admin/xml-sync/jobs/{job_id}/cancel", tags=["Admin - XML Sync"])
+    async def xml_sync_cancel_job(
+        job_id: int = Path(..., ge=1),
+        _token = Depends(require_admin_token)
+    ):
+        """Остановить задание: раннеры вернут свои куски в очередь на ближайшем heartbeat"""
+        from app.xml_sync_jobs import XmlSyncJobs
+
+        if not await XmlSyncJobs(db).set_status(job_id, "cancelled"):
+            raise HTTPException(status_code=409, detail="Задание не найдено или уже не выполняется")
+        return {"job_id": job_id, "status": "cancelled"}
+
+    @router.post("/admin/xml-sync/jobs/{job_id}/resume", tags=["Admin - XML Sync"])
+    async def xml_sync_resume_job(
+        job_id: int = Path(..., ge=1),
+        _token = Depends(require_admin_token)
+    ):
+        """Продолжить задание с незавершённых кусков (в том числе застрявших)"""
+        from app.xml_sync_jobs import XmlSyncJobs
+
+        if not await XmlSyncJobs(db).set_status(job_id, "running"):
+            raise HTTPException(status_code=409, detail="Задание не найдено или уже завершено")
+        return {"job_id": job_id, "status": "running"}
+
     @router.post("/admin/ml/train-playstyle")
     async def admin_train_playstyle(
         days: int = Query(90, ge=30, le=365),
@@ -1994,9 +2124,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         if not SKLEARN_AVAILABLE:
             raise HTTPException(status_code=501, detail="scikit-learn не установлен")
         
-        db = BattleDatabase()
         result = await train_playstyle_model(db, days=days)
-        await db.disconnect()
         
         if result.get("status") == "error":
             raise HTTPException(status_code=500, detail=result.get("error"))
@@ -2017,9 +2145,7 @@ ELO рейтинг игроков в PvE боях (monsters_cnt > 0).
         if not SKLEARN_AVAILABLE:
             raise HTTPException(status_code=501, detail="scikit-learn не установлен")
         
-        db = BattleDatabase()
         result = await train_bot_detector(db, days=days)
-        await db.disconnect()
         
         if result.get("status") == "error":
             raise HTTPException(status_code=500, detail=result.get("error"))
@@ -4,23 +4,67 @@
 """
 
 import asyncio
+import multiprocessing
 import os
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from app.database import BattleDatabase
-from .external_parser import run_new_parser, normalize_for_db
+from .external_parser import parse_for_db, warm_up_parser
 from app.utils import validate_battle_data, sanitize_filename, calculate_file_hash
 from app.adapters.http_mother_client import HttpMotherClient
 from shared.utils.settings import BaseSettings as Settings
 
 
+# Пул процессов парсинга — один на процесс API (BattleLoader создаётся и в роутерах на запрос)
+_PARSE_EXECUTOR: Optional[ProcessPoolExecutor] = None
+
+
+def get_parse_executor(workers: int) -> Optional[ProcessPoolExecutor]:
+    """Ленивое создание пула парсинга; workers=0 — без пула (парсинг в потоке по умолчанию)."""
+    global _PARSE_EXECUTOR
+    if workers <= 0:
+        return None
+    if _PARSE_EXECUTOR is None:
+        # spawn, а не fork: форк из процесса с event loop и открытыми соединениями asyncpg небезопасен
+        _PARSE_EXECUTOR = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=warm_up_parser,
+        )
+    return _PARSE_EXECUTOR
+
+
+def reset_parse_executor(broken: ProcessPoolExecutor) -> None:
+    """
+    Сбросить сломанный пул (процесс парсинга убит OOM-killer'ом или упал)
+
+    Следующий get_parse_executor создаст новый. Сбрасывается только этот пул:
+    одновременные запросы, получившие BrokenProcessPool от него же, не пересоздают
+    уже новый пул.
+    """
+    global _PARSE_EXECUTOR
+    if _PARSE_EXECUTOR is broken:
+        _PARSE_EXECUTOR = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_parse_executor() -> None:
+    """Остановка пула парсинга (вызывается при остановке приложения)."""
+    global _PARSE_EXECUTOR
+    if _PARSE_EXECUTOR is not None:
+        _PARSE_EXECUTOR.shutdown(wait=True, cancel_futures=True)
+        _PARSE_EXECUTOR = None
+
+
 class BattleLoader:
     """Загрузчик данных о боях"""
     
-    def __init__(self, db: BattleDatabase):
+    def __init__(self, db: BattleDatabase, parse_workers: Optional[int] = None):
         self.db = db
         self.logger = logging.getLogger(__name__)
         
@@ -30,6 +74,8 @@ class BattleLoader:
         self.max_workers = s.max_workers
         self.retry_attempts = s.retry_attempts
         self.retry_delay = s.retry_delay
+        self.parse_workers = s.parse_workers if parse_workers is None else parse_workers
+        self.parse_queue_size = max(1, s.parse_queue_size)
     
     async def load_battles_from_directory(
         self, 
@@ -80,82 +126,116 @@ class BattleLoader:
         return await self._process_files_batch(files)
     
     async def _process_files_batch(self, files: List[Path]) -> Dict[str, Any]:
-        """Обработка файлов батчами"""
+        """
+        Конвейер обработки: парсинг в пуле процессов → ограниченная очередь → запись в БД
+
+        Парсинг — чистый CPU, поэтому уходит из event loop в процессы пула (PARSE_WORKERS),
+        а распарсенные боя передаются max_workers писателям через очередь на
+        PARSE_QUEUE_SIZE элементов: если БД не успевает, парсинг ждёт, память не растёт.
+        """
         total_files = len(files)
-        processed = 0
-        successful = 0
-        failed = 0
-        errors = []
+        stats: Dict[str, Any] = {
+            "total_files": total_files,
+            "processed": 0,
+            "successful": 0,
+            "failed": 0,
+            "errors": []
+        }
+        if not files:
+            return stats
         
-        # Обрабатываем файлы батчами
-        for i in range(0, total_files, self.batch_size):
-            batch = files[i:i + self.batch_size]
-            self.logger.info(f"Обрабатываем батч {i//self.batch_size + 1}: файлы {i+1}-{min(i+self.batch_size, total_files)}")
-            
-            # Создаем семафор для ограничения количества одновременных задач
-            semaphore = asyncio.Semaphore(self.max_workers)
-            
-            # Создаем задачи для обработки файлов в батче
-            tasks = [
-                self._process_single_file(semaphore, file_path)
-                for file_path in batch
-            ]
-            
-            # Выполняем задачи
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # Обрабатываем результаты
-            for result in results:
-                processed += 1
-                if isinstance(result, Exception):
-                    failed += 1
-                    error_msg = f"Ошибка обработки файла: {str(result)}"
-                    errors.append(error_msg)
-                    self.logger.error(error_msg)
-                elif result:
-                    successful += 1
-                else:
-                    failed += 1
-                    error_msg = "Неизвестная ошибка обработки файла"
-                    errors.append(error_msg)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.parse_queue_size)
+        # Одновременно в пуле не больше задач, чем процессов (+1, чтобы пул не простаивал)
+        parse_slots = asyncio.Semaphore(max(1, self.parse_workers) + 1)
+        writers_count = max(1, self.max_workers)
+        
+        async def parse_one(file_path: Path) -> None:
+            try:
+                if await self._is_file_already_processed(file_path):
+                    self.logger.debug(f"Файл {file_path} уже обработан, пропускаем")
+                    await queue.put((file_path, None, None))
+                    return
+                battle_data = await self._parse_file(file_path)
+                await queue.put((file_path, battle_data, None))
+            except Exception as e:
+                await queue.put((file_path, None, e))
+            finally:
+                parse_slots.release()
+        
+        async def produce() -> None:
+            parse_tasks = []
+            for file_path in files:
+                await parse_slots.acquire()
+                parse_tasks.append(asyncio.create_task(parse_one(file_path)))
+            await asyncio.gather(*parse_tasks)
+            for _ in range(writers_count):
+                await queue.put(None)
+        
+        async def write() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                file_path, battle_data, error = item
+                try:
+                    if error is not None:
+                        raise error
+                    if battle_data is not None:
+                        await self._save_with_retry(file_path, battle_data)
+                    stats["successful"] += 1
+                except Exception as e:
+                    stats["failed"] += 1
+                    error_msg = f"Ошибка обработки файла {file_path}: {str(e)}"
+                    stats["errors"].append(error_msg)
                     self.logger.error(error_msg)
+                stats["processed"] += 1
+                if stats["processed"] % self.batch_size == 0:
+                    self.logger.info(f"Обработано {stats['processed']}/{total_files} файлов")
         
-        return {
-            "total_files": total_files,
-            "processed": processed,
-            "successful": successful,
-            "failed": failed,
-            "errors": errors
-        }
+        await asyncio.gather(produce(), *(write() for _ in range(writers_count)))
+        return stats
     
-    async def _process_single_file(
-        self, 
-        semaphore: asyncio.Semaphore, 
-        file_path: Path
-    ) -> bool:
+    async def _parse_file(self, file_path: Path) -> Dict[str, Any]:
         """
-        Обработка одного файла с повторными попытками
+        Парсинг файла вне event loop: в пуле процессов или (PARSE_WORKERS=0) в потоке
+
+        Сломанный пул (процесс парсинга погиб) пересоздаётся, файл повторяется один раз
+        в новом пуле; если и там процесс гибнет — это ошибка файла, а не всей загрузки.
+        """
+        loop = asyncio.get_running_loop()
+        for attempt in range(2):
+            executor = get_parse_executor(self.parse_workers)
+            try:
+                return await loop.run_in_executor(executor, parse_for_db, str(file_path))
+            except BrokenProcessPool:
+                reset_parse_executor(executor)
+                if attempt:
+                    raise
+                self.logger.warning(f"Пул парсинга сломан (процесс завершился аварийно) — пересоздаём, повтор {file_path}")
+    
+    async def _save_with_retry(self, file_path: Path, battle_data: Dict[str, Any]) -> bool:
+        """
+        Запись распарсенного боя с повторными попытками
         
         Args:
-            semaphore: Семафор для ограничения параллелизма
             file_path: Путь к файлу
+            battle_data: Результат parse_for_db
             
         Returns:
-            True, если файл успешно обработан
+            True, если бой сохранён
         """
-        async with semaphore:
-            for attempt in range(self.retry_attempts):
-                try:
-                    return await self._process_file_attempt(file_path)
-                except Exception as e:
-                    if attempt == self.retry_attempts - 1:
-                        self.logger.error(f"Файл {file_path} не удалось обработать после {self.retry_attempts} попыток: {e}")
-                        raise
-                    else:
-                        self.logger.warning(f"Попытка {attempt + 1} обработки файла {file_path} не удалась: {e}")
-                        await asyncio.sleep(self.retry_delay * (attempt + 1))
-            
-            return False
+        for attempt in range(self.retry_attempts):
+            try:
+                return await self._save_parsed(file_path, battle_data)
+            except Exception as e:
+                if attempt == self.retry_attempts - 1:
+                    self.logger.error(f"Файл {file_path} не удалось обработать после {self.retry_attempts} попыток: {e}")
+                    raise
+                else:
+                    self.logger.warning(f"Попытка {attempt + 1} обработки файла {file_path} не удалась: {e}")
+                    await asyncio.sleep(self.retry_delay * (attempt + 1))
+        
+        return False
     
     async def _process_file_attempt(self, file_path: Path) -> bool:
         """
@@ -173,13 +253,26 @@ class BattleLoader:
                 self.logger.debug(f"Файл {file_path} уже обработан, пропускаем")
                 return True
             
-            # Новый парсер — по умолчанию, без fallback.
-            parsed = run_new_parser(str(file_path))
-            battle_data = normalize_for_db(parsed)
+            # Новый парсер — по умолчанию, без fallback (в пуле процессов, event loop не блокируется)
+            battle_data = await self._parse_file(file_path)
+            return await self._save_parsed(file_path, battle_data)
             
-            # КРИТИЧНО: Устанавливаем storage_key ПОСЛЕ парсинга
-            battle_data["storage_key"] = str(file_path)
+        except Exception as e:
+            self.logger.error(f"Ошибка обработки файла {file_path}: {e}")
+            raise
+    
+    async def _save_parsed(self, file_path: Path, battle_data: Dict[str, Any]) -> bool:
+        """
+        Валидация и запись распарсенного боя
+        
+        Args:
+            file_path: Путь к файлу
+            battle_data: Результат parse_for_db
             
+        Returns:
+            True, если бой сохранён
+        """
+        try:
             # Валидируем данные
             is_valid, validation_errors = validate_battle_data(battle_data)
             if not is_valid:
@@ -314,35 +407,24 @@ class BattleLoader:
     
     async def cleanup_old_logs(self, days_old: int = 30) -> int:
         """
-        Очистка старых записей логов
+        Очистка старых боёв: отсоединение месячных секций (V8) старше days_old
+        
+        Вместо построчного DELETE секции battles/battle_participants/battle_loot
+        целиком отсоединяются (DETACH PARTITION) и остаются в БД отдельными
+        таблицами — их можно удалить или вернуть через ATTACH PARTITION.
+        Отсоединяются только месяцы, полностью лежащие раньше границы.
         
         Args:
-            days_old: Возраст записей в днях
+            days_old: Возраст боёв в днях
             
         Returns:
-            Количество удаленных записей
+            Количество отсоединённых месяцев
         """
         try:
-            cutoff_date = datetime.now() - timedelta(days=days_old)
-            
-            # Удаляем старые записи логов
-            query = """
-                DELETE FROM battle_logs 
-                WHERE ingested_at < $1 
-                AND status IN ('success', 'error')
-            """
-            result = await self.db._execute_command(query, cutoff_date)
-            
-            # Извлекаем количество удаленных записей из результата
-            deleted_count = 0
-            if "DELETE" in result:
-                try:
-                    deleted_count = int(result.split()[-1])
-                except (ValueError, IndexError):
-                    pass
-            
-            self.logger.info(f"Удалено {deleted_count} старых записей логов")
-            return deleted_count
+            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_old)
+            detached = await self.db.detach_partitions_before(cutoff_date.date())
+            self.logger.info(f"Отсоединено {detached} месячных секций боёв старше {cutoff_date.date()}")
+            return detached
             
         except Exception as e:
             self.logger.error(f"Ошибка очистки старых логов: {e}")
@@ -172,7 +172,8 @@ class PlayerStats(BaseModel):
 
 class ClanStats(BaseModel):
     """Статистика клана"""
-    clan_id: int = Field(..., description="ID клана")
+    # Витрины ведутся по названию клана: клана может не быть в справочнике clans
+    clan_id: Optional[int] = Field(None, description="ID клана (None — нет в справочнике)")
     name: str = Field(..., description="Название клана")
     members_count: int = Field(..., description="Количество участников")
     battles_count: int = Field(..., description="Количество боёв")
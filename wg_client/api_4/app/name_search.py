@@ -0,0 +1,45 @@
+"""
+Поиск по именам справочников (логины, кланы, монстры) для API_4
+
+Условия строятся под триграммные GIN-индексы из миграции V9:
+- substring — ILIKE '%x%' (по умолчанию, прежнее поведение поиска)
+- prefix — ILIKE 'x%' (автодополнение)
+- fuzzy — оператор pg_trgm `%` (опечатки; порог — pg_trgm.similarity_threshold, по умолчанию 0.3)
+"""
+
+from typing import Tuple
+
+MATCH_MODES: Tuple[str, ...] = ("substring", "prefix", "fuzzy")
+MATCH_MODE_PATTERN = "^(" + "|".join(MATCH_MODES) + ")$"
+
+
+def escape_like(term: str) -> str:
+    """Экранирование спецсимволов LIKE: запрос «100%» ищет именно «100%»"""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def match_value(term: str, mode: str) -> str:
+    """Значение параметра для match_sql"""
+    if mode == "fuzzy":
+        return term
+    if mode == "prefix":
+        return f"{escape_like(term)}%"
+    if mode == "substring":
+        return f"%{escape_like(term)}%"
+    raise ValueError(f"Неизвестный режим поиска: {mode}")
+
+
+def match_sql(column: str, param: str, mode: str) -> str:
+    """SQL-условие сравнения column с параметром param (например, "$1")"""
+    if mode == "fuzzy":
+        return f"{column} % {param}"
+    if mode in ("prefix", "substring"):
+        return f"{column} ILIKE {param}"
+    raise ValueError(f"Неизвестный режим поиска: {mode}")
+
+
+def order_sql(column: str, param: str, mode: str) -> str:
+    """Порядок кандидатов: для fuzzy — самые похожие первыми"""
+    if mode == "fuzzy":
+        return f"similarity({column}, {param}) DESC, {column}"
+    return column
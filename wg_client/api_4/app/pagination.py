@@ -0,0 +1,43 @@
+"""
+Курсорная (keyset) пагинация списков боёв для API_4
+
+Курсор — непрозрачная для клиента строка: внутри последний battles.id страницы.
+Следующая страница читается условием b.id < id по индексу, без OFFSET,
+поэтому глубокие страницы стоят столько же, сколько первая.
+"""
+
+import base64
+from typing import Any, Dict, List, Optional
+
+_CURSOR_VERSION = "v1"
+
+
+def encode_cursor(last_id: int) -> str:
+    """Курсор, указывающий на бои с id меньше last_id"""
+    raw = f"{_CURSOR_VERSION}:{int(last_id)}".encode("ascii")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Разбор курсора
+
+    Raises:
+        ValueError: курсор повреждён или выдан несовместимой версией
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        version, _, value = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii").partition(":")
+        last_id = int(value)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor!r}") from e
+    if version != _CURSOR_VERSION or last_id <= 0:
+        raise ValueError(f"Некорректный курсор: {cursor!r}")
+    return last_id
+
+
+def next_cursor_for(battles: List[Dict[str, Any]], limit: int) -> Optional[str]:
+    """Курсор следующей страницы или None, если страница неполная (дальше боёв нет)"""
+    if len(battles) < limit or not battles:
+        return None
+    return encode_cursor(battles[-1]["id"])
@@ -7,7 +7,6 @@ try:
     from lxml import etree as ET  # более устойчивый парсер
 except Exception:  # fallback
     import xml.etree.ElementTree as ET
-import gzip
 import hashlib
 import os
 from typing import Dict, List, Any, Optional, Tuple
@@ -15,8 +14,12 @@ from datetime import datetime
 from pathlib import Path
 
 from app.models import BattleMeta, BattleInfo, Participant, Monster, Loot
+from shared.utils.btl_codec import GZIP_MAGIC, ZSTD_MAGIC, DictRegistry, decode
 import json as _json
 
+# Словари zstd хранилища (загружаются по требованию и кэшируются)
+_ZSTD_DICTS = DictRegistry(os.getenv('LOGS_STORE', '/srv/btl/gz'))
+
 # Попытка подключить example/parser/battle_parser
 _EXAMPLE_BP = None
 try:
@@ -222,17 +225,12 @@ class BattleParser:
         # Вычисляем SHA256
         sha256_hash = self._calculate_sha256(file_path)
         
-        # Определяем, сжат ли файл
-        compressed = file_path.suffix.lower() in ['.gz', '.gzip']
-        
-        # Читаем содержимое файла
+        # Читаем содержимое файла: gzip, zstd (словари — в LOGS_STORE/dicts) или несжатый — по магии
         try:
-            if compressed:
-                with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-                    content = f.read()
-            else:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            compressed = data[:2] == GZIP_MAGIC or data[:4] == ZSTD_MAGIC
+            content = decode(data, _ZSTD_DICTS).decode('utf-8')
         except Exception as e:
             raise ValueError(f"Ошибка чтения файла {file_path}: {e}")
         # Авто-дедупликация по второму <BATTLE> при наличии утилиты
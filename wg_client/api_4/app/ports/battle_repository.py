@@ -14,6 +14,10 @@ class BattleRepository:
     async def list_battles(self, page: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
         raise NotImplementedError
 
+    async def list_battles_after(self, after_id: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Keyset-страница: бои с id меньше after_id (по убыванию id)."""
+        raise NotImplementedError
+
     async def search_battles(self, **filters) -> Tuple[List[Dict[str, Any]], int]:
         raise NotImplementedError
 
@@ -0,0 +1,270 @@
+"""
+Горячий кэш сырых логов боёв для /battle/{id}/raw
+
+Дашборды и get_battle_map.py раз за разом запрашивают одни и те же свежие бои.
+Кэш держит логи в том виде, в каком они лежат в хранилище (gzip / zstd) —
+в несколько раз компактнее распакованных, и gzip отдаётся клиенту как есть:
+
+- память: LRU до RAW_CACHE_MEMORY_MB; вытесненное сбрасывается на диск;
+- диск (RAW_CACHE_DIR): LRU до RAW_CACHE_DISK_MB, вытесненное удаляется;
+- логи больше RAW_CACHE_MAX_ENTRY_MB не кэшируются (отдаются потоком мимо кэша);
+- одновременные промахи по одному бою сливаются в одну загрузку (single-flight).
+
+Запись хранит sha256 лога из battles — он же ETag. Бой может быть перезалит
+(/upload, /sync) с другим логом, поэтому роут на каждый запрос берёт sha256 из
+battles (один индексный запрос), а lookup() отбрасывает запись с другим sha256.
+По времени кэш не инвалидируется.
+
+Кэш живёт в процессе и работает в цикле событий; файлы пишутся и удаляются в
+потоках (asyncio.to_thread). Каталог сброса — свой у каждого процесса и
+удаляется в close().
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.raw_stream import RawSource, file_chunks, memory_chunks
+
+RAW_CACHE_MEMORY_MB = float(os.getenv("RAW_CACHE_MEMORY_MB", "64"))
+RAW_CACHE_DISK_MB = float(os.getenv("RAW_CACHE_DISK_MB", "512"))
+RAW_CACHE_MAX_ENTRY_MB = float(os.getenv("RAW_CACHE_MAX_ENTRY_MB", "8"))
+RAW_CACHE_DIR = os.getenv("RAW_CACHE_DIR", os.path.join(tempfile.gettempdir(), "api4_raw_cache"))
+
+_MB = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RawEntry:
+    """Лог в кэше: байты в памяти (data) или файл сброса (path)"""
+    sha256: str
+    size: int
+    decoded_length: Optional[int]
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+
+
+class RawLogCache:
+    """Двухуровневый (память + диск) LRU-кэш сырых логов с single-flight загрузкой"""
+
+    def __init__(self, max_memory: int, max_disk: int = 0, max_entry: int = 8 * _MB,
+                 spill_dir: Optional[str] = None):
+        self.max_memory = max(0, max_memory)
+        self.max_disk = max(0, max_disk) if spill_dir else 0
+        self.max_entry = max(0, max_entry)
+        self._spill_dir = None
+        if self.max_disk:
+            os.makedirs(spill_dir, exist_ok=True)
+            self._spill_dir = tempfile.mkdtemp(prefix=f"raw-{os.getpid()}-", dir=spill_dir)
+        self._memory: "OrderedDict[int, RawEntry]" = OrderedDict()
+        self._disk: "OrderedDict[int, RawEntry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self._seq = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bypassed = 0
+        self.spills = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, battle_id: int) -> Optional[RawEntry]:
+        """Запись из памяти или с диска (None — промах)"""
+        entry = self._memory.get(battle_id)
+        if entry is not None:
+            self._memory.move_to_end(battle_id)
+            self.hits += 1
+            return entry
+        entry = self._disk.get(battle_id)
+        if entry is not None:
+            self._disk.move_to_end(battle_id)
+            self.disk_hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    async def lookup(self, battle_id: int, sha256: str) -> Optional[RawEntry]:
+        """Запись с этим sha256 (None — промах); запись с другим sha256 устарела и удаляется"""
+        entry = self.get(battle_id)
+        if entry is None or entry.sha256 == sha256:
+            return entry
+        self.invalidations += 1
+        await self.invalidate(battle_id)
+        return None
+
+    async def invalidate(self, battle_id: int) -> None:
+        """Удалить запись боя из памяти и с диска"""
+        removed = self._drop(self._memory, battle_id) + self._drop(self._disk, battle_id)
+        if removed:
+            await asyncio.to_thread(_remove_files, removed)
+
+    async def open(self, entry: RawEntry) -> Optional[AsyncIterator[bytes]]:
+        """Куски записи; None — файл сброса уже вытеснен (считать промахом)"""
+        if entry.data is not None:
+            return memory_chunks(entry.data)
+        try:
+            f = await asyncio.to_thread(open, entry.path, "rb")
+        except FileNotFoundError:
+            return None
+        return file_chunks(f)
+
+    async def load(self, battle_id: int, sha256: str,
+                   open_source: Callable[[], Awaitable[RawSource]]) -> Tuple[Optional[RawEntry], Optional[RawSource]]:
+        """
+        Загрузка по промаху: одна на бой, сколько бы запросов ни ждало
+
+        Returns:
+            (запись, None) — лог в кэше; (None, источник) — лог больше max_entry
+            (или лидер загрузки был отменён), отдавать его нужно потоком из источника
+        """
+        waiting = self._inflight.get(battle_id)
+        if waiting is not None:
+            self.coalesced += 1
+            entry = await asyncio.shield(waiting)
+            if entry is not None and entry.sha256 == sha256:
+                return entry, None
+            return None, await open_source()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[battle_id] = future
+        try:
+            source = await open_source()
+            if source.size is None or source.size > self.max_entry:
+                self.bypassed += 1
+                future.set_result(None)
+                return None, source
+            try:
+                data = b"".join([chunk async for chunk in source.chunks])
+            finally:
+                await source.chunks.aclose()
+            entry = RawEntry(sha256=sha256, size=len(data), decoded_length=source.decoded_length, data=data)
+            await self.put(battle_id, entry)
+            future.set_result(entry)
+            return entry, None
+        except asyncio.CancelledError:
+            # Клиент лидера ушёл — ждущие загрузят сами
+            future.set_result(None)
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # ждущих может не быть — не пишем в лог «exception was never retrieved»
+            raise
+        finally:
+            del self._inflight[battle_id]
+
+    async def put(self, battle_id: int, entry: RawEntry) -> None:
+        """Положить лог в память; вытесненное из памяти сбрасывается на диск"""
+        if entry.size > self.max_entry or entry.size > self.max_memory:
+            return
+        self._drop(self._memory, battle_id)
+        self._memory[battle_id] = entry
+        self._memory_bytes += entry.size
+        spilled: List[Tuple[int, RawEntry]] = []
+        while self._memory_bytes > self.max_memory:
+            key, old = self._memory.popitem(last=False)
+            self._memory_bytes -= old.size
+            if self._spill_dir and old.size <= self.max_disk:
+                self._seq += 1
+                spilled.append((key, RawEntry(old.sha256, old.size, old.decoded_length,
+                                              data=old.data, path=os.path.join(self._spill_dir, f"{key}-{self._seq}"))))
+            else:
+                self.evictions += 1
+        if not spilled:
+            return
+        try:
+            await asyncio.to_thread(_write_spills, spilled)
+        except OSError as e:
+            # Диск сброса недоступен или переполнен — вытесненное просто теряется
+            logger.warning(f"raw cache spill failed: {e}")
+            self.evictions += len(spilled)
+            return
+        removed: List[str] = []
+        for key, disk_entry in spilled:
+            disk_entry.data = None
+            if key in self._memory:  # бой снова попал в память, пока писали
+                removed.append(disk_entry.path)
+                continue
+            removed.extend(self._drop(self._disk, key))
+            self._disk[key] = disk_entry
+            self._disk_bytes += disk_entry.size
+            self.spills += 1
+        while self._disk_bytes > self.max_disk:
+            _, old = self._disk.popitem(last=False)
+            self._disk_bytes -= old.size
+            removed.append(old.path)
+            self.evictions += 1
+        if removed:
+            await asyncio.to_thread(_remove_files, removed)
+
+    def _drop(self, tier: "OrderedDict[int, RawEntry]", battle_id: int) -> List[str]:
+        old = tier.pop(battle_id, None)
+        if old is None:
+            return []
+        if tier is self._memory:
+            self._memory_bytes -= old.size
+            return []
+        self._disk_bytes -= old.size
+        return [old.path]
+
+    def close(self) -> None:
+        """Очистить кэш и удалить каталог сброса процесса"""
+        self._memory.clear()
+        self._disk.clear()
+        self._memory_bytes = self._disk_bytes = 0
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "max_memory_bytes": self.max_memory,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "max_disk_bytes": self.max_disk,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "bypassed": self.bypassed,
+            "spills": self.spills,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+        }
+
+
+def raw_cache_from_env() -> RawLogCache:
+    return RawLogCache(
+        max_memory=int(RAW_CACHE_MEMORY_MB * _MB),
+        max_disk=int(RAW_CACHE_DISK_MB * _MB),
+        max_entry=int(RAW_CACHE_MAX_ENTRY_MB * _MB),
+        spill_dir=RAW_CACHE_DIR,
+    )
+
+
+def _write_spills(spilled: List[Tuple[int, RawEntry]]) -> None:
+    for _, entry in spilled:
+        tmp = f"{entry.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(entry.data)
+        os.replace(tmp, entry.path)
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,222 @@
+"""
+Потоковая отдача сырого лога боя (/battle/{id}/raw)
+
+Лог не собирается в памяти целиком: источник (ответ api_mother, член пака или
+файл хранилища) читается кусками и сразу уходит клиенту.
+
+- Клиенту, который принимает gzip, сжатый gzip отдаётся как есть
+  (Content-Encoding: gzip) — без распаковки на нашей стороне.
+- Остальным лог распаковывается потоком (gzip, zstd со словарём, несжатый).
+- Range (bytes=...) относится к распакованному логу и поддерживается, когда его
+  длина известна заранее: ISIZE трейлера gzip, размер из заголовка кадра zstd
+  или X-Decoded-Length от api_mother. Иначе Range игнорируется (200, весь лог).
+"""
+
+import asyncio
+from typing import AsyncIterator, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from shared.utils.btl_codec import CHUNK, GZIP_MAGIC, DictRegistry, StreamDecoder
+
+# Сколько байт нужно, чтобы определить формат (заголовок кадра zstd — до 18 байт)
+_HEAD = 18
+
+
+class RawSource(NamedTuple):
+    """Открытый источник лога: сжатые (или несжатые) куски и известные длины"""
+    chunks: AsyncIterator[bytes]
+    size: Optional[int] = None
+    decoded_length: Optional[int] = None
+
+
+class RangeNotSatisfiable(Exception):
+    """Диапазон за пределами лога — 416"""
+
+
+def parse_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """
+    Разбор Range: bytes=a-b | bytes=a- | bytes=-n → (start, end) включительно
+
+    None — заголовка нет или он не разобран / содержит несколько диапазонов
+    (отдаём весь лог, как разрешает RFC 9110).
+
+    Raises:
+        RangeNotSatisfiable: диапазон не пересекается с логом
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(length - suffix, 0), length - 1
+        start = int(first)
+        end = int(last) if last else length - 1
+    except ValueError:
+        return None
+    if start >= length:
+        raise RangeNotSatisfiable(header)
+    if start > end:
+        return None
+    return start, min(end, length - 1)
+
+
+def accepts_gzip(header: Optional[str]) -> bool:
+    """Accept-Encoding разрешает gzip (gzip;q=0 — запрет)"""
+    for item in (header or "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "x-gzip"):
+            continue
+        q = params.strip().lower()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def etag_for(sha256: Optional[str]) -> Optional[str]:
+    """
+    ETag лога по sha256 из battles
+
+    Слабый: один и тот же лог отдаётся и gzip-ом, и распакованным.
+    """
+    return f'W/"{sha256}"' if sha256 else None
+
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """304, если If-None-Match совпадает с etag (слабое сравнение), иначе None"""
+    header = request.headers.get("if-none-match")
+    if not etag or not header:
+        return None
+    opaque = etag.removeprefix("W/")
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == opaque:
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+    return None
+
+
+async def memory_chunks(data: bytes, chunk: int = CHUNK) -> AsyncIterator[bytes]:
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk):
+        yield bytes(view[offset:offset + chunk])
+
+
+async def file_chunks(f, chunk: int = CHUNK) -> AsyncIterator[bytes]:
+    """Чтение открытого файла кусками вне цикла событий; файл закрывается в конце"""
+    try:
+        while data := await asyncio.to_thread(f.read, chunk):
+            yield data
+    finally:
+        f.close()
+
+
+async def decode_chunks(chunks: AsyncIterator[bytes], dicts: Optional[DictRegistry] = None) -> AsyncIterator[bytes]:
+    """Потоковая распаковка: gzip (и многочленный), zstd, несжатый — по магии"""
+    decoder = StreamDecoder(dicts)
+    async for chunk in chunks:
+        out = await asyncio.to_thread(decoder.feed, chunk)
+        if out:
+            yield out
+    tail = decoder.flush()
+    if tail:
+        yield tail
+
+
+async def slice_chunks(chunks: AsyncIterator[bytes], start: int, end: int) -> AsyncIterator[bytes]:
+    """Байты [start, end] потока; после end источник дальше не читается"""
+    pos = 0
+    async for chunk in chunks:
+        next_pos = pos + len(chunk)
+        if next_pos > start:
+            piece = chunk[max(start - pos, 0):end + 1 - pos]
+            if piece:
+                yield piece
+        pos = next_pos
+        if pos > end:
+            break
+
+
+async def _peek(chunks: AsyncIterator[bytes]) -> Tuple[bytes, AsyncIterator[bytes]]:
+    """Первые байты потока (для магии) и поток целиком, включая их"""
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= _HEAD:
+            break
+
+    async def rest() -> AsyncIterator[bytes]:
+        if head:
+            yield head
+        async for chunk in chunks:
+            yield chunk
+
+    return head, rest()
+
+
+async def raw_log_response(
+    request: Request,
+    chunks: AsyncIterator[bytes],
+    *,
+    size: Optional[int] = None,
+    decoded_length: Optional[int] = None,
+    dicts: Optional[DictRegistry] = None,
+    etag: Optional[str] = None,
+) -> Response:
+    """
+    Ответ с логом из потока сжатых (или несжатых) кусков
+
+    size — длина потока в байтах, decoded_length — длина распакованного лога
+    (если известны). chunks закрывается по завершении ответа, в том числе при
+    обрыве соединения клиентом.
+    """
+    close = BackgroundTask(chunks.aclose)
+    try:
+        head, body = await _peek(chunks)
+    except BaseException:
+        await chunks.aclose()
+        raise
+    headers = {
+        "Accept-Ranges": "bytes" if decoded_length is not None else "none",
+        "Vary": "Accept-Encoding",
+    }
+    if etag:
+        headers["ETag"] = etag
+
+    if decoded_length is not None:
+        try:
+            byte_range = parse_range(request.headers.get("range"), decoded_length)
+        except RangeNotSatisfiable:
+            await chunks.aclose()
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{decoded_length}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{decoded_length}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                slice_chunks(decode_chunks(body, dicts), start, end),
+                status_code=206, media_type="application/xml", headers=headers, background=close,
+            )
+
+    if head[:2] == GZIP_MAGIC and accepts_gzip(request.headers.get("accept-encoding")):
+        headers["Content-Encoding"] = "gzip"
+        if size is not None:
+            headers["Content-Length"] = str(size)
+        return StreamingResponse(body, media_type="application/xml", headers=headers, background=close)
+
+    if decoded_length is not None:
+        headers["Content-Length"] = str(decoded_length)
+    return StreamingResponse(decode_chunks(body, dicts), media_type="application/xml", headers=headers, background=close)
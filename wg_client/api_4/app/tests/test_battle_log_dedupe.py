@@ -0,0 +1,70 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+from shared.utils.battle_log import BATTLE_TAG, CLEAN_MARKER, CLEAN_MARKER_STR, clean_blook, is_clean
+from shared.utils.frame_reader import FrameReader
+
+EXAMPLE_PARSER = Path(__file__).resolve().parents[3] / "example" / "parser"
+
+
+def _load(name):
+    spec = importlib.util.spec_from_file_location(f"example_parser_{name}", EXAMPLE_PARSER / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _body(battle_id=7):
+    return (
+        b'<BATTLE t2="1" turn="2">\n<USER login="a" battleid="%d" />\n</BATTLE>\n' % battle_id
+        + b'<TURN turn="1">' + b"y" * 50_000 + b"\x1f</TURN>\n"
+    )
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 4096, 1 << 20])
+def test_duplicate_is_cut_without_buffering_it(chunk):
+    stream = b"<BLOOK>" + _body() + _body() + b"</BLOOK>\x00<CHAT t=\"after\" />\x00"
+    frames = FrameReader()
+    received = []
+    peak = 0
+    for i in range(0, len(stream), chunk):
+        frames.feed(stream[i:i + chunk])
+        peak = max(peak, frames.pending)
+        while (frame := frames.next_frame_cut(BATTLE_TAG)) is not None:
+            received.append(clean_blook(frame) if frame.cut else frame.copy())
+
+    # Тело боя без дубля, затем следующее сообщение — как обычно
+    assert received == [_body().replace(b"\x1f", b"") + CLEAN_MARKER, b'<CHAT t="after" />']
+    # Дубль в буфер не попадает
+    assert peak < len(_body()) + 2 * chunk + 16
+
+
+def test_blook_without_duplicate_ends_at_closing_tag():
+    frames = FrameReader()
+    frames.feed(b"<BLOOK>" + _body() + b"</BLOOK>\x00")
+    frame = frames.next_frame_cut(BATTLE_TAG)
+    assert not frame.cut
+    assert clean_blook(frame) == _body().replace(b"\x1f", b"") + CLEAN_MARKER
+
+    # Неполный ответ (нет ни дубля, ни </BLOOK>) не принимается
+    frames.feed(b"<BLOOK>" + _body()[:100] + b"\x00")
+    assert clean_blook(frames.next_frame_cut(BATTLE_TAG)) is None
+
+
+def test_parsers_skip_scans_for_clean_logs():
+    battle_parser = _load("battle_parser")
+    dedupe_tzb = _load("dedupe_tzb")
+    assert battle_parser.CLEAN_MARKER == dedupe_tzb.CLEAN_MARKER == CLEAN_MARKER_STR
+
+    raw = "<BLOOK>" + _body().decode() + _body().decode() + "</BLOOK>"
+    clean = _body().decode() + CLEAN_MARKER_STR
+    assert is_clean(clean) and not is_clean(raw)
+
+    # Очищенный лог возвращается тем же объектом, сырой режется по второму <BATTLE
+    assert dedupe_tzb.dedupe_tzb_content(clean) is clean
+    assert battle_parser.first_battle(clean) is clean
+    assert dedupe_tzb.dedupe_tzb_content(raw) == _body().decode()
+    assert dedupe_tzb.dedupe_tzb_content("<BLOOK>" + _body().decode() + "</BLOOK>") == _body().decode()
+    assert battle_parser.first_battle(raw) == "<BLOOK>" + _body().decode()
@@ -0,0 +1,69 @@
+import gzip
+import importlib.util
+import os
+from pathlib import Path
+
+import pytest
+
+from shared.utils.btl_codec import CodecError, DictRegistry, Encoder, decode
+from shared.utils.btl_pack import PackStore
+
+zstandard = pytest.importorskip("zstandard")
+
+EXAMPLE_PARSER = Path(__file__).resolve().parents[3] / "example" / "parser"
+
+
+def _log(i):
+    return (
+        f'<BATTLE t2="{1700000000 + i}" turn="{i % 40}">\n'
+        + "".join(f'<USER login="$Rat [{j}]" battleid="{i}" side="{j % 2}" level="{j}" />\n' for j in range(i % 9 + 2))
+        + "</BATTLE>\n"
+        + "".join(f'<TURN turn="{t}"><a sf="{t % 3}" t="5" HP="{(i * t) % 97}" /></TURN>\n' for t in range(i % 30 + 5))
+    ).encode()
+
+
+@pytest.fixture
+def store_root(tmp_path):
+    DictRegistry(str(tmp_path)).train([_log(i) for i in range(300)], dict_size=8192)
+    return tmp_path
+
+
+def test_decode_picks_format_by_magic_and_dictionary_by_frame(store_root):
+    dicts = DictRegistry(str(store_root))
+    assert dicts.versions() == [1]
+    old = Encoder("zstd", root=str(store_root)).encode(_log(7))
+
+    # Новая версия не перезаписывает старую; кадры v1 читаются и дальше
+    assert dicts.train([_log(i) for i in range(300, 600)], dict_size=8192) == 2
+    new = Encoder("zstd", root=str(store_root)).encode(_log(7))
+    assert zstandard.get_frame_parameters(old).dict_id == 1
+    assert zstandard.get_frame_parameters(new).dict_id == 2
+    for blob in (old, new, gzip.compress(_log(7)), _log(7)):
+        assert decode(blob, dicts) == _log(7)
+
+    os.unlink(store_root / "dicts" / "tzb-1.zdict")
+    with pytest.raises(CodecError, match="v1"):
+        decode(old, DictRegistry(str(store_root)))
+
+
+def test_pack_members_and_files_in_zstd_are_read_transparently(store_root):
+    encoder = Encoder("zstd", root=str(store_root))
+    store = PackStore(str(store_root), divisor=100, writable=True, encoder=encoder)
+    store.put_raw(42, _log(42))
+    store.put_raw(43, _log(43))
+    assert store.get(42)[:4] == b"\x28\xb5\x2f\xfd"
+    assert PackStore(str(store_root), divisor=100).read_raw(42) == _log(42)
+    # Паки с gzip и zstd вперемешку: кодек — свойство члена, а не пака
+    PackStore(str(store_root), divisor=100, writable=True).put_raw(44, _log(44))
+    assert PackStore(str(store_root), divisor=100).read_raw(44) == _log(44)
+
+    spec = importlib.util.spec_from_file_location("example_parser_battle_parser_zstd", EXAMPLE_PARSER / "battle_parser.py")
+    battle_parser = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(battle_parser)
+    shard_dir = store_root / "0"
+    shard_dir.mkdir()
+    (shard_dir / "42.tzb.zst").write_bytes(encoder.encode(_log(42)))
+    (shard_dir / "43.tzb.gz").write_bytes(gzip.compress(_log(43)))
+    # Словарь ищется рядом с архивом: {root}/dicts для {root}/{shard}/{id}.tzb.zst
+    assert battle_parser.read_log_text(str(shard_dir / "42.tzb.zst")) == _log(42).decode()
+    assert battle_parser.read_log_text(str(shard_dir / "43.tzb.gz")) == _log(43).decode()
@@ -0,0 +1,46 @@
+import gzip
+import os
+
+import pytest
+
+from shared.utils.btl_pack import INDEX_HEADER, SLOT, PackError, PackStore, gzip_member
+
+
+def _log(battle_id):
+    return b'<BATTLE t2="1">' + str(battle_id).encode() * 500 + b"</BATTLE>"
+
+
+def test_reader_sees_members_appended_by_another_store(tmp_path):
+    writer = PackStore(str(tmp_path), divisor=100, writable=True)
+    reader = PackStore(str(tmp_path), divisor=100)
+    assert reader.get(105) is None  # шарда ещё нет
+
+    writer.put_raw(105, _log(105))
+    assert reader.read_raw(105) == _log(105)
+    # Сегмент вырос после первого mmap — читатель перемапливает
+    for battle_id in range(106, 150):
+        writer.put_raw(battle_id, _log(battle_id))
+    assert reader.read_raw(149) == _log(149)
+    assert 104 not in reader and 149 in reader
+    assert list(reader.shard_battle_ids(1)) == list(range(105, 150))
+
+    # Член — самостоятельный .tzb.gz; перезапись перенаправляет слот
+    assert gzip.decompress(reader.get(120)) == _log(120)
+    writer.put(120, gzip_member(b"new"))
+    assert reader.read_raw(120) == b"new"
+    assert sorted(os.listdir(tmp_path)) == ["1.idx", "1.pack"]
+
+
+def test_corrupted_member_and_foreign_divisor_are_rejected(tmp_path):
+    store = PackStore(str(tmp_path), divisor=100, writable=True)
+    store.put_raw(7, _log(7))
+    store.close()
+
+    offset, length, _ = SLOT.unpack_from((tmp_path / "0.idx").read_bytes(), INDEX_HEADER.size + 7 * SLOT.size)
+    with open(tmp_path / "0.pack", "r+b") as f:
+        f.seek(offset + length // 2)
+        f.write(b"\xff")
+    with pytest.raises(PackError, match="crc"):
+        PackStore(str(tmp_path), divisor=100).get(7)
+    with pytest.raises(PackError, match="divisor"):
+        PackStore(str(tmp_path), divisor=50000).get(7)
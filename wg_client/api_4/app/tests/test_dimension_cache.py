@@ -0,0 +1,39 @@
+from app.dimension_cache import DimensionCache
+
+
+def test_dimension_cache_lru_and_counters():
+    cache = DimensionCache("players", max_size=2)
+    cache.put("Elisa", 1)
+    cache.put("Bob", 2)
+
+    assert cache.get("Elisa") == 1  # Elisa становится самой свежей
+    cache.put("Eve", 3)             # вытесняет Bob
+    assert cache.get("Bob") is None
+
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_dimension_cache_get_many_batches_misses():
+    cache = DimensionCache("monsters")
+    cache.put(("rat", None), 10)
+
+    found, missing = cache.get_many([("rat", None), ("bat", "big"), ("bat", "big")])
+    assert found == {("rat", None): 10}
+    assert missing == [("bat", "big")]  # повторы схлопываются в один промах
+
+
+def test_dimension_cache_skips_none_and_invalidates():
+    cache = DimensionCache("clans")
+    cache.put("Ghosts", None)
+    assert cache.get("Ghosts") is None
+
+    cache.put_many({"Ghosts": 5, "Wolves": 6})
+    cache.invalidate(["Ghosts"])
+    assert cache.get("Ghosts") is None
+    assert cache.get("Wolves") == 6
+
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
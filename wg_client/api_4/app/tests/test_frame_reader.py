@@ -0,0 +1,60 @@
+import pytest
+
+from shared.utils.frame_reader import FrameReader
+
+MESSAGES = [b'<OK l="a" />', b"<MYPARAM>" + b"\x1fx" * 3000 + b"</MYPARAM>", b"", b"<N />"]
+STREAM = b"".join(m + b"\x00" for m in MESSAGES)
+
+
+def _feed_all(frames, stream, chunk, take):
+    out = []
+    for i in range(0, len(stream), chunk):
+        frames.feed(stream[i:i + chunk])
+        while (frame := take(frames)) is not None:
+            out.append(frame.copy())
+    return out
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 13, 4096, len(STREAM)])
+def test_next_frame_across_chunk_boundaries(chunk):
+    frames = FrameReader()
+    out = _feed_all(frames, STREAM, chunk, FrameReader.next_frame)
+    # \x00 — граница кадра, \x1f удаляется при копировании
+    assert out == [m.replace(b"\x1f", b"") for m in MESSAGES]
+    assert frames.pending == 0
+
+
+def test_frame_is_a_view_until_copied():
+    frames = FrameReader()
+    frames.feed(b"<A>\x1fone</A>\x00<B")
+    frame = frames.next_frame()
+    assert len(frame) == 11 and b"one" in frame and frame.find(b"</A>") == 7
+    assert frame.copy(strip=b"") == b"<A>\x1fone</A>"
+    assert frame.between(b"<A>", b"</A>") == b"<A>one</A>"
+    assert frames.next_frame() is None and frames.pending == 2
+
+
+def test_multi_byte_delimiter_split_between_chunks():
+    delimiter = b"\x1f\x00"
+    frames = FrameReader(delimiter=delimiter)
+    frames.feed(b"<A />" + delimiter[:1])
+    assert frames.next_frame() is None
+    frames.feed(delimiter[1:] + b"<B />" + delimiter)
+    assert [frames.next_frame().copy(), frames.next_frame().copy()] == [b"<A />", b"<B />"]
+
+
+@pytest.mark.parametrize("chunk", [1, 3, 64])
+def test_next_until_end_tag_split_between_chunks(chunk):
+    stream = b'<SH c="k">' + b"<O id=\"1\" />\x1f" * 50 + b"</SH><SH c=\"m\"></SH>"
+    out = _feed_all(FrameReader(), stream, chunk, lambda frames: frames.next_until(b"</SH>"))
+    assert out == [b'<SH c="k">' + b"<O id=\"1\" />" * 50 + b"</SH>", b'<SH c="m"></SH>']
+
+
+def test_compaction_keeps_unread_tail():
+    frames = FrameReader(compact_threshold=8)
+    frames.feed(b"0123456789\x00tail")
+    assert frames.next_frame().copy() == b"0123456789"
+    frames.feed(b"-end\x00")
+    assert frames.next_frame().copy() == b"tail-end"
+    frames.feed(b"rest")
+    assert frames.take_pending().copy() == b"rest" and frames.pending == 0
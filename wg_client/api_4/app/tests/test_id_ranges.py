@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from app.id_ranges import IdRangeSet, islands_sql
+
+
+def _random_ids(rng, count=300, span=2000):
+    return {rng.randrange(span) for _ in range(count)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_set_algebra_matches_python_sets(seed):
+    rng = random.Random(seed)
+    a_ids, b_ids = _random_ids(rng), _random_ids(rng)
+    a, b = IdRangeSet.from_ids(a_ids), IdRangeSet.from_ids(b_ids)
+
+    assert set(a) == a_ids and len(a) == len(a_ids)
+    assert set(a | b) == a_ids | b_ids
+    assert set(a - b) == a_ids - b_ids
+    assert set(a & b) == a_ids & b_ids
+    assert all((value in a) == (value in a_ids) for value in range(-1, 2001))
+
+
+def test_ranges_are_merged_and_compact():
+    ids = IdRangeSet([(10, 20), (21, 30), (25, 27), (40, 40), (5, 3)])
+    assert ids.ranges == ((10, 30), (40, 40))
+    assert len(ids) == 22
+    assert (ids.min, ids.max) == (10, 40)
+
+    # Миллион подряд идущих боёв — один диапазон
+    span = IdRangeSet.span(1_000_000, 1_999_999)
+    assert len(span) == 1_000_000 and len(span.ranges) == 1
+    assert (span - IdRangeSet([(1_500_000, 1_500_009)])).ranges == ((1_000_000, 1_499_999), (1_500_010, 1_999_999))
+
+
+def test_last_and_describe():
+    ids = IdRangeSet([(1, 3), (10, 15)])
+    assert list(ids.last(8)) == [2, 3, 10, 11, 12, 13, 14, 15]
+    assert list(reversed(ids.last(2))) == [15, 14]
+    assert ids.describe() == [{"range": [1, 3], "count": 3}, {"range": [10, 15], "count": 6}]
+    assert IdRangeSet.from_ids([7]).describe() == [{"single": 7}]
+
+
+def test_islands_sql_groups_by_rank_difference():
+    sql = islands_sql("battle_id", "xml_sync_log", "status = ANY($1::text[])")
+    assert "battle_id - DENSE_RANK() OVER (ORDER BY battle_id)" in sql
+    assert "AND (status = ANY($1::text[]))" in sql
+    assert IdRangeSet.from_rows([{"lo": 1, "hi": 5}, {"lo": 9, "hi": 9}]).ranges == ((1, 5), (9, 9))
@@ -0,0 +1,60 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app import loader
+from app.loader import BattleLoader, shutdown_parse_executor
+
+
+def _no_warm_up():
+    pass
+
+
+def _parse_or_die(path):
+    # Первый вызов «убивает» процесс пула (как OOM-killer), следующие парсят
+    if os.path.exists(path):
+        os.unlink(path)
+        os._exit(1)
+    return {"path": path, "pid": os.getpid()}
+
+
+def _always_die(path):
+    os._exit(1)
+
+
+@pytest.fixture
+def parse_loader(monkeypatch):
+    monkeypatch.setattr(loader, "warm_up_parser", _no_warm_up)
+    shutdown_parse_executor()
+    yield BattleLoader(db=None, parse_workers=1)
+    shutdown_parse_executor()
+
+
+def test_broken_pool_is_rebuilt_and_the_file_retried(parse_loader, monkeypatch, tmp_path):
+    monkeypatch.setattr(loader, "parse_for_db", _parse_or_die)
+    marker = tmp_path / "1.tzb"
+    marker.write_bytes(b"x")
+
+    async def run():
+        first = loader.get_parse_executor(1)
+        result = await parse_loader._parse_file(marker)
+        return first, result, await parse_loader._parse_file(marker)
+
+    first, result, again = asyncio.get_event_loop().run_until_complete(run())
+    assert result["path"] == str(marker) and loader.get_parse_executor(1) is not first
+    # Следующие файлы идут в новый пул
+    assert again["pid"] == result["pid"]
+
+
+def test_file_that_kills_every_pool_fails_alone(parse_loader, monkeypatch, tmp_path):
+    monkeypatch.setattr(loader, "parse_for_db", _always_die)
+
+    async def run():
+        with pytest.raises(BrokenProcessPool):
+            await parse_loader._parse_file(tmp_path / "bad.tzb")
+
+    asyncio.get_event_loop().run_until_complete(run())
+    # Сломанный пул сброшен — следующий вызов получит новый
+    assert loader._PARSE_EXECUTOR is None
@@ -0,0 +1,18 @@
+import pytest
+
+from app.name_search import escape_like, match_sql, match_value
+
+
+def test_match_value_escapes_like_wildcards():
+    assert escape_like("100%_a\\b") == "100\\%\\_a\\\\b"
+    assert match_value("Терм", "prefix") == "Терм%"
+    assert match_value("a_b", "substring") == "%a\\_b%"
+    assert match_value("Термид", "fuzzy") == "Термид"
+
+
+def test_match_sql_per_mode():
+    assert match_sql("p.login", "$1", "substring") == "p.login ILIKE $1"
+    assert match_sql("p.login", "$1", "prefix") == "p.login ILIKE $1"
+    assert match_sql("p.login", "$1", "fuzzy") == "p.login % $1"
+    with pytest.raises(ValueError):
+        match_sql("p.login", "$1", "regex")
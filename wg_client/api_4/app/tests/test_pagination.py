@@ -0,0 +1,22 @@
+import pytest
+
+from app.pagination import decode_cursor, encode_cursor, next_cursor_for
+
+
+def test_cursor_roundtrip_is_opaque():
+    cursor = encode_cursor(2650006)
+    assert "2650006" not in cursor
+    assert decode_cursor(cursor) == 2650006
+
+
+@pytest.mark.parametrize("cursor", ["", "garbage!", encode_cursor(1)[:-2] + "@@", "djI6MTA"])
+def test_decode_cursor_rejects_invalid(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_next_cursor_only_for_full_page():
+    page = [{"id": 30}, {"id": 20}, {"id": 10}]
+    assert decode_cursor(next_cursor_for(page, limit=3)) == 10
+    assert next_cursor_for(page, limit=5) is None
+    assert next_cursor_for([], limit=5) is None
@@ -0,0 +1,105 @@
+import asyncio
+import os
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.raw_cache import RawEntry, RawLogCache
+from app.raw_stream import RawSource, etag_for, memory_chunks, not_modified
+
+
+def _entry(n, size=100):
+    return RawEntry(sha256=f"sha{n}", size=size, decoded_length=None, data=bytes([n % 256]) * size)
+
+
+async def _read(chunks):
+    return b"".join([c async for c in chunks])
+
+
+async def _source(data):
+    return RawSource(memory_chunks(data), size=len(data))
+
+
+def test_lru_spills_to_disk_and_evicts(tmp_path):
+    async def run():
+        cache = RawLogCache(max_memory=250, max_disk=250, spill_dir=str(tmp_path))
+        for n in (1, 2):
+            await cache.put(n, _entry(n))
+        assert cache.get(1) is not None  # 1 — самый свежий, вытеснится 2
+        await cache.put(3, _entry(3))
+        assert cache.get(2).data is None
+        assert await _read(await cache.open(cache.get(2))) == _entry(2).data
+
+        # Диск тоже ограничен: 2 и 1 уходят туда, 3 — остаётся в памяти, следом на диск 4 и 5
+        for n in (4, 5, 6):
+            await cache.put(n, _entry(n))
+        stats = cache.stats()
+        assert stats["memory_bytes"] <= 250 and stats["disk_bytes"] <= 250
+        assert stats["evictions"] > 0 and cache.get(2) is None
+        spill_dir = cache._spill_dir
+        assert len(os.listdir(spill_dir)) == stats["disk_entries"]
+        cache.close()
+        assert not os.path.exists(spill_dir)
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_concurrent_misses_are_loaded_once_and_large_logs_bypass():
+    async def run():
+        cache = RawLogCache(max_memory=10_000, max_entry=1000)
+        opened = []
+
+        async def open_source(size):
+            opened.append(size)
+            await asyncio.sleep(0.01)
+            return RawSource(memory_chunks(b"x" * size, 64), size=size)
+
+        results = await asyncio.gather(*(cache.load(7, "abc", lambda: open_source(500)) for _ in range(5)))
+        assert opened == [500]
+        assert all(entry.data == b"x" * 500 and source is None for entry, source in results)
+        assert cache.stats()["coalesced"] == 4
+        assert cache.get(7).sha256 == "abc"
+
+        # Больше max_entry — каждый отдаёт из своего источника, в кэш не кладём
+        results = await asyncio.gather(*(cache.load(8, "def", lambda: open_source(5000)) for _ in range(3)))
+        assert all(entry is None for entry, _ in results)
+        assert [await _read(source.chunks) for _, source in results] == [b"x" * 5000] * 3
+        assert cache.get(8) is None and cache.stats()["bypassed"] == 1
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_lookup_drops_entries_of_reingested_battles(tmp_path):
+    async def run():
+        cache = RawLogCache(max_memory=150, max_disk=1000, spill_dir=str(tmp_path))
+        await cache.put(1, _entry(1))
+        await cache.put(2, _entry(2))  # 1 уходит на диск
+        assert (await cache.lookup(1, "sha1")).path is not None
+        assert (await cache.lookup(2, "sha2")).data == _entry(2).data
+
+        # Бой перезалит: в battles другой sha256 — запись (и файл сброса) удаляется
+        assert await cache.lookup(1, "new") is None
+        assert await cache.lookup(2, "new") is None
+        stats = cache.stats()
+        assert stats["invalidations"] == 2 and stats["disk_entries"] == stats["memory_entries"] == 0
+        assert os.listdir(cache._spill_dir) == []
+
+        entry, _ = await cache.load(1, "new", lambda: _source(b"fresh"))
+        assert (await cache.lookup(1, "new")).data == b"fresh" and entry.sha256 == "new"
+        cache.close()
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_if_none_match_uses_sha256_etag():
+    app = FastAPI()
+
+    @app.get("/raw")
+    async def raw(request: Request):
+        return not_modified(request, etag_for("abc")) or {"ok": True}
+
+    client = TestClient(app)
+    assert client.get("/raw", headers={"If-None-Match": '"abc"'}).status_code == 304
+    assert client.get("/raw", headers={"If-None-Match": 'W/"zzz", W/"abc"'}).headers["etag"] == 'W/"abc"'
+    assert client.get("/raw", headers={"If-None-Match": '"zzz"'}).status_code == 200
+    assert etag_for("") is None
@@ -0,0 +1,82 @@
+import gzip
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.raw_stream import RangeNotSatisfiable, file_chunks, memory_chunks, parse_range, raw_log_response
+from shared.utils.btl_codec import decoded_length
+
+LOG = b"".join(b'<TURN turn="%d"><a sf="1" t="5" HP="%d" /></TURN>\n' % (i, i % 97) for i in range(20000))
+
+
+def _client(blob, length="auto", chunk=4096, path=None):
+    app = FastAPI()
+
+    @app.get("/raw")
+    async def raw(request: Request):
+        known = decoded_length(blob[:18], blob[-4:], len(blob)) if length == "auto" else length
+        chunks = file_chunks(open(path, "rb"), chunk) if path else memory_chunks(blob, chunk)
+        return await raw_log_response(request, chunks, size=len(blob), decoded_length=known)
+
+    return TestClient(app)
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=10-19", 100) == (10, 19)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-30", 100) == (70, 99)
+    assert parse_range("bytes=50-1000", 100) == (50, 99)
+    # Непонятный или составной Range — весь лог
+    assert parse_range("bytes=1-2,5-6", 100) is None
+    assert parse_range("items=1-2", 100) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range("bytes=100-", 100)
+
+
+def test_gzip_is_passed_through_or_decoded_by_accept_encoding():
+    blob = gzip.compress(LOG)
+    client = _client(blob)
+
+    passed = client.get("/raw", headers={"Accept-Encoding": "gzip"})
+    assert passed.headers["content-encoding"] == "gzip"
+    assert int(passed.headers["content-length"]) == len(blob)
+    assert passed.content == LOG  # распаковал клиент
+
+    plain = client.get("/raw", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert int(plain.headers["content-length"]) == len(LOG)
+    assert plain.content == LOG
+
+
+def test_range_is_served_from_the_decoded_log():
+    client = _client(gzip.compress(LOG))
+    r = client.get("/raw", headers={"Range": "bytes=100000-100099", "Accept-Encoding": "gzip"})
+    assert r.status_code == 206
+    assert r.headers["content-range"] == f"bytes 100000-100099/{len(LOG)}"
+    assert r.content == LOG[100000:100100]
+
+    r = client.get("/raw", headers={"Range": f"bytes={len(LOG)}-"})
+    assert r.status_code == 416
+    assert r.headers["content-range"] == f"bytes */{len(LOG)}"
+
+
+def test_files_multi_member_gzip_and_unknown_length(tmp_path):
+    path = tmp_path / "1.tzb.gz"
+    path.write_bytes(gzip.compress(LOG[:5000]) + gzip.compress(LOG[5000:]))
+    r = _client(path.read_bytes(), length=None, path=str(path)).get(
+        "/raw", headers={"Range": "bytes=0-9", "Accept-Encoding": "identity"}
+    )
+    # Длина неизвестна — Range не поддерживается, отдаётся весь лог
+    assert r.status_code == 200
+    assert r.headers["accept-ranges"] == "none"
+    assert r.content == LOG
+
+
+def test_zstd_range():
+    zstandard = pytest.importorskip("zstandard")
+    client = _client(zstandard.ZstdCompressor().compress(LOG), chunk=1000)
+    r = client.get("/raw", headers={"Range": "bytes=-50", "Accept-Encoding": "gzip"})
+    assert r.status_code == 206
+    assert r.content == LOG[-50:]
@@ -0,0 +1,64 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from app.database import BattleDatabase
+
+
+class FakeConn:
+    def __init__(self):
+        self.calls = []
+
+    async def executemany(self, query, args):
+        self.calls.append(("executemany", query, len(list(args))))
+
+    async def execute(self, query, *args):
+        self.calls.append(("execute", query, len(args)))
+        return "INSERT 0 1"
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.calls.append(("copy", table, len(records)))
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConn()
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def _records(count):
+    now = datetime(2026, 1, 1)
+    return [(battle_id, now, "success", None, f"/srv/btl/raw/0/{battle_id}.tzb", 1000) for battle_id in range(1, count + 1)]
+
+
+def test_small_batches_use_executemany(monkeypatch):
+    monkeypatch.setenv("XML_SYNC_LOG_COPY_MIN_ROWS", "500")
+    db = BattleDatabase()
+    db.pool = FakePool()
+
+    asyncio.get_event_loop().run_until_complete(db.upsert_sync_log(_records(10)))
+
+    assert [(kind, size) for kind, _, size in db.pool.conn.calls] == [("executemany", 10)]
+    assert "ON CONFLICT (battle_id)" in db.pool.conn.calls[0][1]
+
+
+def test_large_batches_copy_and_merge_once(monkeypatch):
+    monkeypatch.setenv("XML_SYNC_LOG_COPY_MIN_ROWS", "500")
+    db = BattleDatabase()
+    db.pool = FakePool()
+
+    asyncio.get_event_loop().run_until_complete(db.upsert_sync_log(_records(10_000)))
+
+    calls = db.pool.conn.calls
+    # 10k строк — три оператора: временная таблица, COPY, одно слияние
+    assert [kind for kind, _, _ in calls] == ["execute", "copy", "execute"]
+    assert calls[1] == ("copy", "_xml_sync_log_staging", 10_000)
+    assert "FROM _xml_sync_log_staging" in calls[2][1]
+    assert "DISTINCT ON (battle_id)" in calls[2][1]
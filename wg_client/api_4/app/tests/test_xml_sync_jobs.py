@@ -0,0 +1,226 @@
+import asyncio
+
+import pytest
+
+from app import xml_sync_jobs
+from app.id_ranges import IdRangeSet
+from app.xml_sync_jobs import XmlSyncJobRunner, XmlSyncJobs
+from app.xml_sync_worker import XmlSyncWorker
+from app.xml_worker_client import XmlWorkerClient
+
+
+class FakeJobs:
+    """Хранилище заданий в памяти: куски выдаются по одному, heartbeat отвечает по сценарию"""
+
+    def __init__(self, chunks, job_status="running"):
+        self.chunks = list(chunks)
+        self.job_status = job_status
+        self.completed = []
+        self.released = []
+        self.status = {start_id: "pending" for start_id, _ in self.chunks}
+        self.attempts = {start_id: 0 for start_id, _ in self.chunks}
+
+    async def claim_chunk(self, owner):
+        if not self.chunks:
+            return None
+        start_id, end_id = self.chunks.pop(0)
+        self.status[start_id] = "leased"
+        self.attempts[start_id] += 1
+        return {"job_id": 1, "start_id": start_id, "end_id": end_id, "attempts": self.attempts[start_id], "skip_existing": True}
+
+    async def heartbeat(self, chunk, owner):
+        return self.job_status
+
+    async def complete_chunk(self, chunk, owner, result):
+        self.status[chunk["start_id"]] = "done"
+        self.completed.append((chunk["start_id"], result))
+        return True
+
+    async def release_chunk(self, chunk, owner, error=None, refund_attempt=False):
+        self.status[chunk["start_id"]] = "pending"
+        self.attempts[chunk["start_id"]] -= int(refund_attempt)
+        self.released.append((chunk["start_id"], error))
+
+
+class FakeWorker:
+    """sync_range, который качает по бою за такт и проверяет abort между батчами"""
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.calls = []
+
+    async def sync_range(self, start_id, end_id, skip_existing=True, abort=None):
+        self.calls.append((start_id, end_id))
+        if start_id == self.fail_on:
+            raise RuntimeError("workers unreachable")
+        done = 0
+        for _ in range(start_id, end_id + 1):
+            if abort():
+                return {"success": done, "aborted": True}
+            await asyncio.sleep(0.001)
+            done += 1
+        return {
+            "success": done,
+            "aborted": False,
+            "worker_stats": {1: {"account": "acc1", "total": done, "success": done, "bytes": done * 100, "busy_seconds": 0.5}},
+        }
+
+
+@pytest.fixture(autouse=True)
+def fast_heartbeat(monkeypatch):
+    monkeypatch.setattr(xml_sync_jobs, "XML_SYNC_JOB_HEARTBEAT_SECONDS", 0.005)
+
+
+def _drain(runner):
+    async def run():
+        while await runner.run_once():
+            pass
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def test_chunks_are_completed_once_each():
+    jobs = FakeJobs([(1, 10), (11, 20)])
+    worker = FakeWorker()
+    _drain(XmlSyncJobRunner(jobs, worker, owner="replica-a"))
+
+    assert worker.calls == [(1, 10), (11, 20)]
+    assert [start for start, _ in jobs.completed] == [1, 11]
+    assert jobs.completed[0][1]["worker_stats"][1]["bytes"] == 1000
+    assert jobs.released == []
+
+
+def test_cancelled_job_releases_chunk_instead_of_completing():
+    jobs = FakeJobs([(1, 200)], job_status="cancelled")
+    _drain(XmlSyncJobRunner(jobs, FakeWorker(), owner="replica-a"))
+
+    assert jobs.completed == []
+    assert jobs.released == [(1, None)]
+
+
+def test_lost_lease_leaves_chunk_to_the_new_owner():
+    jobs = FakeJobs([(1, 200)], job_status=None)
+    _drain(XmlSyncJobRunner(jobs, FakeWorker(), owner="replica-a"))
+
+    # Кусок перехвачен: ни done, ни возврата в очередь от старого владельца
+    assert jobs.completed == [] and jobs.released == []
+
+
+def test_runner_error_returns_chunk_with_reason():
+    jobs = FakeJobs([(1, 5), (6, 10)])
+    _drain(XmlSyncJobRunner(jobs, FakeWorker(fail_on=1), owner="replica-a"))
+
+    assert jobs.released == [(1, "workers unreachable")]
+    assert [start for start, _ in jobs.completed] == [6]
+
+
+class DownClient(XmlWorkerClient):
+    """Все воркеры не отвечают"""
+
+    def __init__(self):
+        super().__init__()
+        self.workers = [{"id": 1, "url": "http://a", "account": "a"}, {"id": 2, "url": "http://b", "account": "b"}]
+
+    async def _fetch_worker_batch(self, client, worker, battle_ids, upload_to_mother, max_parallel):
+        return {
+            "worker_id": worker["id"],
+            "worker_account": worker["account"],
+            "worker_error": "connection refused",
+            "results": [{"battle_id": bid, "status": "failed", "error": "Worker error: refused"} for bid in battle_ids],
+        }
+
+
+class FakeSyncLogDb:
+    def __init__(self):
+        self.records = []
+
+    async def sync_log_ranges(self, start_id=None, end_id=None, statuses=("success",)):
+        return IdRangeSet()
+
+    async def upsert_sync_log(self, records):
+        self.records.extend(records)
+
+
+def test_chunk_goes_back_to_pending_when_all_workers_are_down():
+    jobs = FakeJobs([(1, 40), (41, 80)])
+    worker = XmlSyncWorker(db=FakeSyncLogDb())
+    worker.worker_client = DownClient()
+    runner = XmlSyncJobRunner(jobs, worker, owner="replica-a")
+
+    async def run():
+        assert await runner.run_once()
+        first = runner.backoff
+        assert await runner.run_once()
+        return first
+
+    first_backoff = asyncio.get_event_loop().run_until_complete(run())
+    # Куски не закрыты «с 100% ошибок», а возвращены в очередь без траты попытки
+    assert jobs.completed == []
+    assert jobs.status == {1: "pending", 41: "pending"} and jobs.attempts == {1: 0, 41: 0}
+    assert all(error.startswith(("no healthy workers left", "worker errors")) for _, error in jobs.released)
+    # Раннер не крутится вхолостую: пауза растёт от XML_SYNC_JOB_POLL_SECONDS
+    assert first_backoff == xml_sync_jobs.XML_SYNC_JOB_POLL_SECONDS and runner.backoff == 2 * first_backoff
+
+
+def test_worker_outage_detection():
+    outage = xml_sync_jobs._workers_outage
+    assert outage({"success": 0, "failed": 5, "unserved": 5, "worker_errors": 5}).startswith("no healthy workers left")
+    assert outage({"success": 3, "failed": 2, "worker_errors": 2}).startswith("worker errors")
+    # Ошибки игрового сервера по боям — обычный итог куска
+    assert outage({"success": 3, "failed": 2, "worker_errors": 1}) is None
+    assert outage({"success": 5, "failed": 0}) is None
+
+
+class FakeConn:
+    def __init__(self, fail_chunks):
+        self.fail_chunks = fail_chunks
+        self.in_transaction = False
+        self.rolled_back = False
+        self.statements = []
+
+    def transaction(self):
+        conn = self
+
+        class Tx:
+            async def __aenter__(self):
+                conn.in_transaction = True
+
+            async def __aexit__(self, exc_type, *exc):
+                conn.in_transaction = False
+                conn.rolled_back = exc_type is not None
+
+        return Tx()
+
+    async def fetchval(self, query, *args):
+        self.statements.append(("job", self.in_transaction))
+        return 7
+
+    async def execute(self, query, *args):
+        self.statements.append(("chunks", self.in_transaction))
+        if self.fail_chunks:
+            raise RuntimeError("chunk insert failed")
+
+
+class FakePoolDb:
+    def __init__(self, conn):
+        self.conn = conn
+        self.pool = self
+
+    def acquire(self):
+        conn = self.conn
+
+        class Acquire:
+            async def __aenter__(self):
+                return conn
+
+            async def __aexit__(self, *exc):
+                return None
+
+        return Acquire()
+
+
+def test_create_job_inserts_job_and_chunks_in_one_transaction():
+    conn = FakeConn(fail_chunks=True)
+    with pytest.raises(RuntimeError):
+        asyncio.get_event_loop().run_until_complete(XmlSyncJobs(FakePoolDb(conn)).create_job(1, 100, 10))
+    assert conn.statements == [("job", True), ("chunks", True)]
+    assert conn.rolled_back
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app import xml_worker_client
+from app.xml_sync_state import get_sync_state
+from app.xml_worker_client import XmlWorkerClient
+
+
+WORKERS = [
+    {"id": 1, "url": "http://fast", "account": "fast"},
+    {"id": 2, "url": "http://slow", "account": "slow"},
+    {"id": 3, "url": "http://down", "account": "down"},
+]
+
+
+class FakeClient(XmlWorkerClient):
+    """Воркеры без сети: fast — быстрый, slow — медленный с таймаутами, down — не отвечает"""
+
+    def __init__(self, timeout_ids=()):
+        super().__init__()
+        self.workers = WORKERS
+        self.timeout_ids = set(timeout_ids)
+        self.calls = []
+
+    async def _fetch_worker_batch(self, client, worker, battle_ids, upload_to_mother, max_parallel):
+        self.calls.append((worker["id"], list(battle_ids)))
+        if worker["account"] == "down":
+            return {
+                "worker_id": worker["id"],
+                "worker_account": worker["account"],
+                "worker_error": "connection refused",
+                "results": [{"battle_id": bid, "status": "failed", "error": "Worker error: refused"} for bid in battle_ids],
+            }
+        await asyncio.sleep((0.001 if worker["account"] == "fast" else 0.02) * len(battle_ids))
+        results = []
+        for bid in battle_ids:
+            if worker["account"] == "slow" and bid in self.timeout_ids:
+                results.append({"battle_id": bid, "status": "failed", "error": "connection closed or timeout after retry"})
+            elif bid % 97 == 0:
+                results.append({"battle_id": bid, "status": "failed", "error": "server returned ERROR"})
+            else:
+                results.append({"battle_id": bid, "status": "success"})
+        return {"worker_id": worker["id"], "worker_account": worker["account"], "results": results}
+
+
+@pytest.fixture(autouse=True)
+def fast_targets(monkeypatch):
+    monkeypatch.setattr(xml_worker_client, "XML_SYNC_TARGET_BATCH_SECONDS", 0.05)
+    state = get_sync_state()
+    state.abort_requested = False
+    yield
+    state.abort_requested = False
+
+
+def test_healthy_workers_take_over_the_range():
+    client = FakeClient(timeout_ids=range(100, 400, 7))
+    result = asyncio.get_event_loop().run_until_complete(client._fetch_battles_batch(list(range(100, 400)), True, 10))
+
+    by_id = {r["battle_id"]: r for r in result["results"]}
+    assert sorted(by_id) == list(range(100, 400))
+    # Таймауты медленного аккаунта повторены на быстром, ERROR сервера — нет
+    assert all(by_id[bid]["status"] == "success" for bid in range(100, 400) if bid % 97)
+    assert result["retried"] > 0
+    assert by_id[194]["status"] == "failed" and by_id[194]["worker_id"] != 3
+
+    stats = result["worker_stats"]
+    assert stats[1]["total"] > stats[2]["total"]
+    # Недоступный воркер выбывает после нескольких пробных батчей
+    assert sum(1 for worker_id, _ in client.calls if worker_id == 3) <= 2 * xml_worker_client.XML_SYNC_WORKER_MAX_ERRORS
+
+
+def test_abort_stops_taking_batches():
+    client = FakeClient()
+    get_sync_state().abort_requested = True
+    result = asyncio.get_event_loop().run_until_complete(client._fetch_battles_batch(list(range(1, 50)), True, 10))
+    assert result["aborted"] is True
+    assert client.calls == []
+    assert result["results"] == []
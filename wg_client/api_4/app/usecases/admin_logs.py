@@ -13,5 +13,8 @@ class AdminLogsUseCase:
     async def cleanup(self, *, days_old: int) -> int:
         return await self._loader.cleanup_old_logs(days_old)
 
+    def dimension_cache_stats(self) -> Dict[str, Any]:
+        return self._loader.db.dimension_cache_stats()
+
 
 
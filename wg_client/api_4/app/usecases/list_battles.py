@@ -1,4 +1,4 @@
-from typing import List, Tuple, Dict, Any
+from typing import List, Optional, Tuple, Dict, Any
 
 from ports.battle_repository import BattleRepository
 
@@ -9,7 +9,9 @@ class ListBattlesUseCase:
     def __init__(self, repository: BattleRepository):
         self._repository = repository
 
-    async def execute(self, page: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    async def execute(self, page: int, limit: int, after_id: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        if after_id is not None:
+            return await self._repository.list_battles_after(after_id=after_id, limit=limit)
         return await self._repository.list_battles(page=page, limit=limit)
 
 
@@ -20,6 +20,8 @@ class SearchBattlesUseCase:
         monsters: Optional[str] = None,
         page: int = 1,
         limit: int = 10,
+        after_id: Optional[int] = None,
+        match: str = "substring",
     ) -> Tuple[List[Dict[str, Any]], int]:
         return await self._repository.search_battles(
             player=player,
@@ -30,6 +32,8 @@ class SearchBattlesUseCase:
             monsters=monsters,
             page=page,
             limit=limit,
+            after_id=after_id,
+            match=match,
         )
 
 
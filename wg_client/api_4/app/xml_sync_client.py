@@ -4,12 +4,14 @@ XML Sync Client - альтернативный способ получения 
 """
 import socket
 import time
-import re
 import os
 from typing import Optional, Dict, Any
 from datetime import datetime
 import logging
 
+from shared.utils.battle_log import BATTLE_TAG, clean_blook
+from shared.utils.frame_reader import FrameReader
+
 logger = logging.getLogger(__name__)
 
 
@@ -56,113 +58,60 @@ class XmlSyncClient:
         logger.info("Авторизация успешна")
         return sock
     
-    def _send_command(self, sock: socket.socket, xml_command: str) -> bytes:
-        """Отправка XML команды и получение ответа"""
-        xml_data_full = xml_command.strip() + "\x00"
-        
-        logger.info(f"Отправляем команду: {xml_command}")
+    def _request_battle(self, sock: socket.socket, xml_command: str) -> Optional[bytes]:
+        """
+        Отправка //blook и чтение ответа до тела боя
+
+        Ответ читается кадрами (shared.utils.frame_reader); кадр <BLOOK> обрезается на
+        дубле <BATTLE — как только он пришёл, чтение прекращается (соединение одноразовое).
+        Возвращает тело первого боя с маркером очистки или None (ERROR, нет данных).
+        """
         time.sleep(0.3)  # Небольшая пауза после авторизации
-        sock.sendall(xml_data_full.encode('utf-8'))
+        logger.info(f"Отправляем команду: {xml_command}")
+        sock.sendall((xml_command.strip() + "\x00").encode('utf-8'))
         
-        response = b''
+        frames = FrameReader()
         sock.settimeout(self.receive_timeout)
         start = time.time()
-        
-        total_chunks = 0
+        received = 0
         
         logger.info("Ожидаем ответ от сервера...")
         
-        try:
-            # Читаем данные пока не получим </BLOOK> или другой закрывающий тег
-            while True:
-                chunk = sock.recv(8192)
-                total_chunks += 1
-                
-                if chunk:
-                    response += chunk
-                    logger.debug(f"Получен chunk #{total_chunks}, размер: {len(chunk)} байт")
-                    
-                    # Для логов боев ждём именно </BLOOK>
-                    if b'</BLOOK>' in response:
-                        logger.info("Получен полный лог боя (найден </BLOOK>)")
-                        # Читаем ещё немного на случай если есть хвост
-                        sock.settimeout(2)
-                        try:
-                            tail = sock.recv(8192)
-                            if tail:
-                                response += tail
-                                logger.debug(f"Получен хвост после </BLOOK>: {len(tail)} байт")
-                        except socket.timeout:
-                            pass
-                        break
-                    
-                    # Для других команд проверяем стандартные теги
-                    if b'</POST>' in response or b'</ERROR>' in response or b'</OK>' in response:
-                        logger.info("Получен ответ (найден закрывающий тег)")
-                        sock.settimeout(2)
-                        try:
-                            tail = sock.recv(8192)
-                            if tail:
-                                response += tail
-                        except socket.timeout:
-                            pass
-                        break
-                else:
-                    # Пустой chunk - данные закончились
-                    logger.debug("Пустой chunk, данные закончились")
-                    break
-                
+        while True:
+            frame = frames.next_frame_cut(BATTLE_TAG)
+            if frame is None:
                 # Проверяем общий таймаут
                 if time.time() - start > self.max_response_time:
                     logger.warning(f"Таймаут ответа ({self.max_response_time}s) - скорее всего лога нет")
-                    # Помечаем как response_timeout
                     raise TimeoutError(f"Server response timeout after {self.max_response_time}s")
-        
-        except socket.timeout:
-            logger.warning("Таймаут получения данных")
-            raise TimeoutError("Socket timeout during data reception")
-        except TimeoutError:
-            raise  # Пробрасываем дальше
-        except Exception as e:
-            logger.error(f"Ошибка получения данных: {e}")
-        
-        logger.info(f"Получен ответ размером: {len(response)} байт, chunks: {total_chunks}")
-        return response
-    
-    def _deduplicate_battles(self, xml_content: str) -> str:
-        """
-        Дедубликация тегов <BATTLE> и удаление обёртки <BLOOK>
-        
-        Из: <BLOOK><BATTLE>...</BATTLE><BATTLE>...</BATTLE></BLOOK>
-        В:  <BATTLE>...</BATTLE>
-        """
-        # Убираем открывающий и закрывающий теги BLOOK
-        xml_content = xml_content.replace('<BLOOK>', '').replace('</BLOOK>', '')
-        # На всякий случай убираем варианты с атрибутами
-        xml_content = re.sub(r'<BLOOK[^>]*>', '', xml_content)
-        
-        # Ищем первое вхождение <BATTLE>
-        first_battle_start = xml_content.find('<BATTLE')
-        if first_battle_start == -1:
-            logger.warning("Не найдено ни одного тега <BATTLE> в ответе")
-            return xml_content
-        
-        # Ищем второе вхождение <BATTLE> (признак дубликата)
-        second_battle_start = xml_content.find('<BATTLE', first_battle_start + 1)
-        
-        if second_battle_start != -1:
-            logger.info(f"Найден дубликат <BATTLE> на позиции {second_battle_start}, обрезаем")
-            # Удаляем всё начиная со второго <BATTLE>
-            xml_content = xml_content[:second_battle_start]
-        
-        # Убираем лишние пробелы и переносы в начале/конце
-        xml_content = xml_content.strip()
-        
-        # Проверяем что есть закрывающий тег </BATTLE>
-        if '</BATTLE>' not in xml_content:
-            logger.warning("Отсутствует закрывающий тег </BATTLE>, возможно лог неполный")
-        
-        return xml_content
+                try:
+                    chunk = sock.recv(65536)
+                except socket.timeout:
+                    logger.warning("Таймаут получения данных")
+                    raise TimeoutError("Socket timeout during data reception")
+                if chunk:
+                    received += len(chunk)
+                    frames.feed(chunk)
+                    continue
+                # Сервер закрыл соединение — разбираем хвост без разделителя
+                if not frames.pending:
+                    logger.warning("Соединение закрыто до получения лога боя")
+                    return None
+                frame = frames.take_pending()
+            
+            if b'<ERROR' in frame:
+                error = frame.copy(0, min(len(frame), 500)).decode(errors='ignore')
+                logger.error(f"Сервер вернул ошибку: {error}")
+                return None
+            if b'<BLOOK' not in frame:
+                continue
+            
+            battle = clean_blook(frame)
+            if battle is None:
+                logger.warning("Ответ <BLOOK> без данных о бое")
+            else:
+                logger.info(f"Получен лог боя: принято {received} байт{', дубль <BATTLE> отброшен' if frame.cut else ''}")
+            return battle
     
     def request_battle_log(self, battle_id: int) -> Optional[str]:
         """
@@ -181,24 +130,13 @@ class XmlSyncClient:
             # Подключаемся и авторизуемся
             sock = self._connect_and_authenticate()
             
-            # Отправляем команду и получаем ответ
-            response = self._send_command(sock, xml_command)
-            
-            # Декодируем ответ
-            xml_content = response.decode(errors='ignore')
-            
-            # Проверяем на ошибки
-            if '<ERROR' in xml_content:
-                logger.error(f"Сервер вернул ошибку для battle_id={battle_id}: {xml_content[:500]}")
-                return None
-            
-            # Проверяем что есть данные
-            if '<BATTLE' not in xml_content:
+            # Отправляем команду и читаем ответ (без дубля <BATTLE> и обёртки <BLOOK>)
+            battle = self._request_battle(sock, xml_command)
+            if battle is None:
                 logger.warning(f"Нет данных о бое {battle_id}")
                 return None
             
-            # Дедубликация и очистка
-            battle_xml = self._deduplicate_battles(xml_content)
+            battle_xml = battle.decode(errors='ignore')
             
             logger.info(f"Успешно получен лог боя {battle_id}, размер: {len(battle_xml)} байт")
             return battle_xml
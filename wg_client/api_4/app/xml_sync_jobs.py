@@ -0,0 +1,446 @@
+"""
+Долговечные задания XML синхронизации (таблицы xml_sync_jobs / xml_sync_chunks, миграция V10)
+
+Задание — диапазон боёв, разбитый на куски по chunk_size ID. Каждая реплика api_4
+с XML_SYNC_JOBS_ENABLED=1 крутит XmlSyncJobRunner: забирает свободный кусок в аренду
+(FOR UPDATE SKIP LOCKED — реплики не мешают друг другу), качает его через
+XmlSyncWorker.sync_range и продлевает аренду heartbeat'ом. Готовый кусок помечается
+done и больше не запрашивается; кусок упавшей реплики освобождается по истечении
+аренды и достаётся другой. Кусок, который не скачан из-за недоступности воркеров,
+не закрывается, а возвращается в очередь, и раннер делает паузу (с нарастанием). Прогресс и скорость (бои/с, байты/с по аккаунтам воркеров)
+читаются из БД — в отличие от XmlSyncState, они переживают перезапуск.
+"""
+import asyncio
+import logging
+import os
+import socket
+from typing import Any, Dict, List, Optional
+
+from app.database import BattleDatabase
+from app.xml_sync_worker import XmlSyncWorker
+
+logger = logging.getLogger(__name__)
+
+XML_SYNC_JOB_CHUNK_SIZE = int(os.getenv("XML_SYNC_JOB_CHUNK_SIZE", "1000"))
+XML_SYNC_JOB_LEASE_SECONDS = float(os.getenv("XML_SYNC_JOB_LEASE_SECONDS", "120"))
+XML_SYNC_JOB_HEARTBEAT_SECONDS = float(os.getenv("XML_SYNC_JOB_HEARTBEAT_SECONDS", "30"))
+XML_SYNC_JOB_POLL_SECONDS = float(os.getenv("XML_SYNC_JOB_POLL_SECONDS", "10"))
+# Кусок, уронивший раннер столько раз, больше не выдаётся (виден как stuck, сбрасывается resume)
+XML_SYNC_JOB_MAX_ATTEMPTS = int(os.getenv("XML_SYNC_JOB_MAX_ATTEMPTS", "5"))
+# Воркеры недоступны: кусок возвращается в очередь без траты попытки, пауза раннера
+# удваивается от XML_SYNC_JOB_POLL_SECONDS до этого предела
+XML_SYNC_JOB_OUTAGE_BACKOFF_MAX_SECONDS = float(os.getenv("XML_SYNC_JOB_OUTAGE_BACKOFF_MAX_SECONDS", "300"))
+# Окно, по которому считается текущая скорость (бои/с, байты/с)
+XML_SYNC_JOB_RATE_WINDOW_SECONDS = float(os.getenv("XML_SYNC_JOB_RATE_WINDOW_SECONDS", "300"))
+
+_CHUNK_TOTALS_SQL = """
+    COUNT(c.start_id) AS chunks,
+    COUNT(*) FILTER (WHERE c.status = 'done') AS chunks_done,
+    COUNT(*) FILTER (WHERE c.status = 'leased' AND c.lease_expires_at >= NOW()) AS chunks_leased,
+    COUNT(*) FILTER (WHERE c.status <> 'done' AND c.attempts >= $2) AS chunks_stuck,
+    COALESCE(SUM(c.end_id - c.start_id + 1) FILTER (WHERE c.status = 'done'), 0) AS ids_done,
+    COALESCE(SUM(c.success), 0) AS success,
+    COALESCE(SUM(c.failed), 0) AS failed,
+    COALESCE(SUM(c.timeout), 0) AS timeout,
+    COALESCE(SUM(c.skipped), 0) AS skipped,
+    COALESCE(SUM(c.bytes), 0)::bigint AS bytes,
+    COALESCE(SUM(c.success) FILTER (WHERE c.finished_at > NOW() - make_interval(secs => $3)), 0) AS recent_success,
+    COALESCE(SUM(c.bytes) FILTER (WHERE c.finished_at > NOW() - make_interval(secs => $3)), 0)::bigint AS recent_bytes,
+    MIN(c.started_at) AS first_started_at,
+    MAX(c.finished_at) AS last_finished_at,
+    ARRAY_AGG(DISTINCT c.lease_owner) FILTER (WHERE c.status = 'leased' AND c.lease_expires_at >= NOW()) AS owners
+"""
+
+
+def _rate(amount: float, seconds: Optional[float]) -> Optional[float]:
+    return round(amount / seconds, 2) if seconds and seconds > 0 else None
+
+
+def _workers_outage(result: Dict[str, Any]) -> Optional[str]:
+    """
+    Причина вернуть кусок в очередь вместо done: бои не качались из-за самих воркеров
+
+    Выбыли все воркеры (часть боёв никому не досталась) или каждая ошибка куска —
+    ошибка воркера/транспорта. Такой кусок с «100% ошибок» закрывать нельзя: его
+    бои больше никто не запросит.
+    """
+    unserved = result.get("unserved", 0)
+    if unserved:
+        return f"no healthy workers left: {unserved} battles not fetched"
+    failed = result.get("failed", 0)
+    if failed and result.get("worker_errors", 0) >= failed:
+        return f"worker errors: {failed} battles not fetched"
+    return None
+
+
+def _job_summary(row: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON задания: прогресс по кускам и ID, счётчики, средняя и текущая скорость"""
+    total_ids = row["end_id"] - row["start_id"] + 1
+    elapsed = None
+    if row.get("first_started_at") and row.get("last_finished_at"):
+        elapsed = (row["last_finished_at"] - row["first_started_at"]).total_seconds()
+    return {
+        "job_id": row["id"],
+        "status": row["status"],
+        "range": {"start": row["start_id"], "end": row["end_id"]},
+        "chunk_size": row["chunk_size"],
+        "skip_existing": row["skip_existing"],
+        "created_at": row["created_at"].isoformat() if row.get("created_at") else None,
+        "finished_at": row["finished_at"].isoformat() if row.get("finished_at") else None,
+        "chunks": {
+            "total": row["chunks"] or 0,
+            "done": row["chunks_done"] or 0,
+            "leased": row["chunks_leased"] or 0,
+            "stuck": row["chunks_stuck"] or 0,
+        },
+        "progress": {
+            "ids_done": row["ids_done"],
+            "ids_total": total_ids,
+            "percent": round(100.0 * row["ids_done"] / total_ids, 2),
+        },
+        "success": row["success"],
+        "failed": row["failed"],
+        "timeout": row["timeout"],
+        "skipped": row["skipped"],
+        "bytes": row["bytes"],
+        "throughput": {
+            # В среднем за время работы задания и за последние XML_SYNC_JOB_RATE_WINDOW_SECONDS
+            "battles_per_s": _rate(row["success"], elapsed),
+            "bytes_per_s": _rate(row["bytes"], elapsed),
+            "recent_battles_per_s": _rate(row["recent_success"], XML_SYNC_JOB_RATE_WINDOW_SECONDS),
+            "recent_bytes_per_s": _rate(row["recent_bytes"], XML_SYNC_JOB_RATE_WINDOW_SECONDS),
+        },
+        "lease_owners": [owner for owner in (row.get("owners") or []) if owner],
+    }
+
+
+class XmlSyncJobs:
+    """Хранилище заданий: создание, аренда кусков, heartbeat, завершение и статистика"""
+
+    def __init__(self, db: BattleDatabase):
+        self.db = db
+
+    async def create_job(self, start_id: int, end_id: int, chunk_size: int, skip_existing: bool = True) -> Dict[str, Any]:
+        """
+        Создать задание и его куски (generate_series — одним оператором на весь диапазон)
+
+        Одной транзакцией: задание без кусков осталось бы running навсегда.
+        """
+        if not self.db.pool:
+            await self.db.connect()
+        async with self.db.pool.acquire() as conn:
+            async with conn.transaction():
+                job_id = await conn.fetchval(
+                    """
+                    INSERT INTO xml_sync_jobs (start_id, end_id, chunk_size, skip_existing)
+                    VALUES ($1, $2, $3, $4)
+                    RETURNING id
+                    """,
+                    start_id, end_id, chunk_size, skip_existing
+                )
+                await conn.execute(
+                    """
+                    INSERT INTO xml_sync_chunks (job_id, start_id, end_id)
+                    SELECT $1, s, LEAST(s + $4 - 1, $3)
+                    FROM generate_series($2::int, $3::int, $4::int) AS s
+                    """,
+                    job_id, start_id, end_id, chunk_size
+                )
+        return await self.get_job(job_id)
+
+    async def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = await self.db._execute_one(
+            f"""
+            SELECT j.*, {_CHUNK_TOTALS_SQL}
+            FROM xml_sync_jobs j
+            LEFT JOIN xml_sync_chunks c ON c.job_id = j.id
+            WHERE j.id = $1
+            GROUP BY j.id
+            """,
+            job_id, XML_SYNC_JOB_MAX_ATTEMPTS, XML_SYNC_JOB_RATE_WINDOW_SECONDS
+        )
+        if not row:
+            return None
+        summary = _job_summary(row)
+        summary["accounts"] = await self.account_stats(job_id)
+        return summary
+
+    async def list_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        rows = await self.db._execute_query(
+            f"""
+            SELECT j.*, {_CHUNK_TOTALS_SQL}
+            FROM (SELECT * FROM xml_sync_jobs ORDER BY id DESC LIMIT $1) j
+            LEFT JOIN xml_sync_chunks c ON c.job_id = j.id
+            GROUP BY j.id, j.start_id, j.end_id, j.chunk_size, j.skip_existing, j.status, j.created_at, j.finished_at
+            ORDER BY j.id DESC
+            """,
+            limit, XML_SYNC_JOB_MAX_ATTEMPTS, XML_SYNC_JOB_RATE_WINDOW_SECONDS
+        )
+        return [_job_summary(row) for row in rows]
+
+    async def account_stats(self, job_id: int) -> List[Dict[str, Any]]:
+        """
+        Скорость по аккаунтам воркеров
+
+        battles_per_s / bytes_per_s — за последние XML_SYNC_JOB_RATE_WINDOW_SECONDS;
+        *_per_busy_s — на секунду занятости слота (скорость самого аккаунта без простоев).
+        """
+        rows = await self.db._execute_query(
+            """
+            SELECT
+                worker_account,
+                SUM(total) AS total,
+                SUM(success) AS success,
+                SUM(bytes)::bigint AS bytes,
+                SUM(busy_seconds) AS busy_seconds,
+                COALESCE(SUM(success) FILTER (WHERE recorded_at > NOW() - make_interval(secs => $2)), 0) AS recent_success,
+                COALESCE(SUM(bytes) FILTER (WHERE recorded_at > NOW() - make_interval(secs => $2)), 0)::bigint AS recent_bytes
+            FROM xml_sync_chunk_accounts
+            WHERE job_id = $1
+            GROUP BY worker_account
+            ORDER BY worker_account
+            """,
+            job_id, XML_SYNC_JOB_RATE_WINDOW_SECONDS
+        )
+        return [
+            {
+                "account": row["worker_account"],
+                "total": row["total"],
+                "success": row["success"],
+                "bytes": row["bytes"],
+                "busy_seconds": round(row["busy_seconds"], 1),
+                "battles_per_s": _rate(row["recent_success"], XML_SYNC_JOB_RATE_WINDOW_SECONDS),
+                "bytes_per_s": _rate(row["recent_bytes"], XML_SYNC_JOB_RATE_WINDOW_SECONDS),
+                "battles_per_busy_s": _rate(row["success"], row["busy_seconds"]),
+                "bytes_per_busy_s": _rate(row["bytes"], row["busy_seconds"]),
+            }
+            for row in rows
+        ]
+
+    async def set_status(self, job_id: int, status: str) -> bool:
+        """cancelled — остановить (раннеры бросят куски на ближайшем heartbeat), running — продолжить, сняв stuck"""
+        if status == "cancelled":
+            result = await self.db._execute_command(
+                "UPDATE xml_sync_jobs SET status = 'cancelled', finished_at = NOW() WHERE id = $1 AND status = 'running'",
+                job_id
+            )
+        else:
+            result = await self.db._execute_command(
+                "UPDATE xml_sync_jobs SET status = 'running', finished_at = NULL WHERE id = $1 AND status IN ('cancelled', 'running')",
+                job_id
+            )
+            # Продолжение сбрасывает счётчик попыток у застрявших кусков
+            await self.db._execute_command(
+                "UPDATE xml_sync_chunks SET attempts = 0 WHERE job_id = $1 AND status <> 'done'",
+                job_id
+            )
+        return result.endswith(" 1")
+
+    async def claim_chunk(self, owner: str) -> Optional[Dict[str, Any]]:
+        """Взять в аренду свободный кусок (или кусок с просроченной арендой) любого активного задания"""
+        return await self.db._execute_one(
+            """
+            UPDATE xml_sync_chunks c
+            SET status = 'leased',
+                lease_owner = $1,
+                lease_expires_at = NOW() + make_interval(secs => $2),
+                heartbeat_at = NOW(),
+                attempts = c.attempts + 1,
+                started_at = COALESCE(c.started_at, NOW())
+            FROM (
+                SELECT ch.job_id, ch.start_id, j.skip_existing
+                FROM xml_sync_chunks ch
+                JOIN xml_sync_jobs j ON j.id = ch.job_id
+                WHERE j.status = 'running'
+                  AND ch.attempts < $3
+                  AND (ch.status = 'pending' OR (ch.status = 'leased' AND ch.lease_expires_at < NOW()))
+                ORDER BY ch.job_id, ch.start_id
+                LIMIT 1
+                FOR UPDATE OF ch SKIP LOCKED
+            ) picked
+            WHERE c.job_id = picked.job_id AND c.start_id = picked.start_id
+            RETURNING c.job_id, c.start_id, c.end_id, c.attempts, picked.skip_existing
+            """,
+            owner, XML_SYNC_JOB_LEASE_SECONDS, XML_SYNC_JOB_MAX_ATTEMPTS
+        )
+
+    async def heartbeat(self, chunk: Dict[str, Any], owner: str) -> Optional[str]:
+        """Продлить аренду; статус задания или None, если аренда потеряна"""
+        row = await self.db._execute_one(
+            """
+            UPDATE xml_sync_chunks c
+            SET lease_expires_at = NOW() + make_interval(secs => $4), heartbeat_at = NOW()
+            FROM xml_sync_jobs j
+            WHERE c.job_id = $1 AND c.start_id = $2 AND c.lease_owner = $3
+              AND c.status = 'leased' AND j.id = c.job_id
+            RETURNING j.status
+            """,
+            chunk["job_id"], chunk["start_id"], owner, XML_SYNC_JOB_LEASE_SECONDS
+        )
+        return row["status"] if row else None
+
+    async def release_chunk(self, chunk: Dict[str, Any], owner: str, error: Optional[str] = None,
+                            refund_attempt: bool = False) -> None:
+        """
+        Вернуть кусок в очередь (прерывание, ошибка раннера); уже загруженные бои пропустит skip_existing
+
+        refund_attempt — попытка не засчитывается (простой воркеров — не вина куска,
+        иначе долгий простой переведёт все куски в stuck).
+        """
+        await self.db._execute_command(
+            """
+            UPDATE xml_sync_chunks
+            SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL, last_error = $4,
+                attempts = GREATEST(attempts - $5::int, 0)
+            WHERE job_id = $1 AND start_id = $2 AND lease_owner = $3 AND status = 'leased'
+            """,
+            chunk["job_id"], chunk["start_id"], owner, error, int(refund_attempt)
+        )
+
+    async def complete_chunk(self, chunk: Dict[str, Any], owner: str, result: Dict[str, Any]) -> bool:
+        """Пометить кусок done со счётчиками и статистикой аккаунтов; False — аренду перехватили"""
+        worker_stats = result.get("worker_stats", {}).values()
+        row = await self.db._execute_one(
+            """
+            UPDATE xml_sync_chunks
+            SET status = 'done', lease_owner = NULL, lease_expires_at = NULL, finished_at = NOW(),
+                success = $4, failed = $5, timeout = $6, skipped = $7, bytes = $8, last_error = NULL
+            WHERE job_id = $1 AND start_id = $2 AND lease_owner = $3 AND status = 'leased'
+            RETURNING job_id
+            """,
+            chunk["job_id"], chunk["start_id"], owner,
+            result.get("success", 0), result.get("failed", 0), result.get("timeout", 0),
+            result.get("skipped", 0), sum(stats.get("bytes", 0) for stats in worker_stats)
+        )
+        if not row:
+            return False
+
+        await self.db.executemany(
+            """
+            INSERT INTO xml_sync_chunk_accounts (job_id, chunk_start, worker_account, total, success, bytes, busy_seconds)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            ON CONFLICT (job_id, chunk_start, worker_account) DO UPDATE SET
+                total = EXCLUDED.total,
+                success = EXCLUDED.success,
+                bytes = EXCLUDED.bytes,
+                busy_seconds = EXCLUDED.busy_seconds,
+                recorded_at = NOW()
+            """,
+            [
+                (chunk["job_id"], chunk["start_id"], stats["account"], stats.get("total", 0),
+                 stats.get("success", 0), stats.get("bytes", 0), float(stats.get("busy_seconds", 0.0)))
+                for stats in worker_stats
+            ]
+        )
+        # Последний кусок закрывает задание
+        await self.db._execute_command(
+            """
+            UPDATE xml_sync_jobs SET status = 'done', finished_at = NOW()
+            WHERE id = $1 AND status = 'running'
+              AND NOT EXISTS (SELECT 1 FROM xml_sync_chunks WHERE job_id = $1 AND status <> 'done')
+            """,
+            chunk["job_id"]
+        )
+        return True
+
+
+class XmlSyncJobRunner:
+    """Фоновый цикл реплики: аренда куска → sync_range под heartbeat → done или обратно в очередь"""
+
+    def __init__(self, jobs: XmlSyncJobs, worker: XmlSyncWorker, owner: Optional[str] = None):
+        self.jobs = jobs
+        self.worker = worker
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        # Пауза после куска, возвращённого из-за недоступности воркеров (0 — воркеры работают)
+        self.backoff = 0.0
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run_forever())
+        logger.info(f"🔁 Раннер заданий XML sync запущен ({self.owner})")
+
+    async def stop(self) -> None:
+        """Остановка: текущий кусок прерывается после батча и возвращается в очередь"""
+        self._stop.set()
+        if self._task:
+            try:
+                await asyncio.wait_for(self._task, timeout=XML_SYNC_JOB_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                self._task.cancel()
+
+    async def run_forever(self) -> None:
+        while not self._stop.is_set():
+            try:
+                ran = await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка раннера заданий XML sync: {e}")
+                ran = False
+            if not ran or self.backoff:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), timeout=self.backoff or XML_SYNC_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> bool:
+        """Обработать один кусок; False — свободных кусков нет"""
+        chunk = await self.jobs.claim_chunk(self.owner)
+        if not chunk:
+            return False
+
+        logger.info(
+            f"📦 Задание {chunk['job_id']}: кусок {chunk['start_id']}-{chunk['end_id']} "
+            f"(попытка {chunk['attempts']})"
+        )
+        lease = {"lost": False, "cancelled": False}
+
+        def should_stop() -> bool:
+            return lease["lost"] or lease["cancelled"] or self._stop.is_set()
+
+        heartbeat = asyncio.create_task(self._heartbeat(chunk, lease))
+        try:
+            result = await self.worker.sync_range(
+                chunk["start_id"],
+                chunk["end_id"],
+                skip_existing=chunk["skip_existing"],
+                abort=should_stop
+            )
+        except Exception as e:
+            logger.error(f"Кусок {chunk['start_id']}-{chunk['end_id']} задания {chunk['job_id']}: {e}")
+            await self.jobs.release_chunk(chunk, self.owner, error=str(e))
+            return True
+        finally:
+            heartbeat.cancel()
+
+        if lease["lost"]:
+            logger.warning(f"⚠️ Аренда куска {chunk['start_id']}-{chunk['end_id']} потеряна — кусок доделает другая реплика")
+        elif result.get("aborted"):
+            await self.jobs.release_chunk(chunk, self.owner)
+        elif (outage := _workers_outage(result)) is not None:
+            self.backoff = min(max(self.backoff * 2, XML_SYNC_JOB_POLL_SECONDS), XML_SYNC_JOB_OUTAGE_BACKOFF_MAX_SECONDS)
+            logger.warning(
+                f"⚠️ Кусок {chunk['start_id']}-{chunk['end_id']} возвращён в очередь ({outage}), "
+                f"пауза {self.backoff:.0f}с"
+            )
+            await self.jobs.release_chunk(chunk, self.owner, error=outage, refund_attempt=True)
+        else:
+            self.backoff = 0.0
+            if not await self.jobs.complete_chunk(chunk, self.owner, result):
+                logger.warning(f"⚠️ Кусок {chunk['start_id']}-{chunk['end_id']} уже перехвачен другой репликой")
+        return True
+
+    async def _heartbeat(self, chunk: Dict[str, Any], lease: Dict[str, bool]) -> None:
+        while True:
+            await asyncio.sleep(XML_SYNC_JOB_HEARTBEAT_SECONDS)
+            try:
+                job_status = await self.jobs.heartbeat(chunk, self.owner)
+            except Exception as e:
+                # Сбой БД — аренду не бросаем: запас XML_SYNC_JOB_LEASE_SECONDS покрывает пару пропусков
+                logger.error(f"Heartbeat куска {chunk['start_id']}-{chunk['end_id']}: {e}")
+                continue
+            if job_status is None:
+                lease["lost"] = True
+                return
+            if job_status != "running":
+                lease["cancelled"] = True
+                return
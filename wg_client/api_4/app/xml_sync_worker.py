@@ -3,19 +3,47 @@ XML Sync Worker - система синхронизации логов чере
 """
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional
 from datetime import datetime
 from app.xml_worker_client import XmlWorkerClient
 from app.database import BattleDatabase
+from app.id_ranges import IdRangeSet
 
 logger = logging.getLogger(__name__)
 
 
+def _sync_log_records(results: List[Dict[str, Any]]) -> List[tuple]:
+    """Записи xml_sync_log из результатов воркеров: (battle_id, requested_at, status, error, file_path, size_bytes)"""
+    now = datetime.utcnow()
+    records = []
+    for result in results:
+        battle_id = result.get('battle_id')
+        status = result.get('status')
+        
+        # Определяем file_path (если загружено в mother) — в формате, который использует api_mother
+        file_path = None
+        if result.get('uploaded_to_mother', False) and status == 'success':
+            shard = battle_id // 50000
+            file_path = f"/srv/btl/raw/{shard}/{battle_id}.tzb"
+        
+        records.append((
+            battle_id,
+            now,
+            status,
+            result.get('error'),
+            file_path,
+            result.get('size_bytes')
+        ))
+    return records
+
+
 class XmlSyncWorker:
     """Воркер для синхронизации логов через HTTP воркеры"""
     
-    def __init__(self):
-        self.db: Optional[BattleDatabase] = None
+    def __init__(self, db: Optional[BattleDatabase] = None):
+        # Общий пул приложения (из контейнера) не закрываем — им владеет приложение
+        self.db: Optional[BattleDatabase] = db
+        self._owns_db = db is None
         self.worker_client = XmlWorkerClient()
     
     async def _init_db(self):
@@ -23,7 +51,7 @@ class XmlSyncWorker:
             self.db = BattleDatabase()
     
     async def _close_db(self):
-        if self.db:
+        if self.db and self._owns_db:
             await self.db.disconnect()
     
     async def check_workers_health(self) -> Dict[str, Any]:
@@ -34,27 +62,26 @@ class XmlSyncWorker:
         self, 
         start_id: int, 
         end_id: int, 
-        skip_existing: bool = True
+        skip_existing: bool = True,
+        abort: Optional[Callable[[], bool]] = None
     ) -> Dict[str, Any]:
         """
         Синхронизация диапазона через HTTP воркеры
+
+        abort — свой признак прерывания (задания xml_sync_jobs); по умолчанию глобальный XmlSyncState
         """
         from app.xml_sync_state import get_sync_state
         
         await self._init_db()
         state = get_sync_state()
         
-        # Получаем уже запрошенные ID
-        skip_ids = set()
+        # Уже загруженные ID — диапазонами, без развёртки в множество
+        skip_ids = IdRangeSet()
         if skip_existing:
-            rows = await self.db._execute_query(
-                "SELECT battle_id FROM xml_sync_log WHERE battle_id BETWEEN $1 AND $2 AND status = 'success'",
-                start_id, end_id
-            )
-            skip_ids = {row['battle_id'] for row in rows}
+            skip_ids = await self.db.sync_log_ranges(start_id, end_id)
         
-        # Формируем список ID для загрузки
-        to_download = [bid for bid in range(start_id, end_id + 1) if bid not in skip_ids]
+        # ID для загрузки: диапазон минус загруженные (воркеры разбирают его без списка в памяти)
+        to_download = IdRangeSet.span(start_id, end_id) - skip_ids
         
         if not to_download:
             await self._close_db()
@@ -70,62 +97,21 @@ class XmlSyncWorker:
             }
         
         # Используем HTTP воркеры для параллельной загрузки
-        logger.info(f"Запуск параллельной загрузки {len(to_download)} боев через HTTP воркеры")
+        logger.info(f"Запуск параллельной загрузки {len(to_download)} боев ({len(to_download.ranges)} диапазонов) через HTTP воркеры")
         
         # Воркеры САМИ отправляют в api_mother, нам нужно только собрать результаты
         worker_results = await self.worker_client.fetch_battles_parallel(
             battle_ids=to_download,
             upload_to_mother=True,
-            batch_size=10  # 10 логов на батч
+            batch_size=10,  # 10 логов на батч
+            abort=abort
         )
         
-        # Сохраняем результаты в БД (BATCH INSERT для производительности)
-        results = worker_results.get('results', [])
-        if results:
-            # Подготавливаем данные для batch insert
-            values_list = []
-            now = datetime.utcnow()
-            
-            for result in results:
-                battle_id = result.get('battle_id')
-                status = result.get('status')
-                error = result.get('error')
-                size_bytes = result.get('size_bytes')
-                uploaded = result.get('uploaded_to_mother', False)
-                
-                # Определяем file_path (если загружено в mother)
-                file_path = None
-                if uploaded and status == 'success':
-                    # Путь в формате который использует api_mother
-                    shard = battle_id // 50000
-                    file_path = f"/srv/btl/raw/{shard}/{battle_id}.tzb"
-                
-                values_list.append((
-                    battle_id,
-                    now,
-                    status,
-                    error,
-                    file_path,
-                    size_bytes
-                ))
-            
-            # Выполняем batch insert (1 запрос вместо N)
-            if values_list:
-                # Batch INSERT - выполняем по одному (пока нет executemany в BattleDatabase)
-                for vals in values_list:
-                    query = """
-                        INSERT INTO xml_sync_log (battle_id, requested_at, status, error_message, file_path, size_bytes)
-                        VALUES ($1, $2, $3, $4, $5, $6)
-                        ON CONFLICT (battle_id) DO UPDATE SET
-                            requested_at = EXCLUDED.requested_at,
-                            status = EXCLUDED.status,
-                            error_message = EXCLUDED.error_message,
-                            file_path = EXCLUDED.file_path,
-                            size_bytes = EXCLUDED.size_bytes
-                    """
-                    await self.db._execute_query(query, *vals)
-                
-                logger.info(f"📊 Сохранено в БД: {len(values_list)} записей")
+        # Сохраняем результаты в БД пачкой (executemany / COPY + одно слияние)
+        records = _sync_log_records(worker_results.get('results', []))
+        if records:
+            await self.db.upsert_sync_log(records)
+            logger.info(f"📊 Сохранено в БД: {len(records)} записей")
         
         success_count = worker_results.get('success', 0)
         failed_count = worker_results.get('failed', 0)
@@ -142,7 +128,11 @@ class XmlSyncWorker:
             "skipped": len(skip_ids),
             "timeout": timeout_count,
             "workers_used": worker_results.get('workers_used', 6),
-            "worker_stats": worker_results.get('worker_stats', {})
+            "worker_stats": worker_results.get('worker_stats', {}),
+            # Не скачано из-за недоступности воркеров (см. XmlSyncJobRunner)
+            "unserved": worker_results.get('unserved', 0),
+            "worker_errors": worker_results.get('worker_errors', 0),
+            "aborted": worker_results.get('aborted', False)
         }
     
     async def sync_missing(self, limit: int = 100) -> Dict[str, Any]:
@@ -151,19 +141,9 @@ class XmlSyncWorker:
         """
         await self._init_db()
         
-        # Получаем бои с ошибками
-        rows = await self.db._execute_query(
-            """
-            SELECT battle_id 
-            FROM xml_sync_log 
-            WHERE status IN ('failed', 'response_timeout')
-            ORDER BY battle_id DESC
-            LIMIT $1
-            """,
-            limit
-        )
-        
-        battle_ids = [row['battle_id'] for row in rows]
+        # Бои с ошибками — диапазонами; берём limit самых новых
+        failed_ids = await self.db.sync_log_ranges(statuses=('failed', 'response_timeout'))
+        battle_ids = failed_ids.last(limit)
         
         if not battle_ids:
             await self._close_db()
@@ -174,7 +154,7 @@ class XmlSyncWorker:
                 "timeout": 0
             }
         
-        logger.info(f"Докачка {len(battle_ids)} боев с ошибками")
+        logger.info(f"Докачка {len(battle_ids)} боев с ошибками ({len(battle_ids.ranges)} диапазонов)")
         
         # Используем HTTP воркеры
         worker_results = await self.worker_client.fetch_battles_parallel(
@@ -183,45 +163,11 @@ class XmlSyncWorker:
             batch_size=10  # 10 логов на батч
         )
         
-        # Обновляем результаты в БД (BATCH UPDATE для производительности)
-        results = worker_results.get('results', [])
-        if results:
-            values_list = []
-            now = datetime.utcnow()
-            
-            for result in results:
-                battle_id = result.get('battle_id')
-                status = result.get('status')
-                error = result.get('error')
-                size_bytes = result.get('size_bytes')
-                uploaded = result.get('uploaded_to_mother', False)
-                
-                file_path = None
-                if uploaded and status == 'success':
-                    shard = battle_id // 50000
-                    file_path = f"/srv/btl/raw/{shard}/{battle_id}.tzb"
-                
-                values_list.append((
-                    now,
-                    status,
-                    error,
-                    file_path,
-                    size_bytes,
-                    battle_id
-                ))
-            
-            # Batch UPDATE - выполняем по одному (пока нет executemany)
-            if values_list:
-                for vals in values_list:
-                    query = """
-                        UPDATE xml_sync_log 
-                        SET requested_at = $1, status = $2, error_message = $3, 
-                            file_path = $4, size_bytes = $5
-                        WHERE battle_id = $6
-                    """
-                    await self.db._execute_query(query, *vals)
-                
-                logger.info(f"📊 Обновлено в БД: {len(values_list)} записей")
+        # Обновляем результаты в БД пачкой
+        records = _sync_log_records(worker_results.get('results', []))
+        if records:
+            await self.db.upsert_sync_log(records)
+            logger.info(f"📊 Обновлено в БД: {len(records)} записей")
         
         await self._close_db()
         
@@ -3,11 +3,29 @@ XML Worker Client - HTTP клиент для общения с воркерам
 """
 import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+import os
+import time
+from collections import deque
+from typing import Callable, Collection, Deque, List, Dict, Any, Optional, Set
 import httpx
 
+from app.id_ranges import IdRangeSet
+
 logger = logging.getLogger(__name__)
 
+# Планировщик диапазона: параллельных батчей на воркер, целевая длительность батча,
+# пределы размера батча и число попыток боя на разных аккаунтах
+XML_SYNC_SLOTS_PER_WORKER = int(os.getenv("XML_SYNC_SLOTS_PER_WORKER", "2"))
+XML_SYNC_TARGET_BATCH_SECONDS = float(os.getenv("XML_SYNC_TARGET_BATCH_SECONDS", "20"))
+XML_SYNC_MAX_BATCH = int(os.getenv("XML_SYNC_MAX_BATCH", "50"))
+XML_SYNC_MAX_ATTEMPTS = int(os.getenv("XML_SYNC_MAX_ATTEMPTS", "3"))
+# Столько батчей подряд целиком без ответа воркера — воркер выбывает до конца операции
+XML_SYNC_WORKER_MAX_ERRORS = 3
+
+# Ошибки самих воркеров (а не игрового сервера по бою): воркер не ответил или выбыли все
+WORKER_ERROR_PREFIX = "Worker error"
+NO_HEALTHY_WORKERS = "no healthy workers left"
+
 
 class XmlWorkerConfig:
     """Конфигурация XML воркеров"""
@@ -22,6 +40,161 @@ class XmlWorkerConfig:
     ]
 
 
+def _is_worker_error(result: Dict[str, Any]) -> bool:
+    """Бой не качали: воркер недоступен (транспорт) или не осталось здоровых воркеров"""
+    error = result.get("error") or ""
+    return result.get("status") == "failed" and (error.startswith(WORKER_ERROR_PREFIX) or error == NO_HEALTHY_WORKERS)
+
+
+def _is_retryable(result: Dict[str, Any]) -> bool:
+    """Стоит ли отдать бой другому аккаунту: таймаут или сбой сессии, а не ERROR сервера по самому бою"""
+    status = result.get("status")
+    if status == "response_timeout":
+        return True
+    return status == "failed" and "server returned ERROR" not in (result.get("error") or "")
+
+
+class _WorkerLoad:
+    """
+    Наблюдаемая производительность воркера в текущей операции
+
+    Размер следующего батча — сколько боёв воркер успевает за XML_SYNC_TARGET_BATCH_SECONDS
+    при сглаженной (EWMA) длительности боя; доля таймаутов/сбоев уменьшает батч,
+    чтобы у медленного аккаунта не застревала большая часть диапазона.
+    """
+
+    ALPHA = 0.3
+
+    def __init__(self, worker: Dict[str, Any], initial_batch: int):
+        self.worker = worker
+        self.batch_size = max(1, min(initial_batch, XML_SYNC_MAX_BATCH))
+        self.seconds_per_battle: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_errors = 0
+        self.retired = False
+
+    def record(self, battles: int, elapsed: float, retryable: int, worker_down: bool) -> None:
+        if worker_down:
+            self.consecutive_errors += 1
+            if self.consecutive_errors >= XML_SYNC_WORKER_MAX_ERRORS:
+                self.retired = True
+            self.batch_size = 1
+            return
+        self.consecutive_errors = 0
+        per_battle = elapsed / max(battles, 1)
+        rate = retryable / max(battles, 1)
+        if self.seconds_per_battle is None:
+            self.seconds_per_battle = per_battle
+        else:
+            self.seconds_per_battle += self.ALPHA * (per_battle - self.seconds_per_battle)
+        self.error_rate += self.ALPHA * (rate - self.error_rate)
+        
+        size = XML_SYNC_TARGET_BATCH_SECONDS / max(self.seconds_per_battle, 1e-3)
+        size *= 1.0 - min(self.error_rate, 0.9)
+        self.batch_size = max(1, min(int(size), XML_SYNC_MAX_BATCH))
+
+
+class _RangeScheduler:
+    """
+    Общая очередь боёв операции, из которой воркеры сами берут батчи (work stealing)
+
+    Быстрые воркеры берут батчи чаще, медленные и отключённые — реже или выбывают.
+    Бои с таймаутом/сбоем сессии возвращаются в очередь с пометкой аккаунтов,
+    которые уже пробовали, и достаются другому воркеру (до XML_SYNC_MAX_ATTEMPTS раз).
+    """
+
+    def __init__(self, battle_ids: Collection[int], loads: List[_WorkerLoad]):
+        # ID выдаются по возрастанию лениво: IdRangeSet диапазона не разворачивается в список
+        self._ids = iter(battle_ids if isinstance(battle_ids, IdRangeSet) else sorted(battle_ids))
+        self._next_id: Optional[int] = next(self._ids, None)
+        self.retry: Deque[int] = deque()
+        self.tried: Dict[int, Set[int]] = {}
+        self.loads = loads
+        self.results: Dict[int, Dict[str, Any]] = {}
+        self.in_flight = 0
+        self.cond = asyncio.Condition()
+
+    def _live_worker_ids(self) -> Set[int]:
+        return {load.worker["id"] for load in self.loads if not load.retired}
+
+    def _take(self, load: _WorkerLoad) -> List[int]:
+        worker_id = load.worker["id"]
+        taken: List[int] = []
+        # Повторы — первыми, и только те, что этот аккаунт ещё не пробовал
+        for _ in range(len(self.retry)):
+            if len(taken) >= load.batch_size:
+                break
+            battle_id = self.retry.popleft()
+            if worker_id in self.tried[battle_id]:
+                self.retry.append(battle_id)
+            else:
+                taken.append(battle_id)
+        while self._next_id is not None and len(taken) < load.batch_size:
+            taken.append(self._next_id)
+            self._next_id = next(self._ids, None)
+        return sorted(taken)
+
+    def _drop_unservable_retries(self) -> List[Dict[str, Any]]:
+        """Повторы, которые все оставшиеся воркеры уже пробовали, получают итоговый результат"""
+        live = self._live_worker_ids()
+        dropped = []
+        for _ in range(len(self.retry)):
+            battle_id = self.retry.popleft()
+            if live - self.tried[battle_id]:
+                self.retry.append(battle_id)
+            else:
+                dropped.append(self.results[battle_id])
+        return dropped
+
+    def _finished_for(self, load: _WorkerLoad) -> bool:
+        if self._next_id is not None:
+            return False
+        worker_id = load.worker["id"]
+        if any(worker_id not in self.tried[battle_id] for battle_id in self.retry):
+            return False
+        return self.in_flight == 0
+
+    async def next_batch(self, load: _WorkerLoad, abort) -> Optional[List[int]]:
+        """Следующий батч для воркера или None, если работы для него больше не будет"""
+        async with self.cond:
+            while True:
+                if abort() or load.retired:
+                    return None
+                taken = self._take(load)
+                if taken:
+                    self.in_flight += 1
+                    return taken
+                if self._finished_for(load):
+                    return None
+                await self.cond.wait()
+
+    async def complete(self, load: _WorkerLoad, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Учесть результаты батча; возвращает итоговые (не ушедшие на повтор) результаты"""
+        worker_id = load.worker["id"]
+        final = []
+        async with self.cond:
+            self.in_flight -= 1
+            live = self._live_worker_ids()
+            for result in results:
+                battle_id = result["battle_id"]
+                tried = self.tried.setdefault(battle_id, set())
+                tried.add(worker_id)
+                self.results[battle_id] = result
+                if _is_retryable(result) and len(tried) < XML_SYNC_MAX_ATTEMPTS and live - tried:
+                    self.retry.append(battle_id)
+                else:
+                    final.append(result)
+            if load.retired:
+                final.extend(self._drop_unservable_retries())
+            self.cond.notify_all()
+        return final
+
+    def unfinished(self) -> List[int]:
+        """Бои, не получившие итогового результата (прерывание или выбыли все воркеры)"""
+        rest = [] if self._next_id is None else [self._next_id]
+        return rest + list(self._ids) + list(self.retry)
+
+
 class XmlWorkerClient:
     """
     HTTP клиент для управления XML воркерами
@@ -129,10 +302,11 @@ class XmlWorkerClient:
     
     async def fetch_battles_parallel(
         self,
-        battle_ids: List[int],
+        battle_ids: Collection[int],
         upload_to_mother: bool = True,
         use_batch: bool = True,
-        batch_size: int = 10  # Размер батча на воркер
+        batch_size: int = 10,  # Начальный размер батча на воркер
+        abort: Optional[Callable[[], bool]] = None
     ) -> Dict[str, Any]:
         """
         Параллельно запросить логи боев, распределив их по воркерам
@@ -141,7 +315,8 @@ class XmlWorkerClient:
             battle_ids: Список ID боев
             upload_to_mother: Отправлять ли в API_MOTHER
             use_batch: Использовать batch endpoint (рекомендуется)
-            batch_size: Размер батча на воркер
+            batch_size: Начальный размер батча (дальше подстраивается под каждый воркер)
+            abort: Свой признак прерывания (по умолчанию — глобальный XmlSyncState)
         
         Returns:
             Статистика выполнения
@@ -153,129 +328,128 @@ class XmlWorkerClient:
         
         if use_batch:
             # Новый метод: используем batch endpoint
-            return await self._fetch_battles_batch(battle_ids, upload_to_mother, batch_size)
+            return await self._fetch_battles_batch(battle_ids, upload_to_mother, batch_size, abort)
         else:
             # Старый метод: индивидуальные запросы (fallback)
             return await self._fetch_battles_individual(battle_ids, upload_to_mother)
     
     async def _fetch_battles_batch(
         self,
-        battle_ids: List[int],
+        battle_ids: Collection[int],
         upload_to_mother: bool,
         batch_size: int,
-        concurrency_limit: int = 12  # Макс 12 параллельных батчей одновременно (по 2 на воркер)
+        abort: Optional[Callable[[], bool]] = None
     ) -> Dict[str, Any]:
         """
-        Batch метод: Отправляем батчи боев каждому воркеру С ОГРАНИЧЕНИЕМ ПАРАЛЛЕЛИЗМА
+        Batch метод: общая очередь боёв, из которой воркеры сами берут батчи
+
+        На каждый воркер — XML_SYNC_SLOTS_PER_WORKER параллельных батчей; batch_size —
+        начальный размер, дальше он подстраивается под задержку и долю сбоев воркера.
+        Бои с таймаутом или сбоем сессии повторяются на другом аккаунте; диапазон
+        завершается со скоростью здоровых воркеров.
+
+        Со своим abort (задания xml_sync_jobs) глобальный XmlSyncState не трогается:
+        ни его прерывание, ни его прогресс к такому вызову не относятся.
         """
         from app.xml_sync_state import get_sync_state
         
         total = len(battle_ids)
-        workers_count = len(self.workers)
         state = get_sync_state()
+        own_abort = abort is not None
+        if abort is None:
+            abort = state.check_abort
+        loads = [_WorkerLoad(worker, batch_size) for worker in self.workers]
+        scheduler = _RangeScheduler(battle_ids, loads)
+        worker_stats: Dict[int, Dict[str, Any]] = {}
         
-        # Распределяем бои по воркерам (round-robin)
-        worker_batches = [[] for _ in range(workers_count)]
-        for idx, battle_id in enumerate(battle_ids):
-            worker_idx = idx % workers_count
-            worker_batches[worker_idx].append(battle_id)
-        
-        # РАЗБИВАЕМ каждую пачку воркера на батчи по batch_size
-        logger.info(f"Разбиваем на батчи по {batch_size} логов (concurrency={concurrency_limit})")
-        
-        # Создаём списки батчей для каждого воркера
-        worker_batch_lists = []
-        for worker_idx, worker in enumerate(self.workers):
-            worker_battles = worker_batches[worker_idx]
-            batches = []
-            if worker_battles:
-                for i in range(0, len(worker_battles), batch_size):
-                    batch_chunk = worker_battles[i:i+batch_size]
-                    batches.append((worker, batch_chunk))
-            worker_batch_lists.append(batches)
-        
-        # ЧЕРЕДУЕМ батчи по воркерам (round-robin) для равномерной загрузки
-        all_batches = []
-        max_batches_per_worker = max((len(b) for b in worker_batch_lists), default=0)
-        for batch_idx in range(max_batches_per_worker):
-            for worker_batches_list in worker_batch_lists:
-                if batch_idx < len(worker_batches_list):
-                    all_batches.append(worker_batches_list[batch_idx])
-        
-        logger.info(f"Всего батчей: {len(all_batches)}, concurrency_limit={concurrency_limit}")
+        logger.info(
+            f"Общая очередь: {total} боев, воркеров {len(loads)} × {XML_SYNC_SLOTS_PER_WORKER} слота, "
+            f"начальный батч {batch_size}"
+        )
         
-        # Выполняем батчи с ограничением параллелизма
         async with httpx.AsyncClient(timeout=self.timeout) as client:
-            semaphore = asyncio.Semaphore(concurrency_limit)
-            all_results = []
-            worker_stats = {}
-            aborted = False
             
-            async def process_batch(worker, batch_chunk):
-                """Обработать один батч с семафором"""
-                async with semaphore:
-                    # Проверка abort перед каждым батчем
-                    if state.check_abort():
-                        logger.warning(f"⚠️ Прерывание: пропускаем батч воркера {worker['id']}")
-                        return None
+            async def worker_slot(load: _WorkerLoad):
+                worker = load.worker
+                while True:
+                    chunk = await scheduler.next_batch(load, abort)
+                    if chunk is None:
+                        return
                     
-                    result = await self._fetch_worker_batch(
+                    started = time.monotonic()
+                    batch_result = await self._fetch_worker_batch(
                         client,
                         worker,
-                        batch_chunk,
+                        chunk,
                         upload_to_mother,
-                        batch_size
+                        len(chunk)
                     )
+                    results = batch_result.get("results", [])
+                    retryable = sum(1 for r in results if _is_retryable(r))
+                    worker_down = "worker_error" in batch_result
+                    was_retired = load.retired
+                    elapsed = time.monotonic() - started
+                    load.record(len(chunk), elapsed, retryable, worker_down)
+                    if load.retired and not was_retired:
+                        logger.warning(f"⚠️ Воркер {worker['id']} ({worker['account']}) недоступен — его бои заберут другие")
                     
-                    # Обновляем прогресс
-                    await state.update_progress(
-                        success=result.get("success", 0),
-                        failed=result.get("failed", 0) + result.get("timeout", 0)
-                    )
+                    for result in results:
+                        result["worker_id"] = worker["id"]
+                        result["worker_account"] = worker["account"]
                     
-                    return result
-            
-            # Запускаем все батчи с ограничением параллелизма
-            tasks = [process_batch(worker, batch_chunk) for worker, batch_chunk in all_batches]
-            batch_results = await asyncio.gather(*tasks)
-            
-            # Проверяем если была команда abort
-            if state.check_abort():
-                aborted = True
-                logger.warning("🛑 Операция прервана по запросу")
-            
-            # Разворачиваем результаты из батчей
-            for batch_result in batch_results:
-                if batch_result is None:  # Пропущено из-за abort
-                    continue
-                    
-                worker_id = batch_result["worker_id"]
-                worker_account = batch_result["worker_account"]
-                
-                # Добавляем результаты боев
-                for result in batch_result["results"]:
-                    result["worker_id"] = worker_id
-                    result["worker_account"] = worker_account
-                    all_results.append(result)
-                
-                # Статистика по воркеру
-                if worker_id not in worker_stats:
-                    worker_stats[worker_id] = {
-                        "account": worker_account,
+                    stats = worker_stats.setdefault(worker["id"], {
+                        "account": worker["account"],
                         "total": 0,
                         "success": 0,
                         "failed": 0,
-                        "timeout": 0
-                    }
-                worker_stats[worker_id]["total"] += batch_result["total"]
-                worker_stats[worker_id]["success"] += batch_result["success"]
-                worker_stats[worker_id]["failed"] += batch_result["failed"]
-                worker_stats[worker_id]["timeout"] += batch_result["timeout"]
+                        "timeout": 0,
+                        "bytes": 0,
+                        "busy_seconds": 0.0,
+                        "batch_size": load.batch_size
+                    })
+                    stats["total"] += len(results)
+                    stats["success"] += sum(1 for r in results if r.get("status") == "success")
+                    stats["failed"] += sum(1 for r in results if r.get("status") == "failed")
+                    stats["timeout"] += sum(1 for r in results if r.get("status") == "response_timeout")
+                    stats["bytes"] += sum(r.get("size_bytes") or 0 for r in results if r.get("status") == "success")
+                    stats["busy_seconds"] += elapsed
+                    stats["batch_size"] = load.batch_size
+                    
+                    # Прогресс — только по итоговым результатам (повторы посчитаются позже)
+                    final = await scheduler.complete(load, results)
+                    if own_abort:
+                        continue
+                    await state.update_progress(
+                        success=sum(1 for r in final if r.get("status") == "success"),
+                        failed=sum(1 for r in final if r.get("status") != "success")
+                    )
+            
+            await asyncio.gather(*(
+                worker_slot(load)
+                for load in loads
+                for _ in range(XML_SYNC_SLOTS_PER_WORKER)
+            ))
+        
+        aborted = abort()
+        if aborted:
+            logger.warning("🛑 Операция прервана по запросу")
+        else:
+            # Все воркеры выбыли — оставшиеся бои помечаются ошибкой (докачает sync_missing)
+            for battle_id in scheduler.unfinished():
+                scheduler.results.setdefault(battle_id, {
+                    "battle_id": battle_id,
+                    "status": "failed",
+                    "error": NO_HEALTHY_WORKERS
+                })
         
-        # Общая статистика
+        all_results = list(scheduler.results.values())
         success_count = sum(1 for r in all_results if r.get("status") == "success")
         failed_count = sum(1 for r in all_results if r.get("status") == "failed")
         timeout_count = sum(1 for r in all_results if r.get("status") == "response_timeout")
+        retried = sum(1 for tried in scheduler.tried.values() if len(tried) > 1)
+        # Признаки простоя воркеров: задания xml_sync_jobs не закрывают такой кусок, а возвращают в очередь
+        unserved = sum(1 for r in all_results if r.get("error") == NO_HEALTHY_WORKERS)
+        worker_errors = sum(1 for r in all_results if _is_worker_error(r))
         
         if aborted:
             logger.info(
@@ -283,7 +457,8 @@ class XmlWorkerClient:
             )
         else:
             logger.info(
-                f"✅ Batch завершён: {success_count} успешно, {failed_count} ошибок, {timeout_count} таймаутов"
+                f"✅ Batch завершён: {success_count} успешно, {failed_count} ошибок, {timeout_count} таймаутов, "
+                f"повторено на другом аккаунте: {retried}"
             )
         
         return {
@@ -291,6 +466,9 @@ class XmlWorkerClient:
             "success": success_count,
             "failed": failed_count,
             "timeout": timeout_count,
+            "retried": retried,
+            "unserved": unserved,
+            "worker_errors": worker_errors,
             "workers_used": len(worker_stats),
             "worker_stats": worker_stats,
             "results": all_results,
@@ -335,6 +513,7 @@ class XmlWorkerClient:
             return {
                 "worker_id": worker["id"],
                 "worker_account": worker["account"],
+                "worker_error": str(e),
                 "total": len(battle_ids),
                 "success": 0,
                 "failed": len(battle_ids),
@@ -343,7 +522,7 @@ class XmlWorkerClient:
                     {
                         "battle_id": bid,
                         "status": "failed",
-                        "error": f"Worker error: {str(e)}"
+                        "error": f"{WORKER_ERROR_PREFIX}: {str(e)}"
                     }
                     for bid in battle_ids
                 ]
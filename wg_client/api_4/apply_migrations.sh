@@ -14,6 +14,18 @@ echo "Применение миграций для БД $DB_NAME на $DB_HOST:$
 # Применяем полную миграцию
 PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -p $DB_PORT -U $DB_USER -d $DB_NAME -f /app/migrations/V1__create_tables_complete.sql
 
+# Витрины аналитики (суточные агрегаты, обновляются при save_battle)
+PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -p $DB_PORT -U $DB_USER -d $DB_NAME -v ON_ERROR_STOP=1 -f /app/migrations/V7__analytics_rollups.sql
+
+# Помесячное секционирование battles / battle_participants / battle_loot
+PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -p $DB_PORT -U $DB_USER -d $DB_NAME -v ON_ERROR_STOP=1 -f /app/migrations/V8__partition_battles.sql
+
+# Триграммный поиск по логинам, кланам и монстрам (pg_trgm)
+PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -p $DB_PORT -U $DB_USER -d $DB_NAME -v ON_ERROR_STOP=1 -f /app/migrations/V9__trigram_search.sql
+
+# Долговечные задания XML sync: куски диапазонов с арендой и heartbeat
+PGPASSWORD=$DB_PASSWORD psql -h $DB_HOST -p $DB_PORT -U $DB_USER -d $DB_NAME -v ON_ERROR_STOP=1 -f /app/migrations/V10__xml_sync_jobs.sql
+
 echo "Миграции применены успешно"
 
 
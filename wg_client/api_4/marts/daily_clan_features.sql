@@ -1,31 +1,29 @@
 -- Витрина: Ежедневные фичи кланов
 -- Назначение: Агрегированные метрики кланов за день
--- Частота обновления: Ежедневно
+-- Частота обновления: при каждом save_battle (через mart_clan_player_daily, V7)
 
 CREATE OR REPLACE VIEW daily_clan_features AS
 WITH clan_daily_stats AS (
+    -- Читаем материализованную витрину mart_clan_player_daily (V7), а не battle_participants ⨝ battles
     SELECT 
-        bp.clan,
-        c.name as clan_name,
-        DATE(b.ts) as battle_date,
-        COUNT(DISTINCT bp.player_id) as members_count,
-        COUNT(b.id) as battles_count,
-        SUM(CASE WHEN bp.survived = 1 THEN 1 ELSE 0 END) as wins,
-        SUM(CASE WHEN bp.survived = 0 THEN 1 ELSE 0 END) as losses,
-        SUM(bp.kills_monsters) as kills_monsters,
-        SUM(bp.kills_players) as kills_players,
-        SUM(bp.rank_points) as total_rank_points,
-        SUM(bp.pve_points) as total_pve_points,
-        AVG(bp.rank_points) as avg_rank_points,
-        AVG(bp.pve_points) as avg_pve_points,
-        SUM(b.turns) as total_turns,
-        AVG(b.turns) as avg_turns_per_battle
-    FROM battle_participants bp
-    JOIN clans c ON bp.clan = c.name
-    JOIN battles b ON bp.battle_id = b.id
-    WHERE b.ts >= CURRENT_DATE - INTERVAL '30 days'
-    AND bp.clan IS NOT NULL
-    GROUP BY bp.clan, c.name, DATE(b.ts)
+        m.clan,
+        m.clan as clan_name,
+        m.day as battle_date,
+        COUNT(DISTINCT m.player_id) as members_count,
+        SUM(m.battles) as battles_count,
+        SUM(m.wins) as wins,
+        SUM(m.losses) as losses,
+        SUM(m.kills_monsters) as kills_monsters,
+        SUM(m.kills_players) as kills_players,
+        SUM(m.rank_points_sum) as total_rank_points,
+        SUM(m.pve_points_sum) as total_pve_points,
+        SUM(m.rank_points_sum)::float / NULLIF(SUM(m.battles), 0) as avg_rank_points,
+        SUM(m.pve_points_sum)::float / NULLIF(SUM(m.battles), 0) as avg_pve_points,
+        SUM(m.turns_sum) as total_turns,
+        SUM(m.turns_sum)::float / NULLIF(SUM(m.battles), 0) as avg_turns_per_battle
+    FROM mart_clan_player_daily m
+    WHERE m.day >= CURRENT_DATE - INTERVAL '30 days'
+    GROUP BY m.clan, m.day
 ),
 clan_features AS (
     SELECT 
@@ -107,15 +105,7 @@ SELECT
 FROM clan_features
 ORDER BY battle_date DESC, clan_activity_score DESC;
 
--- Индексы для оптимизации
-CREATE INDEX IF NOT EXISTS idx_daily_clan_features_clan_date 
-ON daily_clan_features (clan, battle_date);
-
-CREATE INDEX IF NOT EXISTS idx_daily_clan_features_activity 
-ON daily_clan_features (clan_activity_score DESC);
-
-CREATE INDEX IF NOT EXISTS idx_daily_clan_features_rank 
-ON daily_clan_features (battle_date, daily_rank);
+-- Индексы: витрина читает mart_clan_player_daily по PRIMARY KEY (clan, day, player_id) и idx_mart_clan_player_daily_day
 
 -- Комментарии
 COMMENT ON VIEW daily_clan_features IS 'Ежедневные фичи кланов для аналитики';
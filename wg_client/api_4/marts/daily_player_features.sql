@@ -1,29 +1,27 @@
 -- Витрина: Ежедневные фичи игроков
 -- Назначение: Агрегированные метрики игроков за день для аналитики и антибота
--- Частота обновления: Ежедневно
+-- Частота обновления: при каждом save_battle (через mart_player_daily, V7)
 
 CREATE OR REPLACE VIEW daily_player_features AS
 WITH player_daily_stats AS (
+    -- Читаем материализованную витрину mart_player_daily (V7), а не battle_participants ⨝ battles
     SELECT 
-        bp.player_id,
-        p.login,
-        DATE(b.ts) as battle_date,
-        COUNT(b.id) as battles_count,
-        SUM(CASE WHEN bp.survived = 1 THEN 1 ELSE 0 END) as wins,
-        SUM(CASE WHEN bp.survived = 0 THEN 1 ELSE 0 END) as losses,
-        SUM(bp.kills_monsters) as kills_monsters,
-        SUM(bp.kills_players) as kills_players,
-        SUM(bp.rank_points) as rank_points_total,
-        SUM(bp.pve_points) as pve_points_total,
-        AVG(bp.rank_points) as rank_points_avg,
-        AVG(bp.pve_points) as pve_points_avg,
-        SUM(b.turns) as total_turns,
-        AVG(b.turns) as avg_turns_per_battle
-    FROM battle_participants bp
-    JOIN players p ON bp.player_id = p.id
-    JOIN battles b ON bp.battle_id = b.id
-    WHERE b.ts >= CURRENT_DATE - INTERVAL '30 days'
-    GROUP BY bp.player_id, p.login, DATE(b.ts)
+        m.player_id,
+        m.login,
+        m.day as battle_date,
+        m.battles as battles_count,
+        m.wins,
+        m.losses,
+        m.kills_monsters,
+        m.kills_players,
+        m.rank_points_sum as rank_points_total,
+        m.pve_points_sum as pve_points_total,
+        m.rank_points_sum::float / NULLIF(m.battles, 0) as rank_points_avg,
+        m.pve_points_sum::float / NULLIF(m.battles, 0) as pve_points_avg,
+        m.turns_sum as total_turns,
+        m.turns_sum::float / NULLIF(m.battles, 0) as avg_turns_per_battle
+    FROM mart_player_daily m
+    WHERE m.day >= CURRENT_DATE - INTERVAL '30 days'
 ),
 player_features AS (
     SELECT 
@@ -95,15 +93,7 @@ SELECT
 FROM player_features
 ORDER BY battle_date DESC, activity_score DESC;
 
--- Индексы для оптимизации
-CREATE INDEX IF NOT EXISTS idx_daily_player_features_player_date 
-ON daily_player_features (player_id, battle_date);
-
-CREATE INDEX IF NOT EXISTS idx_daily_player_features_activity 
-ON daily_player_features (activity_score DESC);
-
-CREATE INDEX IF NOT EXISTS idx_daily_player_features_survival 
-ON daily_player_features (survival_rate DESC);
+-- Индексы: витрина читает mart_player_daily по PRIMARY KEY (player_id, day) и idx_mart_player_daily_day
 
 -- Комментарии
 COMMENT ON VIEW daily_player_features IS 'Ежедневные фичи игроков для аналитики и антибота';
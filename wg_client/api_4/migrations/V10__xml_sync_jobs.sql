@@ -0,0 +1,56 @@
+-- V10: Долговечные задания XML синхронизации (xml_sync_jobs)
+-- Задание — диапазон боёв, разбитый на куски (chunks). Реплика api_4 забирает кусок
+-- в аренду (lease) через FOR UPDATE SKIP LOCKED, продлевает её heartbeat'ом и
+-- помечает кусок done. Кусок с просроченной арендой (реплика упала) забирает другая;
+-- готовые куски больше не запрашиваются. Прогресс переживает перезапуск api_4.
+
+CREATE TABLE IF NOT EXISTS xml_sync_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    start_id INTEGER NOT NULL,
+    end_id INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    skip_existing BOOLEAN NOT NULL DEFAULT TRUE,
+    status TEXT NOT NULL DEFAULT 'running',  -- running, done, cancelled
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at TIMESTAMPTZ,
+    CHECK (end_id >= start_id)
+);
+
+CREATE TABLE IF NOT EXISTS xml_sync_chunks (
+    job_id BIGINT NOT NULL REFERENCES xml_sync_jobs(id) ON DELETE CASCADE,
+    start_id INTEGER NOT NULL,
+    end_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done
+    lease_owner TEXT,
+    lease_expires_at TIMESTAMPTZ,
+    heartbeat_at TIMESTAMPTZ,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    timeout INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    PRIMARY KEY (job_id, start_id)
+);
+
+-- Поиск свободного куска: только незавершённые
+CREATE INDEX IF NOT EXISTS xml_sync_chunks_open_idx
+    ON xml_sync_chunks (job_id, start_id)
+    WHERE status <> 'done';
+
+-- Пропускная способность по аккаунтам воркеров: строка на (кусок, аккаунт)
+CREATE TABLE IF NOT EXISTS xml_sync_chunk_accounts (
+    job_id BIGINT NOT NULL,
+    chunk_start INTEGER NOT NULL,
+    worker_account TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    success INTEGER NOT NULL DEFAULT 0,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    busy_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (job_id, chunk_start, worker_account),
+    FOREIGN KEY (job_id, chunk_start) REFERENCES xml_sync_chunks(job_id, start_id) ON DELETE CASCADE
+);
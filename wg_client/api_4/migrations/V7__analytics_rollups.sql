@@ -0,0 +1,266 @@
+-- V7: Материализованные витрины аналитики с инкрементальным обновлением
+-- Цель: дашборды читают готовые суточные агрегаты (день × игрок / клан / ресурс),
+-- а не агрегируют battle_participants ⨝ battles на каждый запрос.
+-- Все колонки аддитивные (суммы и счётчики), поэтому вклад боя можно
+-- прибавить при сохранении и вычесть при перезаписи — см. mart_apply_battle.
+
+BEGIN;
+
+-- Игрок × день
+CREATE TABLE IF NOT EXISTS mart_player_daily (
+    player_id        INTEGER NOT NULL,
+    day              DATE NOT NULL,
+    login            TEXT NOT NULL,
+    battles          INTEGER NOT NULL DEFAULT 0,
+    wins             INTEGER NOT NULL DEFAULT 0,
+    losses           INTEGER NOT NULL DEFAULT 0,
+    kills_monsters   BIGINT NOT NULL DEFAULT 0,
+    kills_players    BIGINT NOT NULL DEFAULT 0,
+    rank_points_sum  BIGINT NOT NULL DEFAULT 0,
+    pve_points_sum   BIGINT NOT NULL DEFAULT 0,
+    turns_sum        BIGINT NOT NULL DEFAULT 0,
+    -- Для среднего KPT: бои с turns > 0 и суммы убийств/ход по ним (PvE и PvP отдельно — вес PvP задаётся в запросе)
+    kpt_battles      INTEGER NOT NULL DEFAULT 0,
+    kpt_monsters_sum NUMERIC NOT NULL DEFAULT 0,
+    kpt_players_sum  NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_mart_player_daily_day ON mart_player_daily (day);
+CREATE INDEX IF NOT EXISTS idx_mart_player_daily_login ON mart_player_daily (login);
+
+-- Клан × игрок × день (число участников клана за период = COUNT(DISTINCT player_id))
+CREATE TABLE IF NOT EXISTS mart_clan_player_daily (
+    clan             TEXT NOT NULL,
+    player_id        INTEGER NOT NULL,
+    day              DATE NOT NULL,
+    battles          INTEGER NOT NULL DEFAULT 0,
+    wins             INTEGER NOT NULL DEFAULT 0,
+    losses           INTEGER NOT NULL DEFAULT 0,
+    kills_monsters   BIGINT NOT NULL DEFAULT 0,
+    kills_players    BIGINT NOT NULL DEFAULT 0,
+    rank_points_sum  BIGINT NOT NULL DEFAULT 0,
+    pve_points_sum   BIGINT NOT NULL DEFAULT 0,
+    turns_sum        BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (clan, day, player_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_mart_clan_player_daily_day ON mart_clan_player_daily (day);
+
+-- Ресурс × день
+CREATE TABLE IF NOT EXISTS mart_resource_daily (
+    resource_id INTEGER NOT NULL,
+    day         DATE NOT NULL,
+    qty         BIGINT NOT NULL DEFAULT 0,
+    battles     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (resource_id, day)
+);
+
+CREATE INDEX IF NOT EXISTS idx_mart_resource_daily_day ON mart_resource_daily (day);
+
+-- Бои × день
+CREATE TABLE IF NOT EXISTS mart_battles_daily (
+    day              DATE PRIMARY KEY,
+    battles          INTEGER NOT NULL DEFAULT 0,
+    players_cnt_sum  BIGINT NOT NULL DEFAULT 0,
+    monsters_cnt_sum BIGINT NOT NULL DEFAULT 0
+);
+
+-- Прибавить (p_sign = 1) или вычесть (p_sign = -1) вклад одного боя во все витрины.
+-- Вызывается из BattleDatabase.save_battle в той же транзакции: -1 до перезаписи
+-- дочерних строк существующего боя, +1 после записи новых.
+CREATE OR REPLACE FUNCTION mart_apply_battle(p_battle_id BIGINT, p_sign INTEGER)
+RETURNS VOID AS $$
+DECLARE
+  v_day DATE;
+  v_turns INTEGER;
+BEGIN
+  SELECT DATE(b.ts), COALESCE(b.turns, 0) INTO v_day, v_turns
+  FROM battles b
+  WHERE b.id = p_battle_id;
+
+  IF v_day IS NULL THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO mart_battles_daily AS m (day, battles, players_cnt_sum, monsters_cnt_sum)
+  SELECT v_day, p_sign, p_sign * COALESCE(b.players_cnt, 0), p_sign * COALESCE(b.monsters_cnt, 0)
+  FROM battles b
+  WHERE b.id = p_battle_id
+  ON CONFLICT (day) DO UPDATE SET
+    battles = m.battles + EXCLUDED.battles,
+    players_cnt_sum = m.players_cnt_sum + EXCLUDED.players_cnt_sum,
+    monsters_cnt_sum = m.monsters_cnt_sum + EXCLUDED.monsters_cnt_sum;
+
+  -- ORDER BY: одинаковый порядок блокировок строк витрин во всех транзакциях
+  INSERT INTO mart_player_daily AS m (
+    player_id, day, login, battles, wins, losses, kills_monsters, kills_players,
+    rank_points_sum, pve_points_sum, turns_sum, kpt_battles, kpt_monsters_sum, kpt_players_sum
+  )
+  SELECT
+    bp.player_id,
+    v_day,
+    MAX(bp.login),
+    p_sign * COUNT(*),
+    p_sign * COUNT(*) FILTER (WHERE bp.survived = TRUE),
+    p_sign * COUNT(*) FILTER (WHERE bp.survived = FALSE),
+    p_sign * SUM(COALESCE(bp.kills_monsters, 0)),
+    p_sign * SUM(COALESCE(bp.kills_players, 0)),
+    p_sign * SUM(COALESCE(bp.rank_points, 0)),
+    p_sign * SUM(COALESCE(bp.pve_points, 0)),
+    p_sign * COUNT(*) * v_turns,
+    CASE WHEN v_turns > 0 THEN p_sign * COUNT(*) ELSE 0 END,
+    CASE WHEN v_turns > 0 THEN p_sign * SUM(COALESCE(bp.kills_monsters, 0))::numeric / v_turns ELSE 0 END,
+    CASE WHEN v_turns > 0 THEN p_sign * SUM(COALESCE(bp.kills_players, 0))::numeric / v_turns ELSE 0 END
+  FROM battle_participants bp
+  WHERE bp.battle_id = p_battle_id AND bp.player_id IS NOT NULL
+  GROUP BY bp.player_id
+  ORDER BY bp.player_id
+  ON CONFLICT (player_id, day) DO UPDATE SET
+    login = EXCLUDED.login,
+    battles = m.battles + EXCLUDED.battles,
+    wins = m.wins + EXCLUDED.wins,
+    losses = m.losses + EXCLUDED.losses,
+    kills_monsters = m.kills_monsters + EXCLUDED.kills_monsters,
+    kills_players = m.kills_players + EXCLUDED.kills_players,
+    rank_points_sum = m.rank_points_sum + EXCLUDED.rank_points_sum,
+    pve_points_sum = m.pve_points_sum + EXCLUDED.pve_points_sum,
+    turns_sum = m.turns_sum + EXCLUDED.turns_sum,
+    kpt_battles = m.kpt_battles + EXCLUDED.kpt_battles,
+    kpt_monsters_sum = m.kpt_monsters_sum + EXCLUDED.kpt_monsters_sum,
+    kpt_players_sum = m.kpt_players_sum + EXCLUDED.kpt_players_sum;
+
+  INSERT INTO mart_clan_player_daily AS m (
+    clan, player_id, day, battles, wins, losses, kills_monsters, kills_players,
+    rank_points_sum, pve_points_sum, turns_sum
+  )
+  SELECT
+    bp.clan,
+    bp.player_id,
+    v_day,
+    p_sign * COUNT(*),
+    p_sign * COUNT(*) FILTER (WHERE bp.survived = TRUE),
+    p_sign * COUNT(*) FILTER (WHERE bp.survived = FALSE),
+    p_sign * SUM(COALESCE(bp.kills_monsters, 0)),
+    p_sign * SUM(COALESCE(bp.kills_players, 0)),
+    p_sign * SUM(COALESCE(bp.rank_points, 0)),
+    p_sign * SUM(COALESCE(bp.pve_points, 0)),
+    p_sign * COUNT(*) * v_turns
+  FROM battle_participants bp
+  WHERE bp.battle_id = p_battle_id AND bp.player_id IS NOT NULL
+    AND bp.clan IS NOT NULL AND bp.clan <> ''
+  GROUP BY bp.clan, bp.player_id
+  ORDER BY bp.clan, bp.player_id
+  ON CONFLICT (clan, day, player_id) DO UPDATE SET
+    battles = m.battles + EXCLUDED.battles,
+    wins = m.wins + EXCLUDED.wins,
+    losses = m.losses + EXCLUDED.losses,
+    kills_monsters = m.kills_monsters + EXCLUDED.kills_monsters,
+    kills_players = m.kills_players + EXCLUDED.kills_players,
+    rank_points_sum = m.rank_points_sum + EXCLUDED.rank_points_sum,
+    pve_points_sum = m.pve_points_sum + EXCLUDED.pve_points_sum,
+    turns_sum = m.turns_sum + EXCLUDED.turns_sum;
+
+  INSERT INTO mart_resource_daily AS m (resource_id, day, qty, battles)
+  SELECT bl.resource_id, v_day, p_sign * SUM(bl.qty), p_sign
+  FROM battle_loot bl
+  WHERE bl.battle_id = p_battle_id AND bl.kind = 'resource' AND bl.resource_id IS NOT NULL
+  GROUP BY bl.resource_id
+  ORDER BY bl.resource_id
+  ON CONFLICT (resource_id, day) DO UPDATE SET
+    qty = m.qty + EXCLUDED.qty,
+    battles = m.battles + EXCLUDED.battles;
+
+  -- После вычитания убираем опустевшие строки, чтобы они не попадали в COUNT(DISTINCT ...)
+  IF p_sign < 0 THEN
+    DELETE FROM mart_battles_daily WHERE day = v_day AND battles <= 0;
+    DELETE FROM mart_player_daily WHERE day = v_day AND battles <= 0;
+    DELETE FROM mart_clan_player_daily WHERE day = v_day AND battles <= 0;
+    DELETE FROM mart_resource_daily WHERE day = v_day AND battles <= 0;
+  END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Полный пересчёт витрин из сырых таблиц (первичное заполнение и ручная сверка)
+CREATE OR REPLACE FUNCTION mart_rebuild()
+RETURNS VOID AS $$
+BEGIN
+  TRUNCATE mart_battles_daily, mart_player_daily, mart_clan_player_daily, mart_resource_daily;
+
+  INSERT INTO mart_battles_daily (day, battles, players_cnt_sum, monsters_cnt_sum)
+  SELECT DATE(b.ts), COUNT(*), SUM(COALESCE(b.players_cnt, 0)), SUM(COALESCE(b.monsters_cnt, 0))
+  FROM battles b
+  WHERE b.ts IS NOT NULL
+  GROUP BY DATE(b.ts);
+
+  INSERT INTO mart_player_daily (
+    player_id, day, login, battles, wins, losses, kills_monsters, kills_players,
+    rank_points_sum, pve_points_sum, turns_sum, kpt_battles, kpt_monsters_sum, kpt_players_sum
+  )
+  SELECT
+    bp.player_id,
+    DATE(b.ts),
+    MAX(bp.login),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE bp.survived = TRUE),
+    COUNT(*) FILTER (WHERE bp.survived = FALSE),
+    SUM(COALESCE(bp.kills_monsters, 0)),
+    SUM(COALESCE(bp.kills_players, 0)),
+    SUM(COALESCE(bp.rank_points, 0)),
+    SUM(COALESCE(bp.pve_points, 0)),
+    SUM(COALESCE(b.turns, 0)),
+    COUNT(*) FILTER (WHERE b.turns > 0),
+    COALESCE(SUM(COALESCE(bp.kills_monsters, 0)::numeric / NULLIF(b.turns, 0)), 0),
+    COALESCE(SUM(COALESCE(bp.kills_players, 0)::numeric / NULLIF(b.turns, 0)), 0)
+  FROM battle_participants bp
+  JOIN battles b ON b.id = bp.battle_id
+  WHERE b.ts IS NOT NULL AND bp.player_id IS NOT NULL
+  GROUP BY bp.player_id, DATE(b.ts);
+
+  INSERT INTO mart_clan_player_daily (
+    clan, player_id, day, battles, wins, losses, kills_monsters, kills_players,
+    rank_points_sum, pve_points_sum, turns_sum
+  )
+  SELECT
+    bp.clan,
+    bp.player_id,
+    DATE(b.ts),
+    COUNT(*),
+    COUNT(*) FILTER (WHERE bp.survived = TRUE),
+    COUNT(*) FILTER (WHERE bp.survived = FALSE),
+    SUM(COALESCE(bp.kills_monsters, 0)),
+    SUM(COALESCE(bp.kills_players, 0)),
+    SUM(COALESCE(bp.rank_points, 0)),
+    SUM(COALESCE(bp.pve_points, 0)),
+    SUM(COALESCE(b.turns, 0))
+  FROM battle_participants bp
+  JOIN battles b ON b.id = bp.battle_id
+  WHERE b.ts IS NOT NULL AND bp.player_id IS NOT NULL
+    AND bp.clan IS NOT NULL AND bp.clan <> ''
+  GROUP BY bp.clan, bp.player_id, DATE(b.ts);
+
+  INSERT INTO mart_resource_daily (resource_id, day, qty, battles)
+  SELECT bl.resource_id, DATE(b.ts), SUM(bl.qty), COUNT(DISTINCT bl.battle_id)
+  FROM battle_loot bl
+  JOIN battles b ON b.id = bl.battle_id
+  WHERE b.ts IS NOT NULL AND bl.kind = 'resource' AND bl.resource_id IS NOT NULL
+  GROUP BY bl.resource_id, DATE(b.ts);
+END;
+$$ LANGUAGE plpgsql;
+
+-- Первичное заполнение (скрипт миграций запускается при каждом старте — пересчитываем только пустые витрины)
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM mart_battles_daily) THEN
+    PERFORM mart_rebuild();
+  END IF;
+END $$;
+
+COMMENT ON TABLE mart_player_daily IS 'Суточные агрегаты игрока, обновляются при save_battle';
+COMMENT ON TABLE mart_clan_player_daily IS 'Суточные агрегаты игрока в составе клана, обновляются при save_battle';
+COMMENT ON TABLE mart_resource_daily IS 'Суточный приток ресурса, обновляется при save_battle';
+COMMENT ON TABLE mart_battles_daily IS 'Суточные счётчики боёв, обновляются при save_battle';
+COMMENT ON FUNCTION mart_apply_battle IS 'Прибавляет (1) или вычитает (-1) вклад боя в витрины';
+COMMENT ON FUNCTION mart_rebuild IS 'Полный пересчёт витрин из battles/battle_participants/battle_loot';
+
+COMMIT;
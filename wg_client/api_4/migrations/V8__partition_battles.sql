@@ -0,0 +1,296 @@
+-- V8: Помесячное секционирование battles / battle_participants / battle_loot
+-- Цель: запросы с окном b.ts >= cutoff (7/30/90 дней) читают только нужные месяцы
+-- (partition pruning), а очистка старых боёв — это DETACH месячной секции, а не DELETE.
+--
+-- battles секционируется по ts (TIMESTAMPTZ, границы — полночь UTC первого числа),
+-- участники и лут — по battle_ts (DATE боя в UTC) с теми же месячными границами.
+-- Секции создаёт ensure_battle_partitions (BattleDatabase.save_battle вызывает её
+-- один раз на месяц на процесс), отсоединяет — detach_battle_partitions.
+--
+-- Внешние ключи на battles(id) с ON DELETE CASCADE переносятся на уровень секций:
+-- секция участников/лута ссылается на секцию battles того же месяца. Остальные
+-- внешние ключи старых таблиц (на справочники) копируются как есть.
+-- Представления (marts/), зависящие от старых таблиц, пересоздаются в конце миграции.
+
+BEGIN;
+
+-- Определения представлений, которые DROP ... CASCADE удалит вместе со старыми таблицами
+CREATE TEMP TABLE v8_saved_views (
+  name TEXT NOT NULL,
+  relkind "char" NOT NULL,
+  depth INTEGER NOT NULL,
+  def TEXT NOT NULL,
+  comment TEXT
+) ON COMMIT DROP;
+
+-- Пропускаем, если battles уже секционирована (скрипт миграций запускается при каждом старте)
+DO $migration$
+DECLARE
+  v_fk RECORD;
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_partitioned_table pt
+    JOIN pg_class c ON c.oid = pt.partrelid
+    WHERE c.relname = 'battles' AND c.relnamespace = 'public'::regnamespace
+  ) THEN
+    RAISE NOTICE 'battles уже секционирована, V8 пропущена';
+    RETURN;
+  END IF;
+
+  -- Представления над battles / battle_participants / battle_loot (и над ними — транзитивно);
+  -- запоминаем до переименования, пока определения ссылаются на исходные имена
+  INSERT INTO v8_saved_views (name, relkind, depth, def, comment)
+  WITH RECURSIVE deps(view_oid, depth) AS (
+    SELECT r.ev_class, 1
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    WHERE d.classid = 'pg_rewrite'::regclass
+      AND d.refclassid = 'pg_class'::regclass
+      AND d.refobjid IN ('battles'::regclass, 'battle_participants'::regclass, 'battle_loot'::regclass)
+      AND r.ev_class <> d.refobjid
+    UNION
+    SELECT r.ev_class, deps.depth + 1
+    FROM deps
+    JOIN pg_depend d ON d.refobjid = deps.view_oid
+      AND d.refclassid = 'pg_class'::regclass
+      AND d.classid = 'pg_rewrite'::regclass
+    JOIN pg_rewrite r ON r.oid = d.objid
+    WHERE r.ev_class <> deps.view_oid
+  )
+  SELECT c.oid::regclass::text, c.relkind, MAX(deps.depth), pg_get_viewdef(c.oid), obj_description(c.oid, 'pg_class')
+  FROM deps
+  JOIN pg_class c ON c.oid = deps.view_oid
+  GROUP BY c.oid, c.relkind;
+
+  ALTER TABLE battles RENAME TO battles_legacy;
+  ALTER TABLE battle_participants RENAME TO battle_participants_legacy;
+  ALTER TABLE battle_loot RENAME TO battle_loot_legacy;
+
+  -- source_id (ID боя из имени файла) используется кодом как натуральный ключ
+  ALTER TABLE battles_legacy ADD COLUMN IF NOT EXISTS source_id BIGINT;
+
+  -- Бои без времени нельзя положить в секцию: берём start_ts, иначе начало эпохи
+  UPDATE battles_legacy SET ts = COALESCE(start_ts, to_timestamp(0)) WHERE ts IS NULL;
+  -- battle_ts лута раньше был датой загрузки — делаем его датой боя (ключ секции)
+  UPDATE battle_loot_legacy l
+  SET battle_ts = (b.ts AT TIME ZONE 'UTC')::date
+  FROM battles_legacy b
+  WHERE b.id = l.battle_id;
+
+  CREATE TABLE battles (LIKE battles_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (ts);
+  ALTER TABLE battles ALTER COLUMN ts SET NOT NULL;
+  ALTER TABLE battles ADD CONSTRAINT battles_part_pkey PRIMARY KEY (id, ts);
+  ALTER TABLE battles ADD CONSTRAINT battles_uq_source_ts UNIQUE (source_id, ts);
+
+  -- battle_ts (дата боя в UTC) — ключ секции, поэтому объявляется в самой CREATE TABLE
+  CREATE TABLE battle_participants (
+    LIKE battle_participants_legacy INCLUDING DEFAULTS,
+    battle_ts DATE NOT NULL
+  ) PARTITION BY RANGE (battle_ts);
+  ALTER TABLE battle_participants ADD CONSTRAINT battle_participants_part_pkey PRIMARY KEY (id, battle_ts);
+
+  CREATE TABLE battle_loot (LIKE battle_loot_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    PARTITION BY RANGE (battle_ts);
+  ALTER TABLE battle_loot ADD CONSTRAINT battle_loot_part_pkey PRIMARY KEY (id, battle_ts);
+
+  -- LIKE не копирует внешние ключи: ключи на справочники переносим на новые таблицы,
+  -- а ключ на battles(id) создаёт ensure_battle_partitions для каждой секции
+  FOR v_fk IN
+    SELECT c.conname, c.conrelid::regclass::text AS rel, pg_get_constraintdef(c.oid) AS def
+    FROM pg_constraint c
+    WHERE c.contype = 'f'
+      AND c.conrelid IN ('battle_participants_legacy'::regclass, 'battle_loot_legacy'::regclass)
+      AND c.confrelid <> 'battles_legacy'::regclass
+  LOOP
+    EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', replace(v_fk.rel, '_legacy', ''), v_fk.conname, v_fk.def);
+  END LOOP;
+
+  -- Последовательности id переходят к новым таблицам (иначе DROP legacy их удалит)
+  EXECUTE format('ALTER SEQUENCE %s OWNED BY battles.id', pg_get_serial_sequence('battles_legacy', 'id'));
+  EXECUTE format('ALTER SEQUENCE %s OWNED BY battle_participants.id', pg_get_serial_sequence('battle_participants_legacy', 'id'));
+  EXECUTE format('ALTER SEQUENCE %s OWNED BY battle_loot.id', pg_get_serial_sequence('battle_loot_legacy', 'id'));
+END
+$migration$;
+
+-- Создать секцию p_name таблицы p_parent; FALSE — она уже есть (в том числе создана
+-- параллельным загрузчиком). Неприсоединённая таблица с тем же именем (отсоединённая
+-- до переименования в detach_battle_partitions) уводится в архивное имя.
+CREATE OR REPLACE FUNCTION create_battle_partition(p_parent TEXT, p_name TEXT, p_bounds TEXT)
+RETURNS BOOLEAN AS $$
+BEGIN
+  IF EXISTS (
+    SELECT 1 FROM pg_inherits
+    WHERE inhparent = p_parent::regclass AND inhrelid = to_regclass(p_name)
+  ) THEN
+    RETURN FALSE;
+  END IF;
+  IF to_regclass(p_name) IS NOT NULL THEN
+    EXECUTE format('ALTER TABLE %I RENAME TO %I',
+                   p_name, p_name || '_detached_' || to_char(clock_timestamp(), 'YYYYMMDDHH24MISS'));
+  END IF;
+  BEGIN
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I %s', p_name, p_parent, p_bounds);
+  EXCEPTION WHEN duplicate_table OR unique_violation THEN
+    RETURN FALSE;
+  END;
+  RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Создать месячные секции трёх таблиц для месяца, содержащего p_day (идемпотентно)
+CREATE OR REPLACE FUNCTION ensure_battle_partitions(p_day DATE)
+RETURNS VOID AS $$
+DECLARE
+  v_from DATE := date_trunc('month', p_day)::date;
+  v_to DATE := (date_trunc('month', p_day) + INTERVAL '1 month')::date;
+  v_suffix TEXT := to_char(date_trunc('month', p_day), '"y"YYYY"m"MM');
+  v_child TEXT;
+BEGIN
+  IF create_battle_partition(
+    'battles', 'battles_' || v_suffix,
+    format('FOR VALUES FROM (%L) TO (%L)', v_from::timestamp AT TIME ZONE 'UTC', v_to::timestamp AT TIME ZONE 'UTC')
+  ) THEN
+    -- Уникальный id внутри месяца — цель внешних ключей секций участников и лута
+    EXECUTE format('ALTER TABLE %I ADD UNIQUE (id)', 'battles_' || v_suffix);
+  END IF;
+  FOREACH v_child IN ARRAY ARRAY['battle_participants', 'battle_loot'] LOOP
+    IF create_battle_partition(
+      v_child, v_child || '_' || v_suffix,
+      format('FOR VALUES FROM (%L) TO (%L)', v_from, v_to)
+    ) THEN
+      EXECUTE format('ALTER TABLE %I ADD FOREIGN KEY (battle_id) REFERENCES %I (id) ON DELETE CASCADE',
+                     v_child || '_' || v_suffix, 'battles_' || v_suffix);
+    END IF;
+  END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Отсоединить месячные секции, целиком лежащие раньше p_before.
+-- Данные не удаляются: секции переименовываются в {имя}_detached_{время} и остаются
+-- отдельными таблицами (архив); имя месяца освобождается, и ensure_battle_partitions
+-- создаст для него пустую секцию, если бои этого месяца придут снова. battle_monsters
+-- не секционирована — её строки боёв месяца переносятся в battle_monsters_{месяц}_detached_{время}.
+-- Возвращает число месяцев.
+CREATE OR REPLACE FUNCTION detach_battle_partitions(p_before DATE)
+RETURNS INTEGER AS $$
+DECLARE
+  v_part RECORD;
+  v_month DATE;
+  v_suffix TEXT;
+  v_stamp TEXT;
+  v_parent TEXT;
+  v_count INTEGER := 0;
+BEGIN
+  FOR v_part IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'battles'::regclass
+      AND c.relname ~ '^battles_y[0-9]{4}m[0-9]{2}$'
+    ORDER BY c.relname
+  LOOP
+    v_suffix := substring(v_part.relname FROM 'y[0-9]{4}m[0-9]{2}$');
+    v_month := to_date(v_suffix, '"y"YYYY"m"MM');
+    IF (v_month + INTERVAL '1 month')::date <= p_before THEN
+      v_stamp := '_detached_' || to_char(clock_timestamp(), 'YYYYMMDDHH24MISS');
+      FOREACH v_parent IN ARRAY ARRAY['battles', 'battle_participants', 'battle_loot'] LOOP
+        IF EXISTS (
+          SELECT 1 FROM pg_inherits
+          WHERE inhparent = v_parent::regclass AND inhrelid = to_regclass(v_parent || '_' || v_suffix)
+        ) THEN
+          EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', v_parent, v_parent || '_' || v_suffix);
+          EXECUTE format('ALTER TABLE %I RENAME TO %I', v_parent || '_' || v_suffix, v_parent || '_' || v_suffix || v_stamp);
+        END IF;
+      END LOOP;
+      EXECUTE format('CREATE TABLE %I (LIKE battle_monsters INCLUDING DEFAULTS)', 'battle_monsters_' || v_suffix || v_stamp);
+      EXECUTE format(
+        'WITH moved AS (DELETE FROM battle_monsters m USING %I b WHERE m.battle_id = b.id RETURNING m.*) '
+        'INSERT INTO %I SELECT * FROM moved',
+        'battles_' || v_suffix || v_stamp, 'battle_monsters_' || v_suffix || v_stamp
+      );
+      v_count := v_count + 1;
+    END IF;
+  END LOOP;
+  RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Перенос данных (только при первом применении, пока существуют legacy-таблицы)
+DO $migration$
+DECLARE
+  v_month DATE;
+BEGIN
+  IF to_regclass('battles_legacy') IS NULL THEN
+    RETURN;
+  END IF;
+
+  FOR v_month IN
+    SELECT DISTINCT date_trunc('month', ts AT TIME ZONE 'UTC')::date FROM battles_legacy
+  LOOP
+    PERFORM ensure_battle_partitions(v_month);
+  END LOOP;
+
+  INSERT INTO battles SELECT * FROM battles_legacy;
+  INSERT INTO battle_participants
+  SELECT l.*, (b.ts AT TIME ZONE 'UTC')::date
+  FROM battle_participants_legacy l
+  JOIN battles_legacy b ON b.id = l.battle_id;
+  INSERT INTO battle_loot
+  SELECT l.* FROM battle_loot_legacy l
+  JOIN battles_legacy b ON b.id = l.battle_id;
+
+  -- CASCADE снимает внешние ключи battle_monsters → battles и представления marts/
+  -- (их определения сохранены в v8_saved_views и восстанавливаются ниже)
+  DROP TABLE battle_participants_legacy CASCADE;
+  DROP TABLE battle_loot_legacy CASCADE;
+  DROP TABLE battles_legacy CASCADE;
+END
+$migration$;
+
+-- Индексы на секционированных таблицах (наследуются всеми секциями)
+CREATE INDEX IF NOT EXISTS idx_battles_ts ON battles (ts);
+CREATE INDEX IF NOT EXISTS idx_battles_source_id ON battles (source_id);
+CREATE INDEX IF NOT EXISTS idx_battles_storage_key ON battles (storage_key);
+CREATE INDEX IF NOT EXISTS idx_battles_battle_type ON battles (battle_type);
+CREATE INDEX IF NOT EXISTS idx_battles_location ON battles (loc_x, loc_y);
+CREATE INDEX IF NOT EXISTS idx_battles_map_patch ON battles USING GIN (map_patch);
+
+CREATE INDEX IF NOT EXISTS idx_battle_participants_battle_id ON battle_participants (battle_id);
+CREATE INDEX IF NOT EXISTS idx_battle_participants_player_id ON battle_participants (player_id);
+CREATE INDEX IF NOT EXISTS idx_battle_participants_login ON battle_participants (login);
+CREATE INDEX IF NOT EXISTS idx_battle_participants_intervened ON battle_participants USING GIN (intervened);
+CREATE INDEX IF NOT EXISTS idx_battle_participants_kills ON battle_participants USING GIN (kills);
+CREATE INDEX IF NOT EXISTS idx_battle_participants_damage_total ON battle_participants USING GIN (damage_total);
+CREATE INDEX IF NOT EXISTS idx_battle_participants_loot ON battle_participants USING GIN (loot);
+
+CREATE INDEX IF NOT EXISTS idx_battle_loot_battle_id ON battle_loot (battle_id);
+CREATE INDEX IF NOT EXISTS idx_battle_loot_battle_ts ON battle_loot (battle_ts);
+CREATE INDEX IF NOT EXISTS idx_battle_loot_kind ON battle_loot (kind);
+
+-- Представления, удалённые вместе со старыми таблицами, — в порядке зависимостей
+DO $migration$
+DECLARE
+  v_view RECORD;
+BEGIN
+  FOR v_view IN SELECT * FROM v8_saved_views ORDER BY depth, name LOOP
+    EXECUTE format('CREATE %s %s AS %s',
+                   CASE WHEN v_view.relkind = 'm' THEN 'MATERIALIZED VIEW' ELSE 'VIEW' END,
+                   v_view.name, v_view.def);
+    IF v_view.comment IS NOT NULL THEN
+      EXECUTE format('COMMENT ON %s %s IS %L',
+                     CASE WHEN v_view.relkind = 'm' THEN 'MATERIALIZED VIEW' ELSE 'VIEW' END,
+                     v_view.name, v_view.comment);
+    END IF;
+  END LOOP;
+END
+$migration$;
+
+-- Текущий и следующий месяц создаём заранее
+SELECT ensure_battle_partitions(CURRENT_DATE);
+SELECT ensure_battle_partitions((CURRENT_DATE + INTERVAL '1 month')::date);
+
+COMMENT ON FUNCTION ensure_battle_partitions IS 'Создаёт месячные секции battles/battle_participants/battle_loot';
+COMMENT ON FUNCTION detach_battle_partitions IS 'Отсоединяет месячные секции старше даты (данные остаются в таблицах *_detached_*)';
+COMMENT ON FUNCTION create_battle_partition IS 'Создаёт секцию, если её нет; неприсоединённую таблицу с тем же именем переименовывает';
+
+COMMIT;
@@ -0,0 +1,31 @@
+-- V9: Триграммный поиск по логинам, кланам и монстрам (pg_trgm)
+-- ILIKE '%x%' не использует B-tree индексы: GIN gin_trgm_ops обслуживает и подстроку,
+-- и префикс (ILIKE 'x%'), и нечёткое сравнение (оператор %).
+--
+-- Поиск боёв (BattleDatabase.search_battles) сначала находит ID игроков/монстров
+-- и имена кланов в маленьких справочниках, затем идёт в battle_participants /
+-- battle_monsters по составным индексам (player_id, battle_id) / (monster_id, battle_id).
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Справочники: подстрока, префикс, нечёткий поиск
+CREATE INDEX IF NOT EXISTS players_login_trgm_idx ON players USING GIN (login gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS clans_name_trgm_idx ON clans USING GIN (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS monster_catalog_kind_trgm_idx ON monster_catalog USING GIN (kind gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS monster_catalog_spec_trgm_idx ON monster_catalog USING GIN (spec gin_trgm_ops);
+
+-- Переход от найденных ID к боям
+CREATE INDEX IF NOT EXISTS bp_player_battle_idx ON battle_participants (player_id, battle_id);
+CREATE INDEX IF NOT EXISTS bp_clan_battle_idx ON battle_participants (clan, battle_id);
+CREATE INDEX IF NOT EXISTS bm_monster_battle_idx ON battle_monsters (monster_id, battle_id);
+
+-- Справочник кланов раньше не заполнялся при сохранении боя — переносим имеющиеся
+INSERT INTO clans (name)
+SELECT DISTINCT bp.clan
+FROM battle_participants bp
+WHERE bp.clan IS NOT NULL AND bp.clan <> ''
+ON CONFLICT (name) DO NOTHING;
+
+ANALYZE players;
+ANALYZE clans;
+ANALYZE monster_catalog;
@@ -5,6 +5,23 @@ from typing import Optional, Tuple
 from datetime import datetime
 import hashlib
 
+from shared.utils.frame_reader import Frame, FrameReader
+
+# Ответ магазина — десятки-сотни КБ: читаем крупными блоками
+RECV_SIZE = 65536
+
+
+def _recv_until(sock: socket.socket, frames: FrameReader, end_tag: bytes) -> Frame:
+    """Читать сокет до end_tag включительно; если сервер закрыл соединение — всё принятое"""
+    while True:
+        frame = frames.next_until(end_tag)
+        if frame is not None:
+            return frame
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            return frames.take_pending()
+        frames.feed(chunk)
+
 
 class GameSocketClient:
     """
@@ -26,6 +43,7 @@ class GameSocketClient:
         self.session_id: Optional[str] = None
         self.authenticated: bool = False
         self._sock: Optional[socket.socket] = None  # Сохраняем сокет после авторизации
+        self._frames = FrameReader()  # Буфер ответов сохранённого сокета
     
     def connect(self) -> socket.socket:
         """Создать и подключить сокет"""
@@ -51,17 +69,9 @@ class GameSocketClient:
             # Отправка запроса
             sock.sendall(request.encode('utf-8'))
             
-            # Получение ответа
-            response = b""
-            while True:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-                
-                # Проверка окончания XML
-                if end_tag.encode('utf-8') in response:
-                    break
+            # Получение ответа до тега окончания
+            frame = _recv_until(sock, FrameReader(), end_tag.encode('utf-8'))
+            response = frame.copy(strip=b"")
             
             sock.close()
             return response.decode('utf-8', errors='ignore')
@@ -112,6 +122,7 @@ class GameSocketClient:
             
             # Сохраняем сокет для дальнейшего использования
             self._sock = sock
+            self._frames.clear()
             self.authenticated = True
             self.session_id = login  # Используем логин как идентификатор
             
@@ -217,29 +228,15 @@ class GameSocketClient:
                 self._sock.sendall(request.encode('utf-8'))
                 
                 # Получаем ответ до </SH>
-                response = b""
                 self._sock.settimeout(self.timeout)  # Используем timeout из конфига (20 сек)
+                frame = _recv_until(self._sock, self._frames, b"</SH>")
                 
-                while True:
-                    chunk = self._sock.recv(4096)
-                    if not chunk:
-                        break
-                    response += chunk
-                    
-                    if b"</SH>" in response:
-                        break
-                
-                # Декодирование и очистка
-                xml_str = response.decode('utf-8', errors='replace')
-                xml_str = xml_str.replace('\x00', '').replace('\x1f', '')
-                
-                # Извлечь только валидный XML (от <SH до </SH>)
-                if '<SH' in xml_str and '</SH>' in xml_str:
-                    start = xml_str.find('<SH')
-                    end = xml_str.find('</SH>') + 5
-                    xml_str = xml_str[start:end]
+                # Извлечь только валидный XML (от <SH до </SH>) — одна копия, сразу без \x00 и \x1f
+                response = frame.between(b"<SH", b"</SH>")
+                if response is None:
+                    response = frame.copy()
                 
-                return xml_str
+                return response.decode('utf-8', errors='replace')
                 
             except socket.timeout:
                 print(f"⏱ Timeout при запросе магазина")
@@ -273,6 +270,7 @@ class GameSocketClient:
             except:
                 pass
             self._sock = None
+        self._frames.clear()
             
         self.session_id = None
         self.authenticated = False
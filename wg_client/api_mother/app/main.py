@@ -1,12 +1,22 @@
 import os
+import asyncio
 import gzip
+import shutil
+import struct
+import uuid
+import zlib
 import httpx
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Body
+from typing import Dict, List, Optional, Tuple
+from fastapi import FastAPI, HTTPException, Body, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.openapi.utils import get_openapi
 
+from shared.utils.btl_codec import CHUNK, GZIP_MAGIC, CodecError, decode, decoded_length, encoder_from_env
+from shared.utils.btl_pack import PackError, PackStore, gzip_member
+
 app = FastAPI(title="API_MOTHER file aggregator")
 
 # CORS middleware для Swagger UI
@@ -22,6 +32,30 @@ LOGS_RAW = os.getenv('LOGS_RAW', '/srv/btl/raw')
 LOGS_STORE = os.getenv('LOGS_STORE', '/srv/btl/gz')
 API4_URL = os.getenv('API4_URL', 'http://api_4:8084')
 
+# /upload/bulk: тело — кадры подряд [battle_id: uint64 BE][длина: uint32 BE][XML боя]
+BULK_FRAME_HEADER = struct.Struct(">QI")
+BULK_MAX_BATTLE_BYTES = int(os.getenv('BULK_MAX_BATTLE_BYTES', str(64 * 1024 * 1024)))
+UPLOAD_WRITE_THREADS = int(os.getenv('UPLOAD_WRITE_THREADS', '4'))
+# Сжатые логи — в пак шарда ({shard}.pack + {shard}.idx), а не файлом на бой; чтение — из пака, затем из файлов
+LOGS_PACK = os.getenv('LOGS_PACK', '1') == '1'
+
+# Запись файлов загрузок — вне цикла событий
+_write_pool = ThreadPoolExecutor(max_workers=UPLOAD_WRITE_THREADS, thread_name_prefix="upload-write")
+# Кодек записи: LOGS_CODEC=gzip | zstd (словарь — {LOGS_STORE}/dicts, см. app.zstd_dict)
+_encoder = encoder_from_env(LOGS_STORE)
+_pack_store = PackStore(LOGS_STORE, writable=True, encoder=_encoder)
+
+def _as_gzip(member: bytes) -> bytes:
+    """Контракт /gz — gzip: член zstd перепаковывается (быстрый уровень), gzip отдаётся как есть"""
+    if member[:2] == GZIP_MAGIC:
+        return member
+    return gzip_member(decode(member, _pack_store.dicts), 1)
+
+def _with_length(headers: Dict[str, str], head: bytes, tail: bytes, size: int) -> Dict[str, str]:
+    """X-Decoded-Length — размер распакованного лога: api_4 по нему отвечает на Range, не распаковывая"""
+    length = decoded_length(head, tail, size)
+    return headers if length is None else {**headers, "X-Decoded-Length": str(length)}
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
@@ -49,7 +83,7 @@ def sync_logs():
 
 @app.get("/gz/{path:path}")
 def serve_gz(path: str):
-    """Отдаёт .gz файл из локального хранилища с учётом шардирования"""
+    """Отдаёт .gz боя: из пака шарда, иначе файлом из локального хранилища с учётом шардирования"""
     # Извлекаем battle_id из пути (например: "3777832.tzb" или "75/3777832.tzb")
     filename = Path(path).name
     try:
@@ -58,6 +92,20 @@ def serve_gz(path: str):
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid battle_id in path")
     
+    headers = {"Content-Disposition": f'attachment; filename="{battle_id}.tzb.gz"'}
+    try:
+        member = _pack_store.get(battle_id)
+        if member is None:
+            # Отдельный файл zstd (LOGS_PACK=0, LOGS_CODEC=zstd)
+            zst_path = Path(LOGS_STORE) / str(shard) / f"{battle_id}.tzb.zst"
+            if zst_path.exists():
+                member = zst_path.read_bytes()
+        if member is not None:
+            member = _as_gzip(member)
+            return Response(content=member, media_type='application/gzip', headers=_with_length(headers, member[:18], member[-4:], len(member)))
+    except (PackError, CodecError) as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
     # Проверяем с шардированием: /srv/btl/gz/{shard}/{battle_id}.tzb.gz
     gz_path = Path(LOGS_STORE) / str(shard) / f"{battle_id}.tzb.gz"
     
@@ -66,23 +114,36 @@ def serve_gz(path: str):
         tzb_path = Path(LOGS_RAW) / str(shard) / f"{battle_id}.tzb"
         if tzb_path.exists():
             try:
+                # Сжимаем на лету кусками: в памяти не держим исходный лог целиком
+                if LOGS_PACK:
+                    with open(tzb_path, 'rb') as f_in:
+                        _pack_store.put(battle_id, _encoder.encode_file(f_in, os.fstat(f_in.fileno()).st_size))
+                    member = _as_gzip(_pack_store.get(battle_id))
+                    return Response(content=member, media_type='application/gzip', headers=_with_length(headers, member[:18], member[-4:], len(member)))
                 # Создаём директорию для .gz
                 gz_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Сжимаем на лету
-                import gzip as gzip_module
-                with open(tzb_path, 'rb') as f_in:
-                    with gzip_module.open(gz_path, 'wb') as f_out:
-                        f_out.write(f_in.read())
+                tmp_path = gz_path.with_name(f".{gz_path.name}.{uuid.uuid4().hex}.tmp")
+                try:
+                    with open(tzb_path, 'rb') as f_in, gzip.open(tmp_path, 'wb') as f_out:
+                        shutil.copyfileobj(f_in, f_out, CHUNK)
+                    os.replace(tmp_path, gz_path)
+                finally:
+                    tmp_path.unlink(missing_ok=True)
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Compression failed: {e}")
         else:
             raise HTTPException(status_code=404, detail=f"File not found: {battle_id}.tzb (shard {shard})")
     
+    with open(gz_path, 'rb') as f:
+        head = f.read(18)
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(size - 4, 0))
+        tail = f.read(4)
     return FileResponse(
         path=str(gz_path),
         media_type='application/gzip',
-        filename=f"{battle_id}.tzb.gz"
+        filename=f"{battle_id}.tzb.gz",
+        headers=_with_length({}, head, tail, size),
     )
 
 @app.get("/list")
@@ -100,7 +161,7 @@ def list_files():
                 "path": str(rel_path),
                 "size": tzb_file.stat().st_size,
                 "mtime": tzb_file.stat().st_mtime,
-                "compressed": gz_path.exists()
+                "compressed": gz_path.exists() or gz_path.with_suffix(".zst").exists() or (tzb_file.stem.isdigit() and int(tzb_file.stem) in _pack_store)
             })
     
     return {"files": files, "count": len(files)}
@@ -141,8 +202,7 @@ async def process_batch(limit: int = 10, max_parallel: int = 1, delete_after_par
     """Обрабатывает несколько файлов через API 4 с контролем параллельности
     
     После успешного парсинга:
-    - Сжимает файл в .gz
-    - Перемещает в /srv/btl/gz
+    - Сжимает и дописывает в пак шарда /srv/btl/gz/{shard}.pack (LOGS_PACK=0 — файлом .gz в /srv/btl/gz)
     - Удаляет из /srv/btl/raw
     """
     import asyncio
@@ -189,19 +249,34 @@ async def process_batch(limit: int = 10, max_parallel: int = 1, delete_after_par
                         # Сжимаем и удаляем
                         if delete_after_parse:
                             try:
-                                # Путь в gz (сохраняем структуру шардов)
-                                gz_path = store_path / f"{rel_path}.gz"
-                                gz_path.parent.mkdir(parents=True, exist_ok=True)
-                                
-                                # Сжимаем
-                                with open(tzb_file, 'rb') as f_in:
-                                    with gzip.open(gz_path, 'wb', compresslevel=6) as f_out:
-                                        shutil.copyfileobj(f_in, f_out)
+                                if LOGS_PACK and tzb_file.stem.isdigit():
+                                    # Дописываем в пак шарда
+                                    battle_id = int(tzb_file.stem)
+                                    await asyncio.get_running_loop().run_in_executor(
+                                        _write_pool, _pack_store.put_raw, battle_id, tzb_file.read_bytes()
+                                    )
+                                    compressed_to = f"{battle_id // _pack_store.divisor}.pack"
+                                elif _encoder.codec != "gzip":
+                                    # Отдельный файл .tzb.zst
+                                    out_path = store_path / f"{rel_path}{_encoder.suffix}"
+                                    out_path.parent.mkdir(parents=True, exist_ok=True)
+                                    out_path.write_bytes(_encoder.encode(tzb_file.read_bytes()))
+                                    compressed_to = str(out_path)
+                                else:
+                                    # Путь в gz (сохраняем структуру шардов)
+                                    gz_path = store_path / f"{rel_path}.gz"
+                                    gz_path.parent.mkdir(parents=True, exist_ok=True)
+                                    
+                                    # Сжимаем
+                                    with open(tzb_file, 'rb') as f_in:
+                                        with gzip.open(gz_path, 'wb', compresslevel=6) as f_out:
+                                            shutil.copyfileobj(f_in, f_out)
+                                    compressed_to = str(gz_path)
                                 
                                 # Удаляем из raw
                                 tzb_file.unlink()
                                 
-                                result["compressed"] = str(gz_path)
+                                result["compressed"] = compressed_to
                                 result["raw_deleted"] = True
                                 logger.info(f"✅ {rel_path}: parsed → gz → deleted")
                             except Exception as e:
@@ -233,19 +308,160 @@ async def process_batch(limit: int = 10, max_parallel: int = 1, delete_after_par
         "results": list(results)
     }
 
+def _raw_log_path(battle_id: int) -> Path:
+    """Путь лога в зеркале по шардированию (battle_id / 50000)"""
+    return Path(LOGS_RAW) / str(battle_id // 50000) / f"{battle_id}.tzb"
+
+def _write_tmp_log(battle_id: int, content: bytes) -> Path:
+    """
+    Запись во временный файл рядом с итоговым (os.replace в пределах каталога атомарен)
+
+    Данные сбрасываются на диск (fsync) здесь, в пуле потоков: иначе после сбоя
+    питания переименованный файл может оказаться пустым.
+    """
+    file_path = _raw_log_path(battle_id)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f".{battle_id}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+def _commit_tmp_logs(written: List[Tuple[int, Path]]) -> None:
+    """
+    Переименование временных файлов в итоговые и один fsync на каталог шарда за батч
+
+    Содержимое временных файлов уже на диске (_write_tmp_log), fsync каталога
+    закрепляет сами переименования. Читатель видит либо прежний файл, либо новый целиком — недописанных .tzb не бывает.
+    """
+    shard_dirs = set()
+    for battle_id, tmp_path in written:
+        file_path = _raw_log_path(battle_id)
+        os.replace(tmp_path, file_path)
+        shard_dirs.add(file_path.parent)
+    for shard_dir in shard_dirs:
+        fd = os.open(shard_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+def _discard_tmp_logs(paths: List[Path]) -> None:
+    for tmp_path in paths:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+def _discard_written_logs(futures: List[Future]) -> None:
+    """Дождаться записи кадров и удалить их временные файлы — вызывается в пуле записи"""
+    _discard_tmp_logs([
+        future.result()
+        for future in futures
+        if not future.cancelled() and future.exception() is None
+    ])
+
+@app.post("/upload/bulk")
+async def upload_battle_logs_bulk(request: Request):
+    """
+    Пакетная загрузка логов боёв одним запросом (тело может быть сжато: Content-Encoding: gzip)
+
+    Формат тела — кадры подряд: [battle_id: uint64 BE][длина: uint32 BE][XML боя].
+    Бой уходит на запись (с fsync) в пул потоков, как только его кадр дочитан; после
+    конца потока все файлы атомарно переименовываются (os.replace) с одним fsync на каталог.
+    Повреждённый поток (обрыв кадра, неверный gzip) — 400, ни один файл не меняется;
+    при обрыве соединения клиентом временные файлы тоже удаляются.
+    """
+    loop = asyncio.get_running_loop()
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS) if request.headers.get("content-encoding", "").strip().lower() == "gzip" else None
+    buf = bytearray()
+    pending: List[Tuple[int, int, Future]] = []
+    error = None
+    committed = False
+    
+    try:
+        try:
+            async for chunk in request.stream():
+                buf += inflater.decompress(chunk) if inflater else chunk
+                pos = 0
+                while len(buf) - pos >= BULK_FRAME_HEADER.size:
+                    battle_id, size = BULK_FRAME_HEADER.unpack_from(buf, pos)
+                    if size > BULK_MAX_BATTLE_BYTES:
+                        raise ValueError(f"battle {battle_id}: frame of {size} bytes exceeds BULK_MAX_BATTLE_BYTES")
+                    start = pos + BULK_FRAME_HEADER.size
+                    if len(buf) - start < size:
+                        break
+                    content = bytes(buf[start:start + size])
+                    pending.append((battle_id, size, _write_pool.submit(_write_tmp_log, battle_id, content)))
+                    pos = start + size
+                del buf[:pos]
+            if inflater and not inflater.eof:
+                raise ValueError("truncated gzip stream")
+            if buf:
+                raise ValueError(f"truncated frame: {len(buf)} trailing bytes")
+        except (ValueError, zlib.error) as e:
+            error = str(e)
+        
+        outcomes = await asyncio.gather(*(asyncio.wrap_future(future) for _, _, future in pending), return_exceptions=True)
+        written = [
+            (battle_id, outcome)
+            for (battle_id, _, _), outcome in zip(pending, outcomes)
+            if not isinstance(outcome, BaseException)
+        ]
+        
+        if error is not None:
+            raise HTTPException(status_code=400, detail=f"Invalid bulk body: {error}")
+        
+        try:
+            await loop.run_in_executor(_write_pool, _commit_tmp_logs, written)
+        except OSError as e:
+            raise HTTPException(status_code=500, detail=f"Upload failed: {e}")
+        committed = True
+    finally:
+        if not committed:
+            # Любой неуспех (400, 500, обрыв клиента ClientDisconnect, отмена задачи) — временные
+            # файлы удаляются в пуле записи после уже поставленных в него записей, даже если
+            # сам запрос к этому моменту отменён
+            await asyncio.shield(asyncio.wrap_future(
+                _write_pool.submit(_discard_written_logs, [future for _, _, future in pending])
+            ))
+    
+    results: List[Dict[str, object]] = []
+    for (battle_id, size, _), outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            results.append({"battle_id": battle_id, "ok": False, "error": str(outcome)[:200]})
+        else:
+            results.append({"battle_id": battle_id, "ok": True, "size_bytes": size, "shard": battle_id // 50000})
+    saved = sum(1 for r in results if r["ok"])
+    
+    return {"ok": saved == len(results), "saved": saved, "failed": len(results) - saved, "results": results}
+
+def _save_raw_log(battle_id: int, content: bytes) -> Path:
+    """Запись лога в зеркало — вызывается вне цикла событий"""
+    file_path = _raw_log_path(battle_id)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    with open(file_path, 'wb') as f:
+        f.write(content)
+    return file_path
+
 @app.post("/upload/{battle_id}")
-async def upload_battle_log(battle_id: int, content: bytes = Body(...)):
-    """Принимает лог боя от XML Sync и сохраняет в зеркало"""
+async def upload_battle_log(
+    battle_id: int,
+    content: bytes = Body(...),
+    content_encoding: Optional[str] = Header(None),
+):
+    """Принимает лог боя от XML Worker и сохраняет в зеркало (тело может быть сжато: Content-Encoding: gzip)"""
+    if (content_encoding or "").strip().lower() == "gzip":
+        try:
+            content = await asyncio.to_thread(gzip.decompress, content)
+        except (OSError, EOFError, zlib.error) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid gzip body: {e}")
+    
     try:
-        # Определяем путь по шардированию (battle_id / 50000)
         shard = battle_id // 50000
-        shard_dir = Path(LOGS_RAW) / str(shard)
-        shard_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Сохраняем файл
-        file_path = shard_dir / f"{battle_id}.tzb"
-        with open(file_path, 'wb') as f:
-            f.write(content)
+        file_path = await asyncio.to_thread(_save_raw_log, battle_id, content)
         
         return {
             "ok": True,
@@ -0,0 +1,108 @@
+"""
+Перенос хранилища {shard}/{battle_id}.tzb.gz в паки шардов ({shard}.pack + {shard}.idx)
+
+Запуск в контейнере api_mother (см. migrate_gz_to_pack.sh):
+
+    python -m app.pack_migrate [--root /srv/btl/gz] [--shard N] [--verify] [--delete]
+
+Можно прерывать и перезапускать: бой, который уже лежит в паке с теми же байтами,
+пропускается. Файлы .gz переносятся как есть (без пересжатия). --delete удаляет
+исходный файл только после fsync пака и сверки члена, прочитанного из пака, с файлом
+(длина и crc32 — байты файлов шарда в памяти не держатся).
+"""
+
+import argparse
+import gzip
+import os
+import sys
+import time
+import zlib
+from typing import Dict
+
+from shared.utils.btl_pack import DEFAULT_DIVISOR, PackStore
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def migrate_shard(store: PackStore, shard_dir: str, verify: bool, delete: bool) -> Dict[str, int]:
+    stats = {"packed": 0, "skipped": 0, "bad": 0, "deleted": 0, "bytes": 0}
+    moved = []
+    with os.scandir(shard_dir) as entries:
+        names = sorted(e.name for e in entries if e.is_file() and e.name.endswith(".tzb.gz"))
+    for name in names:
+        stem = name[:-len(".tzb.gz")]
+        if not stem.isdigit():
+            continue
+        battle_id = int(stem)
+        path = os.path.join(shard_dir, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(GZIP_MAGIC):
+            print(f"  {path}: not a gzip file, skipped")
+            stats["bad"] += 1
+            continue
+        if verify:
+            try:
+                gzip.decompress(data)
+            except (OSError, EOFError, zlib.error) as e:
+                print(f"  {path}: {e}, skipped")
+                stats["bad"] += 1
+                continue
+        if store.get(battle_id) == data:
+            stats["skipped"] += 1
+        else:
+            store.put(battle_id, data)
+            stats["packed"] += 1
+            stats["bytes"] += len(data)
+        moved.append((battle_id, path, len(data), zlib.crc32(data)))
+
+    if delete and moved:
+        store.sync()
+        for battle_id, path, length, crc in moved:
+            member = store.get(battle_id)
+            if member is not None and len(member) == length and zlib.crc32(member) == crc:
+                os.unlink(path)
+                stats["deleted"] += 1
+        try:
+            os.rmdir(shard_dir)
+        except OSError:
+            pass
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--root", default=os.getenv("LOGS_STORE", "/srv/btl/gz"))
+    parser.add_argument("--divisor", type=int, default=DEFAULT_DIVISOR)
+    parser.add_argument("--shard", type=int, action="append", help="только эти шарды (можно несколько раз)")
+    parser.add_argument("--verify", action="store_true", help="распаковать каждый файл перед переносом")
+    parser.add_argument("--delete", action="store_true", help="удалить перенесённые .tzb.gz")
+    args = parser.parse_args(argv)
+
+    shard_dirs = sorted(
+        (int(e.name), e.path) for e in os.scandir(args.root) if e.is_dir() and e.name.isdigit()
+    )
+    if args.shard:
+        shard_dirs = [(n, p) for n, p in shard_dirs if n in set(args.shard)]
+
+    store = PackStore(args.root, divisor=args.divisor, writable=True)
+    totals = {"packed": 0, "skipped": 0, "bad": 0, "deleted": 0, "bytes": 0}
+    started = time.monotonic()
+    try:
+        for shard_no, shard_dir in shard_dirs:
+            stats = migrate_shard(store, shard_dir, args.verify, args.delete)
+            for key, value in stats.items():
+                totals[key] += value
+            print(f"shard {shard_no}: packed {stats['packed']}, already packed {stats['skipped']}, "
+                  f"bad {stats['bad']}, deleted {stats['deleted']}")
+        store.sync()
+    finally:
+        store.close()
+    print(f"done in {time.monotonic() - started:.0f}s: packed {totals['packed']} "
+          f"({totals['bytes'] / 1e6:.1f} MB), already packed {totals['skipped']}, "
+          f"bad {totals['bad']}, deleted {totals['deleted']}")
+    return 1 if totals["bad"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+import gzip
+import importlib.util
+import os
+
+from shared.utils.btl_pack import PackStore
+
+_app_dir = os.path.dirname(os.path.dirname(__file__))
+_spec = importlib.util.spec_from_file_location("apimother_app_pack_migrate", os.path.join(_app_dir, "pack_migrate.py"))
+pack_migrate = importlib.util.module_from_spec(_spec)
+assert _spec and _spec.loader
+_spec.loader.exec_module(pack_migrate)
+
+
+def _log(battle_id):
+    return b'<BATTLE t2="1">' + str(battle_id).encode() * 500 + b"</BATTLE>"
+
+
+def test_migration_is_resumable_and_deletes_only_packed_files(tmp_path):
+    shard_dir = tmp_path / "2"
+    shard_dir.mkdir()
+    for battle_id in (100_000, 100_001):
+        (shard_dir / f"{battle_id}.tzb.gz").write_bytes(gzip.compress(_log(battle_id)))
+    (shard_dir / "100002.tzb.gz").write_bytes(b"not gzip")
+
+    args = ["--root", str(tmp_path)]
+    assert pack_migrate.main(args) == 1  # битый файл отмечен
+    assert pack_migrate.main(args + ["--delete"]) == 1
+    assert sorted(os.listdir(shard_dir)) == ["100002.tzb.gz"]
+
+    store = PackStore(str(tmp_path))
+    assert store.read_raw(100_001) == _log(100_001)
+    assert store.get(100_002) is None
+
+
+def test_file_is_kept_when_its_pack_member_changed_before_delete(tmp_path, monkeypatch):
+    shard_dir = tmp_path / "0"
+    shard_dir.mkdir()
+    for battle_id in (5, 6):
+        (shard_dir / f"{battle_id}.tzb.gz").write_bytes(gzip.compress(_log(battle_id)))
+    store = PackStore(str(tmp_path), writable=True)
+    sync = store.sync
+
+    def sync_then_overwrite():
+        # api_mother успел дописать бой 5 заново между переносом и удалением
+        sync()
+        store.put(5, gzip.compress(_log(7)))
+
+    monkeypatch.setattr(store, "sync", sync_then_overwrite)
+    try:
+        stats = pack_migrate.migrate_shard(store, str(shard_dir), verify=False, delete=True)
+    finally:
+        store.close()
+    assert stats["packed"] == 2 and stats["deleted"] == 1
+    assert os.listdir(shard_dir) == ["5.tzb.gz"]
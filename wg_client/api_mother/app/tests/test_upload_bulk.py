@@ -0,0 +1,105 @@
+import asyncio
+import gzip
+import importlib.util
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+_app_dir = os.path.dirname(os.path.dirname(__file__))
+
+
+def _frame(battle_id, content):
+    return battle_id.to_bytes(8, "big") + len(content).to_bytes(4, "big") + content
+
+
+def _log(battle_id):
+    return b'<BATTLE t2="1">' + str(battle_id).encode() * 300 + b"</BATTLE>"
+
+
+@pytest.fixture
+def mother(tmp_path, monkeypatch):
+    # Пути хранилища читаются при импорте — модуль грузится заново на каждый тест
+    monkeypatch.setenv("LOGS_RAW", str(tmp_path / "raw"))
+    monkeypatch.setenv("LOGS_STORE", str(tmp_path / "gz"))
+    monkeypatch.setenv("BULK_MAX_BATTLE_BYTES", "10000")
+    spec = importlib.util.spec_from_file_location("apimother_app_main", os.path.join(_app_dir, "main.py"))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    yield mod, TestClient(mod.app), tmp_path / "raw"
+    mod._write_pool.shutdown()
+
+
+def _files(raw):
+    return sorted(p.relative_to(raw).as_posix() for p in raw.rglob("*") if p.is_file())
+
+
+def test_bulk_frames_are_saved_to_shards(mother):
+    _, client, raw = mother
+    body = b"".join(_frame(battle_id, _log(battle_id)) for battle_id in (7, 50_001, 50_002))
+    r = client.post("/upload/bulk", content=body)
+    assert r.status_code == 200
+    assert r.json()["saved"] == 3 and r.json()["ok"]
+    assert _files(raw) == ["0/7.tzb", "1/50001.tzb", "1/50002.tzb"]  # временных файлов не осталось
+    assert (raw / "1" / "50002.tzb").read_bytes() == _log(50_002)
+
+
+def test_bulk_gzip_body(mother):
+    _, client, raw = mother
+    body = gzip.compress(b"".join(_frame(battle_id, _log(battle_id)) for battle_id in (1, 2)))
+    r = client.post("/upload/bulk", content=body, headers={"Content-Encoding": "gzip"})
+    assert r.status_code == 200 and r.json()["saved"] == 2
+    assert (raw / "0" / "1.tzb").read_bytes() == _log(1)
+
+    # Оборванный gzip — 400, файлы не меняются
+    r = client.post("/upload/bulk", content=gzip.compress(_frame(3, _log(3)))[:-10], headers={"Content-Encoding": "gzip"})
+    assert r.status_code == 400
+    assert _files(raw) == ["0/1.tzb", "0/2.tzb"]
+
+
+def test_bulk_truncated_body_changes_nothing(mother):
+    _, client, raw = mother
+    (raw / "0").mkdir(parents=True)
+    (raw / "0" / "1.tzb").write_bytes(b"old")
+    body = _frame(1, _log(1)) + _frame(2, _log(2))[:-5]
+    r = client.post("/upload/bulk", content=body)
+    assert r.status_code == 400
+    assert "truncated frame" in r.json()["detail"]
+    assert _files(raw) == ["0/1.tzb"]
+    assert (raw / "0" / "1.tzb").read_bytes() == b"old"
+
+
+def test_bulk_rejects_oversize_frames(mother):
+    _, client, raw = mother
+    # Заголовок кадра больше BULK_MAX_BATTLE_BYTES — отказ до чтения самого кадра
+    body = _frame(1, _log(1)) + (2).to_bytes(8, "big") + (10_001).to_bytes(4, "big")
+    r = client.post("/upload/bulk", content=body)
+    assert r.status_code == 400
+    assert "exceeds BULK_MAX_BATTLE_BYTES" in r.json()["detail"]
+    assert _files(raw) == []
+
+
+def test_bulk_client_disconnect_leaves_no_tmp_files(mother):
+    mod, _, raw = mother
+    # Целый кадр (уже ушёл на запись) и половина следующего — затем клиент обрывает соединение
+    messages = [
+        {"type": "http.request", "body": _frame(1, _log(1)) + _frame(2, _log(2))[:100], "more_body": True},
+        {"type": "http.disconnect"},
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/upload/bulk", "raw_path": b"/upload/bulk", "root_path": "",
+        "query_string": b"", "headers": [], "client": ("test", 1), "server": ("test", 80),
+    }
+    with pytest.raises(ClientDisconnect):
+        asyncio.get_event_loop().run_until_complete(mod.app(scope, receive, send))
+    mod._write_pool.shutdown(wait=True)  # запись первого кадра успела завершиться
+    assert _files(raw) == []
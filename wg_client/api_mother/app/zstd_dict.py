@@ -0,0 +1,83 @@
+"""
+Словари zstd для хранилища логов ({root}/dicts/tzb-{version}.zdict)
+
+Запуск в контейнере api_mother:
+
+    python -m app.zstd_dict train [--root /srv/btl/gz] [--samples 2000] [--size 114688]
+    python -m app.zstd_dict list  [--root /srv/btl/gz]
+
+train берёт случайную выборку боёв из паков и отдельных файлов хранилища (и из
+--raw, если указан), обучает словарь следующей версии и сохраняет рядом с архивом.
+Новые логи пишутся с ним после перезапуска писателей (LOGS_CODEC=zstd); уже
+сжатые остаются со своей версией — словари не удаляются.
+"""
+
+import argparse
+import os
+import random
+import sys
+from typing import List, Tuple
+
+from shared.utils.btl_codec import DICT_DIR, DICT_SIZE, DictRegistry, decode, dict_path
+from shared.utils.btl_pack import DEFAULT_DIVISOR, PackStore
+
+LOG_SUFFIXES = (".tzb", ".tzb.gz", ".tzb.zst")
+
+
+def _candidates(root: str, raw: str, store: PackStore) -> List[Tuple[str, object]]:
+    """("pack", battle_id) и ("file", путь) по всему хранилищу — без чтения логов"""
+    found: List[Tuple[str, object]] = []
+    for entry in os.scandir(root):
+        if entry.is_file() and entry.name.endswith(".idx") and entry.name[:-4].isdigit():
+            found.extend(("pack", battle_id) for battle_id in store.shard_battle_ids(int(entry.name[:-4])))
+    for base in filter(None, (root, raw)):
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames[:] = [d for d in dirnames if d != DICT_DIR]
+            found.extend(("file", os.path.join(dirpath, n)) for n in filenames if n.endswith(LOG_SUFFIXES))
+    return found
+
+
+def collect_samples(root: str, raw: str, count: int, seed: int = 0) -> List[bytes]:
+    store = PackStore(root, divisor=DEFAULT_DIVISOR)
+    candidates = _candidates(root, raw, store)
+    random.Random(seed).shuffle(candidates)
+    samples = []
+    for kind, key in candidates[:count]:
+        if kind == "pack":
+            data = store.read_raw(key)
+        else:
+            with open(key, "rb") as f:
+                data = decode(f.read(), store.dicts)
+        if data:
+            samples.append(data)
+    store.close()
+    return samples
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["train", "list"])
+    parser.add_argument("--root", default=os.getenv("LOGS_STORE", "/srv/btl/gz"))
+    parser.add_argument("--raw", default=None, help="дополнительно брать выборку из каталога несжатых логов")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=DICT_SIZE, help="размер словаря, байт")
+    args = parser.parse_args(argv)
+
+    registry = DictRegistry(args.root)
+    if args.command == "list":
+        for version in registry.versions():
+            print(f"v{version}: {dict_path(args.root, version)} ({os.path.getsize(dict_path(args.root, version))} bytes)")
+        return 0
+
+    samples = collect_samples(args.root, args.raw, args.samples)
+    if len(samples) < 10:
+        print(f"not enough logs to train on: {len(samples)}")
+        return 1
+    version = registry.train(samples, args.size)
+    print(f"trained v{version} on {len(samples)} logs ({sum(map(len, samples)) / 1e6:.1f} MB): "
+          f"{dict_path(args.root, version)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
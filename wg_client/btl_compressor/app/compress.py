@@ -1,86 +1,369 @@
 #!/usr/bin/env python3
+"""
+btl_compressor: сжатие логов боёв из зеркала (LOGS_MIRROR) в хранилище .gz (LOGS_STORE)
+
+- Что уже сжато, хранится в манифесте (SQLite в хранилище): повторный проход не
+  stat'ит .gz, а сверяет size/mtime исходника с манифестом.
+- Новые файлы приходят событиями inotify (IN_CLOSE_WRITE / IN_MOVED_TO от rsync);
+  полный проход — при старте, при переполнении очереди событий и раз в
+  COMPRESS_RESCAN_INTERVAL. Без inotify — проход каждые COMPRESS_INTERVAL.
+- Сжатие — zlib в пуле потоков (zlib отпускает GIL), без процесса pigz на файл.
+  Логи <battle_id>.tzb дописываются в пак шарда (shared.utils.btl_pack), остальные —
+  файлами .gz; LOGS_PACK=0 — всё файлами, как раньше. LOGS_CODEC=zstd — zstd со
+  словарём (shared.utils.btl_codec) вместо gzip.
+- Раз в COMPRESS_REPORT_INTERVAL в лог и в .compressor_status.json пишутся
+  пропускная способность и размер очереди.
+"""
+import json
 import os
 import time
-import subprocess
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from pathlib import Path
 
+from inotify import InotifyWatcher
+from manifest import Manifest
+from shared.utils.btl_codec import LOGS_CODEC, Encoder, encoder_from_env
+from shared.utils.btl_pack import PackStore
+
 LOGS_MIRROR = os.getenv('LOGS_MIRROR', '/srv/btl_mirror')
 LOGS_STORE = os.getenv('LOGS_STORE', '/srv/btl_store/gz')
 COMPRESS_INTERVAL = int(os.getenv('COMPRESS_INTERVAL', '30'))
+SHARD_DIVISOR = int(os.getenv('SHARD_DIVISOR', '0'))
+# Логи <battle_id>.tzb — в пак шарда ({shard}.pack + {shard}.idx) вместо файла на бой
+LOGS_PACK = os.getenv('LOGS_PACK', '1') == '1'
+
+COMPRESS_WORKERS = int(os.getenv('COMPRESS_WORKERS', str(os.cpu_count() or 2)))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+COMPRESS_WATCH = os.getenv('COMPRESS_WATCH', '1') == '1'
+COMPRESS_RESCAN_INTERVAL = int(os.getenv('COMPRESS_RESCAN_INTERVAL', '3600'))
+COMPRESS_REPORT_INTERVAL = int(os.getenv('COMPRESS_REPORT_INTERVAL', '60'))
+COMPRESS_MANIFEST = os.getenv('COMPRESS_MANIFEST', os.path.join(LOGS_STORE, '.manifest.sqlite'))
+COMPRESS_STATUS_FILE = os.getenv('COMPRESS_STATUS_FILE', os.path.join(LOGS_STORE, '.compressor_status.json'))
+
+CHUNK = 1 << 20
+# Очередь на сжатие не раздувается: сканер подкладывает файлы по мере освобождения пула
+MAX_PENDING = 10_000
+MAX_INFLIGHT = COMPRESS_WORKERS * 2
+MANIFEST_FLUSH_ROWS = 500
+
+
+def target_path(rel_path: Path, suffix: str = '.gz') -> Path:
+    """Путь .gz в хранилище; опциональное шардирование по имени <index>.tzb"""
+    if SHARD_DIVISOR and rel_path.name.endswith('.tzb') and rel_path.name.split('.')[0].isdigit():
+        idx = int(rel_path.name.split('.')[0])
+        shard = idx // SHARD_DIVISOR
+        rel_path = Path(str(rel_path.parent)) / str(shard) / rel_path.name
+    return Path(LOGS_STORE) / f"{rel_path}{suffix}"
+
+
+def battle_id_of(rel_path: Path):
+    """battle_id из имени <index>.tzb или None"""
+    stem = rel_path.name[:-len('.tzb')] if rel_path.name.endswith('.tzb') else ''
+    return int(stem) if stem.isdigit() else None
+
+
+def compress_to_pack(store: PackStore, src_path: Path, battle_id: int, level: int = COMPRESS_LEVEL) -> int:
+    """Сжатие лога (кодек пака, иначе gzip) и дозапись в пак шарда (вызывается из пула); возвращает размер члена"""
+    with open(src_path, 'rb') as f_in:
+        return store.put_raw(battle_id, f_in.read(), level)
+
 
-def compress_file(src_path, dst_path):
-    """Атомарное сжатие файла в .gz"""
+def encode_file(encoder: Encoder, src_path: Path, dst_path: Path) -> int:
+    """Атомарное сжатие файла кодеком encoder (zstd → .tzb.zst); возвращает размер результата"""
+    with open(src_path, 'rb') as f_in:
+        data = encoder.encode(f_in.read())
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = dst_path.with_name(f".{dst_path.name}.tmp")
     try:
-        # Создаём директорию назначения (для шардирования)
-        dst_path = Path(dst_path)
-        dst_path.parent.mkdir(parents=True, exist_ok=True)
-        
-        # Создаём временный файл
-        temp_path = f"{dst_path}.tmp"
-        
-        # Сжимаем во временный файл
-        result = subprocess.run(['pigz', '-c', str(src_path)], 
-                              stdout=open(temp_path, 'wb'), 
-                              stderr=subprocess.PIPE, 
-                              check=True)
-        
-        # Атомарно переименовываем
-        os.rename(temp_path, dst_path)
-        print(f"Compressed: {src_path} -> {dst_path}")
-        return True
-    except Exception as e:
-        print(f"Compression failed {src_path}: {e}")
-        # Удаляем временный файл при ошибке
-        if os.path.exists(temp_path):
+        with open(temp_path, 'wb') as f_out:
+            f_out.write(data)
+        os.replace(temp_path, dst_path)
+    except BaseException:
+        try:
             os.unlink(temp_path)
-        return False
+        except FileNotFoundError:
+            pass
+        raise
+    return len(data)
 
-SHARD_DIVISOR = int(os.getenv('SHARD_DIVISOR', '0'))
 
-def find_new_files():
-    """Находит новые .tzb файлы для сжатия"""
-    mirror_path = Path(LOGS_MIRROR)
-    store_path = Path(LOGS_STORE)
-    
-    if not mirror_path.exists():
-        return []
-    
-    store_path.mkdir(parents=True, exist_ok=True)
-    
-    new_files = []
-    for tzb_file in mirror_path.rglob('*.tzb'):
-        # Вычисляем путь в хранилище
-        rel_path = tzb_file.relative_to(mirror_path)
-        # Опциональное шардирование: ожидаем имя файла как <index>.tzb
-        if SHARD_DIVISOR and rel_path.name.endswith('.tzb') and rel_path.name.split('.')[0].isdigit():
-            idx = int(rel_path.name.split('.')[0])
-            shard = idx // SHARD_DIVISOR
-            rel_path = Path(str(rel_path.parent)) / str(shard) / rel_path.name
-        gz_path = store_path / f"{rel_path}.gz"
-        
-        # Проверяем, нужно ли сжимать
-        if not gz_path.exists() or tzb_file.stat().st_mtime > gz_path.stat().st_mtime:
-            new_files.append((tzb_file, gz_path))
-    
-    return new_files
+def compress_file(src_path: Path, dst_path: Path, level: int = COMPRESS_LEVEL) -> int:
+    """Атомарное сжатие файла в .gz (вызывается из пула); возвращает размер .gz"""
+    dst_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = dst_path.with_name(f".{dst_path.name}.tmp")
+    try:
+        # wbits=31 — формат gzip; потоковое сжатие кусками по CHUNK
+        comp = zlib.compressobj(level, zlib.DEFLATED, 31)
+        with open(src_path, 'rb') as f_in, open(temp_path, 'wb') as f_out:
+            while chunk := f_in.read(CHUNK):
+                f_out.write(comp.compress(chunk))
+            f_out.write(comp.flush())
+            out_size = f_out.tell()
+        os.replace(temp_path, dst_path)
+        return out_size
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
 
-def main():
-    print(f"Starting btl_compressor: {LOGS_MIRROR} -> {LOGS_STORE}")
-    
-    while True:
+
+class Compressor:
+    """Координатор: источники файлов (скан, inotify) → очередь → пул → манифест"""
+
+    def __init__(self, manifest: Manifest, watcher=None, store: PackStore = None, encoder: Encoder = None):
+        self.mirror = Path(LOGS_MIRROR)
+        self.manifest = manifest
+        self.watcher = watcher
+        self.store = store
+        self.encoder = encoder
+        self.pending: "OrderedDict[str, tuple]" = OrderedDict()
+        self.inflight = {}
+        self.active = set()
+        self.done_rows = []
+        self.scanner = None
+        self.next_scan = 0.0
+        # Первый проход и проход после потери событий stat'ят и сжатые файлы:
+        # изменения, пока сервис не работал (или не дошедшие событиями), иначе не заметить
+        self.stat_known = True
+        self.next_report = time.monotonic() + COMPRESS_REPORT_INTERVAL
+        self.totals = {"files": 0, "bytes_in": 0, "bytes_out": 0, "failed": 0, "adopted": 0}
+        self.window = {"files": 0, "bytes_in": 0, "bytes_out": 0, "started": time.monotonic()}
+
+    # ---- источники ----
+
+    def _job(self, rel: Path, size: int, mtime_ns: int) -> None:
+        key = str(rel)
+        self.pending.pop(key, None)
+        self.pending[key] = (rel, size, mtime_ns)
+
+    def scan_dirs(self, dirs, recursive: bool, stat_known: bool):
+        """
+        Генератор прохода по каталогам: кладёт в очередь изменившиеся файлы
+
+        stat_known=False — уже сжатые (по манифесту) файлы не stat'ятся: их изменения
+        приходят событиями inotify (так идут периодические пересмотры при наблюдении;
+        первый проход после запуска и проход после переполнения очереди — с True).
+        Файл, которого нет в манифесте, но чей .gz свежее исходника (сжат до
+        появления манифеста), записывается в манифест без сжатия.
+        """
+        stack = list(dirs)
+        while stack:
+            path = stack.pop()
+            rel_dir = Path(os.path.relpath(path, self.mirror)).as_posix()
+            known = self.manifest.known(rel_dir)
+            adopted = []
+            try:
+                entries = list(os.scandir(path))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                    continue
+                name = entry.name
+                if not name.endswith('.tzb') or name.startswith('.'):
+                    continue
+                if name in known and not stat_known:
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                stamp = (st.st_size, st.st_mtime_ns)
+                if known.get(name) == stamp:
+                    continue
+                rel = Path(rel_dir) / name if rel_dir != '.' else Path(name)
+                if name not in known:
+                    try:
+                        if target_path(rel).stat().st_mtime_ns >= st.st_mtime_ns:
+                            adopted.append((rel_dir, name, stamp[0], stamp[1], None))
+                            continue
+                    except FileNotFoundError:
+                        pass
+                self._job(rel, *stamp)
+                yield
+            if adopted:
+                self.manifest.record(adopted)
+                self.totals["adopted"] += len(adopted)
+
+    def offer(self, path: str) -> None:
+        """Файл из события inotify"""
+        name = os.path.basename(path)
+        if not name.endswith('.tzb') or name.startswith('.'):
+            return
         try:
-            new_files = find_new_files()
-            if new_files:
-                print(f"Found {len(new_files)} files to compress")
-                for src, dst in new_files:
-                    compress_file(src, dst)
+            st = os.stat(path)
+        except FileNotFoundError:
+            return
+        rel = Path(os.path.relpath(path, self.mirror))
+        stamp = (st.st_size, st.st_mtime_ns)
+        if self.manifest.get(rel.parent.as_posix(), name) != stamp:
+            self._job(rel, *stamp)
+
+    def start_scan(self) -> None:
+        if self.scanner is None:
+            print(f"Full scan of {self.mirror} started")
+            self.scanner = self.scan_dirs([str(self.mirror)], recursive=True,
+                                          stat_known=self.stat_known or self.watcher is None)
+            self.stat_known = False
+        interval = COMPRESS_RESCAN_INTERVAL if self.watcher else COMPRESS_INTERVAL
+        self.next_scan = time.monotonic() + interval
+
+    def feed_from_scanner(self) -> None:
+        """Продвинуть проход, пока очередь не заполнена"""
+        if self.scanner is None:
+            return
+        room = MAX_PENDING - len(self.pending)
+        if room <= 0:
+            return
+        # Шаг генератора — один файл в очередь; уже сжатые пропускаются внутри
+        taken = sum(1 for _ in islice(self.scanner, room))
+        if taken < room:
+            self.scanner = None
+            print("Full scan finished")
+
+    # ---- пул ----
+
+    def submit(self, pool: ThreadPoolExecutor) -> None:
+        while self.pending and len(self.inflight) < MAX_INFLIGHT:
+            key, (rel, size, mtime_ns) = self.pending.popitem(last=False)
+            if key in self.active:
+                # Файл изменился во время сжатия — дождаться текущего и сжать заново
+                self.pending[key] = (rel, size, mtime_ns)
+                break
+            battle_id = battle_id_of(rel) if self.store else None
+            if battle_id is not None:
+                future = pool.submit(compress_to_pack, self.store, self.mirror / rel, battle_id)
+            elif self.encoder:
+                future = pool.submit(encode_file, self.encoder, self.mirror / rel, target_path(rel, self.encoder.suffix))
             else:
-                print("No new files to compress")
-            
-            time.sleep(COMPRESS_INTERVAL)
-        except Exception as e:
-            print(f"Error in main loop: {e}")
-            time.sleep(10)
+                future = pool.submit(compress_file, self.mirror / rel, target_path(rel))
+            self.inflight[future] = (rel, size, mtime_ns)
+            self.active.add(key)
+
+    def collect(self, futures) -> None:
+        for future in futures:
+            rel, size, mtime_ns = self.inflight.pop(future)
+            self.active.discard(str(rel))
+            try:
+                out_size = future.result()
+            except Exception as e:
+                self.totals["failed"] += 1
+                print(f"Compression failed {rel}: {e}")
+                continue
+            self.done_rows.append((rel.parent.as_posix(), rel.name, size, mtime_ns, out_size))
+            for counters in (self.totals, self.window):
+                counters["files"] += 1
+                counters["bytes_in"] += size
+                counters["bytes_out"] += out_size
+        if len(self.done_rows) >= MANIFEST_FLUSH_ROWS or (self.done_rows and not self.inflight):
+            self.flush()
+
+    def flush(self) -> None:
+        if self.done_rows:
+            self.manifest.record(self.done_rows)
+            self.done_rows = []
+
+    # ---- отчёт ----
+
+    def report(self) -> None:
+        self.flush()
+        now = time.monotonic()
+        elapsed = max(now - self.window["started"], 1e-6)
+        files_in = self.window["bytes_in"]
+        status = {
+            "files_per_sec": round(self.window["files"] / elapsed, 2),
+            "mb_per_sec": round(files_in / elapsed / 1e6, 3),
+            "ratio": round(self.window["bytes_out"] / files_in, 3) if files_in else None,
+            "backlog": len(self.pending) + len(self.inflight),
+            "scan_in_progress": self.scanner is not None,
+            "watching": self.watcher.watched if self.watcher else 0,
+            "workers": COMPRESS_WORKERS,
+            "totals": dict(self.totals),
+            "updated_at": time.time(),
+        }
+        print(
+            f"Compressed {self.window['files']} files in {elapsed:.0f}s: "
+            f"{status['files_per_sec']} files/s, {status['mb_per_sec']} MB/s, ratio {status['ratio']}; "
+            f"backlog {status['backlog']}{' (+scan)' if status['scan_in_progress'] else ''}, "
+            f"failed {self.totals['failed']}"
+        )
+        try:
+            tmp = f"{COMPRESS_STATUS_FILE}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(status, f)
+            os.replace(tmp, COMPRESS_STATUS_FILE)
+        except OSError as e:
+            print(f"Status file write failed: {e}")
+        self.window = {"files": 0, "bytes_in": 0, "bytes_out": 0, "started": now}
+        self.next_report = now + COMPRESS_REPORT_INTERVAL
+
+    # ---- цикл ----
+
+    def step(self, pool: ThreadPoolExecutor) -> None:
+        if time.monotonic() >= self.next_scan:
+            self.start_scan()
+        self.feed_from_scanner()
+        self.submit(pool)
+
+        busy = bool(self.inflight)
+        if busy:
+            done, _ = wait(list(self.inflight), timeout=0.5, return_when=FIRST_COMPLETED)
+            self.collect(done)
+
+        if self.watcher:
+            files, new_dirs, overflow = self.watcher.read(0 if busy or self.scanner else 1.0)
+            for path in files:
+                self.offer(path)
+            if new_dirs:
+                # Файлы могли появиться до того, как каталог попал под наблюдение
+                for _ in self.scan_dirs(new_dirs, recursive=False, stat_known=True):
+                    pass
+            if overflow:
+                print("inotify queue overflow, rescanning")
+                self.next_scan = 0.0
+                self.stat_known = True
+        elif not busy and self.scanner is None:
+            time.sleep(min(1.0, max(self.next_scan - time.monotonic(), 0)))
+
+        if time.monotonic() >= self.next_report:
+            self.report()
+
+
+def main():
+    print(f"Starting btl_compressor: {LOGS_MIRROR} -> {LOGS_STORE} "
+          f"(workers={COMPRESS_WORKERS}, level={COMPRESS_LEVEL})")
+    Path(LOGS_STORE).mkdir(parents=True, exist_ok=True)
+
+    # Ждём зеркало (btl_syncer может ещё не создать каталог)
+    while not Path(LOGS_MIRROR).exists():
+        print(f"Waiting for {LOGS_MIRROR}")
+        time.sleep(COMPRESS_INTERVAL)
+
+    manifest = Manifest(COMPRESS_MANIFEST)
+    # Наблюдение ставится до первого прохода: файлы между ними не теряются
+    watcher = InotifyWatcher.create(LOGS_MIRROR) if COMPRESS_WATCH else None
+    # gzip — потоковый zlib с COMPRESS_LEVEL; zstd — со словарём из {LOGS_STORE}/dicts
+    encoder = encoder_from_env(LOGS_STORE) if LOGS_CODEC != 'gzip' else None
+    store = PackStore(LOGS_STORE, divisor=SHARD_DIVISOR or 50000, writable=True, encoder=encoder) if LOGS_PACK else None
+    compressor = Compressor(manifest, watcher, store, encoder)
+    if encoder:
+        print(f"Codec: {encoder.codec} level {encoder.level}, dictionary v{encoder.dict_version or 0}")
+
+    with ThreadPoolExecutor(max_workers=COMPRESS_WORKERS, thread_name_prefix="gz") as pool:
+        while True:
+            try:
+                compressor.step(pool)
+            except Exception as e:
+                print(f"Error in main loop: {e}")
+                time.sleep(10)
+
 
 if __name__ == "__main__":
     main()
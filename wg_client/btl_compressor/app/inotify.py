@@ -0,0 +1,124 @@
+"""
+Минимальная обёртка inotify (Linux) через ctypes — без внешних зависимостей
+
+Следит за деревом каталогов: новые каталоги подхватываются автоматически.
+Интересны готовые файлы: IN_CLOSE_WRITE (дописан) и IN_MOVED_TO (rsync
+пишет во временный .имя и переименовывает). Если ядро потеряло события
+(IN_Q_OVERFLOW), read() сообщает об этом — нужен полный пересмотр.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from typing import Dict, List, Optional, Tuple
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """События готовых файлов в дереве root"""
+
+    def __init__(self, root: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._dirs: Dict[int, str] = {}
+        if not self.add_tree(root):
+            raise FileNotFoundError(errno.ENOENT, f"inotify_add_watch {root}")
+
+    @classmethod
+    def create(cls, root: str) -> Optional["InotifyWatcher"]:
+        """Наблюдатель или None, если inotify недоступен (не Linux, исчерпан лимит)"""
+        try:
+            return cls(root)
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, falling back to periodic scans: {e}")
+            return None
+
+    def add_tree(self, root: str) -> List[str]:
+        """
+        Поставить наблюдение на каталог и все вложенные; возвращает добавленные каталоги
+
+        Каталог, удалённый или переименованный до add_watch, пропускается (тогда
+        и root может не попасть в результат): исключение здесь потеряло бы всю
+        пачку событий read().
+        """
+        added = []
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if err in (errno.ENOENT, errno.ENOTDIR):
+                    continue
+                raise OSError(err, f"inotify_add_watch {path}")
+            self._dirs[wd] = path
+            added.append(path)
+            try:
+                with os.scandir(path) as entries:
+                    stack.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+            except FileNotFoundError:
+                pass
+        return added
+
+    @property
+    def watched(self) -> int:
+        return len(self._dirs)
+
+    def read(self, timeout: float) -> Tuple[List[str], List[str], bool]:
+        """
+        События за timeout секунд
+
+        Returns:
+            (готовые файлы, новые каталоги — их нужно просканировать, переполнение очереди)
+        """
+        files: List[str] = []
+        new_dirs: List[str] = []
+        overflow = False
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return files, new_dirs, overflow
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                parent = self._dirs.get(wd)
+                if parent is None or not name:
+                    continue
+                path = os.path.join(parent, name)
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        new_dirs.extend(self.add_tree(path))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    files.append(path)
+        return files, new_dirs, overflow
+
+    def close(self) -> None:
+        os.close(self._fd)
@@ -0,0 +1,61 @@
+"""
+Манифест сжатых логов (SQLite рядом с архивом)
+
+Строка на исходный .tzb: каталог и имя относительно зеркала, размер и mtime_ns
+на момент сжатия. Файл с теми же size/mtime повторно не сжимается, и хранилище
+для проверки не stat'ится — сравнение идёт с манифестом.
+"""
+
+import sqlite3
+import time
+from typing import Dict, Iterable, Tuple
+
+Stamp = Tuple[int, int]  # (size, mtime_ns)
+
+
+class Manifest:
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS compressed (
+                dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                out_size INTEGER,
+                compressed_at REAL NOT NULL,
+                PRIMARY KEY (dir, name)
+            ) WITHOUT ROWID
+            """
+        )
+        self._db.commit()
+
+    def known(self, rel_dir: str) -> Dict[str, Stamp]:
+        """Сжатые файлы одного каталога (шарда): имя → (size, mtime_ns)"""
+        rows = self._db.execute("SELECT name, size, mtime_ns FROM compressed WHERE dir = ?", (rel_dir,))
+        return {name: (size, mtime_ns) for name, size, mtime_ns in rows}
+
+    def get(self, rel_dir: str, name: str):
+        row = self._db.execute(
+            "SELECT size, mtime_ns FROM compressed WHERE dir = ? AND name = ?", (rel_dir, name)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def record(self, rows: Iterable[Tuple[str, str, int, int, int]]) -> None:
+        """Пачка (dir, name, size, mtime_ns, out_size) — одной транзакцией"""
+        now = time.time()
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO compressed (dir, name, size, mtime_ns, out_size, compressed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(*row, now) for row in rows],
+            )
+
+    def count(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM compressed").fetchone()[0]
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кодеков хранения логов: gzip-6 (как сейчас) против zstd без словаря и
+zstd со словарём, обученным на части выборки (shared.utils.btl_codec).
+
+Каждый бой сжимается отдельно — так, как он лежит в хранилище. Выборка делится
+пополам: на первой половине обучается словарь, на второй меряются степень сжатия
+и скорость распаковки (лучшее из нескольких прогонов).
+
+Запуск из wg_client:
+    python btl_compressor/bench_codecs.py [каталог_с_логами] [--samples N] [--level L]
+
+Каталог — .tzb / .tzb.gz / .tzb.zst (например, /srv/btl/raw или распакованная
+выборка); без него — синтетические бои.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from shared.utils.btl_codec import DictRegistry, Encoder, decode, zstandard  # noqa: E402
+
+MONSTERS = ["Rat", "Stich", "Vzzik", "Cursed", "WitchJelly", "Scorpion", "Mutant"]
+ITEMS = ["Rat Fang", "Stich Claw", "Vzzik Wings", "Cursed Paw", "Water crystal", "Metals", "Gems"]
+
+
+def synthetic_battle(rng: random.Random, battle_id: int) -> bytes:
+    """Правдоподобный лог боя: те же теги и атрибуты, разные логины, ходы и карта"""
+    players = [f"player{rng.randint(1, 5000)}" for _ in range(rng.randint(1, 6))]
+    monsters = [f"${rng.choice(MONSTERS)} [{rng.randint(1, 30)}]" for _ in range(rng.randint(2, 25))]
+    out = [f'<BATTLE t2="{1700000000 + battle_id}" turn="{rng.randint(3, 60)}" f="{rng.randint(1, 9)}" '
+           f'note="{rng.randint(0, 999)},{rng.randint(0, 999)}">']
+    for side, login in enumerate(players + monsters):
+        out.append(f'<USER login="{login}" battleid="{battle_id}" side="{side % 2}" level="{rng.randint(1, 30)}" '
+                   f'prof="{rng.randint(1, 9)}" rank_points="{rng.randint(0, 9999)}" HP="{rng.randint(10, 500)}" />')
+    for _ in range(16):
+        out.append('<MAP v="' + "".join(rng.choice("....##~~^") for _ in range(48)) + '" />')
+    out.append("</BATTLE>")
+    for turn in range(1, rng.randint(5, 60)):
+        out.append(f'<TURN turn="{turn}">')
+        for _ in range(rng.randint(3, 30)):
+            who = rng.randint(0, len(players) + len(monsters) - 1)
+            if rng.random() < 0.6:
+                out.append(f'<a sf="{who}" t="5" x="{rng.randint(0, 47)}" y="{rng.randint(0, 15)}" '
+                           f'HP="{rng.randint(0, 120)}" />')
+            elif rng.random() < 0.5:
+                out.append(f'<a sf="{who}" t="8" id="{rng.choice(ITEMS)}" count="{rng.randint(1, 5)}" />')
+            else:
+                out.append(f'<a sf="{who}" t="{rng.randint(1, 4)}" x="{rng.randint(0, 47)}" y="{rng.randint(0, 15)}" />')
+        out.append("</TURN>")
+    return "\n".join(out).encode()
+
+
+def load_samples(source, count: int):
+    rng = random.Random(1)
+    if source is None:
+        return [synthetic_battle(rng, 3_000_000 + i) for i in range(count)]
+    paths = [p for p in Path(source).rglob("*") if p.name.endswith((".tzb", ".tzb.gz", ".tzb.zst"))]
+    rng.shuffle(paths)
+    dicts = DictRegistry(os.getenv("LOGS_STORE", "/srv/btl/gz"))
+    return [decode(p.read_bytes(), dicts) for p in paths[:count]]
+
+
+def _best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(name, encoder, test, dicts, repeat):
+    started = time.perf_counter()
+    blobs = [encoder.encode(data) for data in test]
+    encode_s = time.perf_counter() - started
+    raw = sum(map(len, test))
+    packed = sum(map(len, blobs))
+    assert [decode(b, dicts) for b in blobs] == test
+    decode_s = _best_of(lambda: [decode(b, dicts) for b in blobs], repeat)
+    print(f"{name:<24} ratio {raw / packed:6.2f}x  avg {packed / len(blobs) / 1024:7.1f} KB  "
+          f"compress {raw / encode_s / 1e6:7.1f} MB/s  decompress {raw / decode_s / 1e6:7.1f} MB/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gzip vs zstd (+словарь) на логах боёв")
+    parser.add_argument("source", nargs="?", help="каталог с логами (по умолчанию — синтетика)")
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--level", type=int, default=9, help="уровень zstd")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    samples = load_samples(args.source, args.samples)
+    train, test = samples[: len(samples) // 2], samples[len(samples) // 2:]
+    print(f"{len(samples)} logs, {sum(map(len, samples)) / 1e6:.1f} MB "
+          f"({'synthetic' if args.source is None else args.source}); train {len(train)}, test {len(test)}")
+
+    bench("gzip -6", Encoder("gzip", level=6), test, None, args.repeat)
+    if zstandard is None:
+        print("zstandard is not installed: pip install zstandard")
+        return
+    with tempfile.TemporaryDirectory() as root:
+        dicts = DictRegistry(root)
+        bench(f"zstd -{args.level}", Encoder("zstd", root=root, level=args.level, dict_version=0), test, dicts, args.repeat)
+        started = time.perf_counter()
+        version = dicts.train(train)
+        print(f"dictionary v{version}: {os.path.getsize(os.path.join(root, 'dicts', f'tzb-{version}.zdict')) // 1024} KB, "
+              f"trained in {time.perf_counter() - started:.1f}s")
+        bench(f"zstd -{args.level} + dict", Encoder("zstd", root=root, level=args.level), test, dicts, args.repeat)
+        bench("zstd -3 + dict", Encoder("zstd", root=root, level=3), test, dicts, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
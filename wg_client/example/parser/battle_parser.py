@@ -6,8 +6,8 @@ import base64
 import gzip
 import hashlib
 import xml.etree.ElementTree as ET
-from dataclasses import dataclass
-from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Any, Optional, Set, Tuple
 from datetime import datetime, timezone
 from collections import defaultdict, namedtuple
 
@@ -20,11 +20,98 @@ class FileMeta:
     compressed: bool
 
 
+@dataclass
+class BattleSweep:
+    """Всё, что экстракторам parse_file нужно из лога, собранное за один проход (см. BattleParser._sweep)."""
+    battle_open: Optional[str] = None
+    battle_section_closed: bool = False
+    battle_users: List[str] = field(default_factory=list)        # USER теги секции BATTLE вне TURN
+    dead_logins: Set[str] = field(default_factory=set)           # USER с HP="0" где угодно в логе
+    map_rows: List[str] = field(default_factory=list)
+    map_ids: Set[str] = field(default_factory=set)               # предметы на карте (<O ... bx by />)
+    loot_actors: Set[str] = field(default_factory=set)           # логины не-монстров из всех USER
+    monsters_initial: List[Tuple[str, str, str]] = field(default_factory=list)
+    monster_tags: Dict[str, str] = field(default_factory=dict)   # первый USER тег монстра до </BATTLE>
+    monsters_active: Set[str] = field(default_factory=set)
+    initial_users: Optional[Set[str]] = None                     # None — секции BATTLE нет (до второго <BATTLE)
+    turn_users: List[Tuple[int, List[str]]] = field(default_factory=list)
+    kills: List[Tuple[str, str]] = field(default_factory=list)   # (киллер, тег <a t="20">)
+    attack_bodies: List[Tuple[int, str, List[str]]] = field(default_factory=list)  # (ход, атакующий, теги <a t="5">)
+    loot: List[Tuple[str, List[str]]] = field(default_factory=list)  # (актор, теги <a t="8">)
+
+
 Kill = namedtuple("Kill", "battle_id turn sf killer victim damage shots")
 
 HP_NUM_RE = re.compile(r"(-?\d+)$")  # забираем последнее число с учетом знака (например, из "0:60" → 60, "0:-52" → -52)
 HP_EXTENDED_RE = re.compile(r"^(\d+):(\d+):([A-Z]+\d*)(-?\d+)$")  # расширенный формат "бронебойный:обычный:код_урон"
 
+# Токенизатор для однопроходного разбора: только теги, которые читают экстракторы.
+# Остальные регулярки применяются уже к отдельному тегу (строке в сотни байт), а не ко всему логу,
+# и повторяют шаблоны многопроходных методов ниже — поэтому JSON совпадает байт в байт.
+TAG_RE = re.compile(r'<(/?)(BATTLE|TURN|USER|MAP|O|a)([^>]*)>')
+_TURN_EXACT_RE = re.compile(r'<TURN turn="(\d+)"')
+_TURN_KILL_RE = re.compile(r'<TURN[^>]*turn="(\d+)"[^>]*>')
+_USER_LOGIN_FIRST_RE = re.compile(r'<USER login="([^"]+)"')
+_USER_LOGIN_RE = re.compile(r'<USER[^>]*login="([^"]+)"[^>]*>')
+_LOOT_ACTOR_RE = re.compile(r'<USER[^>]*login="([^$][^"]*)"')
+_MONSTER_INITIAL_RE = re.compile(r'<USER[^>]*login="(\$[^\"]+)"[^>]*level="([^"]*)"[^>]*side="([^"]*)"[^>]*>')
+_MONSTER_ACTIVE_RE = re.compile(r'<USER[^>]*login="(\$[^\"]+)"')
+_ANY_LOGIN_RE = re.compile(r'login="([^"]*)"')
+_HP_ZERO_RE = re.compile(r'HP="0\b')
+_MAP_ROW_RE = re.compile(r'<MAP\s+v="([^"]+)"\s*/>')
+_MAP_ITEM_RE = re.compile(r'<O[^>]*\bid="([^"]+)"[^>]*\bbx="[^"]+"[^>]*\bby="[^"]+"[^>]*/>')
+_ACTION_RE = re.compile(r'<a[^>]*sf="(\d+)"[^>]*t="(\d+)"[^>]*/>')
+_ATTACK_RE = re.compile(r'<a sf="(\d+)" t="5"[^>]*HP="([^"]+)"[^>]*>')
+_PICKUP_RE = re.compile(r'<a[^>]*\bt="8"[^>]*/>')
+
+# Маркер в конце лога, очищенного на входе (shared.utils.battle_log.CLEAN_MARKER):
+# дубля <BATTLE нет, искать второй блок не нужно
+CLEAN_MARKER = "<!--tzb:clean-->"
+
+
+def first_battle(content: str) -> str:
+    """Лог до второго <BATTLE (дубль тела боя в сыром ответе <BLOOK>); очищенный на входе — как есть."""
+    if content.endswith(CLEAN_MARKER):
+        return content
+    second_battle_pos = content.find('<BATTLE', content.find('<BATTLE') + 1)
+    return content[:second_battle_pos] if second_battle_pos != -1 else content
+
+
+# Раскладка словарей zstd — как в shared.utils.btl_codec: {хранилище}/dicts/tzb-{dict_id}.zdict
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def _zstd_decompress(data: bytes, file_path: str) -> bytes:
+    import zstandard  # опционально: нужен только для логов в zstd
+
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    dict_data = None
+    if dict_id:
+        # Словарь лежит рядом с архивом: LOGS_STORE или выше по дереву от файла ({root}/{shard}/{id}.tzb.zst)
+        parent = os.path.dirname(os.path.abspath(file_path))
+        roots = [os.getenv('LOGS_STORE', '/srv/btl/gz'), parent, os.path.dirname(parent)]
+        for root in roots:
+            path = os.path.join(root, 'dicts', f'tzb-{dict_id}.zdict')
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    dict_data = zstandard.ZstdCompressionDict(f.read())
+                break
+        else:
+            raise ValueError(f"{file_path}: zstd dictionary v{dict_id} not found")
+    return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data)
+
+
+def read_log_text(file_path: str) -> str:
+    """Текст лога из файла: несжатый, gzip или zstd — по магии, не по расширению."""
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    elif data[:4] == ZSTD_MAGIC:
+        data = _zstd_decompress(data, file_path)
+    return data.decode('utf-8')
+
 
 class BattleParser:
     def __init__(self) -> None:
@@ -61,10 +148,42 @@ class BattleParser:
         }
 
     def parse_file(self, file_path: str) -> Dict[str, Any]:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        content = read_log_text(file_path)
 
+        # Хэш — от файла целиком, разбор — одного тела боя (без дубля)
         file_meta = self._file_meta(file_path, content)
+        return self.parse_content(first_battle(content), file_meta)
+
+    def parse_content(self, content: str, file_meta: FileMeta) -> Dict[str, Any]:
+        """Разбор лога за один проход токенизатора: все экстракторы питаются из BattleSweep."""
+        sweep = self._sweep(content)
+        battle_info = self._battle_info_from_tag(sweep.battle_open, content)
+
+        participants: List[Dict[str, Any]] = []
+        if sweep.battle_section_closed:
+            participants = self._build_participants(sweep.battle_users, lambda login: 0 if login in sweep.dead_logins else 1)
+        self._apply_interventions(self._interventions_from_sweep(sweep), participants)
+
+        login_to_idx: Dict[str, int] = {p["login"]: i for i, p in enumerate(participants)}
+        if participants:
+            self._count_kills(self._kills_from_sweep(sweep), participants, login_to_idx)
+            self._accumulate_damage(self._attacks_from_sweep(sweep), participants, login_to_idx)
+
+        personal = self._personal_loot_from_sweep(sweep)
+        for participant in participants:
+            participant['loot'] = self._loot_summary(personal.get(participant['login'], {}))
+
+        monsters_agg = self._aggregate_monsters(
+            sweep.monsters_initial, sweep.monsters_active, lambda login: sweep.monster_tags.get(login, "")
+        )
+        loot = self._loot_summary(self._total_loot_from_sweep(sweep))
+        map_patch = self._map_patch_from_rows(sweep.map_rows)
+        return self._assemble(file_meta, battle_info, participants, monsters_agg, loot, map_patch)
+
+    def _parse_content_multipass(self, content: str, file_meta: FileMeta) -> Dict[str, Any]:
+        """Прежний многопроходный разбор: каждый экстрактор сканирует весь лог сам.
+        Оставлен как эталон для проверки однопроходного parse_content (test_single_pass.py).
+        """
         battle_info = self._parse_battle_info(content)
         participants = self._parse_participants(content)
         self._update_interventions(content, participants)
@@ -75,7 +194,11 @@ class BattleParser:
 
         # Map patch (diff against base map rows)
         map_patch = self._build_map_patch(content)
+        return self._assemble(file_meta, battle_info, participants, monsters_agg, loot, map_patch)
 
+    def _assemble(self, file_meta: FileMeta, battle_info: Dict[str, Any], participants: List[Dict[str, Any]],
+                  monsters_agg: Dict[str, Dict[str, Any]], loot: Dict[str, Any],
+                  map_patch: Dict[str, Any]) -> Dict[str, Any]:
         players_cnt = len(participants)
         monsters_cnt = sum(m["count"] for m in monsters_agg.values())
 
@@ -104,6 +227,267 @@ class BattleParser:
 
         return result
 
+    def _sweep(self, content: str) -> BattleSweep:
+        """Один проход TAG_RE по логу.
+
+        Экстракторы многопроходного разбора по-разному режут лог на ходы и USER-блоки
+        (обрезка по второму <BATTLE, разные шаблоны TURN/USER, «проглатывание» соседнего
+        блока самозакрывающимся USER). Здесь каждая такая разметка — маленький автомат
+        над общим потоком тегов, а результат хода фиксируется только на </TURN>, как и
+        у нехватки совпадения в регулярке.
+        """
+        sweep = BattleSweep()
+        battle_opens = 0
+        first_battle_closed = False   # граница для карты и монстров: первый </BATTLE> в логе
+        cut = False                   # после второго <BATTLE: урон и вмешательства уже не копим
+
+        # Секция BATTLE (участники/изначальные участники): без USER из вложенных TURN
+        section = 0                   # 0 — не начата, 1 — внутри, 2 — закрыта
+        section_in_turn = False
+        section_turn_users: List[str] = []
+        section_initial: Set[str] = set()
+
+        # Ходы <TURN turn="N"> до второго <BATTLE: вмешательства и урон
+        ex_turn: Optional[int] = None
+        ex_pending: Optional[str] = None
+        ex_logins: List[str] = []
+        ex_bodies: List[Tuple[str, List[str]]] = []
+        ex_attacks: List[Tuple[int, str, List[str]]] = []
+
+        # Любые <TURN ...> по всему логу: лут
+        lo_in_turn = False
+        lo_pending: Optional[Tuple[str, List[str]]] = None
+        lo_turn: List[Tuple[str, List[str]]] = []
+
+        # <TURN ... turn="N"> по всему логу: убийства
+        k_in_turn = False
+        k_user: Optional[str] = None
+        k_closed = False
+        k_buf: List[str] = []
+        k_turn: List[Tuple[str, str]] = []
+
+        for m in TAG_RE.finditer(content):
+            closing, name, rest = m.groups()
+            if closing:
+                if rest:
+                    continue
+                if name == 'USER':
+                    if ex_pending is not None:
+                        ex_logins.append(ex_pending)
+                        ex_pending = None
+                    if ex_bodies:
+                        for login, tags in ex_bodies:
+                            if tags:
+                                ex_attacks.append((ex_turn, login, tags))
+                        ex_bodies = []
+                    if lo_pending is not None:
+                        lo_turn.append(lo_pending)
+                        lo_pending = None
+                    if k_user is not None:
+                        k_turn.extend((k_user, t) for t in k_buf)
+                        k_buf = []
+                        k_closed = True
+                elif name == 'TURN':
+                    if section == 1 and section_in_turn:
+                        section_in_turn = False
+                        section_turn_users = []
+                    if ex_turn is not None:
+                        sweep.turn_users.append((ex_turn, ex_logins))
+                        sweep.attack_bodies.extend(ex_attacks)
+                        ex_turn, ex_pending, ex_logins, ex_bodies, ex_attacks = None, None, [], [], []
+                    if lo_in_turn:
+                        sweep.loot.extend(lo_turn)
+                        lo_in_turn, lo_pending, lo_turn = False, None, []
+                    if k_in_turn:
+                        if k_user is not None and not k_closed:
+                            k_turn.extend((k_user, t) for t in k_buf)
+                        sweep.kills.extend(k_turn)
+                        k_in_turn, k_user, k_buf, k_turn = False, None, [], []
+                elif name == 'BATTLE':
+                    first_battle_closed = True
+                    if section == 1:
+                        section = 2
+                        sweep.battle_section_closed = True
+                        if section_in_turn:
+                            # незакрытый TURN внутри секции не вырезается
+                            sweep.battle_users.extend(section_turn_users)
+                        if not cut:
+                            sweep.initial_users = section_initial
+                continue
+
+            tag = m.group(0)
+            if name == 'a':
+                if ex_bodies and tag.startswith('<a sf="'):
+                    for _, tags in ex_bodies:
+                        tags.append(tag)
+                if lo_pending is not None and 't="8"' in tag:
+                    lo_pending[1].append(tag)
+                if k_user is not None and 't="20"' in tag and 'code="7"' in tag:
+                    k_buf.append(tag)
+            elif name == 'USER':
+                if 'HP="0' in tag:
+                    hp_zero = [h.start() for h in _HP_ZERO_RE.finditer(tag)]
+                    if hp_zero:
+                        for lm in _ANY_LOGIN_RE.finditer(tag):
+                            if lm.end() <= hp_zero[-1]:
+                                sweep.dead_logins.add(lm.group(1))
+                am = _LOOT_ACTOR_RE.match(tag)
+                if am:
+                    sweep.loot_actors.add(am.group(1))
+                if 'login="$' in tag:
+                    if not first_battle_closed:
+                        mm = _MONSTER_INITIAL_RE.match(tag)
+                        if mm:
+                            sweep.monsters_initial.append(mm.groups())
+                        for lm in _ANY_LOGIN_RE.finditer(tag):
+                            sweep.monster_tags.setdefault(lm.group(1), tag)
+                    else:
+                        mm = _MONSTER_ACTIVE_RE.match(tag)
+                        if mm:
+                            sweep.monsters_active.add(mm.group(1))
+                first = _USER_LOGIN_FIRST_RE.match(tag)
+                if section == 1:
+                    if section_in_turn:
+                        section_turn_users.append(tag)
+                    else:
+                        sweep.battle_users.append(tag)
+                    if first:
+                        section_initial.add(first.group(1))
+                if ex_turn is not None and first:
+                    if ex_pending is None:
+                        ex_pending = first.group(1)
+                    if not tag.endswith('/>'):
+                        ex_bodies.append((first.group(1), []))
+                if lo_in_turn or k_in_turn:
+                    um = _USER_LOGIN_RE.match(tag)
+                    if um:
+                        if lo_in_turn and lo_pending is None:
+                            lo_pending = (um.group(1), [])
+                        if k_in_turn:
+                            if k_user is not None and not k_closed:
+                                k_turn.extend((k_user, t) for t in k_buf)
+                            k_user, k_closed, k_buf = um.group(1), False, []
+            elif name == 'O':
+                if 'bx="' in tag:
+                    om = _MAP_ITEM_RE.match(tag)
+                    if om:
+                        sweep.map_ids.add(om.group(1))
+            elif name == 'TURN':
+                if section == 1 and not section_in_turn:
+                    section_in_turn = True
+                    section_turn_users = []
+                if ex_turn is None and not cut:
+                    tm = _TURN_EXACT_RE.match(tag)
+                    if tm:
+                        ex_turn = int(tm.group(1))
+                lo_in_turn = True
+                if not k_in_turn and _TURN_KILL_RE.match(tag):
+                    k_in_turn = True
+            elif name == 'BATTLE':
+                battle_opens += 1
+                if battle_opens == 1:
+                    sweep.battle_open = tag
+                    section = 1
+                elif battle_opens == 2:
+                    # дальше — дубль лога: ход, не закрытый до этой точки, не считается
+                    cut = True
+                    ex_turn, ex_pending, ex_logins, ex_bodies, ex_attacks = None, None, [], [], []
+            elif name == 'MAP':
+                if not first_battle_closed:
+                    rm = _MAP_ROW_RE.match(tag)
+                    if rm:
+                        sweep.map_rows.append(rm.group(1))
+
+        return sweep
+
+    def _interventions_from_sweep(self, sweep: BattleSweep) -> List[Dict[str, Any]]:
+        """Вмешательства как в analyze_battle_interventions: первый выход нового логина в ходе."""
+        if sweep.initial_users is None:
+            return []
+        interventions: List[Dict[str, Any]] = []
+        all_seen_users = set(sweep.initial_users)
+        for turn, logins in sweep.turn_users:
+            for login in logins:
+                if login not in all_seen_users:
+                    interventions.append({'turn': turn, 'login': login})
+                    all_seen_users.add(login)
+        return interventions
+
+    def _kills_from_sweep(self, sweep: BattleSweep) -> List[Tuple[str, str]]:
+        """Пары (киллер, жертва) по тегам t="20" code="7", как в parse_kills_from_xml."""
+        kills: List[Tuple[str, str]] = []
+        for killer, tag in sweep.kills:
+            a_match = _ACTION_RE.match(tag)
+            if not a_match or int(a_match.group(2)) != 20:
+                continue
+            code_match = re.search(r'code="([^"]*)"', tag)
+            target_match = re.search(r'login="([^"]*)"', tag)
+            if code_match and code_match.group(1) == "7" and target_match and target_match.group(1):
+                kills.append((killer, target_match.group(1)))
+        return kills
+
+    def _attacks_from_sweep(self, sweep: BattleSweep) -> List[Dict[str, Any]]:
+        """Атаки t="5" в том же виде и порядке, что и analyze_damage_by_turns."""
+        all_attacks: List[Dict[str, Any]] = []
+        damage_cache: Dict[str, Dict[str, Any]] = {}
+        for turn, attacker_login, tags in sweep.attack_bodies:
+            first_tag: Dict[Tuple[str, str], str] = {}
+            parsed: List[Tuple[str, str]] = []
+            for tag in tags:
+                am = _ATTACK_RE.match(tag)
+                if not am:
+                    continue
+                parsed.append(am.groups())
+                # жертва/тип берутся из первого тега блока с тем же sf и HP (как re.search в исходном разборе)
+                for hp_m in re.finditer(r'HP="([^"]+)"', tag):
+                    first_tag.setdefault((am.group(1), hp_m.group(1)), tag)
+            for sf, hp_str in parsed:
+                damage_info = damage_cache.get(hp_str)
+                if damage_info is None:
+                    damage_info = damage_cache[hp_str] = self.parse_damage_detailed(hp_str)
+                if damage_info['total_damage'] <= 0:
+                    continue
+                full_tag = first_tag[(sf, hp_str)]
+                login_match = re.search(r'login="([^"]+)"', full_tag)
+                victim_login = login_match.group(1) if login_match else None
+                type_match = re.search(r'type="([^"]+)"', full_tag)
+                attack_type = type_match.group(1) if type_match else None
+                all_attacks.append({
+                    'turn': turn,
+                    'frame': int(sf),
+                    'attacker': attacker_login,
+                    'victim': victim_login if victim_login else 'координаты',
+                    'attack_type': attack_type,
+                    'attack_type_name': self._get_attack_type_name(attack_type),
+                    'hp_string': hp_str,
+                    **damage_info
+                })
+        return sorted(all_attacks, key=lambda x: (x['turn'], x['frame']))
+
+    def _personal_loot_from_sweep(self, sweep: BattleSweep) -> Dict[str, Dict[str, int]]:
+        """Личный лут всех акторов за один проход по подборам (как _parse_personal_loot для каждого)."""
+        by_login: Dict[str, Dict[str, int]] = {}
+        seen_by_login: Dict[str, Set[str]] = {}
+        for actor, tags in sweep.loot:
+            by_name = by_login.setdefault(actor, {})
+            seen_ids = seen_by_login.setdefault(actor, set())
+            for tag in tags:
+                if _PICKUP_RE.match(tag):
+                    self._add_pickup(tag, sweep.map_ids, seen_ids, by_name)
+        return by_login
+
+    def _total_loot_from_sweep(self, sweep: BattleSweep) -> Dict[str, int]:
+        """Общий лут участников с глобальной дедупликацией id (как _parse_loot)."""
+        by_name: Dict[str, int] = {}
+        seen_ids_global: Set[str] = set()
+        for actor, tags in sweep.loot:
+            if actor not in sweep.loot_actors:
+                continue
+            for tag in tags:
+                if _PICKUP_RE.match(tag):
+                    self._add_pickup(tag, sweep.map_ids, seen_ids_global, by_name)
+        return by_name
+
     def _extract_map_rows(self, content: str) -> List[str]:
         """Extract MAP rows (v strings) from the first BATTLE section."""
         # Limit to first BATTLE to avoid duplicates
@@ -117,7 +501,9 @@ class BattleParser:
         For now, we assume final rows equal to base rows (diff empty), which is
         sufficient to carry map identity and integrity.
         """
-        base_rows = self._extract_map_rows(content)
+        return self._map_patch_from_rows(self._extract_map_rows(content))
+
+    def _map_patch_from_rows(self, base_rows: List[str]) -> Dict[str, Any]:
         if not base_rows:
             return {}
 
@@ -186,13 +572,15 @@ class BattleParser:
     def _parse_battle_info(self, content: str) -> Dict[str, Any]:
         # Extract the first BATTLE tag, then read attributes individually (order-agnostic)
         m = re.search(r'<BATTLE[^>]*>', content)
+        return self._battle_info_from_tag(m.group(0) if m else None, content)
+
+    def _battle_info_from_tag(self, battle_open: Optional[str], content: str) -> Dict[str, Any]:
         field_type: Optional[str] = None
         turns: int = 0
         loc_x, loc_y = 0, 0
         start_ts: Optional[int] = None
         end_ts_iso: Optional[str] = None
-        if m:
-            battle_open = m.group(0)
+        if battle_open:
             f_m = re.search(r'\bf="([^"]*)"', battle_open)
             t2_m = re.search(r'\bt2="([^"]*)"', battle_open)
             turn_m = re.search(r'\bturn="([^"]*)"', battle_open)
@@ -252,6 +640,16 @@ class BattleParser:
         
         # Now find USER tags only from battle_content_no_turns
         tags = re.findall(r'<USER[^>]*/>|<USER[^>]*>', battle_content_no_turns)
+
+        def _survived(login: str) -> int:
+            # if there exists a USER snapshot with HP="0" for this login, mark not survived
+            if re.search(fr'<USER[^>]*login="{re.escape(login)}"[^>]*HP="0\b', content):
+                return 0
+            return 1
+
+        return self._build_participants(tags, _survived)
+
+    def _build_participants(self, tags: List[str], survived_of: Callable[[str], int]) -> List[Dict[str, Any]]:
         participants: List[Dict[str, Any]] = []
         seen_logins: set[str] = set()
         for tag in tags:
@@ -289,10 +687,7 @@ class BattleParser:
             pve_points = _int('pve_points')
             gender = _int('man')
 
-            survived = 1
-            # if there exists a USER snapshot with HP="0" for this login, mark not survived
-            if re.search(fr'<USER[^>]*login="{re.escape(login)}"[^>]*HP="0\b', content):
-                survived = 0
+            survived = survived_of(login)
 
             participants.append({
                 "login": login,
@@ -323,10 +718,12 @@ class BattleParser:
         """Update intervention status for each participant."""
         # Get intervention data using existing function
         intervention_data = self.analyze_battle_interventions(content)
-        
+        self._apply_interventions(intervention_data.get('interventions', []), participants)
+
+    def _apply_interventions(self, interventions: Iterable[Dict[str, Any]], participants: List[Dict[str, Any]]) -> None:
         # Create a mapping of login to intervention info
         intervention_map = {}
-        for intervention in intervention_data.get('interventions', []):
+        for intervention in interventions:
             login = intervention['login']
             turn = intervention['turn']
             intervention_map[login] = turn
@@ -343,11 +740,11 @@ class BattleParser:
                 participant['intervened'] = {"state": 0}
 
     def _update_personal_loot(self, content: str, participants: List[Dict[str, Any]]) -> None:
-        """Update personal loot for each participant."""
+        """Update personal loot for each participant (one scan for all logins)."""
+        loot_by_login = self._parse_loot_by_login(content)
         for participant in participants:
             login = participant['login']
-            personal_loot = self._parse_personal_loot(content, login)
-            participant['loot'] = personal_loot
+            participant['loot'] = self._loot_summary(loot_by_login.get(login, {}))
 
     def _augment_kills_by_turn(self, content: str, participants: List[Dict[str, Any]]) -> None:
         """Assign kills and damage per participant using the new kill parser algorithm."""
@@ -363,12 +760,15 @@ class BattleParser:
         
         # Create login to index mapping
         login_to_idx: Dict[str, int] = {p["login"]: i for i, p in enumerate(participants)}
+        self._count_kills(((kill.killer, kill.victim) for kill in kills), participants, login_to_idx)
         
-        # Process each kill for kill count and detailed damage tracking
-        for kill in kills:
-            killer = kill.killer
-            victim = kill.victim
-            
+        # Now process all damage (not just kills) for detailed damage tracking
+        self._track_detailed_damage(content, participants, login_to_idx)
+
+    def _count_kills(self, kills: Iterable[Tuple[str, str]], participants: List[Dict[str, Any]],
+                     login_to_idx: Dict[str, int]) -> None:
+        """Process each (killer, victim) pair for kill counts."""
+        for killer, victim in kills:
             if killer not in login_to_idx:
                 continue
                 
@@ -381,15 +781,15 @@ class BattleParser:
                 # Player kill (but not self-kill)
                 if victim != killer:
                     participants[idx]["kills"]["players"] += 1
-        
-        # Now process all damage (not just kills) for detailed damage tracking
-        self._track_detailed_damage(content, participants, login_to_idx)
 
     def _track_detailed_damage(self, content: str, participants: List[Dict[str, Any]], login_to_idx: Dict[str, int]) -> None:
         """Track detailed damage by type for each participant."""
         # Parse all damage events using existing function
         all_attacks = self.analyze_damage_by_turns(content)
-        
+        self._accumulate_damage(all_attacks, participants, login_to_idx)
+
+    def _accumulate_damage(self, all_attacks: List[Dict[str, Any]], participants: List[Dict[str, Any]],
+                           login_to_idx: Dict[str, int]) -> None:
         # Map status codes to our damage categories (только специальные эффекты)
         status_code_map = {
             'O': 'Poison',        # Отравление входящие  
@@ -456,6 +856,16 @@ class BattleParser:
         initial = re.findall(r'<USER[^>]*login="(\$[^\"]+)"[^>]*level="([^"]*)"[^>]*side="([^"]*)"[^>]*>', battle_start_block)
         # Monster logins that appear in any TURN (state or actions)
         active_logins = set(re.findall(r'<USER[^>]*login="(\$[^\"]+)"', turn_block))
+
+        def _user_tag(login: str) -> str:
+            # Find the full USER tag for this login to extract def/color
+            user_tag_match = re.search(fr'<USER[^>]*login="{re.escape(login)}"[^>]*>', battle_start_block)
+            return user_tag_match.group(0) if user_tag_match else ""
+
+        return self._aggregate_monsters(initial, active_logins, _user_tag)
+
+    def _aggregate_monsters(self, initial: List[Tuple[str, str, str]], active_logins: Set[str],
+                            user_tag_of: Callable[[str], str]) -> Dict[str, Dict[str, Any]]:
         seen_logins: set[str] = set()
         agg: Dict[str, Dict[str, Any]] = {}
         for login, level, side in initial:
@@ -465,9 +875,7 @@ class BattleParser:
             if active_logins and login not in active_logins:
                 continue
             seen_logins.add(login)
-            # Find the full USER tag for this login to extract def/color
-            user_tag_match = re.search(fr'<USER[^>]*login="{re.escape(login)}"[^>]*>', battle_start_block)
-            user_tag = user_tag_match.group(0) if user_tag_match else ""
+            user_tag = user_tag_of(login)
             def_attr_m = re.search(r'\bdef="([^"]*)"', user_tag)
             color_attr_m = re.search(r'\bcolor="([^"]*)"', user_tag)
             def_attr = def_attr_m.group(1) if def_attr_m else None
@@ -593,38 +1001,31 @@ class BattleParser:
                     continue
                 body = user_m.group(2)
                 for tag_m in re.finditer(r'<a[^>]*\bt="8"[^>]*/>', body):
-                    tag = tag_m.group(0)
-                    id_m = re.search(r'\bid="([^"]+)"', tag)
-                    name_m = re.search(r'\btxt="([^"]+)"', tag)
-                    count_m = re.search(r'\bcount="(\d+)"', tag)
-                    if not id_m or not name_m or not count_m:
-                        continue
-                    item_id = id_m.group(1)
-                    if map_ids and item_id not in map_ids:
-                        continue
-                    if item_id in seen_ids_global:
-                        continue
-                    seen_ids_global.add(item_id)
-                    name = name_m.group(1)
-                    qty = int(count_m.group(1))
-                    by_name[name] = by_name.get(name, 0) + qty
+                    self._add_pickup(tag_m.group(0), map_ids, seen_ids_global, by_name)
 
-        resources: List[Dict[str, Any]] = []
-        monster_parts: List[Dict[str, Any]] = []
-        other: List[Dict[str, Any]] = []
+        return self._loot_summary(by_name)
 
-        for name, qty in sorted(by_name.items()):
-            if name in self.resource_types:
-                resources.append({"name": name, "qty": qty})
-            elif name in self.monster_parts:
-                monster_parts.append({"name": name, "qty": qty})
-            else:
-                other.append({"item_id": None, "item_name": name, "qty": qty})
+    def _parse_loot_by_login(self, content: str) -> Dict[str, Dict[str, int]]:
+        """Pickups of every actor in one scan: login -> {item name: qty}.
+        Same result as _parse_personal_loot for each login, without rescanning the log per participant.
+        """
+        by_login: Dict[str, Dict[str, int]] = {}
+        seen_by_login: Dict[str, Set[str]] = {}
+        map_ids: set[str] = set(re.findall(r'<O[^>]*\bid="([^"]+)"[^>]*\bbx="[^"]+"[^>]*\bby="[^"]+"[^>]*/>', content))
 
-        return {"resources": resources, "monster_parts": monster_parts, "other": other}
+        for turn_m in re.finditer(r'<TURN[^>]*>([\s\S]*?)</TURN>', content):
+            turn_body = turn_m.group(1)
+            for user_m in re.finditer(r'<USER[^>]*login="([^"]+)"[^>]*>([\s\S]*?)</USER>', turn_body):
+                actor = user_m.group(1)
+                by_name = by_login.setdefault(actor, {})
+                seen_ids = seen_by_login.setdefault(actor, set())
+                for tag_m in re.finditer(r'<a[^>]*\bt="8"[^>]*/>', user_m.group(2)):
+                    self._add_pickup(tag_m.group(0), map_ids, seen_ids, by_name)
+
+        return by_login
 
     def _parse_personal_loot(self, content: str, player_login: str) -> Dict[str, Any]:
-        # Parse loot for a specific player
+        # Parse loot for a specific player (rescans the whole log; see _parse_loot_by_login)
         by_name: Dict[str, int] = {}
         seen_ids: set[str] = set()
         map_ids: set[str] = set(re.findall(r'<O[^>]*\bid="([^"]+)"[^>]*\bbx="[^"]+"[^>]*\bby="[^"]+"[^>]*/>', content))
@@ -638,22 +1039,28 @@ class BattleParser:
                     continue
                 body = user_m.group(2)
                 for tag_m in re.finditer(r'<a[^>]*\bt="8"[^>]*/>', body):
-                    tag = tag_m.group(0)
-                    id_m = re.search(r'\bid="([^"]+)"', tag)
-                    name_m = re.search(r'\btxt="([^"]+)"', tag)
-                    count_m = re.search(r'\bcount="(\d+)"', tag)
-                    if not id_m or not name_m or not count_m:
-                        continue
-                    item_id = id_m.group(1)
-                    if map_ids and item_id not in map_ids:
-                        continue
-                    if item_id in seen_ids:
-                        continue
-                    seen_ids.add(item_id)
-                    name = name_m.group(1)
-                    qty = int(count_m.group(1))
-                    by_name[name] = by_name.get(name, 0) + qty
+                    self._add_pickup(tag_m.group(0), map_ids, seen_ids, by_name)
+
+        return self._loot_summary(by_name)
+
+    def _add_pickup(self, tag: str, map_ids: Set[str], seen_ids: Set[str], by_name: Dict[str, int]) -> None:
+        """Учесть один подбор <a t="8" id txt count />: только предметы с карты, каждый id один раз."""
+        id_m = re.search(r'\bid="([^"]+)"', tag)
+        name_m = re.search(r'\btxt="([^"]+)"', tag)
+        count_m = re.search(r'\bcount="(\d+)"', tag)
+        if not id_m or not name_m or not count_m:
+            return
+        item_id = id_m.group(1)
+        if map_ids and item_id not in map_ids:
+            return
+        if item_id in seen_ids:
+            return
+        seen_ids.add(item_id)
+        name = name_m.group(1)
+        qty = int(count_m.group(1))
+        by_name[name] = by_name.get(name, 0) + qty
 
+    def _loot_summary(self, by_name: Dict[str, int]) -> Dict[str, Any]:
         resources: List[Dict[str, Any]] = []
         monster_parts: List[Dict[str, Any]] = []
         other: List[Dict[str, Any]] = []
@@ -907,10 +1314,8 @@ class BattleParser:
         
         Возвращает список атак с полной информацией об уроне.
         """
-        # Дедупликация
-        second_battle_pos = content.find('<BATTLE', content.find('<BATTLE') + 1)
-        if second_battle_pos != -1:
-            content = content[:second_battle_pos]
+        # Дедупликация (для очищенного на входе лога — без сканирования)
+        content = first_battle(content)
         
         # Найдем все ходы
         turn_pattern = r'<TURN turn="(\d+)"[^>]*>(.*?)</TURN>'
@@ -981,10 +1386,8 @@ class BattleParser:
         
         Возвращает список изменений стоек с детальной информацией.
         """
-        # Дедупликация
-        second_battle_pos = content.find('<BATTLE', content.find('<BATTLE') + 1)
-        if second_battle_pos != -1:
-            content = content[:second_battle_pos]
+        # Дедупликация (для очищенного на входе лога — без сканирования)
+        content = first_battle(content)
         
         # Найдем все ходы
         turn_pattern = r'<TURN turn="(\d+)"[^>]*>(.*?)</TURN>'
@@ -1041,10 +1444,8 @@ class BattleParser:
         
         Возвращает информацию о первоначальных участниках и вмешательствах по ходам.
         """
-        # Дедупликация
-        second_battle_pos = content.find('<BATTLE', content.find('<BATTLE') + 1)
-        if second_battle_pos != -1:
-            content = content[:second_battle_pos]
+        # Дедупликация (для очищенного на входе лога — без сканирования)
+        content = first_battle(content)
         
         # Извлекаем изначальных участников из блока BATTLE
         battle_match = re.search(r'<BATTLE[^>]*>(.*?)</BATTLE>', content, re.DOTALL)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк личного лута: прежний путь (_parse_personal_loot на каждого участника,
+O(участники × размер лога)) против одного прохода (_parse_loot_by_login и
+однопроходного BattleSweep) на синтетическом бою из mock_host_server/generate_test_logs.py.
+"""
+
+import sys
+import time
+from pathlib import Path
+from battle_parser import BattleParser
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent.parent / "mock_host_server"))
+from generate_test_logs import generate_tzb_battle  # noqa: E402
+
+
+def _best_of(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_personal_loot(players=60, monsters=40, turns=60, repeat=3):
+    parser = BattleParser()
+    content = generate_tzb_battle(2650006, players=players, monsters=monsters, turns=turns, seed=42)
+    participants = parser._parse_participants(content)
+    logins = [p['login'] for p in participants]
+
+    print(f"Синтетический бой: {len(content) / 1024 / 1024:.1f} МБ, участников {len(logins)}, ходов {turns}")
+    print("=" * 80)
+
+    def old_path():
+        return {login: parser._parse_personal_loot(content, login) for login in logins}
+
+    def by_login_path():
+        loot_by_login = parser._parse_loot_by_login(content)
+        return {login: parser._loot_summary(loot_by_login.get(login, {})) for login in logins}
+
+    def sweep_path():
+        personal = parser._personal_loot_from_sweep(parser._sweep(content))
+        return {login: parser._loot_summary(personal.get(login, {})) for login in logins}
+
+    old_time, old_result = _best_of(old_path, repeat)
+    new_time, new_result = _best_of(by_login_path, repeat)
+    sweep_time, sweep_result = _best_of(sweep_path, repeat)
+
+    print(f"_parse_personal_loot × {len(logins):<4}      {old_time:8.3f}s")
+    print(f"_parse_loot_by_login (один скан)  {new_time:8.3f}s  (x{old_time / new_time:.1f})")
+    print(f"_sweep (весь разбор за проход)    {sweep_time:8.3f}s  (x{old_time / sweep_time:.1f})")
+
+    if old_result != new_result or old_result != sweep_result:
+        print("ОШИБКА: результаты путей различаются")
+        return False
+    print("Результаты всех путей совпадают")
+    return True
+
+
+if __name__ == "__main__":
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    sys.exit(0 if bench_personal_loot(players=players, turns=turns) else 1)
@@ -3,31 +3,27 @@ import sys
 import os
 
 
+# Маркер в конце лога, очищенного на входе (shared.utils.battle_log.CLEAN_MARKER)
+CLEAN_MARKER = '<!--tzb:clean-->'
+
+
 def dedupe_tzb_content(content: str) -> str:
-    # Remove <BLOOK> and </BLOOK> tags if present
-    content = content.replace('<BLOOK>', '').replace('</BLOOK>', '')
-    
-    # Find starts of <BATTLE
-    indices = []
-    start = 0
-    while True:
-        i = content.find('<BATTLE', start)
-        if i == -1:
-            break
-        indices.append(i)
-        start = i + 7
-
-    if len(indices) < 2:
+    # Already cleaned at fetch time (xml_worker): no duplicate, no <BLOOK> wrapper
+    if content.endswith(CLEAN_MARKER):
         return content
 
-    # If a second <BATTLE> exists, assume concatenated duplication; keep only until second start
-    second = indices[1]
-    first_part = content[:second]
-
-    # Heuristic validation: if the rest begins with the first part (or its large prefix), it's duplicated
-    rest = content[second:second + len(first_part)]
-    # If not similar, still cut at second to avoid double counting
-    return first_part
+    first = content.find('<BATTLE')
+    if first == -1:
+        return content.replace('<BLOOK>', '').replace('</BLOOK>', '')
+
+    # A second <BATTLE means concatenated duplication: keep only the first battle body.
+    # Without it the body ends at </BLOOK>. One slice instead of copies for tag removal.
+    end = content.find('<BATTLE', first + 7)
+    if end == -1:
+        end = content.find('</BLOOK>', first)
+        if end == -1:
+            end = len(content)
+    return content[first:end]
 
 
 def main() -> None:
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Сверка однопроходного разбора (parse_content) с прежним многопроходным
+(_parse_content_multipass): JSON должен совпадать байт в байт.
+"""
+
+import sys
+import json
+import time
+from battle_parser import BattleParser
+
+
+def compare_single_pass(filename):
+    """Разбирает файл обоими путями, сравнивает JSON и печатает время"""
+
+    parser = BattleParser()
+
+    with open(filename, 'r', encoding='utf-8') as f:
+        content = f.read()
+    file_meta = parser._file_meta(filename, content)
+
+    started = time.perf_counter()
+    single = parser.parse_content(content, file_meta)
+    single_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    multi = parser._parse_content_multipass(content, file_meta)
+    multi_time = time.perf_counter() - started
+
+    single_json = json.dumps(single, ensure_ascii=False, indent=2)
+    multi_json = json.dumps(multi, ensure_ascii=False, indent=2)
+    identical = single_json == multi_json
+
+    status = "OK  " if identical else "DIFF"
+    print(f"{status} {filename}: {len(content)} байт, участников {len(single['participants'])}, "
+          f"один проход {single_time:.3f}s, многопроходный {multi_time:.3f}s")
+    return identical
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Использование: python3 test_single_pass.py <файл.tzb> [<файл.tzb> ...]")
+        sys.exit(1)
+
+    results = [compare_single_pass(path) for path in sys.argv[1:]]
+    sys.exit(0 if all(results) else 1)
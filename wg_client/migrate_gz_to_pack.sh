@@ -0,0 +1,14 @@
+#!/bin/bash
+set -e
+
+# Перенос /srv/btl/gz/{shard}/{battle_id}.tzb.gz в паки шардов ({shard}.pack + {shard}.idx)
+# Аргументы передаются в app.pack_migrate: --shard N, --verify, --delete
+# Перезапуск безопасен: уже перенесённые бои пропускаются.
+
+echo "📦 Миграция .tzb.gz → паки шардов"
+echo "=================================="
+
+docker compose -f HOST_API_SERVICE_LIGHT_WEIGHT_API.yml exec api_mother \
+    python -m app.pack_migrate --root /srv/btl/gz "$@"
+
+echo "✅ Готово"
@@ -4,12 +4,12 @@
 """
 import os
 import random
+import sys
 from datetime import datetime, timedelta
 from pathlib import Path
 
 # Базовая директория для логов
 BASE_DIR = Path(__file__).parent / "export" / "btl"
-BASE_DIR.mkdir(parents=True, exist_ok=True)
 
 # Шаблон XML лога боя
 BATTLE_XML_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
@@ -74,6 +74,77 @@ def generate_player(player_id, team):
         'kills': random.randint(0, 7)
     }
 
+# Ресурсы/части монстров для подборов t="8" в TZB логах
+TZB_LOOT_NAMES = [
+    "Gems", "Metals", "Organic", "Silicon", "Venom",
+    "Rat Fang", "Rat Skin", "Stich Claw", "Vzzik Wings", "Junk"
+]
+
+# Значения HP атак t="5": обычный, крит, бронебой, DoT и расширенный формат
+TZB_HP_VALUES = ["0:60", "1:46", "2:31", "0:18:N4", "0:A7", "0:19:P6", "0:29:H5", "0:3:O2", "45"]
+
+
+def generate_tzb_battle(battle_id, players=60, monsters=40, turns=60, seed=None, duplicate=False):
+    """Генерирует синтетический .tzb лог игрового сервера (BATTLE/MAP/USER/O + TURN с действиями <a>).
+
+    Размер растёт как players × turns: 60 игроков и 60 ходов дают лог в несколько МБ,
+    как у крупной клановой войны. duplicate=True повторяет блок, как в сыром ответе <BLOOK>.
+    """
+    rnd = random.Random(seed)
+    logins = [f"player{i}" for i in range(players)]
+    monster_logins = [f"$rat{i}" if i % 3 else f"$stich{i}_{battle_id % 1000}" for i in range(monsters)]
+    end_ts = int((datetime.now() - timedelta(hours=rnd.randint(0, 720))).timestamp())
+    start_ts = end_ts - turns * 30
+
+    lines = [f'<BATTLE t2="{end_ts}" turn="{turns}" f="{rnd.choice("ABCD")}" note="{rnd.randint(-50, 50)},{rnd.randint(-50, 50)},{start_ts}">']
+    for _ in range(20):
+        lines.append(f'<MAP v="{"".join(rnd.choice("abcdefgh") for _ in range(40))}" />')
+
+    item_ids = []
+    for i in range(players * 10):
+        item_id = str(battle_id * 1000 + i)
+        item_ids.append(item_id)
+        lines.append(f'<O id="{item_id}" count="{rnd.randint(1, 5)}" txt="{rnd.choice(TZB_LOOT_NAMES)}" bx="{i % 40}" by="{i // 40}" />')
+
+    for i, login in enumerate(logins):
+        lines.append(
+            f'<USER login="{login}" battleid="{battle_id}" level="{rnd.randint(1, 30)}" pro="{rnd.randint(0, 17)}" '
+            f'clan="clan{i % 6}" side="{1 + i % 2}" man="{i % 2}" rank_points="{rnd.random() * 100:.1f}" '
+            f'pve_points="{rnd.randint(0, 10**6)}" HP="400">'
+        )
+        lines.append(f'<O id="{10**9 + i}" name="b5-v11" slot="GH" />')
+        lines.append('</USER>')
+    for login in monster_logins:
+        lines.append(f'<USER login="{login}" level="{rnd.randint(1, 15)}" side="2" HP="60" />')
+    lines.append('</BATTLE>')
+
+    for turn in range(1, turns + 1):
+        lines.append(f'<TURN turn="{turn}" t="{start_ts + turn * 30}">')
+        for login in logins:
+            lines.append(f'<USER login="{login}" HP="{rnd.randint(0, 400)}">')
+            for _ in range(rnd.randint(1, 8)):
+                sf = rnd.randint(0, 120)
+                action = rnd.random()
+                target = rnd.choice(monster_logins or logins)
+                if action < 0.55:
+                    lines.append(f'<a sf="{sf}" t="5" type="{rnd.randint(0, 16)}" login="{target}" HP="{rnd.choice(TZB_HP_VALUES)}" />')
+                elif action < 0.65:
+                    lines.append(f'<a sf="{sf}" t="20" code="7" login="{target}" />')
+                elif action < 0.85:
+                    lines.append(f'<a sf="{sf}" t="8" id="{rnd.choice(item_ids)}" txt="{rnd.choice(TZB_LOOT_NAMES)}" count="{rnd.randint(1, 4)}" />')
+                else:
+                    lines.append(f'<a sf="{sf}" t="6" run="{rnd.randint(1, 5)}" />')
+            lines.append('</USER>')
+        for login in monster_logins[:10]:
+            lines.append(f'<USER login="{login}" HP="{rnd.randint(0, 60)}" />')
+        lines.append('</TURN>')
+
+    body = "\n".join(lines) + "\n"
+    if duplicate:
+        return "<BLOOK>" + body + body + "</BLOOK>"
+    return body
+
+
 def generate_battle_log(index):
     """Генерирует один лог боя"""
     # Параметры боя
@@ -117,12 +188,19 @@ def main():
     """Генерирует тестовые логи"""
     # Количество логов для генерации
     num_logs = 100
+    # --tzb: логи в формате игрового сервера (BATTLE/TURN/USER), а не в XML-шаблоне выше
+    tzb_format = "--tzb" in sys.argv[1:]
+    BASE_DIR.mkdir(parents=True, exist_ok=True)
     
     print(f"Генерация {num_logs} тестовых .tzb файлов...")
     
     for i in range(num_logs):
         index = random.randint(1000000, 9999999)
-        log_content = generate_battle_log(index)
+        if tzb_format:
+            log_content = generate_tzb_battle(index, players=random.randint(2, 20), monsters=random.randint(0, 30),
+                                              turns=random.randint(5, 40))
+        else:
+            log_content = generate_battle_log(index)
         
         # Имя файла
         filename = f"{index}.tzb"
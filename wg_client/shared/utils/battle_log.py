@@ -0,0 +1,46 @@
+"""
+Очистка лога боя на входе: один раз, при получении ответа <BLOOK>
+
+Сервер отвечает на //blook обёрткой <BLOOK> с продублированным телом боя
+(<BATTLE ...>...</BATTLE><TURN>... дважды подряд). FrameReader.next_frame_cut(BATTLE_TAG)
+обрезает кадр на втором <BATTLE, не накапливая дубль; clean_blook достаёт из кадра
+тело первого боя без обёртки и дописывает в конец CLEAN_MARKER.
+
+Парсеры (example/parser: dedupe_tzb, battle_parser) по маркеру в конце файла
+понимают, что дубля нет, и не сканируют лог повторно. Маркер — XML-комментарий:
+первая строка остаётся <BATTLE ...>, разбору тегов он не мешает.
+"""
+
+from typing import Optional, Union
+
+from shared.utils.frame_reader import Frame
+
+BATTLE_TAG = b"<BATTLE"
+# Та же строка — в example/parser/battle_parser.py и dedupe_tzb.py (они импортируются без shared)
+CLEAN_MARKER = b"<!--tzb:clean-->"
+CLEAN_MARKER_STR = CLEAN_MARKER.decode("ascii")
+
+
+def is_clean(content: Union[str, bytes]) -> bool:
+    """Лог уже очищен на входе (проверка конца строки, без сканирования)"""
+    marker = CLEAN_MARKER if isinstance(content, (bytes, bytearray)) else CLEAN_MARKER_STR
+    return content.endswith(marker)
+
+
+def clean_blook(frame: Frame) -> Optional[bytes]:
+    """
+    Тело первого боя из кадра <BLOOK> с маркером очистки или None
+
+    Кадр берётся из next_frame_cut(BATTLE_TAG): обрезанный кадр заканчивается перед
+    дублем, необрезанный (боя без дубля) — закрывающим </BLOOK>. Кадр без </BLOOK>
+    и без дубля — неполный ответ.
+    """
+    if b"<BLOOK" not in frame:
+        return None
+    start = frame.find(BATTLE_TAG)
+    if start == -1:
+        return None
+    end = len(frame) if frame.cut else frame.find(b"</BLOOK>", start)
+    if end == -1:
+        return None
+    return frame.copy(start, end) + CLEAN_MARKER
@@ -0,0 +1,264 @@
+"""
+Кодеки хранения логов боёв: gzip (по умолчанию) и zstd со словарём
+
+Логи разных боёв очень похожи (теги, имена атрибутов, строки карты, логины
+монстров), поэтому zstd со словарём, обученным на выборке наших логов, жмёт
+отдельный бой заметно лучше gzip — см. btl_compressor/bench_codecs.py.
+
+Словари лежат рядом с архивом и версионируются: {root}/dicts/tzb-{version}.zdict,
+где version — dict_id словаря. zstd пишет dict_id в заголовок кадра, поэтому
+читатель сам выбирает нужную версию; старые словари не удаляются и не
+перезаписываются, новые получают следующий номер.
+
+Формат определяется по магии, а не по расширению: decode() понимает gzip,
+zstd (со словарём и без) и несжатый лог. zstandard — опциональная зависимость:
+без неё gzip и несжатые логи читаются как раньше.
+"""
+
+import gzip
+import os
+import re
+import struct
+import threading
+import zlib
+from typing import BinaryIO, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # опционально
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DICT_DIR = "dicts"
+DICT_SIZE = 112 * 1024
+CHUNK = 256 * 1024
+# Заголовок кадра zstd — не длиннее 18 байт: столько нужно, чтобы узнать dict_id и размер
+_HEAD = 18
+_DICT_NAME = re.compile(r"^tzb-(\d+)\.zdict$")
+
+LOGS_CODEC = os.getenv("LOGS_CODEC", "gzip")
+LOGS_ZSTD_LEVEL = int(os.getenv("LOGS_ZSTD_LEVEL", "9"))
+# Версия словаря для записи: пусто — последняя обученная, 0 — без словаря
+LOGS_ZSTD_DICT_VERSION = os.getenv("LOGS_ZSTD_DICT_VERSION", "")
+
+
+class CodecError(Exception):
+    """Лог нельзя декодировать: нет zstandard или словаря нужной версии"""
+
+
+def dict_path(root: str, version: int) -> str:
+    return os.path.join(root, DICT_DIR, f"tzb-{version}.zdict")
+
+
+class DictRegistry:
+    """Словари zstd одного хранилища; загружаются по требованию и кэшируются"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self._dicts: Dict[int, "zstandard.ZstdCompressionDict"] = {}
+        self._lock = threading.Lock()
+
+    def versions(self) -> List[int]:
+        try:
+            names = os.listdir(os.path.join(self.root, DICT_DIR))
+        except FileNotFoundError:
+            return []
+        return sorted(int(m.group(1)) for m in map(_DICT_NAME.match, names) if m)
+
+    def latest(self) -> Optional[int]:
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def get(self, version: int) -> "zstandard.ZstdCompressionDict":
+        d = self._dicts.get(version)
+        if d is None:
+            try:
+                with open(dict_path(self.root, version), "rb") as f:
+                    d = zstandard.ZstdCompressionDict(f.read())
+            except FileNotFoundError:
+                raise CodecError(f"zstd dictionary v{version} not found in {os.path.join(self.root, DICT_DIR)}")
+            with self._lock:
+                self._dicts.setdefault(version, d)
+        return d
+
+    def train(self, samples: List[bytes], dict_size: int = DICT_SIZE) -> int:
+        """Обучить словарь следующей версии на выборке логов и сохранить; возвращает версию"""
+        if zstandard is None:
+            raise CodecError("zstandard is not installed")
+        version = (self.latest() or 0) + 1
+        trained = zstandard.train_dictionary(dict_size, samples, dict_id=version)
+        path = dict_path(self.root, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(trained.as_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # Существующую версию не перезаписываем: на неё ссылаются уже сжатые логи
+        os.link(tmp, path)
+        os.unlink(tmp)
+        return version
+
+
+def decode(data: bytes, dicts: Optional[DictRegistry] = None) -> bytes:
+    """Лог из gzip, zstd или как есть (несжатый)"""
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        return _zstd_decompressor(data, dicts).decompress(data)
+    return bytes(data)
+
+
+def _zstd_decompressor(head: bytes, dicts: Optional[DictRegistry]):
+    if zstandard is None:
+        raise CodecError("zstd-compressed log, but zstandard is not installed")
+    dict_id = zstandard.get_frame_parameters(head).dict_id
+    if dict_id and dicts is None:
+        raise CodecError(f"zstd log needs dictionary v{dict_id}, no dictionary store given")
+    return zstandard.ZstdDecompressor(dict_data=dicts.get(dict_id) if dict_id else None)
+
+
+def decoded_length(head: bytes, tail: bytes, size: int) -> Optional[int]:
+    """
+    Длина распакованного лога без распаковки или None
+
+    gzip — ISIZE из трейлера (одночленный gzip, как пишут наши писатели), zstd —
+    размер из заголовка кадра, несжатый — size. head — первые байты, tail — последние 4.
+    """
+    if head[:2] == GZIP_MAGIC:
+        return struct.unpack("<I", tail[-4:])[0] if len(tail) >= 4 else None
+    if head[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            return None
+        try:
+            content_size = zstandard.get_frame_parameters(head[:_HEAD]).content_size
+        except zstandard.ZstdError:
+            return None
+        return None if content_size == zstandard.CONTENTSIZE_UNKNOWN else content_size
+    return size
+
+
+class StreamDecoder:
+    """
+    Потоковая распаковка кусками: в памяти — кусок, а не весь лог
+
+    Формат определяется по первым байтам (как в decode): gzip (в том числе из
+    нескольких членов), zstd со словарём из заголовка кадра или несжатый поток.
+    """
+
+    def __init__(self, dicts: Optional[DictRegistry] = None):
+        self._dicts = dicts
+        self._head = b""
+        self._kind: Optional[str] = None
+        self._impl = None
+
+    def _start(self, head: bytes) -> None:
+        if head[:2] == GZIP_MAGIC:
+            self._kind = "gzip"
+            self._impl = zlib.decompressobj(31)
+        elif head[:4] == ZSTD_MAGIC:
+            self._kind = "zstd"
+            self._impl = _zstd_decompressor(head, self._dicts).decompressobj()
+        else:
+            self._kind = "plain"
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self._kind is None:
+            self._head += chunk
+            if len(self._head) < _HEAD:
+                return b""
+            chunk, self._head = self._head, b""
+            self._start(chunk)
+        if self._kind == "plain":
+            return bytes(chunk)
+        if self._kind == "zstd":
+            return self._impl.decompress(chunk)
+        out = []
+        while chunk:
+            if self._impl is None:
+                self._impl = zlib.decompressobj(31)
+            out.append(self._impl.decompress(chunk))
+            if not self._impl.eof:
+                break
+            # Следующий член gzip
+            chunk = self._impl.unused_data
+            self._impl = None
+        return b"".join(out)
+
+    def flush(self) -> bytes:
+        """Конец потока: хвост короткого лога или ошибка, если сжатый поток оборван"""
+        if self._kind is None:
+            if not self._head:
+                return b""
+            head, self._head = self._head, b""
+            self._start(head)
+            return self.feed(head) + self.flush()
+        if self._kind == "gzip" and self._impl is not None:
+            raise CodecError("truncated gzip stream")
+        if self._kind == "zstd" and not self._impl.eof:
+            raise CodecError("truncated zstd stream")
+        return b""
+
+
+class Encoder:
+    """
+    Сжатие лога для хранения: gzip или zstd (со словарём последней версии)
+
+    Потокобезопасен: у каждого потока свой ZstdCompressor.
+    """
+
+    def __init__(self, codec: str = "gzip", root: Optional[str] = None, level: Optional[int] = None,
+                 dict_version: Optional[int] = None):
+        if codec not in ("gzip", "zstd"):
+            raise ValueError(f"unknown codec: {codec}")
+        self.codec = codec
+        self.dict_version = None
+        if codec == "gzip":
+            self.level = 6 if level is None else level
+            return
+        if zstandard is None:
+            raise CodecError("LOGS_CODEC=zstd, but zstandard is not installed")
+        self.level = LOGS_ZSTD_LEVEL if level is None else level
+        self._dict = None
+        if dict_version is None and root is not None:
+            dict_version = DictRegistry(root).latest()
+        if dict_version:
+            self._dict = DictRegistry(root).get(dict_version)
+            self.dict_version = dict_version
+        self._local = threading.local()
+
+    @property
+    def suffix(self) -> str:
+        """Расширение отдельного файла лога"""
+        return ".gz" if self.codec == "gzip" else ".zst"
+
+    def _compressor(self) -> "zstandard.ZstdCompressor":
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._dict)
+            self._local.compressor = compressor
+        return compressor
+
+    def encode(self, data: bytes) -> bytes:
+        if self.codec == "gzip":
+            return gzip.compress(data, self.level, mtime=0)
+        return self._compressor().compress(data)
+
+    def encode_file(self, f: BinaryIO, size: Optional[int] = None) -> bytes:
+        """Сжатие из файла кусками: в памяти только результат, а не весь лог"""
+        if self.codec == "gzip":
+            comp = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        else:
+            comp = self._compressor().compressobj(size=-1 if size is None else size)
+        out = []
+        while chunk := f.read(CHUNK):
+            out.append(comp.compress(chunk))
+        out.append(comp.flush())
+        return b"".join(out)
+
+
+def encoder_from_env(root: str) -> Encoder:
+    """Кодек записи по LOGS_CODEC / LOGS_ZSTD_LEVEL / LOGS_ZSTD_DICT_VERSION"""
+    version = int(LOGS_ZSTD_DICT_VERSION) if LOGS_ZSTD_DICT_VERSION else None
+    return Encoder(LOGS_CODEC, root=root, dict_version=version)
@@ -0,0 +1,242 @@
+"""
+Пакованное хранилище логов боёв: сегмент на шард вместо файла на бой
+
+Раскладка в корне хранилища (тот же LOGS_STORE, что и у {shard}/{id}.tzb.gz):
+
+    {shard}.pack — PACK_MAGIC, затем сжатые члены подряд; только дозапись
+    {shard}.idx  — INDEX_HEADER, затем divisor слотов SLOT по battle_id % divisor:
+                   [offset u64][length u32][crc32 u32], little-endian; length=0 — боя нет
+
+Каждый член — самостоятельный gzip-файл боя: /gz отдаёт его байты как есть, без
+пересжатия. При LOGS_CODEC=zstd член — кадр zstd со словарём (shared.utils.btl_codec);
+read_raw различает форматы по магии. Индекс фиксированной ширины (разреженный
+файл): поиск — один pread.
+
+Запись: член дописывается в конец .pack, затем слот переписывается одним pwrite;
+процессы (api_mother, btl_compressor, миграция) сериализуются flock на .idx.
+Падение между шагами оставляет в конце сегмента ничейные байты, но не битый
+слот. Повторная запись боя дописывает новый член и перенаправляет слот.
+
+Чтение: .pack отображается через mmap (перемапливается, когда сегмент вырос),
+crc32 члена сверяется со слотом.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterator, Optional, Tuple
+
+from shared.utils.btl_codec import DictRegistry, Encoder, decode
+
+PACK_MAGIC = b"TZBPACK1"
+INDEX_MAGIC = b"TZBIDX01"
+INDEX_HEADER = struct.Struct("<8sII")  # magic, divisor, reserved
+SLOT = struct.Struct("<QII")  # offset, length, crc32
+DEFAULT_DIVISOR = 50000
+
+
+class PackError(Exception):
+    """Повреждённый или несовместимый пак"""
+
+
+def gzip_member(data: bytes, level: int = 6) -> bytes:
+    """Самостоятельный gzip-член (формат .tzb.gz)"""
+    comp = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return comp.compress(data) + comp.flush()
+
+
+def _pwrite_all(fd: int, data: bytes, offset: int) -> None:
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+class _Shard:
+    """Пара файлов шарда; дескрипторы и mmap живут, пока жив PackStore"""
+
+    def __init__(self, root: str, shard: int, divisor: int, writable: bool):
+        self.shard = shard
+        self.divisor = divisor
+        self.pack_path = os.path.join(root, f"{shard}.pack")
+        self.idx_path = os.path.join(root, f"{shard}.idx")
+        self._lock = threading.Lock()
+        self._map: Optional[mmap.mmap] = None
+        if writable:
+            os.makedirs(root, exist_ok=True)
+            flags = os.O_RDWR | os.O_CREAT | os.O_CLOEXEC
+        else:
+            flags = os.O_RDONLY | os.O_CLOEXEC
+        self.idx_fd = os.open(self.idx_path, flags, 0o644)
+        try:
+            self.pack_fd = os.open(self.pack_path, flags, 0o644)
+        except OSError:
+            os.close(self.idx_fd)
+            raise
+        if writable:
+            self._init_files()
+        self._check_header()
+
+    def _init_files(self) -> None:
+        fcntl.flock(self.idx_fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.pack_fd).st_size == 0:
+                _pwrite_all(self.pack_fd, PACK_MAGIC, 0)
+            if os.fstat(self.idx_fd).st_size == 0:
+                _pwrite_all(self.idx_fd, INDEX_HEADER.pack(INDEX_MAGIC, self.divisor, 0), 0)
+                os.ftruncate(self.idx_fd, INDEX_HEADER.size + self.divisor * SLOT.size)
+        finally:
+            fcntl.flock(self.idx_fd, fcntl.LOCK_UN)
+
+    def _check_header(self) -> None:
+        magic, divisor, _ = INDEX_HEADER.unpack(os.pread(self.idx_fd, INDEX_HEADER.size, 0).ljust(INDEX_HEADER.size, b"\0"))
+        if magic != INDEX_MAGIC or os.pread(self.pack_fd, len(PACK_MAGIC), 0) != PACK_MAGIC:
+            raise PackError(f"{self.idx_path}: not a battle pack")
+        if divisor != self.divisor:
+            raise PackError(f"{self.idx_path}: divisor {divisor}, expected {self.divisor}")
+
+    def _slot_pos(self, battle_id: int) -> int:
+        return INDEX_HEADER.size + (battle_id % self.divisor) * SLOT.size
+
+    def slot(self, battle_id: int) -> Optional[Tuple[int, int, int]]:
+        raw = os.pread(self.idx_fd, SLOT.size, self._slot_pos(battle_id))
+        if len(raw) < SLOT.size:
+            return None
+        offset, length, crc = SLOT.unpack(raw)
+        return (offset, length, crc) if length else None
+
+    def _view(self, end: int) -> mmap.mmap:
+        view = self._map
+        if view is None or len(view) < end:
+            with self._lock:
+                view = self._map
+                if view is None or len(view) < end:
+                    # Старое отображение не закрывается явно: его может читать другой поток
+                    view = mmap.mmap(self.pack_fd, 0, access=mmap.ACCESS_READ)
+                    self._map = view
+        if len(view) < end:
+            raise PackError(f"{self.pack_path}: slot points past the end of segment")
+        return view
+
+    def get(self, battle_id: int) -> Optional[bytes]:
+        slot = self.slot(battle_id)
+        if slot is None:
+            return None
+        offset, length, crc = slot
+        data = self._view(offset + length)[offset:offset + length]
+        if zlib.crc32(data) != crc:
+            raise PackError(f"{self.pack_path}: crc mismatch for battle {battle_id}")
+        return data
+
+    def put(self, battle_id: int, member: bytes, fsync: bool) -> None:
+        crc = zlib.crc32(member)
+        with self._lock:
+            fcntl.flock(self.idx_fd, fcntl.LOCK_EX)
+            try:
+                offset = os.fstat(self.pack_fd).st_size
+                _pwrite_all(self.pack_fd, member, offset)
+                if fsync:
+                    os.fdatasync(self.pack_fd)
+                _pwrite_all(self.idx_fd, SLOT.pack(offset, len(member), crc), self._slot_pos(battle_id))
+                if fsync:
+                    os.fdatasync(self.idx_fd)
+            finally:
+                fcntl.flock(self.idx_fd, fcntl.LOCK_UN)
+
+    def battle_ids(self) -> Iterator[int]:
+        """Бои шарда по индексу"""
+        base = self.shard * self.divisor
+        raw = os.pread(self.idx_fd, self.divisor * SLOT.size, INDEX_HEADER.size)
+        for i, (_, length, _) in enumerate(SLOT.iter_unpack(raw[:len(raw) - len(raw) % SLOT.size])):
+            if length:
+                yield base + i
+
+    def sync(self) -> None:
+        os.fsync(self.pack_fd)
+        os.fsync(self.idx_fd)
+
+    def close(self) -> None:
+        self._map = None
+        os.close(self.pack_fd)
+        os.close(self.idx_fd)
+
+
+class PackStore:
+    """
+    Паки всех шардов в корне хранилища
+
+    writable=False — только чтение: шард, которого ещё нет на диске, считается пустым
+    (и проверяется снова при следующем обращении). Потокобезопасен.
+    """
+
+    def __init__(self, root: str, divisor: int = DEFAULT_DIVISOR, writable: bool = False, fsync: bool = False,
+                 encoder: Optional[Encoder] = None):
+        self.root = root
+        self.divisor = divisor
+        self.writable = writable
+        self.fsync = fsync
+        self.encoder = encoder
+        self.dicts = DictRegistry(root)
+        self._shards: Dict[int, _Shard] = {}
+        self._lock = threading.Lock()
+
+    def _shard(self, battle_id: int, create: bool) -> Optional[_Shard]:
+        shard_no = battle_id // self.divisor
+        shard = self._shards.get(shard_no)
+        if shard is not None:
+            return shard
+        with self._lock:
+            shard = self._shards.get(shard_no)
+            if shard is None:
+                if not create and not os.path.exists(os.path.join(self.root, f"{shard_no}.idx")):
+                    return None
+                shard = _Shard(self.root, shard_no, self.divisor, self.writable)
+                self._shards[shard_no] = shard
+        return shard
+
+    def get(self, battle_id: int) -> Optional[bytes]:
+        """Член боя (байты .tzb.gz или кадр zstd) или None"""
+        shard = self._shard(battle_id, create=False)
+        return shard.get(battle_id) if shard else None
+
+    def read_raw(self, battle_id: int) -> Optional[bytes]:
+        """Распакованный лог боя или None"""
+        member = self.get(battle_id)
+        return decode(member, self.dicts) if member is not None else None
+
+    def __contains__(self, battle_id: int) -> bool:
+        shard = self._shard(battle_id, create=False)
+        return bool(shard and shard.slot(battle_id))
+
+    def put(self, battle_id: int, member: bytes) -> None:
+        """Дописать готовый сжатый член боя"""
+        if not self.writable:
+            raise PackError("pack store is read-only")
+        self._shard(battle_id, create=True).put(battle_id, member, self.fsync)
+
+    def put_raw(self, battle_id: int, data: bytes, level: int = 6) -> int:
+        """Сжать лог боя (кодеком encoder, иначе gzip) и дописать; возвращает размер члена"""
+        member = self.encoder.encode(data) if self.encoder else gzip_member(data, level)
+        self.put(battle_id, member)
+        return len(member)
+
+    def shard_battle_ids(self, shard_no: int) -> Iterator[int]:
+        shard = self._shard(shard_no * self.divisor, create=False)
+        return shard.battle_ids() if shard else iter(())
+
+    def sync(self) -> None:
+        """fsync всех открытых шардов (например, перед удалением исходных файлов)"""
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.sync()
+
+    def close(self) -> None:
+        with self._lock:
+            for shard in self._shards.values():
+                shard.close()
+            self._shards.clear()
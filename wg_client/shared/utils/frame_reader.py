@@ -0,0 +1,182 @@
+"""
+Чтение ответов игрового сервера кадрами без лишних копий
+
+Сервер шлёт XML-сообщения, разделённые \x00; внутри встречаются управляющие \x1f.
+FrameReader копит байты в одном bytearray и ищет разделитель (или закрывающий тег)
+только в новых байтах — от хвоста предыдущего поиска, а не с начала буфера.
+Кадр (Frame) — это границы в буфере: поиск идёт по ним без копирования,
+а наружу данные копируются один раз, сразу без управляющих байтов.
+
+Используется XML Worker (бои <BLOOK>) и API_5 (магазин <SH>).
+
+next_frame_cut обрезает кадр на повторе тега (дубль <BATTLE в ответе <BLOOK>):
+хвост кадра до разделителя отбрасывается прямо в feed(), не попадая в буфер.
+"""
+
+from typing import Optional
+
+CONTROL_BYTES = b"\x00\x1f"
+
+
+class Frame:
+    """
+    Кадр внутри буфера FrameReader (без копирования)
+
+    Действителен до следующего FrameReader.feed(): буфер может быть уплотнён.
+    cut — кадр обрезан на повторе тега (next_frame_cut), остаток сообщения отброшен.
+    """
+
+    __slots__ = ("_buf", "start", "end", "cut")
+
+    def __init__(self, buf: bytearray, start: int, end: int, cut: bool = False):
+        self._buf = buf
+        self.start = start
+        self.end = end
+        self.cut = cut
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def find(self, needle: bytes, start: int = 0) -> int:
+        """Позиция needle относительно начала кадра или -1"""
+        idx = self._buf.find(needle, self.start + start, self.end)
+        return -1 if idx == -1 else idx - self.start
+
+    def __contains__(self, needle: bytes) -> bool:
+        return self.find(needle) != -1
+
+    def copy(self, start: int = 0, end: Optional[int] = None, strip: bytes = CONTROL_BYTES) -> bytes:
+        """Байты кадра [start:end) — одна копия через memoryview, управляющие байты удаляются"""
+        end = len(self) if end is None else end
+        with memoryview(self._buf) as view:
+            data = view[self.start + start:self.start + end].tobytes()
+        # translate без удалённых байтов возвращает тот же объект — копии не добавляется
+        return data.translate(None, strip) if strip else data
+
+    def between(self, start_tag: bytes, end_tag: bytes, strip: bytes = CONTROL_BYTES) -> Optional[bytes]:
+        """Первый фрагмент от start_tag до end_tag включительно или None"""
+        start = self.find(start_tag)
+        if start == -1:
+            return None
+        end = self.find(end_tag, start)
+        if end == -1:
+            return None
+        return self.copy(start, end + len(end_tag), strip)
+
+
+class FrameReader:
+    """Буфер входящих байтов с инкрементальным поиском границ кадров"""
+
+    def __init__(self, delimiter: bytes = b"\x00", compact_threshold: int = 1 << 20):
+        self.delimiter = delimiter
+        self.compact_threshold = compact_threshold
+        self._buf = bytearray()
+        # Начало непрочитанных данных и позиция, до которой уже искали
+        self._pos = 0
+        self._scanned = 0
+        # next_frame_cut: первое вхождение тега в текущем кадре и докуда его искали
+        self._tag_first = -1
+        self._tag_scanned = 0
+        # Остаток обрезанного кадра ещё в пути — входящие байты до разделителя не храним
+        self._discard = False
+
+    @property
+    def pending(self) -> int:
+        """Байт в буфере, ещё не отданных кадрами"""
+        return len(self._buf) - self._pos
+
+    def clear(self) -> None:
+        self._buf.clear()
+        self._pos = 0
+        self._scanned = 0
+        self._tag_first = -1
+        self._tag_scanned = 0
+        self._discard = False
+
+    def feed(self, data: bytes) -> None:
+        """Добавить принятые байты (ранее выданные Frame после этого недействительны)"""
+        if self._discard:
+            idx = data.find(self.delimiter)
+            if idx == -1:
+                return
+            self._discard = False
+            data = data[idx + len(self.delimiter):]
+        if self._pos:
+            if self._pos == len(self._buf):
+                self._buf.clear()
+                self._pos = self._scanned = self._tag_scanned = 0
+            elif self._pos >= self.compact_threshold:
+                del self._buf[:self._pos]
+                self._scanned -= self._pos
+                self._tag_scanned = max(0, self._tag_scanned - self._pos)
+                if self._tag_first != -1:
+                    self._tag_first -= self._pos
+                self._pos = 0
+        self._buf += data
+
+    def next_frame(self) -> Optional[Frame]:
+        """Следующий кадр до разделителя (без него) или None, если кадр ещё не дочитан"""
+        return self._take(self.delimiter, include=False)
+
+    def next_frame_cut(self, tag: bytes) -> Optional[Frame]:
+        """
+        Кадр до разделителя или до второго вхождения tag — что раньше
+
+        Обрезанный кадр (cut=True) выдаётся, как только пришёл повтор тега: остаток
+        сообщения до разделителя отбрасывается по мере поступления и не копится в буфере.
+        """
+        delimiter_from = max(self._pos, self._scanned - len(self.delimiter) + 1)
+        idx = self._buf.find(self.delimiter, delimiter_from)
+        limit = len(self._buf) if idx == -1 else idx
+
+        tag_from = max(self._pos, self._tag_scanned - len(tag) + 1)
+        if self._tag_first == -1:
+            first = self._buf.find(tag, tag_from, limit)
+            if first != -1:
+                self._tag_first = first
+                tag_from = first + 1
+        if self._tag_first != -1:
+            second = self._buf.find(tag, max(tag_from, self._tag_first + 1), limit)
+            if second != -1:
+                frame = Frame(self._buf, self._pos, second, cut=True)
+                if idx == -1:
+                    # Разделитель ещё не пришёл: всё, что придёт до него, отбросит feed()
+                    self._pos = self._scanned = len(self._buf)
+                    self._discard = True
+                else:
+                    self._pos = self._scanned = idx + len(self.delimiter)
+                self._tag_first = -1
+                self._tag_scanned = self._pos
+                return frame
+
+        if idx == -1:
+            self._scanned = self._tag_scanned = len(self._buf)
+            return None
+        frame = Frame(self._buf, self._pos, idx)
+        self._pos = self._scanned = self._tag_scanned = idx + len(self.delimiter)
+        self._tag_first = -1
+        return frame
+
+    def next_until(self, end_tag: bytes) -> Optional[Frame]:
+        """Данные до end_tag включительно (для ответов без разделителя, например </SH>)"""
+        return self._take(end_tag, include=True)
+
+    def take_pending(self) -> Frame:
+        """Всё непрочитанное (например, хвост ответа, когда сервер закрыл соединение)"""
+        frame = Frame(self._buf, self._pos, len(self._buf))
+        self._pos = self._scanned = self._tag_scanned = len(self._buf)
+        self._tag_first = -1
+        return frame
+
+    def _take(self, needle: bytes, include: bool) -> Optional[Frame]:
+        # Совпадение может начаться в последних len(needle) - 1 байтах прошлого поиска
+        search_from = max(self._pos, self._scanned - len(needle) + 1)
+        idx = self._buf.find(needle, search_from)
+        if idx == -1:
+            self._scanned = len(self._buf)
+            return None
+        end = idx + len(needle)
+        frame = Frame(self._buf, self._pos, end if include else idx)
+        self._pos = self._scanned = self._tag_scanned = end
+        self._tag_first = -1
+        return frame
@@ -11,6 +11,10 @@ class BaseSettings:
     max_workers: int = int(os.getenv("MAX_WORKERS", "4"))
     retry_attempts: int = int(os.getenv("RETRY_ATTEMPTS", "3"))
     retry_delay: float = float(os.getenv("RETRY_DELAY", "1.0"))
+    # Пул процессов для парсинга (0 — без пула, парсинг в потоке); пусто — по числу ядер
+    parse_workers: int = int(os.getenv("PARSE_WORKERS") or os.cpu_count() or 1)
+    # Сколько распарсенных боёв может ждать записи в БД (очередь между парсингом и записью)
+    parse_queue_size: int = int(os.getenv("PARSE_QUEUE_SIZE", "32"))
 
 
 
@@ -0,0 +1,337 @@
+"""
+Долгоживущие сессии с игровым сервером для XML Worker (asyncio streams)
+
+Протокол: каждое сообщение (и запрос, и ответ) завершается байтом \x00.
+Ответы читаются кадрами до \x00 (shared.utils.frame_reader) — без пауз и «дренажа» сокета:
+- авторизация: LOGIN + GETME одной записью, ждём кадр <MYPARAM (или <ERROR);
+- бой: //blook + GETMYBATTLE одной записью, ждём кадр <BLOOK> нужного battleid;
+  кадр обрезается на дубле <BATTLE (shared.utils.battle_log) — наружу уходит
+  одно тело боя с маркером очистки, дубль в память не попадает.
+
+Все операции неблокирующие: пока сессия ждёт сервер, цикл событий воркера
+обслуживает /health и другие сессии. Каждый запрос ограничен своим дедлайном,
+отмена запроса (CancelledError) помечает сессию broken — при следующей выдаче
+она переподключится, а не прочитает чужой хвост.
+
+SessionPool держит авторизованные сессии аккаунтов между батчами, пингует
+простаивающие (<N />) и переподключается с повторной авторизацией при обрыве.
+"""
+
+import asyncio
+import logging
+import re
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Sequence, Tuple
+
+from shared.utils.battle_log import BATTLE_TAG, clean_blook
+from shared.utils.frame_reader import Frame, FrameReader
+
+logger = logging.getLogger("app.game_session")
+
+_BATTLE_ID_RE = re.compile(rb'battleid="(\d+)"')
+
+
+class GameProtocolError(ConnectionError):
+    """Сессия непригодна: обрыв, таймаут кадра или ошибка авторизации"""
+
+
+class GameTimeoutError(GameProtocolError):
+    """Сервер не ответил на запрос за его дедлайн"""
+
+
+class GameConn:
+    """Одна авторизованная TCP-сессия аккаунта с игровым сервером."""
+
+    def __init__(self, host: str, port: int, login: str, key: str, connect_timeout: float = 10.0):
+        self.host = host
+        self.port = int(port)
+        self.login = login
+        self.key = key
+        self.connect_timeout = connect_timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._frames = FrameReader()
+        self.last_used = 0.0
+        self.broken = False
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.broken
+
+    def is_alive(self) -> bool:
+        """Сокет не закрыт ни нами, ни сервером (проверка без ожидания)."""
+        if not self.connected:
+            return False
+        if self.writer.is_closing() or self.reader.at_eof():
+            self.broken = True
+            return False
+        return True
+
+    async def close(self):
+        """Безопасное закрытие соединения."""
+        writer, self.reader, self.writer = self.writer, None, None
+        self._frames.clear()
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), 1.0)
+            logger.debug("🔌 Соединение закрыто")
+        except Exception as e:
+            logger.debug(f"Ошибка при закрытии сокета: {e}")
+
+    async def connect_and_auth(self):
+        """Подключение и авторизация: LOGIN и GETME одной записью, ответ — кадр MYPARAM."""
+        await self.close()
+        self.broken = False
+        loop = asyncio.get_running_loop()
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+                login_xml = f'<LOGIN v3="10.20.30.40" lang="ru" v2="4875537" v="108" p="{self.key}" l="{self.login}" />\x00'
+                await self._send(login_xml.encode("utf-8") + b"<GETME />\x00")
+
+                # Приветствие и ответ на LOGIN пропускаем — сессия активна, когда пришёл MYPARAM
+                while True:
+                    frame = await self._read_frame()
+                    if b"<ERROR" in frame:
+                        raise GameProtocolError(f"Ошибка авторизации: {frame.copy(0, min(len(frame), 100))!r}")
+                    if b"<MYPARAM" in frame:
+                        break
+
+            self.last_used = loop.time()
+            logger.info(f"✅ Подключено к {self.host}:{self.port} как {self.login}")
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                logger.error(f"❌ Ошибка подключения {self.login}: {e}")
+            self.broken = True
+            await self.close()
+            if isinstance(e, (TimeoutError, OSError)) and not isinstance(e, GameProtocolError):
+                raise GameProtocolError(f"подключение {self.host}:{self.port}: {e!r}") from e
+            raise
+
+    async def _send(self, data: bytes):
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except OSError as e:
+            self.broken = True
+            raise GameProtocolError(f"ошибка отправки: {e}") from e
+
+    async def _read_frame(self, cut_at: Optional[bytes] = None) -> Frame:
+        """
+        Следующий кадр (сообщение до \x00, без разделителя)
+
+        Кадр — границы в буфере сессии, действителен до следующего вызова.
+        cut_at — обрезать кадр на втором вхождении тега (FrameReader.next_frame_cut).
+        Дедлайн задаёт вызывающий код (asyncio.timeout) — ожидание данных не блокирует цикл событий.
+
+        Raises:
+            GameProtocolError: сервер закрыл соединение
+        """
+        while True:
+            frame = self._frames.next_frame() if cut_at is None else self._frames.next_frame_cut(cut_at)
+            if frame is not None:
+                return frame
+
+            try:
+                chunk = await self.reader.read(65536)
+            except OSError as e:
+                self.broken = True
+                raise GameProtocolError(f"ошибка чтения: {e}") from e
+            if not chunk:
+                self.broken = True
+                raise GameProtocolError("сервер закрыл соединение")
+            self._frames.feed(chunk)
+
+    async def ping(self) -> bool:
+        """Keep-alive <N />; False — сессию нужно переподключить."""
+        if not self.is_alive():
+            return False
+        try:
+            async with asyncio.timeout(self.connect_timeout):
+                await self._send(b"<N />\x00")
+        except (GameProtocolError, TimeoutError) as e:
+            logger.warning(f"keep-alive {self.login}: {e}")
+            self.broken = True
+            return False
+        self.last_used = asyncio.get_running_loop().time()
+        return True
+
+    async def fetch_one_blook(self, battle_id: int, hard_timeout: float = 20.0) -> Optional[str]:
+        """
+        Запрашивает один бой и читает кадры до <BLOOK> этого боя (без дубля <BATTLE).
+
+        Кадры других боёв (запоздавшие ответы на прошлые запросы) пропускаются.
+
+        Args:
+            battle_id: ID боя
+            hard_timeout: Дедлайн запроса целиком (отправка + ответ)
+
+        Returns:
+            XML строка (тело боя + CLEAN_MARKER) или None, если сервер ответил ERROR
+
+        Raises:
+            GameTimeoutError: дедлайн — сессия помечается broken
+            GameProtocolError: обрыв — сессия помечается broken
+        """
+        if not self.connected:
+            raise GameProtocolError(f"{battle_id}: сокет не инициализирован")
+
+        try:
+            async with asyncio.timeout(hard_timeout):
+                return await self._request_blook(battle_id)
+        except TimeoutError as e:
+            self.broken = True
+            raise GameTimeoutError(f"{battle_id}: дедлайн {hard_timeout}с (в буфере {self._frames.pending} байт)") from e
+        except asyncio.CancelledError:
+            # Ответ на отменённый запрос ещё может прийти — сессию не переиспользуем как есть
+            self.broken = True
+            raise
+
+    async def _request_blook(self, battle_id: int) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        # Обе команды — одной записью: сервер сам разделяет их по \x00
+        await self._send(f'<POST t="//blook {battle_id}" />\x00<GETMYBATTLE />\x00'.encode("utf-8"))
+        while True:
+            frame = await self._read_frame(cut_at=BATTLE_TAG)
+            if b"<ERROR" in frame:
+                error = frame.copy(0, min(len(frame), 200)).decode("utf-8", errors="replace")
+                logger.warning(f"⚠️ {battle_id}: сервер вернул ERROR: {error}")
+                self.last_used = loop.time()
+                return None
+            # Единственная копия ответа — без обёртки, дубля и \x1f
+            blook = clean_blook(frame)
+            if blook is None:
+                continue
+
+            # Проверяем что это правильный бой
+            match = _BATTLE_ID_RE.search(blook)
+            if match and int(match.group(1)) != battle_id:
+                logger.warning(f"⚠️ Запросили {battle_id}, получили {int(match.group(1))} — пропускаем")
+                continue
+
+            self.last_used = loop.time()
+            return blook.decode("utf-8", errors="replace")
+
+
+def parse_accounts(spec: str) -> List[Tuple[str, str]]:
+    """Список аккаунтов из строки "login:key,login2:key2" (пустые элементы пропускаются)."""
+    accounts = []
+    for item in spec.split(","):
+        login, sep, key = item.strip().rpartition(":")
+        if sep and login and key:
+            accounts.append((login.strip(), key.strip()))
+    return accounts
+
+
+class SessionPool:
+    """
+    Пул авторизованных сессий аккаунтов воркера
+
+    На каждый аккаунт — size сессий. Сессии переживают батчи; простаивающие
+    дольше keepalive_interval пингуются фоновой задачей, мёртвые переподключаются
+    с повторной авторизацией при выдаче.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        accounts: Sequence[Tuple[str, str]],
+        size: int = 1,
+        keepalive_interval: float = 20.0,
+    ):
+        self.host = host
+        self.port = int(port)
+        self.accounts = list(accounts)
+        self.size = max(1, size)
+        self.keepalive_interval = keepalive_interval
+        self._sessions: List[GameConn] = [
+            GameConn(self.host, self.port, login, key)
+            for login, key in self.accounts
+            for _ in range(self.size)
+        ]
+        self._idle: Deque[GameConn] = deque(self._sessions)
+        self._cond = asyncio.Condition()
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self.reauths = 0
+        self.pings = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._sessions)
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[GameConn]:
+        """Выдать живую авторизованную сессию (ждёт, если все заняты)."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: bool(self._idle))
+            conn = self._idle.popleft()
+        try:
+            await self.ensure_ready(conn)
+            yield conn
+        finally:
+            async with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    async def ensure_ready(self, conn: GameConn) -> None:
+        """Проверить сессию перед запросом; мёртвую — переподключить и авторизовать заново."""
+        if conn.is_alive():
+            return
+        if conn.last_used:
+            self.reauths += 1
+            logger.info(f"🔄 {conn.login}: повторная авторизация")
+        await conn.connect_and_auth()
+
+    async def keepalive(self) -> None:
+        """Пинг простаивающих сессий (занятые сессии не трогаем)."""
+        async with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        try:
+            now = asyncio.get_running_loop().time()
+            for conn in idle:
+                if conn.connected and now - conn.last_used >= self.keepalive_interval:
+                    if await conn.ping():
+                        self.pings += 1
+        finally:
+            async with self._cond:
+                self._idle.extend(idle)
+                self._cond.notify_all()
+
+    async def _keepalive_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.keepalive_interval / 2)
+            try:
+                await self.keepalive()
+            except Exception as e:
+                logger.warning(f"keep-alive: {e}")
+
+    def start_keepalive(self) -> None:
+        if self._keepalive_task is None:
+            self._keepalive_task = asyncio.get_running_loop().create_task(self._keepalive_loop())
+
+    async def close(self) -> None:
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        for conn in self._sessions:
+            await conn.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "accounts": [login for login, _ in self.accounts],
+            "sessions": self.capacity,
+            "idle": len(self._idle),
+            "connected": sum(1 for conn in self._sessions if conn.connected),
+            "reauths": self.reauths,
+            "pings": self.pings,
+        }
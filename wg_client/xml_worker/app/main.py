@@ -1,17 +1,21 @@
 """
-XML Worker - ЭПИЗОДИЧЕСКОЕ соединение (context manager)
-Открыть → авторизоваться → забрать батч → закрыть
+XML Worker - ДОЛГОЖИВУЩИЕ сессии аккаунтов (SessionPool, asyncio)
+Авторизация один раз → батчи по уже открытым сессиям → keep-alive между батчами
+Каждый бой уходит в api_mother сразу после </BLOOK> (из памяти, без перечитывания файла)
 """
+import asyncio
+import gzip
 import os
-import socket
-import time
 import logging
-import re
-from typing import Optional, List
+import struct
+import zlib
+from typing import Dict, Optional, List, Set
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import httpx
 
+from app.game_session import GameProtocolError, GameTimeoutError, SessionPool, parse_accounts
+
 # Логирование
 logging.basicConfig(
     level=logging.INFO,
@@ -24,173 +28,65 @@ WORKER_ID = os.getenv("WORKER_ID", "unknown")
 LOGIN_NAME = os.getenv("LOGIN_NAME", "")
 LOGIN_KEY = os.getenv("LOGIN_KEY", "")
 API_MOTHER_URL = os.getenv("API_MOTHER_URL", "http://host-api-service-api_mother-1:8083")
+GAME_SERVER_HOST = os.getenv("GAME_SERVER_HOST", "185.92.72.18")
+GAME_SERVER_PORT = int(os.getenv("GAME_SERVER_PORT", "5190"))
+GAME_SESSIONS = int(os.getenv("GAME_SESSIONS", "1"))
+GAME_KEEPALIVE_INTERVAL = float(os.getenv("GAME_KEEPALIVE_INTERVAL", "20"))
+BLOOK_TIMEOUT = float(os.getenv("BLOOK_TIMEOUT", "20"))
+
+# Загрузка в api_mother: single — запрос на бой, bulk — один потоковый /upload/bulk на батч;
+# одновременных запросов, сжатие тела, копия в /srv/btl/raw воркера
+UPLOAD_MODE = os.getenv("UPLOAD_MODE", "single")
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_GZIP = os.getenv("UPLOAD_GZIP", "0") == "1"
+UPLOAD_GZIP_LEVEL = 6
+SAVE_RAW_FILES = os.getenv("SAVE_RAW_FILES", "1") == "1"
+
+# Кадр /upload/bulk: [battle_id: uint64 BE][длина: uint32 BE][XML боя]
+BULK_FRAME_HEADER = struct.Struct(">QI")
+
+# Дополнительные аккаунты того же воркера: "login:key,login2:key2"
+GAME_ACCOUNTS = parse_accounts(os.getenv("GAME_ACCOUNTS", ""))
 
 if not LOGIN_NAME or not LOGIN_KEY:
     raise ValueError("LOGIN_NAME и LOGIN_KEY должны быть установлены!")
 
-logger.info(f"XML Worker {WORKER_ID} запущен с аккаунтом: {LOGIN_NAME}")
+ACCOUNTS = [(LOGIN_NAME, LOGIN_KEY)] + [acc for acc in GAME_ACCOUNTS if acc[0] != LOGIN_NAME]
+
+logger.info(f"XML Worker {WORKER_ID} запущен с аккаунтами: {', '.join(login for login, _ in ACCOUNTS)}")
 
 app = FastAPI(title=f"XML Worker {WORKER_ID}")
 
+# Сессии аккаунтов живут весь процесс: авторизация не повторяется на каждый батч
+session_pool: Optional[SessionPool] = None
 
-class GameConn:
-    """Эпизодическое соединение с игровым сервером: открыть → авторизоваться → забрать батч → закрыть."""
-    
-    def __init__(self, host: str, port: int, login: str, key: str):
-        self.host = host
-        self.port = int(port)
-        self.login = login
-        self.key = key
-        self.sock: Optional[socket.socket] = None
-
-    def __enter__(self):
-        """Context manager: открываем соединение и авторизуемся."""
-        self._connect_and_auth()
-        return self
-
-    def __exit__(self, exc_type, exc, tb):
-        """Context manager: гарантированно закрываем соединение."""
-        self._safe_close()
-
-    def _safe_close(self):
-        """Безопасное закрытие сокета."""
-        try:
-            if self.sock:
-                self.sock.close()
-                logger.debug("🔌 Соединение закрыто")
-        except Exception as e:
-            logger.warning(f"Ошибка при закрытии сокета: {e}")
-        finally:
-            self.sock = None
+# Один keep-alive клиент к api_mother на процесс: соединения переиспользуются между боями и батчами
+mother_client: Optional[httpx.AsyncClient] = None
+upload_slots: Optional[asyncio.Semaphore] = None
 
-    def _connect_and_auth(self):
-        """Подключение и авторизация."""
-        try:
-            self.sock = socket.create_connection((self.host, self.port), timeout=10)
-            # Ускоряем детект мёртвого соединения
-            try:
-                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            except Exception:
-                pass
-            
-            # Читаем приветствие
-            welcome = self.sock.recv(8192)
-            logger.debug(f"Приветствие: {welcome[:50]}...")
-            
-            # Логин
-            login_xml = f'<LOGIN v3="10.20.30.40" lang="ru" v2="4875537" v="108" p="{self.key}" l="{self.login}" />\x00'
-            self.sock.sendall(login_xml.encode('utf-8'))
-            login_response = self.sock.recv(8192)
-            
-            if b'<ERROR' in login_response:
-                raise ConnectionError(f"Ошибка авторизации: {login_response[:100]}")
-            
-            logger.debug(f"LOGIN OK: {login_response[:50]}...")
-            
-            # GETME для активации сессии
-            self.sock.sendall(b"<GETME />\x00")
-            time.sleep(0.2)
-            
-            # Очищаем буфер от хвостов (MYPARAM и прочего)
-            self._drain(0.3)
-            
-            logger.info(f"✅ Подключено к {self.host}:{self.port} как {self.login}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка подключения: {e}")
-            self._safe_close()
-            raise
-
-    def _drain(self, timeout: float = 0.3):
-        """Очистка буфера от остатков данных."""
-        if not self.sock:
-            return
-        self.sock.settimeout(timeout)
-        drained = 0
-        try:
-            while True:
-                chunk = self.sock.recv(65536)
-                if not chunk:
-                    break
-                drained += len(chunk)
-        except socket.timeout:
-            pass
-        finally:
-            self.sock.settimeout(5)
-        if drained > 0:
-            logger.debug(f"🧹 Очищено {drained} байт из буфера")
-
-    def fetch_one_blook(self, battle_id: int, hard_timeout: float = 20.0) -> Optional[str]:
-        """
-        Запрашивает один бой и читает до </BLOOK>.
-        
-        Args:
-            battle_id: ID боя
-            hard_timeout: Максимальное время ожидания ответа
-            
-        Returns:
-            XML строка или None при ошибке
-        """
-        if not self.sock:
-            logger.error(f"❌ {battle_id}: сокет не инициализирован")
-            return None
-            
-        try:
-            # Запрос боя
-            self.sock.sendall(f'<POST t="//blook {battle_id}" />\x00'.encode('utf-8'))
-            time.sleep(0.05)
-            self.sock.sendall(b"<GETMYBATTLE />\x00")
-        except OSError as e:
-            logger.error(f"❌ {battle_id}: ошибка отправки команды: {e}")
-            return None
-
-        # Чтение ответа до </BLOOK>
-        buf = b""
-        self.sock.settimeout(1.0)
-        start_time = time.time()
-        
-        while time.time() - start_time < hard_timeout:
-            try:
-                chunk = self.sock.recv(65536)
-                if not chunk:
-                    # Сервер закрыл соединение
-                    logger.warning(f"⚠️ {battle_id}: сервер закрыл соединение")
-                    return None
-                buf += chunk
-                if b"</BLOOK>" in buf:
-                    break
-                if b"<ERROR" in buf:
-                    error_text = buf.decode('utf-8', errors='replace')[:200]
-                    logger.warning(f"⚠️ {battle_id}: сервер вернул ERROR: {error_text}")
-                    return None
-            except socket.timeout:
-                # Продолжаем ждать в пределах hard_timeout
-                pass
-
-        if b"</BLOOK>" not in buf:
-            logger.warning(f"⚠️ {battle_id}: таймаут {hard_timeout}с (получено {len(buf)} байт)")
-            return None
-
-        # Декодирование и очистка
-        decoded = buf.decode('utf-8', errors='replace')
-        decoded = decoded.replace('\x00', '').replace('\x1f', '')
-        
-        # Извлечение первого полного BLOOK
-        start = decoded.find("<BLOOK>")
-        end = decoded.find("</BLOOK>", start)
-        if start == -1 or end == -1:
-            logger.warning(f"⚠️ {battle_id}: некорректный XML (нет BLOOK тегов)")
-            return None
-        end += len("</BLOOK>")
-        blook_xml = decoded[start:end]
-        
-        # Проверяем что это правильный бой
-        match = re.search(r'battleid="(\d+)"', blook_xml)
-        if match:
-            received_id = int(match.group(1))
-            if received_id != battle_id:
-                logger.warning(f"⚠️ Запросили {battle_id}, получили {received_id}")
-        
-        return blook_xml
+
+@app.on_event("startup")
+async def _start_sessions():
+    global session_pool, mother_client, upload_slots
+    session_pool = SessionPool(
+        GAME_SERVER_HOST, GAME_SERVER_PORT, ACCOUNTS,
+        size=GAME_SESSIONS, keepalive_interval=GAME_KEEPALIVE_INTERVAL,
+    )
+    session_pool.start_keepalive()
+    mother_client = httpx.AsyncClient(
+        base_url=API_MOTHER_URL,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=UPLOAD_CONCURRENCY, max_keepalive_connections=UPLOAD_CONCURRENCY),
+    )
+    upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+
+@app.on_event("shutdown")
+async def _close_sessions():
+    if session_pool is not None:
+        await session_pool.close()
+    if mother_client is not None:
+        await mother_client.aclose()
 
 
 class FetchResponse(BaseModel):
@@ -203,9 +99,12 @@ class FetchResponse(BaseModel):
 
 class BatchFetchRequest(BaseModel):
     battle_ids: List[int]
-    semaphore_limit: int = 1
-    delay_seconds: float = 0.5
+    # Сколько сессий пула одновременно работают на батч (None — все)
+    semaphore_limit: Optional[int] = None
+    delay_seconds: float = 0.0
     upload_to_mother: bool = True
+    # Копия в /srv/btl/raw воркера (None — по SAVE_RAW_FILES; без загрузки в mother — всегда)
+    save_to_disk: Optional[bool] = None
 
 
 class BatchFetchResponse(BaseModel):
@@ -222,120 +121,194 @@ async def health():
     return {
         "status": "healthy",
         "worker_id": WORKER_ID,
-        "login": LOGIN_NAME
+        "login": LOGIN_NAME,
+        "sessions": session_pool.stats() if session_pool else None
     }
 
 
+def _write_battle_file(output_dir: str, battle_id: int, data: bytes) -> str:
+    shard = battle_id // 50000
+    shard_dir = os.path.join(output_dir, str(shard))
+    os.makedirs(shard_dir, exist_ok=True)
+    file_path = os.path.join(shard_dir, f"{battle_id}.tzb")
+    with open(file_path, "wb") as f:
+        f.write(data)
+    return file_path
+
+
+async def _upload_battle(battle_id: int, data: bytes) -> bool:
+    """Отправить бой в api_mother (при UPLOAD_GZIP — сжатым, Content-Encoding: gzip)."""
+    headers = {"Content-Type": "application/xml"}
+    async with upload_slots:
+        try:
+            if UPLOAD_GZIP:
+                data = await asyncio.to_thread(gzip.compress, data, UPLOAD_GZIP_LEVEL)
+                headers["Content-Encoding"] = "gzip"
+            response = await mother_client.post(f"/upload/{battle_id}", content=data, headers=headers)
+        except Exception as e:
+            logger.warning(f"upload failed for {battle_id}: {e}")
+            return False
+    if response.status_code != 200:
+        logger.warning(f"upload failed for {battle_id}: HTTP {response.status_code}")
+        return False
+    return True
+
+
+async def _fetch_with_retry(gc, battle_id: int):
+    """
+    (xml, error, timed_out): обрыв — повторная авторизация и одна повторная попытка.
+
+    Дедлайн не повторяется: повтор того же боя снова упрётся в BLOOK_TIMEOUT и
+    задержит весь батч. Сессия после дедлайна помечена broken и переподключается
+    перед следующим боем.
+    """
+    error = "server returned ERROR"
+    for attempt in range(2):
+        try:
+            if attempt:
+                logger.warning(f"🔄 {battle_id}: ретрай с переподключением")
+            if attempt or not gc.connected:
+                await session_pool.ensure_ready(gc)
+            return await gc.fetch_one_blook(battle_id, hard_timeout=BLOOK_TIMEOUT), error, False
+        except GameTimeoutError as e:
+            logger.warning(f"⏱️ {e}")
+            return None, f"timeout: {e}", True
+        except GameProtocolError as e:
+            error = f"connection closed or timeout after retry: {e}"
+            logger.warning(f"⚠️ {battle_id}: {e}")
+    return None, error, False
+
+
+def _deflate_frame(deflater, frame: bytes) -> bytes:
+    # SYNC_FLUSH: api_mother распаковывает и пишет бой, не дожидаясь конца потока
+    return deflater.compress(frame) + deflater.flush(zlib.Z_SYNC_FLUSH)
+
+
+async def _bulk_upload(battles: asyncio.Queue) -> Dict[int, bool]:
+    """
+    Один потоковый запрос /upload/bulk на батч: кадр боя уходит, как только бой получен.
+    Очередь завершается None. Результат — {battle_id: сохранён ли в api_mother}.
+    """
+    async def frames():
+        deflater = zlib.compressobj(UPLOAD_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if UPLOAD_GZIP else None
+        while True:
+            item = await battles.get()
+            if item is None:
+                break
+            battle_id, data = item
+            frame = BULK_FRAME_HEADER.pack(battle_id, len(data)) + data
+            if deflater is not None:
+                frame = await asyncio.to_thread(_deflate_frame, deflater, frame)
+            yield frame
+        if deflater is not None:
+            yield deflater.flush()
+    
+    headers = {"Content-Type": "application/octet-stream"}
+    if UPLOAD_GZIP:
+        headers["Content-Encoding"] = "gzip"
+    try:
+        response = await mother_client.post("/upload/bulk", content=frames(), headers=headers)
+    except Exception as e:
+        logger.warning(f"bulk upload failed: {e}")
+        return {}
+    if response.status_code != 200:
+        logger.warning(f"bulk upload failed: HTTP {response.status_code} {response.text[:200]}")
+        return {}
+    return {int(item["battle_id"]): bool(item["ok"]) for item in response.json().get("results", [])}
+
+
 @app.post("/fetch_batch", response_model=BatchFetchResponse)
 async def fetch_battle_batch(request: BatchFetchRequest):
     """
-    Получить пачку боёв с ЭПИЗОДИЧЕСКИМ соединением.
-    Одно соединение на весь батч: открыть → забрать все → закрыть.
+    Получить пачку боёв по долгоживущим сессиям аккаунтов.
+    Несколько сессий разбирают общую очередь ID; цикл событий при этом свободен
+    (health-check и другие батчи обслуживаются параллельно).
     """
-    host = "185.92.72.18"
-    port = 5190
     output_dir = "/srv/btl/raw"
-    os.makedirs(output_dir, exist_ok=True)
+    save_to_disk = request.save_to_disk
+    if save_to_disk is None:
+        # Без загрузки в mother файл воркера — единственная копия боя
+        save_to_disk = SAVE_RAW_FILES or not request.upload_to_mother
+    if save_to_disk:
+        os.makedirs(output_dir, exist_ok=True)
     
-    results = []
-    saved_files = []
-    success_count = 0
-    failed_count = 0
-    timeout_count = 0
+    by_id: Dict[int, FetchResponse] = {}
+    timed_out: Set[int] = set()
+    uploads: List[asyncio.Task] = []
+    bulk: Optional[asyncio.Queue] = None
+    if request.upload_to_mother and UPLOAD_MODE == "bulk":
+        bulk = asyncio.Queue()
+        bulk_task = asyncio.create_task(_bulk_upload(bulk))
     
-    logger.info(f"📦 Batch: {len(request.battle_ids)} боев (эпизодический режим)")
+    queue: asyncio.Queue = asyncio.Queue()
+    for battle_id in request.battle_ids:
+        queue.put_nowait(battle_id)
     
-    try:
-        # ОДНО соединение на весь батч (живёт только пока идёт батч)
-        with GameConn(host, port, LOGIN_NAME, LOGIN_KEY) as gc:
-            for battle_id in request.battle_ids:
-                # Первая попытка
-                xml = gc.fetch_one_blook(battle_id, hard_timeout=20.0)
-                
-                # Ретрай с переподключением при обрыве
-                if xml is None:
-                    logger.warning(f"🔄 {battle_id}: ретрай с переподключением")
-                    gc._safe_close()
-                    try:
-                        gc._connect_and_auth()
-                        xml = gc.fetch_one_blook(battle_id, hard_timeout=20.0)
-                    except Exception as e:
-                        logger.error(f"❌ {battle_id}: ошибка переподключения: {e}")
-                
-                # Результат
-                if xml is None:
-                    results.append(FetchResponse(
-                        battle_id=battle_id,
-                        status="failed",
-                        error="connection closed or timeout after retry"
-                    ))
-                    failed_count += 1
-                else:
-                    # Сохраняем файл
-                    shard = battle_id // 50000
-                    shard_dir = os.path.join(output_dir, str(shard))
-                    os.makedirs(shard_dir, exist_ok=True)
-                    file_path = os.path.join(shard_dir, f"{battle_id}.tzb")
-                    
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        f.write(xml)
+    sessions = min(request.semaphore_limit or session_pool.capacity, session_pool.capacity, max(len(request.battle_ids), 1))
+    logger.info(f"📦 Batch: {len(request.battle_ids)} боев, сессий: {sessions}")
+    
+    async def _upload_and_mark(result: FetchResponse, data: bytes):
+        result.uploaded_to_mother = await _upload_battle(result.battle_id, data)
+    
+    async def _session_worker():
+        try:
+            async with session_pool.session() as gc:
+                while not queue.empty():
+                    battle_id = queue.get_nowait()
+                    xml, error, timeout = await _fetch_with_retry(gc, battle_id)
+                    if timeout:
+                        timed_out.add(battle_id)
                     
-                    size_kb = len(xml) / 1024
-                    logger.info(f"✓ {battle_id}.tzb ({size_kb:.1f} KB)")
+                    # Результат
+                    if xml is None:
+                        by_id[battle_id] = FetchResponse(battle_id=battle_id, status="failed", error=error[:200])
+                    else:
+                        data = xml.encode("utf-8")
+                        result = FetchResponse(battle_id=battle_id, status="success", size_bytes=len(data))
+                        by_id[battle_id] = result
+                        # Загрузка идёт параллельно со следующим запросом сессии
+                        if bulk is not None:
+                            bulk.put_nowait((battle_id, data))
+                        elif request.upload_to_mother:
+                            uploads.append(asyncio.create_task(_upload_and_mark(result, data)))
+                        if save_to_disk:
+                            # Запись — вне цикла событий
+                            await asyncio.to_thread(_write_battle_file, output_dir, battle_id, data)
+                        logger.info(f"✓ {battle_id}.tzb ({len(data) / 1024:.1f} KB)")
                     
-                    results.append(FetchResponse(
-                        battle_id=battle_id,
-                        status="success",
-                        size_bytes=len(xml)
-                    ))
-                    saved_files.append(file_path)
-                    success_count += 1
-                
-                # Пауза между боями
-                if request.delay_seconds > 0:
-                    time.sleep(request.delay_seconds)
-        
-        # ← Здесь сокет уже закрыт (вышли из with)
-        
-    except Exception as e:
-        # Глобальная ошибка - остальные бои помечаем как failed
-        logger.error(f"❌ Глобальная ошибка батча: {e}")
-        for bid in request.battle_ids[len(results):]:
-            results.append(FetchResponse(
-                battle_id=bid,
-                status="failed",
-                error=f"batch error: {str(e)[:100]}"
-            ))
-            failed_count += 1
+                    # Необязательная пауза между боями (по умолчанию темп задаёт сервер)
+                    if request.delay_seconds > 0:
+                        await asyncio.sleep(request.delay_seconds)
+        except Exception as e:
+            # Сессия не поднялась — оставшиеся бои заберут другие сессии, иначе они помечаются failed ниже
+            logger.error(f"❌ Ошибка сессии батча: {e}")
+    
+    await asyncio.gather(*(_session_worker() for _ in range(sessions)))
+    # Дожидаемся загрузок, ещё не завершившихся к концу выборки
+    await asyncio.gather(*uploads)
+    if bulk is not None:
+        bulk.put_nowait(None)
+        uploaded = await bulk_task
+        for result in by_id.values():
+            result.uploaded_to_mother = uploaded.get(result.battle_id, False)
+    
+    results = [
+        by_id.get(battle_id) or FetchResponse(
+            battle_id=battle_id,
+            status="failed",
+            error="batch error: game session failed"
+        )
+        for battle_id in request.battle_ids
+    ]
+    success_count = sum(1 for r in results if r.status == "success")
+    failed_count = len(results) - success_count
+    # Таймауты (дедлайн BLOOK_TIMEOUT) входят и в failed
+    timeout_count = len(timed_out)
     
     logger.info(f"📊 Результат: {success_count} успешно, {failed_count} ошибок, {timeout_count} таймаутов")
     
-    # Upload в mother (опционально)
-    uploaded_count = 0
-    if request.upload_to_mother and saved_files:
-        async with httpx.AsyncClient(timeout=30.0) as http_client:
-            for file_path in saved_files:
-                try:
-                    battle_id = int(os.path.basename(file_path).split(".")[0])
-                    
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        xml_content = f.read()
-                    
-                    response = await http_client.post(
-                        f"{API_MOTHER_URL}/upload/{battle_id}",
-                        content=xml_content,
-                        headers={"Content-Type": "application/xml"}
-                    )
-                    
-                    if response.status_code == 200:
-                        uploaded_count += 1
-                        for res in results:
-                            if res.battle_id == battle_id:
-                                res.uploaded_to_mother = True
-                                break
-                except Exception as e:
-                    logger.warning(f"upload failed for {file_path}: {e}")
-        
+    if request.upload_to_mother and success_count:
+        uploaded_count = sum(1 for r in results if r.uploaded_to_mother)
         logger.info(f"📤 Загружено в mother: {uploaded_count}/{success_count}")
     
     return BatchFetchResponse(
@@ -0,0 +1,177 @@
+import asyncio
+import importlib.util
+import os
+import re
+
+import pytest
+
+from shared.utils.battle_log import CLEAN_MARKER_STR
+
+_app_dir = os.path.dirname(os.path.dirname(__file__))
+_spec = importlib.util.spec_from_file_location("xmlworker_app_game_session", os.path.join(_app_dir, "game_session.py"))
+game_session = importlib.util.module_from_spec(_spec)
+assert _spec and _spec.loader
+_spec.loader.exec_module(game_session)
+
+SILENT = 999  # бой, на который сервер не отвечает
+HANG_UP = 666  # бой, на котором сервер закрывает соединение
+
+
+def _blook(battle_id):
+    body = b'<BATTLE t2="1"><USER login="a" battleid="%d" /></BATTLE>\n<TURN turn="1">\x1f' % battle_id + b"y" * 5000 + b"</TURN>\n"
+    # Сервер присылает тело боя дважды — наружу уходит одно
+    return b"<BLOOK>" + body + body + b"</BLOOK>\x00"
+
+
+class FakeGameServer:
+    """Игровой сервер в процессе: кадры до \\x00, ответы кусками"""
+
+    def __init__(self):
+        self.logins = 0
+        self.pings = 0
+        self.writers = []
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        for writer in self.writers:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _send_split(self, writer, data, parts=5):
+        step = len(data) // parts + 1
+        for i in range(0, len(data), step):
+            writer.write(data[i:i + step])
+            await writer.drain()
+            await asyncio.sleep(0)
+
+    async def _handle(self, reader, writer):
+        self.writers.append(writer)
+        writer.write(b'<HELLO s="1" />\x00')
+        buf = b""
+        while True:
+            chunk = await reader.read(4096)
+            if not chunk:
+                break
+            buf += chunk
+            *messages, buf = buf.split(b"\x00")
+            for message in messages:
+                if message.startswith(b"<LOGIN"):
+                    self.logins += 1
+                    bad = b'p="bad"' in message
+                    writer.write(b'<ERROR code="2" />\x00' if bad else b'<OK />\x00')
+                elif message.startswith(b"<GETME"):
+                    writer.write(b'<MYPARAM login="a" />\x00')
+                elif message.startswith(b"<N "):
+                    self.pings += 1
+                elif message.startswith(b"<POST"):
+                    battle_id = int(re.search(rb"//blook (\d+)", message).group(1))
+                    if battle_id == HANG_UP:
+                        writer.close()
+                        return
+                    if battle_id != SILENT:
+                        # Запоздавший ответ на прошлый запрос, затем нужный бой
+                        await self._send_split(writer, _blook(battle_id + 1) + b'<CHAT t="hi" />\x00' + _blook(battle_id))
+            await writer.drain()
+
+
+def _run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_fetch_reads_split_frames_and_skips_foreign_battles():
+    async def run():
+        async with FakeGameServer() as server:
+            conn = game_session.GameConn("127.0.0.1", server.port, "a", "key")
+            await conn.connect_and_auth()
+            for battle_id in (7, 8):
+                xml = await conn.fetch_one_blook(battle_id, hard_timeout=5)
+                assert f'battleid="{battle_id}"' in xml and xml.count("<BATTLE") == 1
+                assert xml.endswith(CLEAN_MARKER_STR) and "\x1f" not in xml
+            assert conn.is_alive() and server.logins == 1
+            await conn.close()
+
+    _run(run())
+
+
+def test_deadline_raises_timeout_and_breaks_session():
+    async def run():
+        async with FakeGameServer() as server:
+            conn = game_session.GameConn("127.0.0.1", server.port, "a", "key")
+            await conn.connect_and_auth()
+            with pytest.raises(game_session.GameTimeoutError):
+                await conn.fetch_one_blook(SILENT, hard_timeout=0.2)
+            assert not conn.connected
+
+            # Обрыв — не дедлайн
+            await conn.connect_and_auth()
+            with pytest.raises(game_session.GameProtocolError) as e:
+                await conn.fetch_one_blook(HANG_UP, hard_timeout=5)
+            assert not isinstance(e.value, game_session.GameTimeoutError)
+            assert not conn.connected
+            await conn.close()
+
+    _run(run())
+
+
+def test_auth_error_is_a_protocol_error():
+    async def run():
+        async with FakeGameServer() as server:
+            conn = game_session.GameConn("127.0.0.1", server.port, "a", "bad")
+            with pytest.raises(game_session.GameProtocolError, match="авторизации"):
+                await conn.connect_and_auth()
+            assert not conn.connected
+
+    _run(run())
+
+
+def test_pool_hands_out_distinct_sessions_and_reauthenticates():
+    async def run():
+        async with FakeGameServer() as server:
+            pool = game_session.SessionPool("127.0.0.1", server.port, [("a", "key")], size=2)
+            seen = []
+
+            async def fetch(battle_id):
+                async with pool.session() as conn:
+                    seen.append(conn)
+                    return await conn.fetch_one_blook(battle_id, hard_timeout=5)
+
+            results = await asyncio.gather(*(fetch(battle_id) for battle_id in (1, 2, 3)))
+            assert all(f'battleid="{i}"' in xml for i, xml in zip((1, 2, 3), results))
+            assert len(set(map(id, seen))) == 2 and server.logins == 2
+
+            # Сервер оборвал сессию — при следующей выдаче (она в конце очереди) авторизуется заново
+            with pytest.raises(game_session.GameProtocolError):
+                await fetch(HANG_UP)
+            for battle_id in (4, 5):
+                assert f'battleid="{battle_id}"' in await fetch(battle_id)
+            assert seen[-1] is seen[-3]
+            assert pool.reauths == 1 and server.logins == 3
+            assert pool.stats()["idle"] == 2
+            await pool.close()
+
+    _run(run())
+
+
+def test_keepalive_pings_only_idle_sessions():
+    async def run():
+        async with FakeGameServer() as server:
+            pool = game_session.SessionPool("127.0.0.1", server.port, [("a", "key"), ("b", "key")], keepalive_interval=0)
+            async with pool.session():
+                async with pool.session():
+                    pass
+                # Первая сессия занята — пингуется только вторая
+                await pool.keepalive()
+                assert pool.pings == 1
+            await pool.keepalive()
+            await asyncio.sleep(0.05)
+            assert pool.pings == 3 and server.pings == 3
+            assert pool.stats()["connected"] == 2
+            await pool.close()
+            assert pool.stats()["connected"] == 0
+
+    _run(run())
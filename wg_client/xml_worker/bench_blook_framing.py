@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк чтения BLOOK: прежний путь (response += chunk и поиск </BLOOK> по всему
+ответу после каждого recv, затем decode и replace управляющих байтов) против
+shared.utils.frame_reader (bytearray, поиск только в новых байтах, одна копия
+без \\x00/\\x1f) на синтетическом бое из памяти — сеть не участвует.
+
+Запуск из wg_client: python xml_worker/bench_blook_framing.py [размер_МБ]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from shared.utils.frame_reader import FrameReader  # noqa: E402
+
+
+def _best_of(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def synthetic_blook(size_mb=5, battle_id=2650006):
+    """Ответ сервера: приветствие, BLOOK нужного размера с \\x1f внутри, разделители \\x00"""
+    turn = (
+        '<TURN n="{n}"><A l="Игрок{p}" t="{n}" d="17\x1f3" /><M k="Крыса" s="2" hp="40" />'
+        '<L l="Игрок{p}" i="Шкура\x1f" c="1" /></TURN>\n'
+    )
+    parts = [f'<OK l="bot" />\x00<BLOOK battleid="{battle_id}" t="1" time="1700000000">']
+    size = 0
+    n = 0
+    target = size_mb * 1024 * 1024
+    while size < target:
+        line = turn.format(n=n, p=n % 60)
+        parts.append(line)
+        size += len(line.encode("utf-8"))
+        n += 1
+    parts.append("</BLOOK>\x00")
+    return "".join(parts).encode("utf-8")
+
+
+def _chunks(payload, chunk_size):
+    return [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+
+
+def old_path(chunks):
+    response = b""
+    for chunk in chunks:
+        response += chunk
+        if b"</BLOOK>" in response:
+            break
+    xml_str = response.decode("utf-8", errors="replace").replace("\x00", "").replace("\x1f", "")
+    start = xml_str.find("<BLOOK")
+    end = xml_str.find("</BLOOK>") + len("</BLOOK>")
+    return xml_str[start:end]
+
+
+def frame_reader_path(chunks):
+    frames = FrameReader()
+    for chunk in chunks:
+        frames.feed(chunk)
+        frame = frames.next_frame()
+        while frame is not None:
+            blook = frame.between(b"<BLOOK", b"</BLOOK>")
+            if blook is not None:
+                return blook.decode("utf-8", errors="replace")
+            frame = frames.next_frame()
+    return None
+
+
+def bench_blook_framing(size_mb=5, repeat=3):
+    payload = synthetic_blook(size_mb)
+    print(f"Синтетический BLOOK: {len(payload) / 1024 / 1024:.1f} МБ")
+    print("=" * 80)
+
+    results = []
+    for chunk_size in (4096, 65536):
+        chunks = _chunks(payload, chunk_size)
+        old_time, old_result = _best_of(lambda: old_path(chunks), repeat)
+        new_time, new_result = _best_of(lambda: frame_reader_path(chunks), repeat)
+        print(f"recv({chunk_size:<5}) × {len(chunks):<5} response += chunk  {old_time:8.3f}s")
+        print(f"recv({chunk_size:<5}) × {len(chunks):<5} FrameReader        {new_time:8.3f}s  (x{old_time / new_time:.1f})")
+        results.append(old_result == new_result)
+
+    if not all(results):
+        print("ОШИБКА: результаты путей различаются")
+        return False
+    print("Результаты совпадают")
+    return True
+
+
+if __name__ == "__main__":
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sys.exit(0 if bench_blook_framing(size_mb=size_mb) else 1)